@@ -26,6 +26,14 @@ def create_app():
     from . import db
     db.init_app(app)
 
+    # Métricas SQL por petición (cabeceras en debug, log de lentas en producción)
+    from . import sql_profiler
+    sql_profiler.init_app(app)
+
+    # Un hilo LISTEN por worker para invalidaciones entre procesos
+    from . import pg_listener, cache_configuracion, agenda_stream
+    pg_listener.init_app(app)
+
     # ----------------------------------------------------------
     # INYECTOR GLOBAL (Temas y Sucursales para todas las vistas)
     # ----------------------------------------------------------
@@ -40,68 +48,41 @@ def create_app():
         mis_sucursales = []
         sucursal_actual = None
         config_sistema = None 
+        config_sucursal = None # Variable para config especifica de sucursal
         
+        # Todo sale de la caché de configuración (ver cache_configuracion.py):
+        # solo se consulta la BD cuando la entrada expiró o fue invalidada.
         try:
-            conn = db.get_db()
-            if conn:
-                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                    
-                    # A. Cargar Configuración Visual
-                    try:
-                        cursor.execute("SELECT * FROM configuracion_sistema WHERE id = 1")
-                        config_db = cursor.fetchone()
-                        
-                        if config_db:
-                            config_sistema = config_db
-                            # Actualizar claves si existen en la BD
-                            for key in tema.keys():
-                                db_key = f"color_{key}" if key != 'primario' and key != 'secundario' and key != 'fondo' and key != 'texto' else f"color_{key}"
-                                if config_db.get(db_key):
-                                    tema[key] = config_db[db_key]
-                            # Mapeo manual para los básicos si los nombres difieren
-                            if config_db.get('color_primario'): tema['primario'] = config_db['color_primario']
-                            if config_db.get('color_secundario'): tema['secundario'] = config_db['color_secundario']
-                            if config_db.get('color_fondo'): tema['fondo'] = config_db['color_fondo']
-                            if config_db.get('color_texto'): tema['texto'] = config_db['color_texto']
-                    except Exception:
-                        pass 
-
-                    # B. Cargar Sucursales (Solo si hay usuario)
-                    if current_user.is_authenticated:
-                        try:
-                            # Verificar si es admin (comprobando atributo rol_nombre o rol)
-                            rol = getattr(current_user, 'rol_nombre', getattr(current_user, 'rol', ''))
-                            
-                            if rol == 'Administrador':
-                                cursor.execute("SELECT id, nombre FROM sucursales WHERE activo = TRUE ORDER BY nombre")
-                            else:
-                                cursor.execute("""
-                                    SELECT s.id, s.nombre
-                                    FROM sucursales s
-                                    JOIN empleado_sucursales es ON s.id = es.sucursal_id
-                                    WHERE es.empleado_id = %s AND s.activo = TRUE
-                                    ORDER BY s.nombre
-                                """, (current_user.id,))
-                            
-                            mis_sucursales = cursor.fetchall()
-                        except Exception:
-                            pass
-
-                    # C. Cargar Datos de la Sucursal Actual (Para el Footer)
-                    sucursal_id = session.get('sucursal_id')
-                    config_sucursal = None # Variable para config especifica de sucursal
-                    
-                    if sucursal_id:
-                        try:
-                            cursor.execute("SELECT * FROM sucursales WHERE id = %s", (sucursal_id,))
-                            sucursal_actual = cursor.fetchone()
-                            
-                            # Cargar Configuración de Sucursal (Agenda, Fuentes, etc.)
-                            cursor.execute("SELECT * FROM configuracion_sucursal WHERE sucursal_id = %s", (sucursal_id,))
-                            config_sucursal = cursor.fetchone()
-                            
-                        except Exception:
-                            pass
+            # A. Cargar Configuración Visual
+            try:
+                config_db = cache_configuracion.config_sistema()
+                
+                if config_db:
+                    config_sistema = config_db
+                    # Actualizar claves si existen en la BD
+                    for key in tema.keys():
+                        db_key = f"color_{key}"
+                        if config_db.get(db_key):
+                            tema[key] = config_db[db_key]
+            except Exception:
+                pass 
+
+            # B. Cargar Sucursales (Solo si hay usuario)
+            if current_user.is_authenticated:
+                try:
+                    # Verificar si es admin (comprobando atributo rol_nombre o rol)
+                    rol = getattr(current_user, 'rol_nombre', getattr(current_user, 'rol', ''))
+                    mis_sucursales = cache_configuracion.sucursales_de_usuario(current_user.id, rol == 'Administrador')
+                except Exception:
+                    pass
+
+            # C. Cargar Datos de la Sucursal Actual (Para el Footer, Agenda, Fuentes, etc.)
+            sucursal_id = session.get('sucursal_id')
+            if sucursal_id:
+                try:
+                    sucursal_actual, config_sucursal = cache_configuracion.datos_sucursal(sucursal_id)
+                except Exception:
+                    pass
 
         except Exception as e:
             # Loguear error pero no romper la app
@@ -141,9 +122,20 @@ def create_app():
     from .routes_reportes import reportes_bp
     app.register_blueprint(reportes_bp)
 
-    # 4. AUTO-MIGRACIÓN DE BASE DE DATOS (Producción Friendly)
-    from .db import check_schema_updates
-    check_schema_updates(app)
+    # 4. MIGRACIONES DE BASE DE DATOS
+    # Se aplican una vez por despliegue con `flask db-upgrade`; aquí solo se
+    # verifica (con una consulta) que la versión del esquema esté al día.
+    from . import migrador
+    migrador.init_app(app)
+    migrador.verificar_version_esquema(app)
+
+    # Worker del outbox (`flask outbox-worker`); los manejadores se registran al importar sus servicios
+    from . import outbox
+    outbox.init_app(app)
+
+    # Comandos de mantenimiento (cierres mensuales de saldos, verificaciones)
+    from . import comandos
+    comandos.init_app(app)
     
     return app
 
@@ -0,0 +1,154 @@
+import json
+import time
+import queue
+import threading
+from . import pg_listener
+
+# ---------------------------------------------------------
+# AGENDA EN VIVO (Server-Sent Events)
+# ---------------------------------------------------------
+# El trigger de agenda (migración 0006) emite NOTIFY 'agenda' al confirmar cada
+# cambio de reservas, horarios extra, ausencias u horarios. El único LISTEN del
+# worker (pg_listener) entrega el aviso aquí y se copia a la cola de cada cliente
+# SSE suscrito a las sucursales afectadas. Los clientes no tienen conexión a la BD:
+# solo esperan en su cola.
+
+CANAL = 'agenda'
+
+# Cada conexión SSE ocupa un hilo del worker (gthread, --threads 16 en el Procfile)
+# mientras está abierta: se cierra sola tras este tiempo y EventSource reconecta
+# (con 'retry'). Para que las pantallas de agenda no se queden con todos los
+# hilos, cada worker acepta como máximo AGENDA_SSE_MAX_POR_WORKER flujos a la vez
+# (config, 4 por defecto: quedan 12 hilos para el resto de peticiones). Por
+# encima del tope la ruta responde 503 y la agenda pasa a sondeo con ETag hasta
+# volver a intentar. Capacidad en vivo = workers x tope; el resto sondea.
+DURACION_MAXIMA_SEGUNDOS = 600
+KEEPALIVE_SEGUNDOS = 25
+RETRY_MS = 3000
+MAX_FLUJOS_POR_WORKER = 4
+
+_clientes = {}  # sucursal_id -> set(queue.Queue)
+_flujos_abiertos = 0
+_lock = threading.Lock()
+
+
+def _suscribir(sucursal_id):
+    cola = queue.Queue(maxsize=200)
+    with _lock:
+        _clientes.setdefault(sucursal_id, set()).add(cola)
+    return cola
+
+
+def _desuscribir(sucursal_id, cola):
+    with _lock:
+        colas = _clientes.get(sucursal_id)
+        if colas:
+            colas.discard(cola)
+            if not colas:
+                del _clientes[sucursal_id]
+
+
+def _entregar(cola, evento):
+    try:
+        cola.put_nowait(evento)
+    except queue.Full:
+        # Cliente lento: descartamos lo acumulado y le pedimos recargar todo
+        try:
+            while True:
+                cola.get_nowait()
+        except queue.Empty:
+            pass
+        cola.put_nowait(('resync', {}))
+
+
+def _al_recibir_aviso(payload):
+    if payload is None:
+        # Reconexión del listener: pudimos perder avisos
+        with _lock:
+            destinos = [c for colas in _clientes.values() for c in colas]
+        for cola in destinos:
+            _entregar(cola, ('resync', {}))
+        return
+
+    try:
+        aviso = json.loads(payload)
+    except ValueError:
+        return
+    evento = ('cambio', {
+        'tabla': aviso.get('t'),
+        'registro_id': aviso.get('id'),
+        'empleado_id': aviso.get('e'),
+        'desde': aviso.get('d'),
+        'hasta': aviso.get('h')
+    })
+    with _lock:
+        destinos = [c for s in (aviso.get('s') or []) for c in _clientes.get(s, ())]
+    for cola in destinos:
+        _entregar(cola, evento)
+
+
+def clientes_conectados():
+    with _lock:
+        return {s: len(colas) for s, colas in _clientes.items()}
+
+
+def flujos_abiertos():
+    with _lock:
+        return _flujos_abiertos
+
+
+class _Flujo:
+    """
+    Cuerpo de la respuesta SSE que ocupa un cupo del worker. El cupo se libera en
+    close(), que el servidor llama siempre al terminar la respuesta (también si el
+    cliente se fue antes de que empezara a iterarse el generador).
+    """
+
+    def __init__(self, sucursal_id):
+        self._eventos = _eventos(sucursal_id)
+        self._liberado = False
+
+    def __iter__(self):
+        return self._eventos
+
+    def close(self):
+        global _flujos_abiertos
+        self._eventos.close()
+        with _lock:
+            if not self._liberado:
+                self._liberado = True
+                _flujos_abiertos -= 1
+
+
+def abrir_flujo(sucursal_id, maximo=MAX_FLUJOS_POR_WORKER):
+    """Cuerpo text/event-stream para la sucursal, o None si el worker ya tiene `maximo` flujos abiertos."""
+    global _flujos_abiertos
+    with _lock:
+        if _flujos_abiertos >= maximo:
+            return None
+        _flujos_abiertos += 1
+    return _Flujo(sucursal_id)
+
+
+def _eventos(sucursal_id):
+    """
+    Generador de eventos para una sucursal. No usa la BD ni el contexto de la app
+    (la conexión del request ya volvió al pool).
+    """
+    cola = _suscribir(sucursal_id)
+    fin = time.monotonic() + DURACION_MAXIMA_SEGUNDOS
+    try:
+        yield f"retry: {RETRY_MS}\nevent: listo\ndata: {{}}\n\n"
+        while time.monotonic() < fin:
+            try:
+                tipo, datos = cola.get(timeout=KEEPALIVE_SEGUNDOS)
+            except queue.Empty:
+                # Comentario SSE: mantiene viva la conexión a través de proxies
+                yield ": ping\n\n"
+                continue
+            yield f"event: {tipo}\ndata: {json.dumps(datos)}\n\n"
+    finally:
+        _desuscribir(sucursal_id, cola)
+
+
+pg_listener.suscribir(CANAL, _al_recibir_aviso)
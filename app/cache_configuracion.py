@@ -0,0 +1,127 @@
+import time
+import threading
+import psycopg2.extras
+from flask import current_app
+from . import pg_listener
+from .db import get_db
+
+# ---------------------------------------------------------
+# CACHÉ DE CONFIGURACIÓN (tema, sucursales, config de sucursal)
+# ---------------------------------------------------------
+# inject_global_data corre en cada render y antes consultaba 4 tablas que cambian
+# pocas veces al año. Ahora lee de esta caché en memoria (por worker) con TTL.
+# Las pantallas que editan esos datos llaman a invalidar(), que limpia la caché
+# local y emite un NOTIFY para que el resto de workers también la limpie.
+
+CANAL = 'cache_configuracion'
+
+
+class CacheTTL:
+    """Diccionario thread-safe con expiración por entrada."""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, cargar, ttl):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave)
+        if entrada and entrada[0] > ahora:
+            return entrada[1]
+
+        valor = cargar()
+        with self._lock:
+            self._datos[clave] = (ahora + ttl, valor)
+        return valor
+
+    def invalidar(self, prefijo=()):
+        """Elimina las claves que empiezan con 'prefijo' (todas si está vacío)."""
+        n = len(prefijo)
+        with self._lock:
+            for clave in [c for c in self._datos if c[:n] == prefijo]:
+                del self._datos[clave]
+
+
+_cache = CacheTTL()
+
+
+def _ttl():
+    return float(current_app.config.get('CONFIG_CACHE_TTL', 300))
+
+
+def _consultar(sql, params=(), uno=False):
+    with get_db().cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone() if uno else cursor.fetchall()
+
+
+def config_sistema():
+    return _cache.obtener(
+        ('sistema',),
+        lambda: _consultar("SELECT * FROM configuracion_sistema WHERE id = 1", uno=True),
+        _ttl()
+    )
+
+
+def sucursales_de_usuario(empleado_id, es_admin):
+    if es_admin:
+        return _cache.obtener(
+            ('sucursales', 'admin'),
+            lambda: _consultar("SELECT id, nombre FROM sucursales WHERE activo = TRUE ORDER BY nombre"),
+            _ttl()
+        )
+    return _cache.obtener(
+        ('sucursales', str(empleado_id)),
+        lambda: _consultar("""
+            SELECT s.id, s.nombre
+            FROM sucursales s
+            JOIN empleado_sucursales es ON s.id = es.sucursal_id
+            WHERE es.empleado_id = %s AND s.activo = TRUE
+            ORDER BY s.nombre
+        """, (empleado_id,)),
+        _ttl()
+    )
+
+
+def datos_sucursal(sucursal_id):
+    """Devuelve (fila de sucursales, fila de configuracion_sucursal)."""
+    def cargar():
+        sucursal = _consultar("SELECT * FROM sucursales WHERE id = %s", (sucursal_id,), uno=True)
+        config = _consultar("SELECT * FROM configuracion_sucursal WHERE sucursal_id = %s", (sucursal_id,), uno=True)
+        return sucursal, config
+    return _cache.obtener(('sucursal', str(sucursal_id)), cargar, _ttl())
+
+
+def _a_prefijo(alcance):
+    """'sistema' -> ('sistema',) | 'sucursal:3' -> ('sucursal', '3') | '*' -> ()"""
+    if not alcance or alcance == '*':
+        return ()
+    return tuple(alcance.split(':'))
+
+
+def _al_recibir_aviso(payload):
+    # payload None = reconexión del listener: no sabemos qué cambió, limpiamos todo
+    _cache.invalidar(_a_prefijo(payload))
+
+
+def invalidar(conn, *alcances):
+    """
+    Invalida la caché en este worker y avisa al resto.
+    Alcances: 'sistema', 'sucursales' (listas de sucursales de todos los usuarios),
+    'sucursales:<empleado_id>', 'sucursal:<id>' o '*'. Llamar después del commit.
+    """
+    alcances = alcances or ('*',)
+    for alcance in alcances:
+        _cache.invalidar(_a_prefijo(alcance))
+    try:
+        with conn.cursor() as cursor:
+            for alcance in alcances:
+                pg_listener.notificar(cursor, CANAL, alcance)
+        conn.commit()
+    except Exception as e:
+        # El TTL termina corrigiendo a los otros workers
+        current_app.logger.warning(f"No se pudo notificar invalidación de configuración: {e}")
+
+
+pg_listener.suscribir(CANAL, _al_recibir_aviso)
@@ -0,0 +1,92 @@
+import click
+from .db import get_pool
+from .utils.fechas import hoy_lima
+
+# ---------------------------------------------------------
+# COMANDOS DE MANTENIMIENTO (flask <comando>)
+# ---------------------------------------------------------
+# Tareas periódicas o de verificación que no corresponden a una petición web.
+# Se programan como cron del hosting (p.ej. `flask saldos-cierre` el día 1).
+
+
+def _con_conexion(funcion):
+    """Entrega una conexión del pool, hace commit si todo salió bien y la devuelve."""
+    pool = get_pool()
+    conn = pool.obtener()
+    try:
+        resultado = funcion(conn)
+        conn.commit()
+        return resultado
+    finally:
+        pool.devolver(conn)
+
+
+def init_app(app):
+    from .services import saldos, devengos, kpi_diarios
+
+    @app.cli.command('kpi-consolidar')
+    def kpi_consolidar_command():
+        """Pasa a kpi_diarios las diferencias pendientes (el outbox-worker lo hace cada minuto)."""
+        def ejecutar(conn):
+            with conn.cursor() as cursor:
+                return kpi_diarios.consolidar(cursor)
+        filas = _con_conexion(ejecutar)
+        click.echo("Otra consolidación está en curso." if filas < 0 else f"✅ {filas} fila(s) de kpi_diarios actualizadas.")
+
+    @app.cli.command('saldos-cierre')
+    def saldos_cierre_command():
+        """Calcula los cierres mensuales de monedero/puntos pendientes (hasta el mes pasado)."""
+        def ejecutar(conn):
+            with conn.cursor() as cursor:
+                return saldos.cerrar_pendientes(cursor, hoy_lima(), eco=click.echo)
+        cerrados = _con_conexion(ejecutar)
+        click.echo(f"✅ {len(cerrados)} mes(es) cerrado(s)." if cerrados else "Sin meses pendientes de cierre.")
+
+    @app.cli.command('saldos-verificar')
+    @click.option('--limite', default=50, show_default=True)
+    def saldos_verificar_command(limite):
+        """Compara el saldo en caché de cada cliente con su último movimiento del libro."""
+        def ejecutar(conn):
+            with conn.cursor() as cursor:
+                return saldos.diferencias(cursor, limite)
+        filas = _con_conexion(ejecutar)
+        if not filas:
+            click.echo("✅ Saldos en caché consistentes con el libro.")
+            return
+        for cliente_id, cuenta, en_cache, en_libro in filas:
+            click.echo(f"  cliente {cliente_id} {cuenta}: caché {en_cache} / libro {en_libro}")
+        raise click.ClickException(f"{len(filas)} diferencia(s) encontradas.")
+
+    @app.cli.command('comisiones-rebuild')
+    def comisiones_rebuild_command():
+        """Registra en el libro de devengos las diferencias contra las ventas y recalcula el resumen diario."""
+        def ejecutar(conn):
+            with conn.cursor() as cursor:
+                return devengos.reconstruir(cursor)
+        movimientos, filas = _con_conexion(ejecutar)
+        click.echo(f"✅ {movimientos} movimiento(s) de ajuste, {filas} fila(s) en el resumen diario.")
+
+    @app.cli.command('comisiones-verificar')
+    @click.option('--limite', default=50, show_default=True)
+    def comisiones_verificar_command(limite):
+        """Compara el libro y el resumen diario de comisiones con lo calculado desde las ventas."""
+        def ejecutar(conn):
+            with conn.cursor() as cursor:
+                return devengos.verificar(cursor, limite)
+        ventas, resumen, negativos = _con_conexion(ejecutar)
+        if not ventas and not resumen and not negativos:
+            click.echo("✅ Devengos de comisiones consistentes con las ventas.")
+            return
+        for venta_id, empleado_id, dia, fuente, produccion, comision in ventas:
+            click.echo(f"  venta {venta_id} ({empleado_id}, {dia}, {fuente}): falta producción {produccion} / comisión {comision}")
+        for empleado_id, sucursal_id, dia, fuente in resumen:
+            click.echo(f"  resumen {empleado_id}/{sucursal_id} {dia} {fuente}: difiere del cálculo desde cero")
+        for empleado_id, sucursal_id, dia, fuente, pendiente in negativos:
+            click.echo(f"  resumen {empleado_id}/{sucursal_id} {dia} {fuente}: pagado por caja de más ({pendiente})")
+        if ventas or resumen:
+            raise click.ClickException(
+                f"{len(ventas)} venta(s) y {len(resumen)} fila(s) de resumen con diferencias. Corrige con `flask comisiones-rebuild`."
+            )
+        raise click.ClickException(
+            f"{len(negativos)} fila(s) con más comisión pagada por caja que devengada (revisar ventas editadas tras el pago)."
+        )
@@ -1,300 +1,224 @@
 import os
+import time
+import threading
 import psycopg2
 import psycopg2.extras
-from flask import g, current_app
+from psycopg2 import pool as pg_pool
+from flask import g, current_app, has_app_context
+from .sql_profiler import ConexionInstrumentada
+
+
+# ---------------------------------------------------------
+# POOL DE CONEXIONES (Uno por proceso/worker de gunicorn)
+# ---------------------------------------------------------
+# Antes cada petición abría una conexión nueva, ejecutaba SET TIME ZONE + commit
+# y la cerraba al final. Ahora cada worker mantiene un pool propio: la zona horaria
+# se fija una sola vez al crear la conexión (parámetro 'options' del handshake) y
+# las conexiones se reutilizan entre peticiones e hilos (worker sync o gthread).
+
+ZONA_HORARIA_DB = 'America/Lima'
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _config(clave, defecto):
+    """Lee un valor de app.config (si hay contexto) o de las variables de entorno."""
+    if has_app_context() and clave in current_app.config:
+        return current_app.config[clave]
+    return os.environ.get(clave, defecto)
+
+
+def _parametros_conexion():
+    """Devuelve (args, kwargs) para psycopg2.connect según el entorno (Nube o Local)."""
+    opciones = {
+        'options': f"-c timezone={ZONA_HORARIA_DB}",
+        'connection_factory': ConexionInstrumentada  # Métricas SQL por petición (ver sql_profiler.py)
+    }
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url:
+        # MODO NUBE (Railway)
+        return (database_url,), opciones
+    # MODO LOCAL (Tu PC)
+    opciones.update(
+        host=os.environ.get('DB_HOST', 'localhost'),
+        user=os.environ.get('DB_USER', 'postgres'),
+        password=os.environ.get('DB_PASSWORD', 'jv123'),
+        database=os.environ.get('DB_NAME', 'jv_studio_pg_db'),
+        port=os.environ.get('DB_PORT', '5432')
+    )
+    return (), opciones
+
+
+class PoolConexiones:
+    """
+    Pool thread-safe con espera acotada, chequeo de salud al entregar la conexión
+    y contadores para monitoreo.
+    Nota: no usamos psycopg2.pool porque cierra toda conexión devuelta por encima
+    de 'minconn', lo que bajo carga equivale a volver a conectar en cada petición.
+    """
+
+    def __init__(self, minconn, maxconn, *args, timeout=10, ping_segundos=30, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = float(timeout)
+        self.ping_segundos = float(ping_segundos)
+        self._args = args
+        self._kwargs = kwargs
+        self._cupos = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._libres = []  # [(conexion, instante_ultimo_uso)]
+        self.stats = {'en_uso': 0, 'esperando': 0, 'creadas': 0, 'descartadas': 0, 'timeouts': 0}
+
+        for _ in range(minconn):
+            self._libres.append((self._conectar(), time.monotonic()))
+
+    def _conectar(self):
+        conn = psycopg2.connect(*self._args, **self._kwargs)
+        self._incrementar('creadas')
+        return conn
+
+    def _incrementar(self, clave, valor=1):
+        with self._lock:
+            self.stats[clave] += valor
+
+    def _esta_sana(self, conn, ultimo_uso):
+        """Descarta conexiones cerradas; hace un ping si estuvo ociosa mucho tiempo."""
+        if conn.closed:
+            return False
+        if time.monotonic() - ultimo_uso < self.ping_segundos:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _descartar(self, conn):
+        self._incrementar('descartadas')
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def obtener(self):
+        """Entrega una conexión sana; espera hasta 'timeout' segundos si el pool está lleno."""
+        self._incrementar('esperando')
+        try:
+            disponible = self._cupos.acquire(timeout=self.timeout)
+        finally:
+            self._incrementar('esperando', -1)
+        if not disponible:
+            self._incrementar('timeouts')
+            raise pg_pool.PoolError(f"Pool agotado: {self.maxconn} conexiones en uso por más de {self.timeout}s")
+
+        try:
+            while True:
+                with self._lock:
+                    libre = self._libres.pop() if self._libres else None
+                if libre is None:
+                    conn = self._conectar()
+                    break
+                if self._esta_sana(*libre):
+                    conn = libre[0]
+                    break
+                self._descartar(libre[0])
+        except Exception:
+            self._cupos.release()
+            raise
+
+        self._incrementar('en_uso')
+        return conn
+
+    def devolver(self, conn):
+        """Limpia la conexión (rollback de lo pendiente) y la devuelve al pool."""
+        try:
+            sana = not conn.closed
+            if sana:
+                try:
+                    if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    if conn.autocommit:
+                        conn.autocommit = False
+                except psycopg2.Error:
+                    sana = False
+
+            if sana:
+                with self._lock:
+                    self._libres.append((conn, time.monotonic()))
+            else:
+                self._descartar(conn)
+        finally:
+            self._incrementar('en_uso', -1)
+            self._cupos.release()
+
+    def resumen(self):
+        with self._lock:
+            datos = dict(self.stats)
+            datos['disponibles'] = len(self._libres)
+        datos.update(
+            minimo=self.minconn,
+            maximo=self.maxconn,
+            abiertas=datos['disponibles'] + datos['en_uso'],
+            pid=os.getpid()
+        )
+        return datos
+
+
+def get_pool():
+    """
+    Devuelve el pool del proceso actual, creándolo la primera vez.
+    Se valida el PID para no heredar conexiones de gunicorn a través de fork().
+    """
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            args, kwargs = _parametros_conexion()
+            _pool = PoolConexiones(
+                int(_config('DB_POOL_MIN', 1)),
+                int(_config('DB_POOL_MAX', 10)),
+                *args,
+                timeout=_config('DB_POOL_TIMEOUT', 10),
+                ping_segundos=_config('DB_POOL_PING_SEGUNDOS', 30),
+                **kwargs
+            )
+            _pool_pid = os.getpid()
+            print(f"✅ Pool PostgreSQL listo (pid {_pool_pid}, min={_pool.minconn}, max={_pool.maxconn})")
+    return _pool
+
+
+def pool_stats():
+    """Estadísticas del pool del worker actual (en uso, esperando, creadas, etc.)."""
+    if _pool is None or _pool_pid != os.getpid():
+        return {'pid': os.getpid(), 'inicializado': False}
+    datos = _pool.resumen()
+    datos['inicializado'] = True
+    return datos
+
 
 def get_db():
     if 'db' not in g:
-        # 1. Intentamos leer la URL de la base de datos desde las variables de entorno (Nube)
-        database_url = os.environ.get('DATABASE_URL')
-        
         try:
-            if database_url:
-                # MODO NUBE (Railway)
-                g.db = psycopg2.connect(database_url)
-                print("✅ Conectado a base de datos NUBE")
-            else:
-                # MODO LOCAL (Tu PC)
-                print("⚠️ Variable DATABASE_URL no encontrada, usando credenciales locales (.env)...")
-                g.db = psycopg2.connect(
-                    host=os.environ.get('DB_HOST', 'localhost'),
-                    user=os.environ.get('DB_USER', 'postgres'),
-                    password=os.environ.get('DB_PASSWORD', 'jv123'),
-                    database=os.environ.get('DB_NAME', 'jv_studio_pg_db'),
-                    port=os.environ.get('DB_PORT', '5432')
-                )
-                print("✅ Conectado a base de datos LOCAL")
-            
-            # --- CONFIGURAR ZONA HORARIA PARA LA SESIÓN ---
-            with g.db.cursor() as cursor:
-                cursor.execute("SET TIME ZONE 'America/Lima';")
-                g.db.commit()
-                # print("🕒 Zona Horaria establecida a: America/Lima")
+            g.db = get_pool().obtener()
         except Exception as e:
             print(f"❌ Error crítico conectando a PostgreSQL: {e}")
             g.db = None # Importante para evitar el error 'NoneType' posterior
-            
+
     return g.db
 
 
 def close_db(e=None):
     db = g.pop('db', None)
-    if db is not None:
+    if db is not None and _pool is not None and _pool_pid == os.getpid():
+        _pool.devolver(db)
+    elif db is not None:
         db.close()
 
 def init_app(app):
     app.teardown_appcontext(close_db)
-
-def check_schema_updates(app):
-    """
-    Función de auto-migración simple para asegurar que las columnas existan en Producción.
-    Se debe llamar al iniciar la app.
-    """
-    with app.app_context():
-        db = get_db()
-        if not db:
-            return
-            
-        try:
-            with db.cursor() as cursor:
-                # ---------------------------------------------------------
-                # 0. CREACIÓN DE TABLAS FALTANTES (Auto-Fix)
-                # ---------------------------------------------------------
-                # Tabla Compras
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS compras (
-                        id SERIAL PRIMARY KEY,
-                        proveedor_id INTEGER REFERENCES proveedores(id),
-                        sucursal_id INTEGER REFERENCES sucursales(id),
-                        fecha_compra DATE DEFAULT CURRENT_DATE,
-                        tipo_comprobante VARCHAR(50),
-                        serie_numero_comprobante VARCHAR(100),
-                        monto_subtotal DECIMAL(10, 2) DEFAULT 0.00,
-                        monto_impuestos DECIMAL(10, 2) DEFAULT 0.00,
-                        monto_total DECIMAL(10, 2) DEFAULT 0.00,
-                        estado_pago VARCHAR(20) DEFAULT 'Pendiente',
-                        notas TEXT,
-                        fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-                # Tabla Detalle Compras
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS compra_items (
-                        id SERIAL PRIMARY KEY,
-                        compra_id INTEGER REFERENCES compras(id) ON DELETE CASCADE,
-                        producto_id INTEGER REFERENCES productos(id),
-                        cantidad INTEGER NOT NULL,
-                        costo_unitario DECIMAL(10, 2) NOT NULL,
-                        subtotal DECIMAL(10, 2) NOT NULL
-                    );
-                """)
-                
-                # Tabla Kardex (Movimientos de Inventario)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS kardex (
-                        id SERIAL PRIMARY KEY,
-                        producto_id INTEGER REFERENCES productos(id),
-                        tipo_movimiento VARCHAR(50), 
-                        cantidad INTEGER,
-                        stock_anterior INTEGER,
-                        stock_actual INTEGER,
-                        motivo TEXT,
-                        usuario_id INTEGER REFERENCES empleados(id),
-                        venta_id INTEGER REFERENCES ventas(id),
-                        fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-
-                # Tabla Comisiones (Generales)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS comisiones (
-                        id SERIAL PRIMARY KEY,
-                        venta_item_id INTEGER REFERENCES venta_items(id) ON DELETE CASCADE,
-                        empleado_id INTEGER REFERENCES empleados(id),
-                        monto_comision DECIMAL(10, 2) NOT NULL,
-                        porcentaje DECIMAL(5, 2) DEFAULT 0.00,
-                        fecha_generacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        estado VARCHAR(20) DEFAULT 'Pendiente',
-                        pago_caja_sesion_id INTEGER, 
-                        fecha_pago TIMESTAMP
-                    );
-                """)
-
-                # Tabla Loyalty Rules
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS loyalty_rules (
-                        id SERIAL PRIMARY KEY,
-                        nombre VARCHAR(100) NOT NULL,
-                        servicio_id INTEGER REFERENCES servicios(id),
-                        cantidad_requerida INTEGER NOT NULL,
-                        periodo_meses INTEGER NOT NULL,
-                        descuento_porcentaje NUMERIC(5, 2) NOT NULL,
-                        activo BOOLEAN DEFAULT TRUE
-                    );
-                """)
-                
-                # Tabla Junction Loyalty Services (M:N)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS loyalty_rule_services (
-                        loyalty_rule_id INTEGER REFERENCES loyalty_rules(id) ON DELETE CASCADE,
-                        servicio_id INTEGER REFERENCES servicios(id) ON DELETE CASCADE,
-                        PRIMARY KEY (loyalty_rule_id, servicio_id)
-                    );
-                """)
-                
-                # Tabla CRM Config
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS crm_config (
-                        id SERIAL PRIMARY KEY,
-                        tipo_evento VARCHAR(50) NOT NULL,
-                        mensaje_plantilla TEXT,
-                        dias_anticipacion INTEGER DEFAULT 0,
-                        activo BOOLEAN DEFAULT TRUE
-                    );
-                """)
-
-                # Tabla Historial de Clientes (con fotos de Cloudinary)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS cliente_historial (
-                        id SERIAL PRIMARY KEY,
-                        cliente_id INTEGER REFERENCES clientes(id) ON DELETE CASCADE,
-                        venta_id INTEGER REFERENCES ventas(id) ON DELETE SET NULL,
-                        empleado_id INTEGER REFERENCES empleados(id) ON DELETE SET NULL,
-                        fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        servicios_realizados TEXT NOT NULL,
-                        monto_pagado DECIMAL(10, 2) DEFAULT 0.00,
-                        foto_frente TEXT,
-                        foto_lateral_izq TEXT,
-                        foto_lateral_der TEXT,
-                        foto_atras TEXT,
-                        notas TEXT
-                    );
-                """)
-
-                # -------------------------
-                # PAQUETES DE SERVICIOS
-                # -------------------------
-                # Tabla Packages
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS packages (
-                        id SERIAL PRIMARY KEY,
-                        name VARCHAR(100) NOT NULL,
-                        price DECIMAL(10, 2) NOT NULL DEFAULT 0.00,
-                        is_active BOOLEAN DEFAULT TRUE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-                
-                # Tabla Package Items
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS package_items (
-                        package_id INTEGER NOT NULL REFERENCES packages(id) ON DELETE CASCADE,
-                        service_id INTEGER NOT NULL REFERENCES servicios(id) ON DELETE CASCADE,
-                        quantity INTEGER NOT NULL DEFAULT 1,
-                        PRIMARY KEY (package_id, service_id)
-                    );
-                """)
-
-                # -------------------------
-                # DEUDAS, PENALIDADES, BONOS
-                # -------------------------
-                # Tabla Deudas
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS empleado_deudas (
-                        id SERIAL PRIMARY KEY,
-                        empleado_id INTEGER REFERENCES empleados(id) ON DELETE CASCADE,
-                        concepto VARCHAR(255) NOT NULL,
-                        monto_total DECIMAL(10, 2) NOT NULL,
-                        monto_pagado DECIMAL(10, 2) DEFAULT 0.00,
-                        estado VARCHAR(50) DEFAULT 'Pendiente',
-                        fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-                
-                # Tabla Penalidades
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS empleado_penalidades (
-                        id SERIAL PRIMARY KEY,
-                        empleado_id INTEGER REFERENCES empleados(id) ON DELETE CASCADE,
-                        motivo VARCHAR(255) NOT NULL,
-                        monto DECIMAL(10, 2) NOT NULL,
-                        fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        deducido_en_planilla_id INTEGER REFERENCES planillas(id) ON DELETE SET NULL
-                    );
-                """)
-                
-                # Tabla Bonos (NUEVO)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS empleado_bonos (
-                        id SERIAL PRIMARY KEY,
-                        empleado_id INTEGER REFERENCES empleados(id) ON DELETE CASCADE,
-                        motivo VARCHAR(255) NOT NULL,
-                        monto DECIMAL(10, 2) NOT NULL,
-                        fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        deducido_en_planilla_id INTEGER REFERENCES planillas(id) ON DELETE SET NULL
-                    );
-                """)
-
-                db.commit()
-
-                # Lista de Columnas Nuevas a Verificar/Agregar
-                columns_to_check = [
-                    # tabla, columna, definición
-                    ("configuracion_sucursal", "agenda_hora_inicio", "TIME DEFAULT '08:00:00'"),
-                    ("configuracion_sucursal", "agenda_hora_fin", "TIME DEFAULT '22:00:00'"),
-                    # Agregamos las de empleados también por seguridad
-                    ("empleados", "tipo_contrato", "VARCHAR(20) DEFAULT 'FIJO'"),
-                    # ("empleados", "puede_realizar_servicios", "BOOLEAN DEFAULT TRUE"), # DEPRECATED
-                    ("empleados", "porcentaje_comision_productos", "DECIMAL(5,2) DEFAULT 0.00"),
-                    ("empleados", "configuracion_comision", "JSONB DEFAULT '{}'"),
-                    # VENTAS
-                    ("venta_items", "es_hora_extra", "BOOLEAN DEFAULT FALSE"),
-                    ("venta_items", "porcentaje_servicio_extra", "DECIMAL(5,2) DEFAULT 0.00"),
-                    ("venta_items", "comision_servicio_extra", "DECIMAL(10,2) DEFAULT 0.00"),
-                    ("venta_items", "entregado_al_colaborador", "BOOLEAN DEFAULT FALSE"),
-                    # PRODUCTOS
-                    ("productos", "comision_vendedor_monto", "DECIMAL(10,2) DEFAULT 0.00"),
-                    # COMISIONES (Fix para tablas antiguas)
-                    ("comisiones", "porcentaje", "DECIMAL(5, 2) DEFAULT 0.00"),
-                    # CLIENTES
-                    ("clientes", "apellido_paterno", "VARCHAR(100)"),
-                    ("clientes", "apellido_materno", "VARCHAR(100)"),
-                    ("clientes", "saldo_monedero", "DECIMAL(12, 2) DEFAULT 0.00"),
-                    ("clientes", "notas_especiales", "TEXT"),
-                    # GASTOS
-                    ("gastos", "estado_confirmacion", "VARCHAR(20) DEFAULT 'Confirmado'"),
-                    # GIFT CARDS - PAQUETES
-                    ("gift_cards", "package_id", "INTEGER REFERENCES packages(id) ON DELETE SET NULL"),
-                    # RESERVAS
-                    ("reservas", "origen", "VARCHAR(20) DEFAULT 'POS'"),
-                    # CATEGORIAS GASTOS
-                    ("categorias_gastos", "requiere_beneficiario", "BOOLEAN DEFAULT FALSE"),
-                    # ORDENACION
-                    ("servicios", "orden", "INTEGER DEFAULT 0"),
-                    ("servicios", "ciclo_dias", "INTEGER DEFAULT 0"),
-                    ("productos", "orden", "INTEGER DEFAULT 0"),
-                ]
-                
-                print("--- Iniciando Verificación de Schema (Auto-Migration) ---")
-                for table, col, definition in columns_to_check:
-                    try:
-                        # Intentar agregar columna. Si falla porque existe, ignoramos.
-                        # Postgres no tiene "ADD COLUMN IF NOT EXISTS" nativo en versiones viejas,
-                        # pero el try/except es robusto.
-                        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {col} {definition}")
-                        print(f"✅ Columna Agregada: {table}.{col}")
-                    except psycopg2.errors.DuplicateColumn:
-                        db.rollback() # Importante rollbackear el error
-                        # print(f"ℹ️ Columna ya existe: {table}.{col}")
-                    except psycopg2.errors.UndefinedTable:
-                         db.rollback()
-                         print(f"⚠️ Tabla no encontrada: {table}")
-                    except Exception as e:
-                        db.rollback()
-                        print(f"❌ Error migrando {table}.{col}: {e}")
-                    else:
-                        db.commit()
-                print("--- Verificación de Schema Finalizada ---")
-                
-        except Exception as e:
-            print(f"Error general en check_schema_updates: {e}")
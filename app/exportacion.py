@@ -0,0 +1,304 @@
+import os
+import uuid
+import queue
+import tempfile
+import threading
+import unicodedata
+from datetime import datetime
+from urllib.parse import quote
+from flask import Response, stream_with_context
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet es opcional: sin pyarrow solo se ofrece CSV/Excel
+    pa = pq = None
+
+# ---------------------------------------------------------
+# EXPORTACIÓN A EXCEL EN STREAMING
+# ---------------------------------------------------------
+# Antes cada exportación hacía fetchall() -> DataFrame de pandas -> libro completo
+# en un BytesIO: con un año de ventas el worker subía cientos de MB (las filas
+# vivían tres veces en memoria) y la petición podía pasar el timeout.
+# Ahora:
+#   1. Las filas se leen con un cursor de servidor (con nombre), de a
+#      FILAS_POR_LOTE: en memoria solo está el lote actual.
+#   2. Se escriben en un libro openpyxl write-only, que vuelca cada hoja a disco
+#      a medida que se agregan filas, y el .xlsx se guarda en un archivo temporal.
+#   3. La respuesta envía ese archivo en trozos y lo borra al terminar.
+# La memoria queda acotada sin importar la cantidad de filas; la conexión vuelve
+# al pool antes de empezar a enviar (ver bench_exportacion.py).
+#
+# Uso:
+#   hojas = [Hoja('Ventas', sql, params, [('Fecha', 18), ('Cliente', 35), ...])]
+#   ruta, filas = escribir_xlsx(get_db(), hojas)
+#   return respuesta_archivo(ruta, 'ventas.xlsx', MIME_XLSX)
+
+MIME_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+MIME_CSV = 'text/csv; charset=utf-8'
+MIME_PARQUET = 'application/vnd.apache.parquet'
+PARQUET_DISPONIBLE = pa is not None
+FILAS_POR_LOTE = 2000
+FILAS_POR_LOTE_PARQUET = 20000
+TROZO_BYTES = 64 * 1024
+TROZOS_EN_COLA = 16  # Tope de memoria del CSV: ~1 MB entre COPY y el cliente
+_FUENTE_ENCABEZADO = Font(bold=True)
+
+
+class Hoja:
+    """
+    Una hoja del libro. `columnas` es [(encabezado, ancho)] en el mismo orden que
+    las columnas del SELECT (las filas se escriben como tuplas, sin dict por fila).
+    """
+
+    def __init__(self, titulo, sql, params=(), columnas=()):
+        self.titulo = titulo[:31]  # Límite de Excel para el nombre de la hoja
+        self.sql = sql
+        self.params = tuple(params)
+        self.columnas = list(columnas)
+
+
+def _valor(valor):
+    """Ajusta los tipos que Excel no acepta (zona horaria, caracteres de control)."""
+    if isinstance(valor, str):
+        return ILLEGAL_CHARACTERS_RE.sub('', valor)
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        return valor.replace(tzinfo=None)
+    return valor
+
+
+def _escribir_hoja(conn, libro, hoja, lote):
+    ws = libro.create_sheet(hoja.titulo)
+    # En write-only los anchos y paneles se fijan antes de la primera fila
+    for indice, (_, ancho) in enumerate(hoja.columnas, start=1):
+        if ancho:
+            ws.column_dimensions[get_column_letter(indice)].width = ancho
+    ws.freeze_panes = 'A2'
+
+    encabezados = []
+    for titulo, _ in hoja.columnas:
+        celda = WriteOnlyCell(ws, value=titulo)
+        celda.font = _FUENTE_ENCABEZADO
+        encabezados.append(celda)
+    ws.append(encabezados)
+
+    filas = 0
+    # Cursor con nombre = cursor del lado del servidor: Postgres entrega las filas
+    # de a `itersize` en vez de mandar el resultado completo al worker.
+    with conn.cursor(name=f"exportar_{uuid.uuid4().hex[:12]}") as cursor:
+        cursor.itersize = lote
+        cursor.execute(hoja.sql, hoja.params)
+        for fila in cursor:
+            ws.append([_valor(v) for v in fila])
+            filas += 1
+    return filas
+
+
+def escribir_xlsx(conn, hojas, lote=FILAS_POR_LOTE):
+    """
+    Escribe las hojas en un .xlsx temporal y devuelve (ruta, filas_por_hoja).
+    El llamador es dueño del archivo: respuesta_archivo() lo borra al enviarlo,
+    o hay que borrarlo con os.remove() si no se envía (p.ej. sin datos).
+    La conexión no debe estar en autocommit (los cursores con nombre viven dentro
+    de la transacción).
+    """
+    descriptor, ruta = tempfile.mkstemp(prefix='export_', suffix='.xlsx')
+    os.close(descriptor)
+    try:
+        libro = Workbook(write_only=True)
+        filas = [_escribir_hoja(conn, libro, hoja, lote) for hoja in hojas]
+        libro.save(ruta)
+    except Exception:
+        os.remove(ruta)
+        raise
+    return ruta, filas
+
+
+def _nombre_descarga(nombre_descarga):
+    """Opciones de Content-Disposition: nombre ASCII + filename* (RFC 5987) para tildes y ñ."""
+    nombre_ascii = unicodedata.normalize('NFKD', nombre_descarga).encode('ascii', 'ignore').decode('ascii')
+    opciones = {'filename': nombre_ascii}
+    if nombre_ascii != nombre_descarga:
+        opciones['filename*'] = f"UTF-8''{quote(nombre_descarga)}"
+    return opciones
+
+
+def _enviar_y_borrar(ruta):
+    try:
+        with open(ruta, 'rb') as archivo:
+            while True:
+                trozo = archivo.read(TROZO_BYTES)
+                if not trozo:
+                    break
+                yield trozo
+    finally:
+        # También corre si el cliente corta la descarga (el servidor cierra el generador)
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def respuesta_archivo(ruta, nombre_descarga, mimetype):
+    """Respuesta en streaming del archivo temporal; se borra al terminar el envío."""
+    respuesta = Response(_enviar_y_borrar(ruta), mimetype=mimetype, direct_passthrough=True)
+    respuesta.content_length = os.path.getsize(ruta)
+    respuesta.headers.set('Content-Disposition', 'attachment', **_nombre_descarga(nombre_descarga))
+    return respuesta
+
+
+# ---------------------------------------------------------
+# CSV MASIVO CON COPY ... TO STDOUT
+# ---------------------------------------------------------
+# Para bajar periodos completos (contabilidad) el CSV no pasa fila por fila por
+# Python: Postgres lo genera con COPY (SELECT ...) TO STDOUT y psycopg2 lo copia
+# con copy_expert(). Un hilo corre el COPY y deja trozos de 64 KB en una cola
+# acotada; la respuesta los envía a medida que llegan. Si el cliente es más
+# lento, la cola se llena y el COPY espera (la memoria no crece), y si corta la
+# descarga el COPY se aborta. Sin archivo temporal.
+
+class _CopiaCancelada(Exception):
+    pass
+
+
+class _Tuberia:
+    """Objeto tipo archivo para copy_expert(): agrupa en trozos y los pasa a la cola."""
+
+    def __init__(self):
+        self.cola = queue.Queue(maxsize=TROZOS_EN_COLA)
+        self.cancelada = threading.Event()
+        self._pendiente = bytearray()
+        self._primero = True
+
+    def write(self, datos):
+        self._pendiente += datos
+        # El primer trozo (el encabezado) sale enseguida: confirma que la consulta arrancó
+        if self._primero or len(self._pendiente) >= TROZO_BYTES:
+            self._primero = False
+            self._poner(bytes(self._pendiente))
+            self._pendiente = bytearray()
+
+    def _poner(self, elemento):
+        while not self.cancelada.is_set():
+            try:
+                self.cola.put(elemento, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise _CopiaCancelada()
+
+    def cerrar(self, error=None):
+        if self._pendiente and error is None:
+            self._poner(bytes(self._pendiente))
+        self._poner(error)  # None = fin; una excepción = falló el COPY
+
+
+def _copiar(conn, sentencia, tuberia):
+    try:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(sentencia, tuberia)
+        tuberia.cerrar()
+    except _CopiaCancelada:
+        pass
+    except Exception as e:
+        try:
+            tuberia.cerrar(e)
+        except _CopiaCancelada:
+            pass
+
+
+def respuesta_csv(conn, sql, params, nombre_descarga):
+    """
+    Respuesta CSV (UTF-8, con encabezado) generada por COPY y enviada en streaming.
+    Los errores de la consulta se lanzan aquí, antes de enviar nada, para que la
+    ruta pueda avisar con flash. La conexión queda ocupada hasta terminar el envío.
+    """
+    with conn.cursor() as cursor:
+        consulta = cursor.mogrify(sql, params)
+    sentencia = b"COPY (" + consulta + b") TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')"
+
+    tuberia = _Tuberia()
+    hilo = threading.Thread(target=_copiar, args=(conn, sentencia, tuberia), daemon=True)
+    hilo.start()
+
+    primero = tuberia.cola.get()
+    if isinstance(primero, BaseException):
+        hilo.join()
+        raise primero
+
+    def _enviar():
+        try:
+            elemento = primero
+            while elemento is not None:
+                if isinstance(elemento, BaseException):
+                    raise elemento  # Ya se enviaron datos: solo queda cortar la descarga
+                yield elemento
+                elemento = tuberia.cola.get()
+        finally:
+            tuberia.cancelada.set()
+            hilo.join()
+
+    # stream_with_context: la conexión no vuelve al pool hasta que termine el COPY
+    respuesta = Response(stream_with_context(_enviar()), mimetype=MIME_CSV)
+    respuesta.headers.set('Content-Disposition', 'attachment', **_nombre_descarga(nombre_descarga))
+    return respuesta
+
+
+# ---------------------------------------------------------
+# PARQUET (opcional, requiere pyarrow)
+# ---------------------------------------------------------
+# Se lee con un cursor de servidor y se escribe por lotes de Arrow (RecordBatch)
+# con tipos fijos tomados de las columnas de la consulta; el archivo va a un
+# temporal porque Parquet escribe su índice al final.
+
+def _tipo_arrow(columna):
+    tipos = {
+        16: pa.bool_(), 20: pa.int64(), 21: pa.int16(), 23: pa.int32(),
+        700: pa.float32(), 701: pa.float64(), 1082: pa.date32(),
+        1114: pa.timestamp('us'), 1184: pa.timestamp('us', tz='UTC'),
+    }
+    if columna.type_code == 1700:  # NUMERIC: se respeta la escala (montos exactos)
+        if columna.precision and columna.scale is not None:
+            return pa.decimal128(columna.precision, columna.scale)
+        return pa.decimal128(38, 10)
+    return tipos.get(columna.type_code, pa.string())
+
+
+def _columna_arrow(valores, tipo):
+    if pa.types.is_string(tipo):
+        valores = [None if v is None else str(v) for v in valores]
+    return pa.array(valores, type=tipo)
+
+
+def escribir_parquet(conn, sql, params=(), lote=FILAS_POR_LOTE_PARQUET):
+    """Escribe el resultado en un .parquet temporal y devuelve (ruta, filas)."""
+    if not PARQUET_DISPONIBLE:
+        raise RuntimeError("La exportación a Parquet necesita pyarrow instalado")
+
+    descriptor, ruta = tempfile.mkstemp(prefix='export_', suffix='.parquet')
+    os.close(descriptor)
+    filas = 0
+    try:
+        with conn.cursor(name=f"exportar_{uuid.uuid4().hex[:12]}") as cursor:
+            cursor.execute(sql, tuple(params))
+            bloque = cursor.fetchmany(lote)
+            # En un cursor con nombre la descripción de columnas llega con el primer FETCH
+            esquema = pa.schema([(c.name, _tipo_arrow(c)) for c in cursor.description])
+            with pq.ParquetWriter(ruta, esquema, compression='snappy') as escritor:
+                while bloque:
+                    columnas = list(zip(*bloque))
+                    escritor.write_batch(pa.RecordBatch.from_arrays(
+                        [_columna_arrow(valores, campo.type) for valores, campo in zip(columnas, esquema)],
+                        schema=esquema
+                    ))
+                    filas += len(bloque)
+                    bloque = cursor.fetchmany(lote)
+    except Exception:
+        os.remove(ruta)
+        raise
+    return ruta, filas
@@ -0,0 +1,40 @@
+import threading
+from collections import deque
+
+# ---------------------------------------------------------
+# LATENCIAS DE OPERACIONES CRÍTICAS (p50/p99 por worker)
+# ---------------------------------------------------------
+# Ventana deslizante de las últimas VENTANA mediciones por operación (p.ej.
+# 'checkout'). Vive en memoria del worker, igual que las estadísticas del pool:
+# /api/sistema/latencias muestra las del worker que atiende la petición.
+
+VENTANA = 1000
+
+_muestras = {}  # operacion -> deque de milisegundos
+_lock = threading.Lock()
+
+
+def registrar(operacion, ms):
+    with _lock:
+        _muestras.setdefault(operacion, deque(maxlen=VENTANA)).append(ms)
+
+
+def _percentil(ordenados, p):
+    # Nearest-rank: con pocas muestras p99 es el máximo, no una interpolación
+    indice = max(0, -(-len(ordenados) * p // 100) - 1)
+    return ordenados[int(indice)]
+
+
+def resumen():
+    """{operacion: {'n', 'p50_ms', 'p99_ms', 'max_ms'}} de la ventana actual."""
+    with _lock:
+        copia = {op: sorted(valores) for op, valores in _muestras.items()}
+    return {
+        op: {
+            'n': len(valores),
+            'p50_ms': round(_percentil(valores, 50), 1),
+            'p99_ms': round(_percentil(valores, 99), 1),
+            'max_ms': round(valores[-1], 1)
+        }
+        for op, valores in copia.items() if valores
+    }
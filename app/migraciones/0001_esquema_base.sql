@@ -0,0 +1,159 @@
+-- 0001: Esquema base.
+-- Reemplaza a db.check_schema_updates(), que ejecutaba estas sentencias en cada
+-- arranque de cada worker. Es idempotente para poder aplicarse sobre la BD de
+-- producción existente.
+
+CREATE TABLE IF NOT EXISTS compras (
+    id SERIAL PRIMARY KEY,
+    proveedor_id INTEGER REFERENCES proveedores(id),
+    sucursal_id INTEGER REFERENCES sucursales(id),
+    fecha_compra DATE DEFAULT CURRENT_DATE,
+    tipo_comprobante VARCHAR(50),
+    serie_numero_comprobante VARCHAR(100),
+    monto_subtotal DECIMAL(10, 2) DEFAULT 0.00,
+    monto_impuestos DECIMAL(10, 2) DEFAULT 0.00,
+    monto_total DECIMAL(10, 2) DEFAULT 0.00,
+    estado_pago VARCHAR(20) DEFAULT 'Pendiente',
+    notas TEXT,
+    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS compra_items (
+    id SERIAL PRIMARY KEY,
+    compra_id INTEGER REFERENCES compras(id) ON DELETE CASCADE,
+    producto_id INTEGER REFERENCES productos(id),
+    cantidad INTEGER NOT NULL,
+    costo_unitario DECIMAL(10, 2) NOT NULL,
+    subtotal DECIMAL(10, 2) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS kardex (
+    id SERIAL PRIMARY KEY,
+    producto_id INTEGER REFERENCES productos(id),
+    tipo_movimiento VARCHAR(50), 
+    cantidad INTEGER,
+    stock_anterior INTEGER,
+    stock_actual INTEGER,
+    motivo TEXT,
+    usuario_id INTEGER REFERENCES empleados(id),
+    venta_id INTEGER REFERENCES ventas(id),
+    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS comisiones (
+    id SERIAL PRIMARY KEY,
+    venta_item_id INTEGER REFERENCES venta_items(id) ON DELETE CASCADE,
+    empleado_id INTEGER REFERENCES empleados(id),
+    monto_comision DECIMAL(10, 2) NOT NULL,
+    porcentaje DECIMAL(5, 2) DEFAULT 0.00,
+    fecha_generacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    estado VARCHAR(20) DEFAULT 'Pendiente',
+    pago_caja_sesion_id INTEGER, 
+    fecha_pago TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS loyalty_rules (
+    id SERIAL PRIMARY KEY,
+    nombre VARCHAR(100) NOT NULL,
+    servicio_id INTEGER REFERENCES servicios(id),
+    cantidad_requerida INTEGER NOT NULL,
+    periodo_meses INTEGER NOT NULL,
+    descuento_porcentaje NUMERIC(5, 2) NOT NULL,
+    activo BOOLEAN DEFAULT TRUE
+);
+
+CREATE TABLE IF NOT EXISTS loyalty_rule_services (
+    loyalty_rule_id INTEGER REFERENCES loyalty_rules(id) ON DELETE CASCADE,
+    servicio_id INTEGER REFERENCES servicios(id) ON DELETE CASCADE,
+    PRIMARY KEY (loyalty_rule_id, servicio_id)
+);
+
+CREATE TABLE IF NOT EXISTS crm_config (
+    id SERIAL PRIMARY KEY,
+    tipo_evento VARCHAR(50) NOT NULL,
+    mensaje_plantilla TEXT,
+    dias_anticipacion INTEGER DEFAULT 0,
+    activo BOOLEAN DEFAULT TRUE
+);
+
+CREATE TABLE IF NOT EXISTS cliente_historial (
+    id SERIAL PRIMARY KEY,
+    cliente_id INTEGER REFERENCES clientes(id) ON DELETE CASCADE,
+    venta_id INTEGER REFERENCES ventas(id) ON DELETE SET NULL,
+    empleado_id INTEGER REFERENCES empleados(id) ON DELETE SET NULL,
+    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    servicios_realizados TEXT NOT NULL,
+    monto_pagado DECIMAL(10, 2) DEFAULT 0.00,
+    foto_frente TEXT,
+    foto_lateral_izq TEXT,
+    foto_lateral_der TEXT,
+    foto_atras TEXT,
+    notas TEXT
+);
+
+CREATE TABLE IF NOT EXISTS packages (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    price DECIMAL(10, 2) NOT NULL DEFAULT 0.00,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS package_items (
+    package_id INTEGER NOT NULL REFERENCES packages(id) ON DELETE CASCADE,
+    service_id INTEGER NOT NULL REFERENCES servicios(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (package_id, service_id)
+);
+
+CREATE TABLE IF NOT EXISTS empleado_deudas (
+    id SERIAL PRIMARY KEY,
+    empleado_id INTEGER REFERENCES empleados(id) ON DELETE CASCADE,
+    concepto VARCHAR(255) NOT NULL,
+    monto_total DECIMAL(10, 2) NOT NULL,
+    monto_pagado DECIMAL(10, 2) DEFAULT 0.00,
+    estado VARCHAR(50) DEFAULT 'Pendiente',
+    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS empleado_penalidades (
+    id SERIAL PRIMARY KEY,
+    empleado_id INTEGER REFERENCES empleados(id) ON DELETE CASCADE,
+    motivo VARCHAR(255) NOT NULL,
+    monto DECIMAL(10, 2) NOT NULL,
+    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    deducido_en_planilla_id INTEGER REFERENCES planillas(id) ON DELETE SET NULL
+);
+
+CREATE TABLE IF NOT EXISTS empleado_bonos (
+    id SERIAL PRIMARY KEY,
+    empleado_id INTEGER REFERENCES empleados(id) ON DELETE CASCADE,
+    motivo VARCHAR(255) NOT NULL,
+    monto DECIMAL(10, 2) NOT NULL,
+    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    deducido_en_planilla_id INTEGER REFERENCES planillas(id) ON DELETE SET NULL
+);
+
+-- Columnas agregadas con el tiempo (antes: columns_to_check)
+ALTER TABLE IF EXISTS configuracion_sucursal ADD COLUMN IF NOT EXISTS agenda_hora_inicio TIME DEFAULT '08:00:00';
+ALTER TABLE IF EXISTS configuracion_sucursal ADD COLUMN IF NOT EXISTS agenda_hora_fin TIME DEFAULT '22:00:00';
+ALTER TABLE IF EXISTS empleados ADD COLUMN IF NOT EXISTS tipo_contrato VARCHAR(20) DEFAULT 'FIJO';
+ALTER TABLE IF EXISTS empleados ADD COLUMN IF NOT EXISTS porcentaje_comision_productos DECIMAL(5,2) DEFAULT 0.00;
+ALTER TABLE IF EXISTS empleados ADD COLUMN IF NOT EXISTS configuracion_comision JSONB DEFAULT '{}';
+ALTER TABLE IF EXISTS venta_items ADD COLUMN IF NOT EXISTS es_hora_extra BOOLEAN DEFAULT FALSE;
+ALTER TABLE IF EXISTS venta_items ADD COLUMN IF NOT EXISTS porcentaje_servicio_extra DECIMAL(5,2) DEFAULT 0.00;
+ALTER TABLE IF EXISTS venta_items ADD COLUMN IF NOT EXISTS comision_servicio_extra DECIMAL(10,2) DEFAULT 0.00;
+ALTER TABLE IF EXISTS venta_items ADD COLUMN IF NOT EXISTS entregado_al_colaborador BOOLEAN DEFAULT FALSE;
+ALTER TABLE IF EXISTS productos ADD COLUMN IF NOT EXISTS comision_vendedor_monto DECIMAL(10,2) DEFAULT 0.00;
+ALTER TABLE IF EXISTS comisiones ADD COLUMN IF NOT EXISTS porcentaje DECIMAL(5, 2) DEFAULT 0.00;
+ALTER TABLE IF EXISTS clientes ADD COLUMN IF NOT EXISTS apellido_paterno VARCHAR(100);
+ALTER TABLE IF EXISTS clientes ADD COLUMN IF NOT EXISTS apellido_materno VARCHAR(100);
+ALTER TABLE IF EXISTS clientes ADD COLUMN IF NOT EXISTS saldo_monedero DECIMAL(12, 2) DEFAULT 0.00;
+ALTER TABLE IF EXISTS clientes ADD COLUMN IF NOT EXISTS notas_especiales TEXT;
+ALTER TABLE IF EXISTS gastos ADD COLUMN IF NOT EXISTS estado_confirmacion VARCHAR(20) DEFAULT 'Confirmado';
+ALTER TABLE IF EXISTS gift_cards ADD COLUMN IF NOT EXISTS package_id INTEGER REFERENCES packages(id) ON DELETE SET NULL;
+ALTER TABLE IF EXISTS reservas ADD COLUMN IF NOT EXISTS origen VARCHAR(20) DEFAULT 'POS';
+ALTER TABLE IF EXISTS categorias_gastos ADD COLUMN IF NOT EXISTS requiere_beneficiario BOOLEAN DEFAULT FALSE;
+ALTER TABLE IF EXISTS servicios ADD COLUMN IF NOT EXISTS orden INTEGER DEFAULT 0;
+ALTER TABLE IF EXISTS servicios ADD COLUMN IF NOT EXISTS ciclo_dias INTEGER DEFAULT 0;
+ALTER TABLE IF EXISTS productos ADD COLUMN IF NOT EXISTS orden INTEGER DEFAULT 0;
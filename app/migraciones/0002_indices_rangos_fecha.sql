@@ -0,0 +1,33 @@
+-- migrador: sin-transaccion
+-- 0002: Índices para los filtros por rango de fecha (ver app/utils/fechas.py).
+-- Los reportes, listados y la agenda ahora filtran con col >= inicio AND col < fin,
+-- así que un índice btree (filtro, fecha) sirve para acotar el escaneo.
+-- Se crean CONCURRENTLY para no bloquear ventas/reservas durante el despliegue.
+
+-- VENTAS
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ventas_sucursal_fecha ON ventas (sucursal_id, fecha_venta);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ventas_empleado_fecha ON ventas (empleado_id, fecha_venta);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ventas_fecha ON ventas (fecha_venta);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_venta_items_venta ON venta_items (venta_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_venta_pagos_venta ON venta_pagos (venta_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_comisiones_venta_item ON comisiones (venta_item_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_comisiones_empleado_fecha ON comisiones (empleado_id, fecha_generacion);
+
+-- AGENDA
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservas_sucursal_inicio ON reservas (sucursal_id, fecha_hora_inicio);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservas_empleado_inicio ON reservas (empleado_id, fecha_hora_inicio);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ausencias_empleado_inicio ON ausencias_empleado (empleado_id, fecha_hora_inicio);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_horarios_empleado_dia ON horarios_empleado (empleado_id, dia_semana);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_horarios_extra_empleado_fecha ON horarios_extra (empleado_id, fecha);
+
+-- FINANZAS Y CAJA
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_gastos_sucursal_fecha ON gastos (sucursal_id, fecha);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_movimientos_caja_sesion_fecha ON movimientos_caja (caja_sesion_id, fecha);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_caja_sesiones_sucursal_estado ON caja_sesiones (sucursal_id, estado, fecha_apertura);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_propinas_empleado_fecha ON propinas (empleado_id, fecha_registro);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_compras_sucursal_fecha ON compras (sucursal_id, fecha_compra);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_empleado_penalidades_empleado_fecha ON empleado_penalidades (empleado_id, fecha_registro);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_empleado_bonos_empleado_fecha ON empleado_bonos (empleado_id, fecha_registro);
+
+-- INVENTARIO
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_kardex_producto_fecha ON kardex (producto_id, fecha);
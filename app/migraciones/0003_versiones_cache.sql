@@ -0,0 +1,8 @@
+-- 0003: Sellos de versión para cachés en memoria (usuario, permisos por rol, etc.).
+-- Cada clave ('empleado:5', 'rol:2', ...) se incrementa al modificar los datos
+-- que la caché representa; los workers comparan su copia con esta versión.
+CREATE TABLE IF NOT EXISTS versiones_cache (
+    clave VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
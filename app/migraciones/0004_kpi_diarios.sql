@@ -0,0 +1,103 @@
+-- 0004: KPIs diarios por sucursal y cumpleaños indexables para el dashboard.
+-- index() sumaba las ventas y contaba las citas del día sobre las tablas crudas
+-- en cada carga. Ahora los triggers de ventas y reservas mantienen kpi_diarios
+-- (una fila por sucursal y día) aplicando solo la diferencia de cada cambio:
+-- restan el aporte de la fila vieja y suman el de la nueva. Así cubren altas,
+-- anulaciones, ediciones y reprogramaciones sin tocar el código de las rutas.
+
+CREATE TABLE IF NOT EXISTS kpi_diarios (
+    sucursal_id INTEGER NOT NULL,          -- 0 = ventas/reservas sin sucursal
+    fecha DATE NOT NULL,
+    numero_ventas INTEGER NOT NULL DEFAULT 0,
+    total_servicios NUMERIC(12,2) NOT NULL DEFAULT 0,
+    total_productos NUMERIC(12,2) NOT NULL DEFAULT 0,
+    numero_citas INTEGER NOT NULL DEFAULT 0,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sucursal_id, fecha)
+);
+
+CREATE OR REPLACE FUNCTION kpi_diarios_sumar(
+    p_sucursal_id INTEGER, p_fecha DATE,
+    p_ventas INTEGER, p_servicios NUMERIC, p_productos NUMERIC, p_citas INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO kpi_diarios AS k (sucursal_id, fecha, numero_ventas, total_servicios, total_productos, numero_citas)
+    VALUES (COALESCE(p_sucursal_id, 0), p_fecha, p_ventas, p_servicios, p_productos, p_citas)
+    ON CONFLICT (sucursal_id, fecha) DO UPDATE SET
+        numero_ventas = k.numero_ventas + EXCLUDED.numero_ventas,
+        total_servicios = k.total_servicios + EXCLUDED.total_servicios,
+        total_productos = k.total_productos + EXCLUDED.total_productos,
+        numero_citas = k.numero_citas + EXCLUDED.numero_citas,
+        actualizado_en = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Mismo criterio que el dashboard: estado_pago != 'Anulado' (NULL no cuenta)
+CREATE OR REPLACE FUNCTION kpi_diarios_ventas() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.fecha_venta IS NOT NULL AND OLD.estado_pago <> 'Anulado' THEN
+        PERFORM kpi_diarios_sumar(OLD.sucursal_id, OLD.fecha_venta::date, -1,
+                                  -COALESCE(OLD.subtotal_servicios, 0), -COALESCE(OLD.subtotal_productos, 0), 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.fecha_venta IS NOT NULL AND NEW.estado_pago <> 'Anulado' THEN
+        PERFORM kpi_diarios_sumar(NEW.sucursal_id, NEW.fecha_venta::date, 1,
+                                  COALESCE(NEW.subtotal_servicios, 0), COALESCE(NEW.subtotal_productos, 0), 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_kpi_diarios_ventas ON ventas;
+CREATE TRIGGER trg_kpi_diarios_ventas
+AFTER INSERT OR DELETE OR UPDATE OF sucursal_id, fecha_venta, estado_pago, subtotal_servicios, subtotal_productos
+ON ventas FOR EACH ROW EXECUTE FUNCTION kpi_diarios_ventas();
+
+-- Mismo criterio que el dashboard: estado NOT IN ('Cancelada', 'No Asistio')
+CREATE OR REPLACE FUNCTION kpi_diarios_reservas() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.fecha_hora_inicio IS NOT NULL
+       AND OLD.estado NOT IN ('Cancelada', 'No Asistio') THEN
+        PERFORM kpi_diarios_sumar(OLD.sucursal_id, OLD.fecha_hora_inicio::date, 0, 0, 0, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.fecha_hora_inicio IS NOT NULL
+       AND NEW.estado NOT IN ('Cancelada', 'No Asistio') THEN
+        PERFORM kpi_diarios_sumar(NEW.sucursal_id, NEW.fecha_hora_inicio::date, 0, 0, 0, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_kpi_diarios_reservas ON reservas;
+CREATE TRIGGER trg_kpi_diarios_reservas
+AFTER INSERT OR DELETE OR UPDATE OF sucursal_id, fecha_hora_inicio, estado
+ON reservas FOR EACH ROW EXECUTE FUNCTION kpi_diarios_reservas();
+
+-- Carga inicial con el histórico (los triggers ya están activos dentro de esta transacción)
+TRUNCATE kpi_diarios;
+
+INSERT INTO kpi_diarios (sucursal_id, fecha, numero_ventas, total_servicios, total_productos)
+SELECT COALESCE(sucursal_id, 0), fecha_venta::date, COUNT(*),
+       COALESCE(SUM(subtotal_servicios), 0), COALESCE(SUM(subtotal_productos), 0)
+FROM ventas
+WHERE fecha_venta IS NOT NULL AND estado_pago <> 'Anulado'
+GROUP BY 1, 2;
+
+INSERT INTO kpi_diarios AS k (sucursal_id, fecha, numero_citas)
+SELECT COALESCE(sucursal_id, 0), fecha_hora_inicio::date, COUNT(*)
+FROM reservas
+WHERE fecha_hora_inicio IS NOT NULL AND estado NOT IN ('Cancelada', 'No Asistio')
+GROUP BY 1, 2
+ON CONFLICT (sucursal_id, fecha) DO UPDATE SET numero_citas = EXCLUDED.numero_citas;
+
+-- CUMPLEAÑOS: clave mes*100+día (ej. 3 de julio = 703) calculada por Postgres
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS cumple_mmdd SMALLINT
+    GENERATED ALWAYS AS ((EXTRACT(MONTH FROM fecha_nacimiento) * 100 + EXTRACT(DAY FROM fecha_nacimiento))::SMALLINT) STORED;
+CREATE INDEX IF NOT EXISTS idx_clientes_cumple_mmdd ON clientes (cumple_mmdd) WHERE cumple_mmdd IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_cliente_comunicaciones_cliente_tipo_anio
+    ON cliente_comunicaciones (cliente_id, tipo_comunicacion, año_aplicable);
+
+-- ALERTAS DEL DASHBOARD: índices parciales, solo contienen las filas que se muestran
+CREATE INDEX IF NOT EXISTS idx_productos_stock_bajo ON productos (stock_actual)
+    WHERE activo = TRUE AND stock_actual <= stock_minimo;
+CREATE INDEX IF NOT EXISTS idx_cliente_membresias_activas_fin ON cliente_membresias (fecha_fin)
+    WHERE estado = 'Activa';
@@ -0,0 +1,72 @@
+-- 0005: Registro de cambios de la agenda para el modo delta de /api/agenda_dia_data.
+-- Cada alta/edición/baja en reservas, horarios_extra, ausencias_empleado u
+-- horarios_empleado deja una fila por empleado afectado (la versión vieja y la
+-- nueva si la reserva se movió de colaborador o de día) con el id de la
+-- transacción que la hizo. El cliente guarda como token el xmin del snapshot con
+-- el que leyó la agenda: toda transacción que no vio tiene un txid >= ese xmin.
+-- Ver app/services/agenda.py.
+
+CREATE TABLE IF NOT EXISTS agenda_cambios (
+    id BIGSERIAL PRIMARY KEY,
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    tabla VARCHAR(40) NOT NULL,
+    registro_id INTEGER,
+    empleado_id INTEGER,
+    sucursal_id INTEGER,
+    fecha_desde DATE,              -- NULL = todos los días (horario semanal)
+    fecha_hasta DATE,
+    creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_agenda_cambios_txid ON agenda_cambios (txid);
+CREATE INDEX IF NOT EXISTS idx_agenda_cambios_creado ON agenda_cambios (creado_en);
+
+-- Función genérica: lee las columnas por nombre vía JSONB, así sirve para las
+-- cuatro tablas (las que no tienen fecha quedan con rango NULL = todos los días).
+CREATE OR REPLACE FUNCTION agenda_registrar_cambio() RETURNS TRIGGER AS $$
+DECLARE
+    filas JSONB[] := ARRAY[]::JSONB[];
+    f JSONB;
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        filas := filas || to_jsonb(OLD);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        filas := filas || to_jsonb(NEW);
+    END IF;
+
+    FOREACH f IN ARRAY filas LOOP
+        INSERT INTO agenda_cambios (tabla, registro_id, empleado_id, sucursal_id, fecha_desde, fecha_hasta)
+        VALUES (
+            TG_TABLE_NAME,
+            (f->>'id')::INTEGER,
+            (f->>'empleado_id')::INTEGER,
+            (f->>'sucursal_id')::INTEGER,
+            COALESCE((f->>'fecha')::DATE, (f->>'fecha_hora_inicio')::DATE),
+            COALESCE((f->>'fecha')::DATE, (f->>'fecha_hora_fin')::DATE, (f->>'fecha_hora_inicio')::DATE)
+        );
+    END LOOP;
+
+    -- Limpieza ocasional: los tokens de más de un día ya no se aceptan
+    IF random() < 0.001 THEN
+        DELETE FROM agenda_cambios WHERE creado_en < CURRENT_TIMESTAMP - INTERVAL '3 days';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_agenda_cambios ON reservas;
+CREATE TRIGGER trg_agenda_cambios AFTER INSERT OR UPDATE OR DELETE ON reservas
+FOR EACH ROW EXECUTE FUNCTION agenda_registrar_cambio();
+
+DROP TRIGGER IF EXISTS trg_agenda_cambios ON horarios_extra;
+CREATE TRIGGER trg_agenda_cambios AFTER INSERT OR UPDATE OR DELETE ON horarios_extra
+FOR EACH ROW EXECUTE FUNCTION agenda_registrar_cambio();
+
+DROP TRIGGER IF EXISTS trg_agenda_cambios ON ausencias_empleado;
+CREATE TRIGGER trg_agenda_cambios AFTER INSERT OR UPDATE OR DELETE ON ausencias_empleado
+FOR EACH ROW EXECUTE FUNCTION agenda_registrar_cambio();
+
+DROP TRIGGER IF EXISTS trg_agenda_cambios ON horarios_empleado;
+CREATE TRIGGER trg_agenda_cambios AFTER INSERT OR UPDATE OR DELETE ON horarios_empleado
+FOR EACH ROW EXECUTE FUNCTION agenda_registrar_cambio();
@@ -0,0 +1,55 @@
+-- 0006: Avisos NOTIFY 'agenda' desde el registro de cambios (migración 0005).
+-- Además de escribir en agenda_cambios, el trigger emite pg_notify con la tabla,
+-- el colaborador, las sucursales afectadas y el rango de fechas. El listener de
+-- cada worker (app/pg_listener.py) los reparte a los clientes SSE de
+-- /api/agenda/stream. Así cubre nueva_reserva, reagendar, cancelar, cambios de
+-- estado, bloqueos y horarios extra sin tocar cada ruta.
+
+CREATE OR REPLACE FUNCTION agenda_registrar_cambio() RETURNS TRIGGER AS $$
+DECLARE
+    filas JSONB[] := ARRAY[]::JSONB[];
+    f JSONB;
+    v_empleado INTEGER;
+    v_sucursal INTEGER;
+    v_desde DATE;
+    v_hasta DATE;
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        filas := filas || to_jsonb(OLD);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        filas := filas || to_jsonb(NEW);
+    END IF;
+
+    FOREACH f IN ARRAY filas LOOP
+        v_empleado := (f->>'empleado_id')::INTEGER;
+        v_sucursal := (f->>'sucursal_id')::INTEGER;
+        v_desde := COALESCE((f->>'fecha')::DATE, (f->>'fecha_hora_inicio')::DATE);
+        v_hasta := COALESCE((f->>'fecha')::DATE, (f->>'fecha_hora_fin')::DATE, (f->>'fecha_hora_inicio')::DATE);
+
+        INSERT INTO agenda_cambios (tabla, registro_id, empleado_id, sucursal_id, fecha_desde, fecha_hasta)
+        VALUES (TG_TABLE_NAME, (f->>'id')::INTEGER, v_empleado, v_sucursal, v_desde, v_hasta);
+
+        -- Aviso para /api/agenda/stream: sucursales donde se ve al colaborador.
+        -- Se entrega recién al hacer commit (y nunca si hay rollback).
+        PERFORM pg_notify('agenda', json_build_object(
+            't', TG_TABLE_NAME,
+            'id', (f->>'id')::INTEGER,
+            'e', v_empleado,
+            's', ARRAY(
+                SELECT v_sucursal WHERE v_sucursal IS NOT NULL
+                UNION
+                SELECT es.sucursal_id FROM empleado_sucursales es WHERE es.empleado_id = v_empleado
+            ),
+            'd', v_desde,
+            'h', v_hasta
+        )::TEXT);
+    END LOOP;
+
+    -- Limpieza ocasional: los tokens de más de un día ya no se aceptan
+    IF random() < 0.001 THEN
+        DELETE FROM agenda_cambios WHERE creado_en < CURRENT_TIMESTAMP - INTERVAL '3 days';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
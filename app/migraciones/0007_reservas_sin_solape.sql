@@ -0,0 +1,41 @@
+-- 0007: Un colaborador no puede tener dos reservas activas que se solapen.
+-- Antes nueva_reserva hacía SELECT de choques y luego INSERT (y solo registraba
+-- el choque en el log), así que dos reservas simultáneas pasaban ambas.
+-- Ahora lo garantiza Postgres con una restricción de exclusión GiST sobre
+-- (empleado_id, rango [inicio, fin)). Las columnas son TIMESTAMP sin zona (hora
+-- de Lima), por eso se usa tsrange. Las reservas canceladas o 'No Asistio' no
+-- ocupan horario.
+--
+-- Los solapes que ya existen en la BD (la agenda los permitía) se marcan con
+-- solape_heredado = TRUE y quedan fuera de la restricción; conservan su horario.
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE reservas ADD COLUMN IF NOT EXISTS solape_heredado BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Se marca la reserva más nueva (id mayor) de cada par solapado
+UPDATE reservas r
+SET solape_heredado = TRUE
+WHERE r.estado NOT IN ('Cancelada', 'Cancelada por Cliente', 'Cancelada por Staff', 'No Asistio')
+  AND r.fecha_hora_fin > r.fecha_hora_inicio
+  AND EXISTS (
+      SELECT 1 FROM reservas o
+      WHERE o.empleado_id = r.empleado_id
+        AND o.id < r.id
+        AND o.estado NOT IN ('Cancelada', 'Cancelada por Cliente', 'Cancelada por Staff', 'No Asistio')
+        AND o.fecha_hora_fin > o.fecha_hora_inicio
+        AND o.fecha_hora_inicio < r.fecha_hora_fin
+        AND o.fecha_hora_fin > r.fecha_hora_inicio
+  );
+
+ALTER TABLE reservas DROP CONSTRAINT IF EXISTS reservas_sin_solape;
+ALTER TABLE reservas ADD CONSTRAINT reservas_sin_solape
+    EXCLUDE USING gist (
+        empleado_id WITH =,
+        tsrange(fecha_hora_inicio, fecha_hora_fin, '[)') WITH &&
+    )
+    WHERE (
+        estado NOT IN ('Cancelada', 'Cancelada por Cliente', 'Cancelada por Staff', 'No Asistio')
+        AND NOT solape_heredado
+        AND fecha_hora_fin > fecha_hora_inicio
+    );
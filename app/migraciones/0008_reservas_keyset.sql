@@ -0,0 +1,10 @@
+-- migrador: sin-transaccion
+-- 0008: Paginación por cursor (keyset) del listado de reservas.
+-- listar_reservas pide la página siguiente con
+--   WHERE (fecha_hora_inicio, id) < (%s, %s) ORDER BY fecha_hora_inicio DESC, id DESC LIMIT n
+-- así que cada página es un recorrido corto del índice, sin OFFSET.
+-- Con filtro por sucursal o colaborador se usan los índices compuestos de abajo.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservas_inicio_id ON reservas (fecha_hora_inicio DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservas_sucursal_inicio_id ON reservas (sucursal_id, fecha_hora_inicio DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reservas_empleado_inicio_id ON reservas (empleado_id, fecha_hora_inicio DESC, id DESC);
@@ -0,0 +1,25 @@
+-- 0009: Un correlativo (tipo, serie, número) no puede repetirse en ventas.
+-- Antes nueva_venta leía ultimo_numero y luego lo actualizaba a +1 en otra
+-- sentencia, así que dos cajas simultáneas podían emitir el mismo número y SUNAT
+-- rechazaba el segundo. Ahora se asigna con UPDATE ... RETURNING
+-- (app/services/correlativos.py) y este índice único lo garantiza.
+--
+-- Los duplicados que ya existen se marcan con correlativo_heredado = TRUE (se
+-- conserva la venta de menor id sin marcar) y quedan fuera del índice.
+
+ALTER TABLE ventas ADD COLUMN IF NOT EXISTS correlativo_heredado BOOLEAN NOT NULL DEFAULT FALSE;
+
+UPDATE ventas v
+SET correlativo_heredado = TRUE
+WHERE v.numero_comprobante IS NOT NULL
+  AND EXISTS (
+      SELECT 1 FROM ventas o
+      WHERE o.tipo_comprobante = v.tipo_comprobante
+        AND o.serie_comprobante = v.serie_comprobante
+        AND o.numero_comprobante = v.numero_comprobante
+        AND o.id < v.id
+  );
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_ventas_correlativo
+    ON ventas (tipo_comprobante, serie_comprobante, numero_comprobante)
+    WHERE NOT correlativo_heredado;
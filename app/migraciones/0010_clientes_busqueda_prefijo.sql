@@ -0,0 +1,13 @@
+-- migrador: sin-transaccion
+-- 0010: Índices para la búsqueda por prefijo del selector de clientes del POS
+-- (app/services/clientes_busqueda.py). text_pattern_ops permite que
+-- col LIKE 'abc%' use el índice aunque la BD no tenga collation "C".
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_nombre_prefijo ON clientes (lower(razon_social_nombres) text_pattern_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_apellidos_prefijo ON clientes (lower(apellidos) text_pattern_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_documento_prefijo ON clientes (numero_documento text_pattern_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_telefono_prefijo ON clientes (telefono text_pattern_ops);
+
+-- Clientes frecuentes por sucursal (ventas recientes con cliente)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ventas_sucursal_fecha_cliente ON ventas (sucursal_id, fecha_venta, cliente_receptor_id)
+    WHERE cliente_receptor_id IS NOT NULL;
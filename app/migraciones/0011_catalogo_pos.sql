@@ -0,0 +1,86 @@
+-- 0011: Versión del catálogo del POS y marca de cambios de stock.
+-- /api/pos/catalogo responde 304 mientras la versión 'catalogo' de
+-- versiones_cache no cambie (ver app/services/catalogo_pos.py). Estos triggers
+-- la incrementan y emiten el NOTIFY 'versiones_cache' que ya escuchan los
+-- workers, así que cubren todas las pantallas que editan precios, productos,
+-- campañas o colaboradores sin tocar cada ruta.
+--
+-- El stock cambia en cada venta y NO invalida el catálogo: cada cambio de
+-- stock_actual guarda el txid en productos.stock_txid y /api/pos/stock entrega
+-- solo los productos modificados desde el token del cliente.
+
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS stock_txid BIGINT;
+CREATE INDEX IF NOT EXISTS idx_productos_stock_txid ON productos (stock_txid);
+
+CREATE OR REPLACE FUNCTION productos_marcar_stock() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.stock_actual IS DISTINCT FROM OLD.stock_actual THEN
+        NEW.stock_txid := txid_current();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_productos_stock_txid ON productos;
+CREATE TRIGGER trg_productos_stock_txid
+    BEFORE INSERT OR UPDATE ON productos
+    FOR EACH ROW EXECUTE FUNCTION productos_marcar_stock();
+
+CREATE OR REPLACE FUNCTION catalogo_incrementar_version() RETURNS TRIGGER AS $$
+DECLARE
+    v_version BIGINT;
+BEGIN
+    -- Triggers por fila: ignorar cambios que el catálogo no muestra
+    IF TG_LEVEL = 'ROW' AND TG_OP = 'UPDATE' THEN
+        -- (IF anidados: plpgsql no garantiza cortocircuito y NEW.x falla si la tabla no tiene x)
+        IF TG_TABLE_NAME = 'productos' THEN
+            IF (to_jsonb(NEW) - 'stock_actual' - 'stock_txid') = (to_jsonb(OLD) - 'stock_actual' - 'stock_txid') THEN
+                RETURN NULL;
+            END IF;
+        ELSIF TG_TABLE_NAME = 'empleados' THEN
+            IF NEW.activo IS NOT DISTINCT FROM OLD.activo
+               AND NEW.realiza_ventas IS NOT DISTINCT FROM OLD.realiza_ventas
+               AND NEW.nombre_display IS NOT DISTINCT FROM OLD.nombre_display
+               AND NEW.nombres IS NOT DISTINCT FROM OLD.nombres THEN
+                RETURN NULL;
+            END IF;
+        END IF;
+    END IF;
+
+    INSERT INTO versiones_cache (clave, version) VALUES ('catalogo', 1)
+    ON CONFLICT (clave) DO UPDATE
+    SET version = versiones_cache.version + 1, actualizado_en = CURRENT_TIMESTAMP
+    RETURNING version INTO v_version;
+
+    -- Se entrega al hacer commit (y nunca si hay rollback)
+    PERFORM pg_notify('versiones_cache', 'catalogo=' || v_version);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_catalogo_version ON productos;
+CREATE TRIGGER trg_catalogo_version
+    AFTER INSERT OR UPDATE OR DELETE ON productos
+    FOR EACH ROW EXECUTE FUNCTION catalogo_incrementar_version();
+
+DROP TRIGGER IF EXISTS trg_catalogo_version ON empleados;
+CREATE TRIGGER trg_catalogo_version
+    AFTER INSERT OR UPDATE OR DELETE ON empleados
+    FOR EACH ROW EXECUTE FUNCTION catalogo_incrementar_version();
+
+DROP TRIGGER IF EXISTS trg_catalogo_version ON servicios;
+CREATE TRIGGER trg_catalogo_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON servicios
+    FOR EACH STATEMENT EXECUTE FUNCTION catalogo_incrementar_version();
+
+DROP TRIGGER IF EXISTS trg_catalogo_version ON campanas;
+CREATE TRIGGER trg_catalogo_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON campanas
+    FOR EACH STATEMENT EXECUTE FUNCTION catalogo_incrementar_version();
+
+DROP TRIGGER IF EXISTS trg_catalogo_version ON marcas;
+CREATE TRIGGER trg_catalogo_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON marcas
+    FOR EACH STATEMENT EXECUTE FUNCTION catalogo_incrementar_version();
+
+UPDATE productos SET stock_txid = txid_current() WHERE stock_txid IS NULL;
@@ -0,0 +1,41 @@
+-- 0012: Outbox transaccional para los efectos secundarios de una venta.
+-- nueva_venta confirma solo lo que mueve dinero (venta, ítems, stock, pagos,
+-- propina, gastos/caja y canje de puntos) y, en la MISMA transacción, deja un
+-- evento por efecto pendiente (acumular puntos, consumir fidelidad, completar
+-- la reserva...). El worker `flask outbox-worker` los procesa después
+-- (ver app/outbox.py). Si la venta hace ROLLBACK, el evento tampoco existe.
+--
+-- clave es la llave de idempotencia ('venta:123:puntos'): encolar dos veces el
+-- mismo efecto no crea dos eventos.
+
+CREATE TABLE IF NOT EXISTS outbox_eventos (
+    id BIGSERIAL PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    clave VARCHAR(120) NOT NULL UNIQUE,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    disponible_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    procesado_en TIMESTAMP,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    ultimo_error TEXT
+);
+
+-- Solo los pendientes: el índice se mantiene chico aunque la tabla crezca
+CREATE INDEX IF NOT EXISTS idx_outbox_pendientes
+    ON outbox_eventos (disponible_en, id) WHERE procesado_en IS NULL;
+
+-- Tablas/columnas que usan los manejadores y que antes se creaban desde rutas de
+-- mantenimiento de marketing (pueden no existir en instalaciones nuevas)
+CREATE TABLE IF NOT EXISTS puntos_historial (
+    id SERIAL PRIMARY KEY,
+    cliente_id INTEGER REFERENCES clientes(id) ON DELETE CASCADE,
+    venta_id INTEGER REFERENCES ventas(id) ON DELETE SET NULL,
+    monto_puntos INTEGER NOT NULL,
+    tipo_transaccion VARCHAR(20) NOT NULL,
+    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    descripcion TEXT
+);
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS puntos_fidelidad INTEGER DEFAULT 0;
+ALTER TABLE venta_items ADD COLUMN IF NOT EXISTS loyalty_consumption_group_id VARCHAR(50);
+
+CREATE INDEX IF NOT EXISTS idx_puntos_historial_venta ON puntos_historial (venta_id, tipo_transaccion);
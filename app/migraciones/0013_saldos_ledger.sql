@@ -0,0 +1,68 @@
+-- 0013: Libro mayor (append-only) del monedero y los puntos de cada cliente.
+-- clientes.saldo_monedero y clientes.puntos_fidelidad quedan como saldo actual
+-- en caché: solo los modifica app/services/saldos.py, con un UPDATE condicional
+-- (WHERE saldo >= débito) que en la MISMA sentencia inserta el movimiento con
+-- el saldo resultante. Los cierres mensuales guardan el saldo de cada cuenta al
+-- final del mes para consultar saldos a una fecha sin recorrer el historial.
+
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS saldo_monedero NUMERIC(10, 2) DEFAULT 0.00;
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS puntos_fidelidad INTEGER DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS saldo_movimientos (
+    id BIGSERIAL PRIMARY KEY,
+    cliente_id INTEGER NOT NULL REFERENCES clientes(id),
+    cuenta VARCHAR(10) NOT NULL CHECK (cuenta IN ('MONEDERO', 'PUNTOS')),
+    tipo VARCHAR(20) NOT NULL,            -- APERTURA, ABONO, PAGO_VENTA, CANJE, ACUMULA, ANULACION, AJUSTE
+    monto NUMERIC(12, 2) NOT NULL,        -- con signo: + abona, - descuenta
+    saldo_resultante NUMERIC(12, 2) NOT NULL,
+    venta_id INTEGER REFERENCES ventas(id),
+    referencia TEXT,
+    usuario_id INTEGER,
+    -- clock_timestamp(): se toma ya con la fila del cliente bloqueada, así el
+    -- orden por fecha coincide con el orden en que se aplicaron los movimientos
+    creado_en TIMESTAMP NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE INDEX IF NOT EXISTS idx_saldo_mov_cliente
+    ON saldo_movimientos (cliente_id, cuenta, creado_en DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_saldo_mov_fecha ON saldo_movimientos (creado_en);
+
+-- Un movimiento de cada tipo por venta y cuenta: reintentos (outbox, doble
+-- envío del formulario) no pueden duplicar un canje, pago o acumulación
+CREATE UNIQUE INDEX IF NOT EXISTS uq_saldo_mov_venta
+    ON saldo_movimientos (venta_id, cuenta, tipo) WHERE venta_id IS NOT NULL;
+
+CREATE OR REPLACE FUNCTION saldo_movimientos_inmutable() RETURNS TRIGGER AS $$
+BEGIN
+    RAISE EXCEPTION 'saldo_movimientos es de solo inserción: registre un movimiento de AJUSTE';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_saldo_movimientos_inmutable ON saldo_movimientos;
+CREATE TRIGGER trg_saldo_movimientos_inmutable
+    BEFORE UPDATE OR DELETE ON saldo_movimientos
+    FOR EACH ROW EXECUTE FUNCTION saldo_movimientos_inmutable();
+
+-- Saldo de cada cuenta al cierre del mes (mes = primer día del mes cerrado)
+CREATE TABLE IF NOT EXISTS saldo_cierres (
+    cliente_id INTEGER NOT NULL REFERENCES clientes(id),
+    cuenta VARCHAR(10) NOT NULL,
+    mes DATE NOT NULL,
+    saldo NUMERIC(12, 2) NOT NULL,
+    ultimo_movimiento_id BIGINT,
+    PRIMARY KEY (cliente_id, cuenta, mes)
+);
+CREATE INDEX IF NOT EXISTS idx_saldo_cierres_mes ON saldo_cierres (mes);
+
+-- Apertura: el saldo actual de cada cliente pasa a ser su primer movimiento
+INSERT INTO saldo_movimientos (cliente_id, cuenta, tipo, monto, saldo_resultante, referencia)
+SELECT c.id, 'MONEDERO', 'APERTURA', c.saldo_monedero, c.saldo_monedero, 'Saldo inicial del libro'
+FROM clientes c
+WHERE COALESCE(c.saldo_monedero, 0) <> 0
+  AND NOT EXISTS (SELECT 1 FROM saldo_movimientos m WHERE m.cliente_id = c.id AND m.cuenta = 'MONEDERO');
+
+INSERT INTO saldo_movimientos (cliente_id, cuenta, tipo, monto, saldo_resultante, referencia)
+SELECT c.id, 'PUNTOS', 'APERTURA', c.puntos_fidelidad, c.puntos_fidelidad, 'Saldo inicial del libro'
+FROM clientes c
+WHERE COALESCE(c.puntos_fidelidad, 0) <> 0
+  AND NOT EXISTS (SELECT 1 FROM saldo_movimientos m WHERE m.cliente_id = c.id AND m.cuenta = 'PUNTOS');
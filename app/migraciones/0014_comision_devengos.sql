@@ -0,0 +1,89 @@
+-- 0014: Libro de devengo de comisiones + resumen diario por colaborador.
+-- Cada venta registra su producción y comisión por (colaborador, sucursal, día,
+-- fuente) en comision_devengos (solo inserción; las correcciones son nuevas
+-- filas con la diferencia) y acumula en comision_resumen_diario, que es lo que
+-- leen planilla, métricas del fondo y caja (ver app/services/devengos.py).
+-- Esta migración carga el histórico con motivo 'APERTURA'.
+
+CREATE TABLE IF NOT EXISTS comision_devengos (
+    id BIGSERIAL PRIMARY KEY,
+    empleado_id INTEGER NOT NULL,
+    sucursal_id INTEGER NOT NULL,
+    dia DATE NOT NULL,
+    fuente VARCHAR(12) NOT NULL CHECK (fuente IN ('SERVICIO', 'HORA_EXTRA', 'PRODUCTO')),
+    venta_id INTEGER NOT NULL,              -- sin FK: una venta eliminada deja su reverso en el libro
+    motivo VARCHAR(15) NOT NULL,            -- APERTURA, VENTA, EDICION, ANULACION, ELIMINACION, REBUILD
+    produccion NUMERIC(12, 2) NOT NULL,     -- con signo
+    comision NUMERIC(12, 2) NOT NULL,       -- con signo
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_comision_devengos_venta ON comision_devengos (venta_id);
+
+CREATE TABLE IF NOT EXISTS comision_resumen_diario (
+    empleado_id INTEGER NOT NULL,
+    sucursal_id INTEGER NOT NULL,
+    dia DATE NOT NULL,
+    fuente VARCHAR(12) NOT NULL,
+    produccion NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    comision NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    produccion_liquidada NUMERIC(12, 2) NOT NULL DEFAULT 0,  -- ya incluida en una planilla pagada
+    comision_pagada NUMERIC(12, 2) NOT NULL DEFAULT 0,       -- ya pagada desde caja
+    PRIMARY KEY (empleado_id, sucursal_id, dia, fuente)
+);
+CREATE INDEX IF NOT EXISTS idx_comision_resumen_empleado_dia
+    ON comision_resumen_diario (empleado_id, fuente, dia);
+-- Solo lo que falta pagar por caja: el resumen de caja no recorre el histórico
+CREATE INDEX IF NOT EXISTS idx_comision_resumen_pendiente
+    ON comision_resumen_diario (sucursal_id, empleado_id) WHERE comision <> comision_pagada;
+
+-- Histórico: devengo de todas las ventas vigentes
+INSERT INTO comision_devengos (empleado_id, sucursal_id, dia, fuente, venta_id, motivo, produccion, comision)
+SELECT v.empleado_id, COALESCE(v.sucursal_id, 0), v.fecha_venta::date,
+       CASE WHEN vi.producto_id IS NOT NULL THEN 'PRODUCTO'
+            WHEN vi.es_hora_extra THEN 'HORA_EXTRA'
+            ELSE 'SERVICIO' END,
+       v.id, 'APERTURA',
+       SUM(COALESCE(vi.subtotal_item_neto, 0)),
+       SUM(CASE WHEN vi.producto_id IS NOT NULL
+                THEN COALESCE((SELECT SUM(c.monto_comision) FROM comisiones c WHERE c.venta_item_id = vi.id), 0)
+                WHEN vi.es_hora_extra THEN COALESCE(vi.comision_servicio_extra, 0)
+                ELSE 0 END)
+FROM ventas v
+JOIN venta_items vi ON vi.venta_id = v.id
+WHERE v.empleado_id IS NOT NULL
+  AND COALESCE(v.estado_pago, '') <> 'Anulado'
+  AND (vi.producto_id IS NOT NULL OR vi.servicio_id IS NOT NULL)
+  AND NOT EXISTS (SELECT 1 FROM comision_devengos d WHERE d.venta_id = v.id)
+GROUP BY 1, 2, 3, 4, 5;
+
+INSERT INTO comision_resumen_diario
+       (empleado_id, sucursal_id, dia, fuente, produccion, comision, produccion_liquidada)
+SELECT d.empleado_id, d.sucursal_id, d.dia, d.fuente,
+       SUM(d.produccion), SUM(d.comision),
+       SUM(CASE WHEN v.pago_nomina_id IS NOT NULL THEN d.produccion ELSE 0 END)
+FROM comision_devengos d
+LEFT JOIN ventas v ON v.id = d.venta_id
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (empleado_id, sucursal_id, dia, fuente) DO NOTHING;
+
+UPDATE comision_resumen_diario r
+SET comision_pagada = p.pagado
+FROM (
+    SELECT v.empleado_id, COALESCE(v.sucursal_id, 0) AS sucursal_id, v.fecha_venta::date AS dia,
+           'PRODUCTO' AS fuente, SUM(c.monto_comision) AS pagado
+    FROM comisiones c
+    JOIN venta_items vi ON vi.id = c.venta_item_id
+    JOIN ventas v ON v.id = vi.venta_id
+    WHERE c.estado = 'Pagada' AND v.empleado_id IS NOT NULL AND vi.producto_id IS NOT NULL
+    GROUP BY 1, 2, 3
+    UNION ALL
+    SELECT v.empleado_id, COALESCE(v.sucursal_id, 0), v.fecha_venta::date,
+           'HORA_EXTRA', SUM(COALESCE(vi.comision_servicio_extra, 0))
+    FROM venta_items vi
+    JOIN ventas v ON v.id = vi.venta_id
+    WHERE vi.es_hora_extra AND vi.entregado_al_colaborador AND vi.producto_id IS NULL
+      AND v.empleado_id IS NOT NULL
+    GROUP BY 1, 2, 3
+) p
+WHERE r.empleado_id = p.empleado_id AND r.sucursal_id = p.sucursal_id
+  AND r.dia = p.dia AND r.fuente = p.fuente;
@@ -0,0 +1,37 @@
+-- migrador: sin-transaccion
+-- 0015: Búsqueda de clientes y alumnos insensible a tildes y mayúsculas, por
+-- subcadena, con índices de trigramas (app/services/clientes_busqueda.py).
+-- Antes cada pantalla hacía su propio ILIKE '%term%' sobre cuatro columnas:
+-- recorrido secuencial completo, y "Munoz" no encontraba a "Muñoz".
+--
+-- No se agregan columnas: los índices GIN gin_trgm_ops son de EXPRESIÓN sobre
+--   nombre   nombres + apellidos sin tildes y en minúsculas
+--   dígitos  solo los dígitos del documento y del teléfono
+-- (una columna generada STORED reescribiría clientes completa con ACCESS
+-- EXCLUSIVE; el índice de expresión se crea CONCURRENTLY sin bloquear el POS).
+-- Sirven para LIKE '%x%' y para la similitud de palabras (<%) con la que se
+-- toleran errores de tipeo. Las consultas deben usar EXACTAMENTE las mismas
+-- expresiones (_FUENTES en clientes_busqueda.py).
+-- unaccent() no es IMMUTABLE (depende del search_path), por eso se envuelve
+-- con el diccionario calificado para poder usarlo en índices.
+
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION normalizar_busqueda(texto TEXT) RETURNS TEXT LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, COALESCE(texto, ''))) $$;
+CREATE OR REPLACE FUNCTION solo_digitos(texto TEXT) RETURNS TEXT LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ SELECT regexp_replace(COALESCE(texto, ''), '[^0-9]', '', 'g') $$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_busqueda_nombre_trgm ON clientes
+    USING gin ((normalizar_busqueda(COALESCE(razon_social_nombres, '') || ' ' || COALESCE(apellidos, ''))) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_busqueda_digitos_trgm ON clientes
+    USING gin ((solo_digitos(numero_documento) || ' ' || solo_digitos(telefono)) gin_trgm_ops);
+
+-- Desempate por recencia: última visita de cada candidato
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ventas_cliente_fecha ON ventas (cliente_receptor_id, fecha_venta DESC)
+    WHERE cliente_receptor_id IS NOT NULL;
+
+-- Alumnos de la escuela: el código también se busca como texto
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_escuela_alumnos_busqueda_nombre_trgm ON escuela_alumnos
+    USING gin ((normalizar_busqueda(COALESCE(nombres, '') || ' ' || COALESCE(apellidos, '') || ' ' || COALESCE(codigo_alumno, ''))) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_escuela_alumnos_busqueda_digitos_trgm ON escuela_alumnos
+    USING gin ((solo_digitos(dni) || ' ' || solo_digitos(telefono) || ' ' || solo_digitos(codigo_alumno)) gin_trgm_ops);
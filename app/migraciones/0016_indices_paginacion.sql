@@ -0,0 +1,31 @@
+-- migrador: sin-transaccion
+-- 0016: Índices para la paginación por cursor de los listados (app/paginacion.py).
+-- Cada página pide  WHERE (orden, id) < (%s, %s) ORDER BY orden, id LIMIT n + 1,
+-- así que un índice sobre exactamente (orden, id) permite empezar en la posición
+-- del cursor: la página 200 cuesta lo mismo que la primera. Las expresiones con
+-- COALESCE deben coincidir con las de la lista blanca de cada Listado.
+-- (reservas ya los tiene desde la migración 0008.)
+
+-- VENTAS (listar_ventas; los filtros por colaborador/sucursal usan los índices de 0002)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ventas_fecha_id ON ventas (fecha_venta, id);
+
+-- CLIENTES (listar_clientes sin búsqueda)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_pag_nombre ON clientes ((COALESCE(razon_social_nombres, '')), id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_pag_documento ON clientes ((COALESCE(numero_documento, '')), id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_pag_telefono ON clientes ((COALESCE(telefono, '')), id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_pag_puntos ON clientes ((COALESCE(puntos_fidelidad, 0)), id);
+
+-- CAJA, GASTOS Y COMPRAS
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_caja_sesiones_apertura_id ON caja_sesiones (fecha_apertura, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_caja_sesiones_sucursal_apertura_id ON caja_sesiones (sucursal_id, fecha_apertura, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_gastos_fecha_id ON gastos (fecha, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_compras_fecha_id ON compras (fecha_compra, id);
+
+-- INVENTARIO
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_kardex_producto_fecha_id ON kardex (producto_id, fecha, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_pag_stock ON productos ((COALESCE(stock_actual, 0)), id) WHERE activo = TRUE;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_pag_nombre ON productos ((COALESCE(nombre, '')), id) WHERE activo = TRUE;
+
+-- ESCUELA
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_escuela_alumnos_pag_inscripcion
+    ON escuela_alumnos ((COALESCE(fecha_inscripcion, TIMESTAMP '1900-01-01')), id);
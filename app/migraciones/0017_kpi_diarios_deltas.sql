@@ -0,0 +1,69 @@
+-- 0017: kpi_diarios sin fila caliente.
+-- En 0004 cada trigger de ventas/reservas hacía INSERT ... ON CONFLICT DO UPDATE
+-- sobre la fila (sucursal, día) dentro de la transacción del cobro: todas las
+-- ventas concurrentes de una sucursal esperaban el bloqueo de esa fila hasta el
+-- commit, y mover una venta entre dos días bloqueaba dos filas (posible deadlock).
+-- Ahora los triggers solo agregan una fila de diferencia en kpi_diarios_deltas
+-- (INSERT puro, sin conflictos ni bloqueos compartidos) y el worker del outbox
+-- las consolida en kpi_diarios cada minuto (app/services/kpi_diarios.py).
+-- El dashboard lee kpi_diarios_vigentes = consolidado + deltas pendientes, así
+-- que las cifras son exactas aunque la consolidación vaya atrasada.
+
+CREATE TABLE IF NOT EXISTS kpi_diarios_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    sucursal_id INTEGER NOT NULL,
+    fecha DATE NOT NULL,
+    numero_ventas INTEGER NOT NULL DEFAULT 0,
+    total_servicios NUMERIC(12,2) NOT NULL DEFAULT 0,
+    total_productos NUMERIC(12,2) NOT NULL DEFAULT 0,
+    numero_citas INTEGER NOT NULL DEFAULT 0,
+    creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_kpi_diarios_deltas_fecha ON kpi_diarios_deltas (fecha);
+
+-- Misma firma que en 0004: los triggers no cambian, solo dejan de tocar kpi_diarios
+CREATE OR REPLACE FUNCTION kpi_diarios_sumar(
+    p_sucursal_id INTEGER, p_fecha DATE,
+    p_ventas INTEGER, p_servicios NUMERIC, p_productos NUMERIC, p_citas INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO kpi_diarios_deltas (sucursal_id, fecha, numero_ventas, total_servicios, total_productos, numero_citas)
+    VALUES (COALESCE(p_sucursal_id, 0), p_fecha, p_ventas, p_servicios, p_productos, p_citas);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Pasa las diferencias confirmadas a kpi_diarios y las borra, en una sola sentencia.
+-- Las de transacciones aún abiertas no son visibles para el DELETE y quedan para
+-- la próxima pasada. El lock consultivo evita dos consolidaciones a la vez.
+-- Devuelve cuántas filas de kpi_diarios tocó (-1 si otra consolidación está en curso).
+CREATE OR REPLACE FUNCTION kpi_diarios_consolidar() RETURNS INTEGER AS $$
+DECLARE
+    filas INTEGER;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(727007) THEN
+        RETURN -1;
+    END IF;
+    WITH movidos AS (
+        DELETE FROM kpi_diarios_deltas
+        RETURNING sucursal_id, fecha, numero_ventas, total_servicios, total_productos, numero_citas
+    )
+    INSERT INTO kpi_diarios AS k (sucursal_id, fecha, numero_ventas, total_servicios, total_productos, numero_citas)
+    SELECT sucursal_id, fecha, SUM(numero_ventas), SUM(total_servicios), SUM(total_productos), SUM(numero_citas)
+    FROM movidos
+    GROUP BY sucursal_id, fecha
+    ON CONFLICT (sucursal_id, fecha) DO UPDATE SET
+        numero_ventas = k.numero_ventas + EXCLUDED.numero_ventas,
+        total_servicios = k.total_servicios + EXCLUDED.total_servicios,
+        total_productos = k.total_productos + EXCLUDED.total_productos,
+        numero_citas = k.numero_citas + EXCLUDED.numero_citas,
+        actualizado_en = CURRENT_TIMESTAMP;
+    GET DIAGNOSTICS filas = ROW_COUNT;
+    RETURN filas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Lectura exacta: lo consolidado más lo que aún no pasó el worker (sumar por sucursal/día)
+CREATE OR REPLACE VIEW kpi_diarios_vigentes AS
+SELECT sucursal_id, fecha, numero_ventas, total_servicios, total_productos, numero_citas FROM kpi_diarios
+UNION ALL
+SELECT sucursal_id, fecha, numero_ventas, total_servicios, total_productos, numero_citas FROM kpi_diarios_deltas;
@@ -0,0 +1,35 @@
+-- 0018: comisiones pagadas por caja de ventas luego anuladas.
+-- Al anular una venta su devengo pasa a 0, pero comision_pagada seguía sumando lo
+-- ya entregado al colaborador: comision - comision_pagada (lo que muestra la caja
+-- como pendiente) quedaba negativo. Ahora ese monto se mueve a
+-- comision_pagada_anulada (ver devengos.anular_pagos y registrar_pago).
+
+ALTER TABLE comision_resumen_diario
+    ADD COLUMN IF NOT EXISTS comision_pagada_anulada NUMERIC(12, 2) NOT NULL DEFAULT 0;  -- pagada por caja, venta anulada
+
+-- Histórico: lo pagado de ventas ya anuladas
+UPDATE comision_resumen_diario r
+SET comision_pagada = r.comision_pagada - p.pagado,
+    comision_pagada_anulada = r.comision_pagada_anulada + p.pagado
+FROM (
+    SELECT empleado_id, sucursal_id, dia, fuente, SUM(pagado) AS pagado
+    FROM (
+        SELECT v.empleado_id, COALESCE(v.sucursal_id, 0) AS sucursal_id, v.fecha_venta::date AS dia,
+               'PRODUCTO' AS fuente, c.monto_comision AS pagado
+        FROM comisiones c
+        JOIN venta_items vi ON vi.id = c.venta_item_id
+        JOIN ventas v ON v.id = vi.venta_id
+        WHERE c.estado = 'Pagada' AND v.empleado_id IS NOT NULL AND vi.producto_id IS NOT NULL
+          AND v.estado_pago = 'Anulado'
+        UNION ALL
+        SELECT v.empleado_id, COALESCE(v.sucursal_id, 0), v.fecha_venta::date,
+               'HORA_EXTRA', COALESCE(vi.comision_servicio_extra, 0)
+        FROM venta_items vi
+        JOIN ventas v ON v.id = vi.venta_id
+        WHERE vi.es_hora_extra AND vi.entregado_al_colaborador AND vi.producto_id IS NULL
+          AND v.empleado_id IS NOT NULL AND v.estado_pago = 'Anulado'
+    ) t
+    GROUP BY 1, 2, 3, 4
+) p
+WHERE r.empleado_id = p.empleado_id AND r.sucursal_id = p.sucursal_id
+  AND r.dia = p.dia AND r.fuente = p.fuente;
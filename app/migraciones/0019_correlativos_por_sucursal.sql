@@ -0,0 +1,17 @@
+-- migrador: sin-transaccion
+-- 0019: El correlativo es único por sucursal, no global.
+-- Las series se configuran por sucursal (series_comprobantes.sucursal_id), así que
+-- dos sucursales pueden tener la misma serie (p.ej. B001) y emitir los mismos
+-- números. El índice de 0009 sobre (tipo, serie, número) hacía fallar la venta de
+-- la segunda sucursal; ahora la clave incluye sucursal_id.
+-- Orden: primero el índice nuevo (los marcados como heredados siguen fuera), luego
+-- se quita el viejo y recién entonces se desmarcan los que 0009 marcó solo por
+-- coincidir con otra sucursal.
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_ventas_correlativo_sucursal
+    ON ventas (sucursal_id, tipo_comprobante, serie_comprobante, numero_comprobante)
+    WHERE NOT correlativo_heredado;
+
+DROP INDEX CONCURRENTLY IF EXISTS uq_ventas_correlativo;
+
+UPDATE ventas v SET correlativo_heredado = FALSE WHERE v.correlativo_heredado AND NOT EXISTS (SELECT 1 FROM ventas o WHERE o.sucursal_id = v.sucursal_id AND o.tipo_comprobante = v.tipo_comprobante AND o.serie_comprobante = v.serie_comprobante AND o.numero_comprobante = v.numero_comprobante AND o.id < v.id);
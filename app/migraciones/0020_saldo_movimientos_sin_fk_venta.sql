@@ -0,0 +1,8 @@
+-- 0020: saldo_movimientos.venta_id sin FK a ventas.
+-- Con la FK de 0013, eliminar una Nota de Venta que usó monedero, canjeó puntos o
+-- ya acumuló puntos fallaba (el libro es de solo inserción: tampoco sirve
+-- ON DELETE SET NULL, el trigger rechaza el UPDATE). Ahora la eliminación revierte
+-- los saldos con saldos.revertir_venta y los movimientos conservan el venta_id de
+-- la venta eliminada, igual que comision_devengos.venta_id (0014).
+
+ALTER TABLE saldo_movimientos DROP CONSTRAINT IF EXISTS saldo_movimientos_venta_id_fkey;
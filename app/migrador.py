@@ -0,0 +1,235 @@
+import os
+import re
+import time
+import hashlib
+import click
+import psycopg2
+from .db import get_pool
+
+# ---------------------------------------------------------
+# MIGRACIONES VERSIONADAS
+# ---------------------------------------------------------
+# Los cambios de esquema viven en app/migraciones/NNNN_descripcion.sql y se
+# aplican una sola vez por despliegue con `flask db-upgrade`. Cada migración
+# aplicada queda registrada (con su checksum) en la tabla schema_migraciones.
+# Al arrancar, la app solo verifica con una consulta que la versión esté al día.
+
+DIRECTORIO_MIGRACIONES = os.path.join(os.path.dirname(__file__), 'migraciones')
+PATRON_ARCHIVO = re.compile(r'^(\d{4})_([\w\-]+)\.sql$')
+
+# Las migraciones que contienen CREATE INDEX CONCURRENTLY no pueden correr dentro
+# de una transacción. Se marcan con esta línea y se ejecutan sentencia por sentencia
+# (separadas por ';' al final de la línea) en modo autocommit.
+MARCA_SIN_TRANSACCION = '-- migrador: sin-transaccion'
+
+# Evita que dos despliegues simultáneos apliquen migraciones a la vez
+LOCK_MIGRACIONES = 727001
+
+SQL_TABLA_LEDGER = """
+    CREATE TABLE IF NOT EXISTS schema_migraciones (
+        version INTEGER PRIMARY KEY,
+        nombre VARCHAR(200) NOT NULL,
+        checksum CHAR(64) NOT NULL,
+        aplicada_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        duracion_ms INTEGER
+    );
+"""
+
+
+class MigracionError(Exception):
+    pass
+
+
+class Migracion:
+    def __init__(self, version, nombre, ruta):
+        self.version = version
+        self.nombre = nombre
+        self.ruta = ruta
+        with open(ruta, encoding='utf-8') as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode('utf-8')).hexdigest()
+        self.sin_transaccion = MARCA_SIN_TRANSACCION in self.sql
+
+    def sentencias(self):
+        """Divide el archivo en sentencias (solo para migraciones sin transacción)."""
+        partes = re.split(r';\s*$', self.sql, flags=re.M)
+        sentencias = []
+        for parte in partes:
+            lineas = [l for l in parte.splitlines() if l.strip() and not l.strip().startswith('--')]
+            if lineas:
+                sentencias.append("\n".join(lineas))
+        return sentencias
+
+    def __repr__(self):
+        return f"<Migracion {self.version:04d} {self.nombre}>"
+
+
+def descubrir_migraciones(directorio=DIRECTORIO_MIGRACIONES):
+    """Lista las migraciones del directorio ordenadas por versión."""
+    migraciones = []
+    for archivo in sorted(os.listdir(directorio)):
+        m = PATRON_ARCHIVO.match(archivo)
+        if m:
+            migraciones.append(Migracion(int(m.group(1)), m.group(2), os.path.join(directorio, archivo)))
+
+    versiones = [m.version for m in migraciones]
+    if len(versiones) != len(set(versiones)):
+        raise MigracionError(f"Hay versiones de migración duplicadas en {directorio}")
+    return migraciones
+
+
+def version_objetivo():
+    migraciones = descubrir_migraciones()
+    return migraciones[-1].version if migraciones else 0
+
+
+def _aplicadas(cursor):
+    cursor.execute("SELECT version, nombre, checksum FROM schema_migraciones ORDER BY version")
+    return {row[0]: (row[1], row[2].strip()) for row in cursor.fetchall()}
+
+
+def migraciones_pendientes(conn):
+    """
+    Devuelve las migraciones aún no aplicadas.
+    Lanza MigracionError si alguna ya aplicada fue modificada (checksum distinto).
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(SQL_TABLA_LEDGER)
+        aplicadas = _aplicadas(cursor)
+    conn.commit()
+
+    pendientes = []
+    for migracion in descubrir_migraciones():
+        registro = aplicadas.get(migracion.version)
+        if registro is None:
+            pendientes.append(migracion)
+        elif registro[1] != migracion.checksum:
+            raise MigracionError(
+                f"La migración {migracion.version:04d} ({registro[0]}) cambió después de aplicarse. "
+                "Crea una migración nueva en lugar de editar una existente."
+            )
+    return pendientes
+
+
+def _aplicar(conn, migracion):
+    inicio = time.monotonic()
+    if migracion.sin_transaccion:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                for sentencia in migracion.sentencias():
+                    cursor.execute(sentencia)
+        finally:
+            conn.autocommit = False
+    else:
+        with conn.cursor() as cursor:
+            cursor.execute(migracion.sql)
+
+    duracion_ms = int((time.monotonic() - inicio) * 1000)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO schema_migraciones (version, nombre, checksum, duracion_ms) VALUES (%s, %s, %s, %s)",
+            (migracion.version, migracion.nombre, migracion.checksum, duracion_ms)
+        )
+    conn.commit()
+    return duracion_ms
+
+
+def aplicar_migraciones(conn, eco=print):
+    """Aplica todas las migraciones pendientes, cada una en su propia transacción."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (LOCK_MIGRACIONES,))
+    conn.commit()
+    try:
+        pendientes = migraciones_pendientes(conn)
+        if not pendientes:
+            eco("✅ El esquema ya está al día.")
+            return []
+
+        for migracion in pendientes:
+            eco(f"⏳ Aplicando {migracion.version:04d}_{migracion.nombre}...")
+            try:
+                duracion_ms = _aplicar(conn, migracion)
+            except Exception:
+                conn.rollback()
+                raise
+            eco(f"✅ {migracion.version:04d}_{migracion.nombre} aplicada ({duracion_ms} ms)")
+        return pendientes
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (LOCK_MIGRACIONES,))
+        conn.commit()
+
+
+def version_actual(conn):
+    """Versión aplicada en la BD (0 si el ledger aún no existe). Una sola consulta."""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migraciones")
+            return cursor.fetchone()[0]
+    except psycopg2.errors.UndefinedTable:
+        return 0
+    finally:
+        conn.rollback()
+
+
+def verificar_version_esquema(app):
+    """
+    Chequeo barato al arrancar: compara la versión aplicada con la última migración
+    del repositorio. No modifica nada salvo que AUTO_MIGRAR esté activo (uso local).
+    """
+    pool = None
+    conn = None
+    try:
+        pool = get_pool()
+        conn = pool.obtener()
+        actual = version_actual(conn)
+        objetivo = version_objetivo()
+
+        if actual >= objetivo:
+            return True
+
+        if app.config.get('AUTO_MIGRAR'):
+            app.logger.warning(f"Esquema en v{actual}, aplicando migraciones hasta v{objetivo} (AUTO_MIGRAR)")
+            aplicar_migraciones(conn, eco=app.logger.warning)
+            return True
+
+        app.logger.error(
+            f"⚠️ Esquema desactualizado: BD en v{actual}, código espera v{objetivo}. "
+            "Ejecuta `flask db-upgrade` en el despliegue."
+        )
+        return False
+    except Exception as e:
+        app.logger.error(f"No se pudo verificar la versión del esquema: {e}")
+        return False
+    finally:
+        if conn is not None:
+            pool.devolver(conn)
+
+
+def init_app(app):
+    @app.cli.command('db-upgrade')
+    def db_upgrade_command():
+        """Aplica las migraciones pendientes de app/migraciones."""
+        pool = get_pool()
+        conn = pool.obtener()
+        try:
+            aplicar_migraciones(conn, eco=click.echo)
+        except MigracionError as e:
+            raise click.ClickException(str(e))
+        finally:
+            pool.devolver(conn)
+
+    @app.cli.command('db-status')
+    def db_status_command():
+        """Muestra la versión del esquema y las migraciones pendientes."""
+        pool = get_pool()
+        conn = pool.obtener()
+        try:
+            click.echo(f"Versión aplicada: {version_actual(conn)} / última disponible: {version_objetivo()}")
+            for migracion in migraciones_pendientes(conn):
+                click.echo(f"  pendiente: {migracion.version:04d}_{migracion.nombre}")
+        except MigracionError as e:
+            raise click.ClickException(str(e))
+        finally:
+            pool.devolver(conn)
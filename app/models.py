@@ -1,8 +1,19 @@
+import threading
+from flask import session
 from flask_login import UserMixin
 from . import login_manager
+from . import versiones
 from .db import get_db
 import psycopg2.extras
 
+# Permisos por rol compartidos entre peticiones del worker: {rol_id: (version, frozenset)}
+_permisos_por_rol = {}
+_permisos_lock = threading.Lock()
+
+# Clave de sesión donde se guarda la identidad ya cargada (con su sello de versión)
+CLAVE_PRINCIPAL = '_principal'
+
+
 class User(UserMixin):
     # Actualizamos el constructor para aceptar 'sucursal_id'
     def __init__(self, id, nombres, apellidos, email, rol_id, rol_nombre, sucursal_id=None):
@@ -24,21 +35,7 @@ class User(UserMixin):
             if self.rol_id is None:
                 self._permisos = set()
             else:
-                db = get_db()
-                try:
-                    # Usamos RealDictCursor para consistencia
-                    with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                        sql = """
-                            SELECT p.nombre 
-                            FROM permisos p
-                            JOIN rol_permisos rp ON p.id = rp.permiso_id
-                            WHERE rp.rol_id = %s
-                        """
-                        cursor.execute(sql, (self.rol_id,))
-                        # Extraemos solo los nombres de los permisos
-                        self._permisos = {row['nombre'] for row in cursor.fetchall()}
-                except Exception:
-                    self._permisos = set()
+                self._permisos = _permisos_de_rol(self.rol_id)
                     
         return self._permisos
 
@@ -48,12 +45,64 @@ class User(UserMixin):
     def is_admin(self):
         return self.can('acceso_total')
 
+    def a_principal(self, version):
+        """Datos mínimos para reconstruir el usuario desde la sesión."""
+        return {
+            'id': self.id, 'nombres': self.nombres, 'apellidos': self.apellidos,
+            'email': self.email, 'rol_id': self.rol_id, 'rol_nombre': self.rol_nombre,
+            'sucursal_id': self.sucursal_id, 'v': version
+        }
+
+
+def _permisos_de_rol(rol_id):
+    """
+    Permisos del rol desde la caché del worker; solo consulta rol_permisos
+    si la versión 'rol:<id>' cambió (guardar_permisos_rol la incrementa).
+    """
+    version = versiones.version(f'rol:{rol_id}')
+    with _permisos_lock:
+        en_cache = _permisos_por_rol.get(rol_id)
+    if en_cache and version is not None and en_cache[0] == version:
+        return en_cache[1]
+
+    db = get_db()
+    try:
+        # Usamos RealDictCursor para consistencia
+        with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            sql = """
+                SELECT p.nombre 
+                FROM permisos p
+                JOIN rol_permisos rp ON p.id = rp.permiso_id
+                WHERE rp.rol_id = %s
+            """
+            cursor.execute(sql, (rol_id,))
+            # Extraemos solo los nombres de los permisos
+            permisos = frozenset(row['nombre'] for row in cursor.fetchall())
+    except Exception:
+        return set()
+
+    if version is not None:
+        with _permisos_lock:
+            _permisos_por_rol[rol_id] = (version, permisos)
+    return permisos
+
+
 @login_manager.user_loader
 def load_user(user_id):
+    # La versión se lee ANTES de los datos: si alguien edita al empleado entre
+    # medio, guardamos datos nuevos con sello viejo y solo se recargan una vez más.
+    version = versiones.version(f'empleado:{user_id}')
+
+    # 1. Identidad guardada en la sesión y aún vigente -> sin consultas
+    principal = session.get(CLAVE_PRINCIPAL)
+    if principal and str(principal.get('id')) == str(user_id) and version is not None and principal.get('v') == version:
+        datos = {k: v for k, v in principal.items() if k != 'v'}
+        return User(**datos)
+
+    # 2. Primera carga o empleado modificado -> BD
     db = get_db()
     try:
         with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            # JOIN para obtener el nombre del rol en cada carga de página
             sql = """
                 SELECT e.*, r.nombre as rol_nombre
                 FROM empleados e
@@ -65,7 +114,7 @@ def load_user(user_id):
             
             if user_data:
                 # Aquí también pasamos sucursal_id
-                return User(
+                user = User(
                     id=user_data['id'], 
                     nombres=user_data['nombres'],
                     apellidos=user_data['apellidos'],
@@ -74,7 +123,10 @@ def load_user(user_id):
                     rol_nombre=user_data['rol_nombre'],
                     sucursal_id=user_data['sucursal_id'] # <--- IMPORTANTE
                 )
+                if version is not None:
+                    session[CLAVE_PRINCIPAL] = user.a_principal(version)
+                return user
     except Exception as e:
         print(f"Error cargando usuario: {e}")
         return None
-    return None
\ No newline at end of file
+    return None
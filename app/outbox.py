@@ -0,0 +1,253 @@
+import json
+import time
+import select
+import click
+import psycopg2
+import psycopg2.extras
+import psycopg2.extensions
+from . import pg_listener
+from .db import get_pool
+
+# ---------------------------------------------------------
+# OUTBOX TRANSACCIONAL (efectos secundarios fuera de la venta)
+# ---------------------------------------------------------
+# La ruta que origina el efecto llama a encolar() con SU cursor: el evento se
+# confirma o se descarta junto con la transacción principal. El worker
+# (`flask outbox-worker`, proceso aparte del Procfile) lo procesa después.
+#
+# Idempotencia:
+#   - clave UNIQUE: encolar el mismo efecto dos veces no duplica el evento.
+#   - Cada evento se toma con FOR UPDATE SKIP LOCKED y se marca procesado en la
+#     MISMA transacción que aplica el manejador: o quedan ambos o ninguno, y dos
+#     workers nunca procesan el mismo evento a la vez.
+#   - Si un manejador falla se vuelve al SAVEPOINT, se anota el error y el
+#     evento se reintenta con espera exponencial hasta MAX_INTENTOS.
+# Los manejadores reciben (cursor RealDictCursor, payload) y no hacen commit.
+#
+# El mismo worker corre tareas periódicas livianas (p.ej. consolidar KPIs):
+# se registran con @tarea_periodica y cada una va en su propia transacción.
+
+CANAL = 'outbox'
+LOTE = 50
+MAX_INTENTOS = 8
+ESPERA_BASE_SEGUNDOS = 30
+ESPERA_MAXIMA_SEGUNDOS = 6 * 3600
+
+_manejadores = {}  # tipo -> funcion(cursor, payload)
+_periodicas = {}  # nombre -> {'funcion': funcion(cursor), 'segundos': n, 'ultima': instante}
+
+
+def manejador(tipo):
+    """Decorador que registra la función que procesa los eventos de un tipo."""
+    def registrar(funcion):
+        _manejadores[tipo] = funcion
+        return funcion
+    return registrar
+
+
+def tarea_periodica(nombre, segundos):
+    """Decorador que registra una tarea que el worker corre cada `segundos` (como mínimo)."""
+    def registrar(funcion):
+        _periodicas[nombre] = {'funcion': funcion, 'segundos': segundos, 'ultima': None}
+        return funcion
+    return registrar
+
+
+def encolar(cursor, tipo, clave, payload=None):
+    """
+    Registra un evento dentro de la transacción del cursor. Devuelve True si se
+    creó, False si ya existía uno con la misma clave.
+    """
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            INSERT INTO outbox_eventos (tipo, clave, payload)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (clave) DO NOTHING
+        """, (tipo, clave, json.dumps(payload or {}, default=str)))
+        creado = cur.rowcount == 1
+        if creado:
+            pg_listener.notificar(cur, CANAL, tipo)
+    return creado
+
+
+def ejecutar(cursor, tipo, payload):
+    """Aplica el manejador en la transacción del llamador (sin pasar por la tabla)."""
+    _manejadores[tipo](cursor, payload)
+
+
+def _espera_reintento(intentos):
+    return min(ESPERA_BASE_SEGUNDOS * (2 ** max(intentos - 1, 0)), ESPERA_MAXIMA_SEGUNDOS)
+
+
+def procesar_siguiente(conn):
+    """
+    Procesa un evento pendiente en su propia transacción.
+    Devuelve (id, ok) o None si no hay eventos disponibles.
+    """
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute("""
+            SELECT id, tipo, payload, intentos
+            FROM outbox_eventos
+            WHERE procesado_en IS NULL
+              AND disponible_en <= CURRENT_TIMESTAMP
+              AND intentos < %s
+            ORDER BY disponible_en, id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """, (MAX_INTENTOS,))
+        evento = cursor.fetchone()
+        if not evento:
+            conn.rollback()
+            return None
+
+        cursor.execute("SAVEPOINT outbox_evento")
+        try:
+            funcion = _manejadores.get(evento['tipo'])
+            if funcion is None:
+                raise LookupError(f"Sin manejador para el tipo '{evento['tipo']}'")
+            funcion(cursor, evento['payload'])
+            cursor.execute("""
+                UPDATE outbox_eventos
+                SET procesado_en = CURRENT_TIMESTAMP, intentos = intentos + 1, ultimo_error = NULL
+                WHERE id = %s
+            """, (evento['id'],))
+            ok = True
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT outbox_evento")
+            intentos = evento['intentos'] + 1
+            cursor.execute("""
+                UPDATE outbox_eventos
+                SET intentos = %s, ultimo_error = %s,
+                    disponible_en = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE id = %s
+            """, (intentos, f"{type(e).__name__}: {e}"[:2000], _espera_reintento(intentos), evento['id']))
+            ok = False
+        conn.commit()
+    return evento['id'], ok
+
+
+def ejecutar_periodicas(conn, eco=print):
+    """Corre las tareas periódicas vencidas. Un fallo se anota y se reintenta en el próximo turno."""
+    ahora = time.monotonic()
+    for nombre, tarea in _periodicas.items():
+        if tarea['ultima'] is not None and ahora - tarea['ultima'] < tarea['segundos']:
+            continue
+        tarea['ultima'] = ahora
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                tarea['funcion'](cursor)
+            conn.commit()
+        except psycopg2.OperationalError:
+            raise
+        except Exception as e:
+            conn.rollback()
+            eco(f"⚠️ Tarea periódica {nombre} falló: {type(e).__name__}: {e}")
+
+
+def procesar_lote(conn, limite=LOTE, eco=print):
+    """Procesa hasta `limite` eventos. Devuelve cuántos se tomaron."""
+    tomados = 0
+    while tomados < limite:
+        resultado = procesar_siguiente(conn)
+        if resultado is None:
+            break
+        evento_id, ok = resultado
+        if not ok:
+            eco(f"⚠️ Evento {evento_id} falló; se reintentará.")
+        tomados += 1
+    return tomados
+
+
+def _conexion_listen():
+    from .db import _parametros_conexion
+
+    args, kwargs = _parametros_conexion()
+    kwargs.pop('connection_factory', None)
+    conn = psycopg2.connect(*args, **kwargs)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    with conn.cursor() as cursor:
+        cursor.execute(f"LISTEN {CANAL}")
+    return conn
+
+
+def _esperar_aviso(conn_listen, segundos):
+    """Bloquea hasta un NOTIFY del canal o hasta agotar la espera."""
+    listos, _, _ = select.select([conn_listen], [], [], segundos)
+    if listos:
+        conn_listen.poll()
+        conn_listen.notifies.clear()
+
+
+def init_app(app):
+    @app.cli.command('outbox-worker')
+    @click.option('--una-vez', is_flag=True, help='Procesa lo pendiente y termina.')
+    @click.option('--espera', default=30.0, show_default=True,
+                  help='Segundos máximos entre revisiones si no llegan avisos (reintentos programados).')
+    def outbox_worker_command(una_vez, espera):
+        """Procesa los eventos pendientes de outbox_eventos."""
+        pool = get_pool()
+        conn = pool.obtener()
+        conn_listen = None
+        try:
+            if not una_vez:
+                conn_listen = _conexion_listen()
+            click.echo(f"📬 Outbox: manejadores {sorted(_manejadores)}, tareas periódicas {sorted(_periodicas)}")
+            while True:
+                try:
+                    ejecutar_periodicas(conn, eco=click.echo)
+                    tomados = procesar_lote(conn, eco=click.echo)
+                except psycopg2.OperationalError as e:
+                    # Postgres reiniciado o red caída: conexión nueva y seguir
+                    click.echo(f"❌ Outbox: conexión perdida ({e}); reintentando...")
+                    pool.devolver(conn)  # la descarta si quedó rota
+                    time.sleep(5)
+                    conn = pool.obtener()
+                    continue
+                if tomados:
+                    click.echo(f"✅ Outbox: {tomados} evento(s) procesado(s)")
+                if una_vez and not tomados:
+                    break
+                if tomados == LOTE:
+                    continue  # Quedan más: no esperar
+                if not una_vez:
+                    try:
+                        _esperar_aviso(conn_listen, espera)
+                    except (psycopg2.OperationalError, OSError):
+                        try:
+                            conn_listen.close()
+                        except Exception:
+                            pass
+                        time.sleep(5)
+                        conn_listen = _conexion_listen()
+        finally:
+            if conn_listen is not None:
+                conn_listen.close()
+            pool.devolver(conn)
+
+    @app.cli.command('outbox-status')
+    def outbox_status_command():
+        """Resumen de eventos pendientes, fallidos y procesados en las últimas 24 h."""
+        pool = get_pool()
+        conn = pool.obtener()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT tipo,
+                           COUNT(*) FILTER (WHERE procesado_en IS NULL AND intentos < %s) AS pendientes,
+                           COUNT(*) FILTER (WHERE procesado_en IS NULL AND intentos >= %s) AS agotados,
+                           COUNT(*) FILTER (WHERE procesado_en >= CURRENT_TIMESTAMP - INTERVAL '1 day') AS procesados_24h,
+                           MIN(creado_en) FILTER (WHERE procesado_en IS NULL) AS mas_antiguo
+                    FROM outbox_eventos
+                    WHERE procesado_en IS NULL OR procesado_en >= CURRENT_TIMESTAMP - INTERVAL '1 day'
+                    GROUP BY tipo
+                    ORDER BY tipo
+                """, (MAX_INTENTOS, MAX_INTENTOS))
+                filas = cursor.fetchall()
+            conn.rollback()
+            if not filas:
+                click.echo("Sin eventos pendientes ni procesados en las últimas 24 h.")
+            for tipo, pendientes, agotados, procesados, mas_antiguo in filas:
+                click.echo(f"  {tipo}: {pendientes} pendiente(s), {agotados} agotado(s), "
+                           f"{procesados} procesado(s) 24h, más antiguo sin procesar: {mas_antiguo or '-'}")
+        finally:
+            pool.devolver(conn)
@@ -0,0 +1,194 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+# ---------------------------------------------------------
+# PAGINACIÓN POR CURSOR (keyset) PARA LISTADOS
+# ---------------------------------------------------------
+# Los listados cargaban todo o se cortaban con un LIMIT fijo. Con OFFSET la
+# página 200 obliga a Postgres a leer y descartar las 199 anteriores; con keyset
+# cada página continúa desde la última fila vista:
+#   WHERE (orden, id) < (%s, %s) ORDER BY orden DESC, id DESC LIMIT n + 1
+# así que con un índice sobre (orden, id) cualquier página cuesta lo mismo que
+# la primera (migración 0016). La fila de más indica si hay página siguiente.
+#
+# Uso:
+#   LISTADO = Listado({'fecha': ('v.fecha_venta', 'desc'), ...}, defecto='fecha', clave='v.id')
+#   pagina = LISTADO.pagina(cursor, columnas, desde, where, params, request.args, contar='aproximado')
+#   -> pagina.filas, pagina.siguiente / pagina.anterior (tokens), pagina.total
+# y en la plantilla: {% from 'partials/_paginacion.html' import controles, encabezado %}
+#
+# Reglas:
+#  * Solo se ordena por las claves de `ordenes` (lista blanca: la expresión SQL
+#    nunca sale de la URL). Los parámetros de la URL son sort / order / cursor.
+#  * La expresión de orden no puede ser NULL (una comparación con NULL pierde
+#    filas): usar COALESCE en columnas opcionales e indexar esa expresión.
+#  * El token es opaco para el usuario (base64 de JSON) y va ligado al orden:
+#    si cambian sort/order se ignora y se vuelve a la primera página.
+
+POR_PAGINA = 50
+
+
+def _a_json(valor):
+    if isinstance(valor, datetime):
+        return {'dt': valor.isoformat()}
+    if isinstance(valor, date):
+        return {'d': valor.isoformat()}
+    if isinstance(valor, Decimal):
+        return {'n': str(valor)}
+    return valor
+
+
+def _de_json(valor):
+    if isinstance(valor, dict):
+        if 'dt' in valor:
+            return datetime.fromisoformat(valor['dt'])
+        if 'd' in valor:
+            return date.fromisoformat(valor['d'])
+        if 'n' in valor:
+            return Decimal(valor['n'])
+        raise ValueError('valor de cursor desconocido')
+    return valor
+
+
+def codificar(datos):
+    texto = json.dumps(datos, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar(token):
+    """Devuelve el dict del token o None si no es válido."""
+    if not token:
+        return None
+    try:
+        relleno = '=' * (-len(token) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(token + relleno).decode())
+        return datos if isinstance(datos, dict) else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class Pagina:
+    """Resultado de Listado.pagina(): filas + tokens de navegación + total opcional."""
+
+    def __init__(self, filas, orden, direccion, siguiente=None, anterior=None,
+                 es_primera=True, total=None, total_aproximado=False):
+        self.filas = filas
+        self.orden = orden
+        self.direccion = direccion
+        self.siguiente = siguiente
+        self.anterior = anterior
+        self.es_primera = es_primera
+        self.total = total
+        self.total_aproximado = total_aproximado
+
+    def a_dict(self):
+        """Para respuestas JSON (las filas van aparte, el llamador decide su formato)."""
+        return {
+            'siguiente': self.siguiente, 'anterior': self.anterior, 'orden': self.orden,
+            'direccion': self.direccion, 'total': self.total, 'total_aproximado': self.total_aproximado,
+        }
+
+
+class Listado:
+    """
+    Definición de un listado paginable.
+    ordenes: {'nombre en la URL': ('expresión SQL', 'asc' | 'desc' por defecto)}
+    clave:   expresión única que desempata (normalmente la PK con su alias)
+    """
+
+    def __init__(self, ordenes, defecto, clave='id', por_pagina=POR_PAGINA):
+        if defecto not in ordenes:
+            raise ValueError(f"Orden por defecto '{defecto}' no está en la lista")
+        self.ordenes = ordenes
+        self.defecto = defecto
+        self.clave = clave
+        self.por_pagina = por_pagina
+
+    def leer(self, args):
+        """(orden, dirección, posición) desde request.args; posición es None en la primera página."""
+        orden = args.get('sort') if args.get('sort') in self.ordenes else self.defecto
+        direccion = (args.get('order') or '').lower()
+        if direccion not in ('asc', 'desc'):
+            direccion = self.ordenes[orden][1]
+
+        datos = decodificar(args.get('cursor', ''))
+        posicion = None
+        if datos and datos.get('o') == orden and datos.get('r') == direccion and datos.get('s') in ('sig', 'ant'):
+            try:
+                valor, clave = (_de_json(v) for v in datos['v'])
+                posicion = (datos['s'], valor, clave)
+            except (KeyError, TypeError, ValueError):
+                posicion = None
+        return orden, direccion, posicion
+
+    def _token(self, orden, direccion, sentido, fila):
+        return codificar({
+            'o': orden, 'r': direccion, 's': sentido,
+            'v': [_a_json(fila['_pag_orden']), _a_json(fila['_pag_clave'])]
+        })
+
+    def pagina(self, cursor, columnas, desde, where=(), params=(), args=None, contar=None, agrupar=''):
+        """
+        Ejecuta la página pedida en args. `desde` es el FROM con sus JOIN, `where`
+        una lista de condiciones con %s y `params` sus valores (en orden).
+        agrupar: 'GROUP BY ...' opcional (el orden no puede ser un agregado).
+        contar: None, 'aproximado' (estimación del planificador, no recorre la
+        tabla) o 'exacto' (COUNT(*) del filtro).
+        El cursor debe ser RealDictCursor.
+        """
+        orden, direccion, posicion = self.leer(args or {})
+        expresion = self.ordenes[orden][0]
+        condiciones = list(where) or ['TRUE']
+        valores = list(params)
+
+        hacia_atras = posicion is not None and posicion[0] == 'ant'
+        # Hacia atrás se recorre en sentido inverso y luego se invierten las filas
+        ascendente = (direccion == 'asc') != hacia_atras
+        if posicion:
+            condiciones.append(f"({expresion}, {self.clave}) {'>' if ascendente else '<'} (%s, %s)")
+            valores.extend(posicion[1:])
+        sentido_sql = 'ASC' if ascendente else 'DESC'
+
+        cursor.execute(f"""
+            SELECT {columnas}, {expresion} AS _pag_orden, {self.clave} AS _pag_clave
+            FROM {desde}
+            WHERE {' AND '.join(condiciones)}
+            {agrupar}
+            ORDER BY {expresion} {sentido_sql}, {self.clave} {sentido_sql}
+            LIMIT %s
+        """, valores + [self.por_pagina + 1])
+        filas = cursor.fetchall()
+        hay_mas = len(filas) > self.por_pagina
+        filas = filas[:self.por_pagina]
+        if hacia_atras:
+            filas.reverse()
+
+        siguiente = anterior = None
+        if filas:
+            if hay_mas or hacia_atras:
+                siguiente = self._token(orden, direccion, 'sig', filas[-1])
+            if posicion and (hay_mas or not hacia_atras):
+                anterior = self._token(orden, direccion, 'ant', filas[0])
+
+        total = None
+        if contar:
+            total = self._contar(cursor, desde, list(where) or ['TRUE'], list(params), agrupar, contar)
+
+        return Pagina(filas, orden, direccion, siguiente=siguiente, anterior=anterior,
+                      es_primera=posicion is None or (hacia_atras and not hay_mas),
+                      total=total, total_aproximado=(contar == 'aproximado'))
+
+    @staticmethod
+    def _contar(cursor, desde, condiciones, params, agrupar, modo):
+        sql = f"SELECT 1 FROM {desde} WHERE {' AND '.join(condiciones)} {agrupar}"
+        if modo == 'exacto':
+            cursor.execute(f"SELECT COUNT(*) AS total FROM ({sql}) t", params)
+            return cursor.fetchone()['total']
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()
+        plan = plan['QUERY PLAN'] if isinstance(plan, dict) else plan[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
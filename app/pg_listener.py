@@ -0,0 +1,108 @@
+import os
+import re
+import time
+import select
+import threading
+import psycopg2
+import psycopg2.extensions
+
+# ---------------------------------------------------------
+# LISTEN/NOTIFY (Un solo hilo y una sola conexión por worker)
+# ---------------------------------------------------------
+# Los módulos registran callbacks por canal con suscribir(). El primer request de
+# cada worker arranca el hilo (iniciar), que abre una conexión dedicada fuera del
+# pool, ejecuta LISTEN en todos los canales y despacha cada NOTIFY recibido.
+# Tras una reconexión se llama a los callbacks con payload=None ("resincronizar"),
+# porque los avisos emitidos mientras estábamos desconectados se pierden.
+
+_CANAL_VALIDO = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+_suscriptores = {}  # canal -> [callback(payload)]
+_lock = threading.Lock()
+_hilo = None
+_hilo_pid = None
+
+
+def suscribir(canal, callback):
+    """Registra callback(payload) para un canal. Llamar al configurar la app."""
+    if not _CANAL_VALIDO.match(canal):
+        raise ValueError(f"Nombre de canal inválido: {canal}")
+    with _lock:
+        _suscriptores.setdefault(canal, []).append(callback)
+
+
+def notificar(cursor, canal, payload=''):
+    """
+    Emite un NOTIFY dentro de la transacción del cursor: los demás workers lo
+    reciben recién cuando se haga commit (y nunca si hay rollback).
+    """
+    cursor.execute("SELECT pg_notify(%s, %s)", (canal, str(payload)))
+
+
+def _despachar(canal, payload):
+    for callback in list(_suscriptores.get(canal, [])):
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"❌ Error en suscriptor de '{canal}': {e}")
+
+
+def _escuchar():
+    # Import tardío para evitar el ciclo db -> pg_listener -> db
+    from .db import _parametros_conexion
+
+    espera = 1
+    while True:
+        conn = None
+        try:
+            args, kwargs = _parametros_conexion()
+            kwargs.pop('connection_factory', None)
+            conn = psycopg2.connect(*args, **kwargs)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                for canal in list(_suscriptores):
+                    cursor.execute(f"LISTEN {canal}")
+
+            # Lo que haya cambiado mientras no escuchábamos se da por invalidado
+            for canal in list(_suscriptores):
+                _despachar(canal, None)
+            espera = 1
+
+            while True:
+                listos, _, _ = select.select([conn], [], [], 60)
+                if not listos:
+                    # Keepalive: detecta conexiones muertas (reinicio de Postgres, red)
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    aviso = conn.notifies.pop(0)
+                    _despachar(aviso.channel, aviso.payload)
+        except Exception as e:
+            print(f"⚠️ LISTEN desconectado ({e}), reintentando en {espera}s")
+            time.sleep(espera)
+            espera = min(espera * 2, 30)
+        finally:
+            if conn is not None and not conn.closed:
+                conn.close()
+
+
+def iniciar():
+    """Arranca el hilo LISTEN del worker actual si aún no existe (idempotente y barato)."""
+    global _hilo, _hilo_pid
+    if _hilo is not None and _hilo_pid == os.getpid() and _hilo.is_alive():
+        return
+    with _lock:
+        if not _suscriptores:
+            return
+        if _hilo is None or _hilo_pid != os.getpid() or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_escuchar, name='pg-listener', daemon=True)
+            _hilo_pid = os.getpid()
+            _hilo.start()
+
+
+def init_app(app):
+    @app.before_request
+    def _asegurar_listener():
+        iniciar()
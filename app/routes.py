@@ -7,13 +7,17 @@ import json
 import math
 import zipfile
 import base64
+import hashlib
 import calendar
 from datetime import datetime, date, time, timedelta, timezone
 from urllib.parse import quote, quote_plus
+from time import perf_counter
 import requests 
 import pytz
 from app.services.whatsapp_service import enviar_alerta_reserva
 from app.services.image_service import subir_imagen, configurar_cloudinary # Importamos el servicio de imágenes
+from app.services import agenda as agenda_service
+from app.services import disponibilidad, reservas_lote, correlativos, venta_detalle, clientes_busqueda, catalogo_pos, post_venta, saldos, devengos, kpi_diarios
 import pandas as pd
 import psycopg2
 from psycopg2.extras import execute_values
@@ -50,9 +54,11 @@ from zeep.wsse.username import UsernameToken
 # -------------------------------------------------------------------------
 # 2. IMPORTACIONES LOCALES (De tu propio proyecto)
 # -------------------------------------------------------------------------
-from .db import get_db
-from .models import User
+from .db import get_db, close_db, pool_stats
+from . import cache_configuracion, versiones, agenda_stream, latencias, paginacion, exportacion
+from .models import User, CLAVE_PRINCIPAL
 from .decorators import admin_required
+from .utils.fechas import rango_dia, rango_fechas, filtro_rango, hoy_lima, a_fecha, a_hora_local
 
 # -------------------------------------------------------------------------
 # 3. DEFINICIÓN DEL BLUEPRINT (El corazón de las rutas)
@@ -87,11 +93,9 @@ def timedelta_to_time_obj(td):
 @main_bp.teardown_app_request
 def teardown_db(exception):
     """
-    Cierra la conexión a la base de datos al finalizar la petición.
+    Devuelve la conexión al pool al finalizar la petición.
     """
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    close_db(exception)
 
 
 @main_bp.route('/ayuda/contenido')
@@ -146,24 +150,13 @@ def index():
         # Ajusta 'Administrador' si tu rol se llama diferente en la BD
         if getattr(current_user, 'rol', '') == 'Administrador' or getattr(current_user, 'rol_nombre', '') == 'Administrador':
             with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                # 1. Ventas del día (Postgres: COALESCE)
-                cursor.execute("""
-                    SELECT 
-                        COUNT(id) as numero_ventas,
-                        COALESCE(SUM(subtotal_servicios), 0) as total_servicios,
-                        COALESCE(SUM(subtotal_productos), 0) as total_productos
-                    FROM ventas 
-                    WHERE DATE(fecha_venta) = %s AND estado_pago != 'Anulado'
-                """, (hoy,))
-                resultado_ventas = cursor.fetchone()
-                if resultado_ventas:
-                    ventas_hoy = resultado_ventas
-
-                # 2. Citas del día
-                cursor.execute("SELECT COUNT(id) as numero_citas FROM reservas WHERE DATE(fecha_hora_inicio) = %s AND estado NOT IN ('Cancelada', 'No Asistio')", (hoy,))
-                datos_para_plantilla['citas_hoy'] = cursor.fetchone()
+                # 1 y 2. Ventas y citas del día: KPIs diarios (triggers + consolidación, ver services/kpi_diarios.py)
+                kpis = kpi_diarios.totales_dia(cursor, hoy)
+                if kpis:
+                    ventas_hoy = {k: kpis[k] for k in ('numero_ventas', 'total_servicios', 'total_productos')}
+                    datos_para_plantilla['citas_hoy'] = {'numero_citas': kpis['numero_citas']}
 
-                # 3. Productos con stock bajo
+                # 3. Productos con stock bajo (índice parcial idx_productos_stock_bajo)
                 cursor.execute("SELECT id, nombre, stock_actual, stock_minimo FROM productos WHERE activo = TRUE AND stock_actual <= stock_minimo ORDER BY stock_actual ASC")
                 datos_para_plantilla['productos_stock_bajo'] = cursor.fetchall()
                 
@@ -190,11 +183,11 @@ def index():
                     FROM reservas r 
                     JOIN servicios s ON r.servicio_id = s.id 
                     LEFT JOIN clientes c ON r.cliente_id = c.id
-                    WHERE r.empleado_id = %s AND DATE(r.fecha_hora_inicio) = %s 
+                    WHERE r.empleado_id = %s AND r.fecha_hora_inicio >= %s AND r.fecha_hora_inicio < %s
                       AND r.estado = 'Programada' AND r.fecha_hora_inicio >= CURRENT_TIMESTAMP
                     ORDER BY r.fecha_hora_inicio ASC LIMIT 5
                 """
-                cursor.execute(sql, (current_user.id, hoy))
+                cursor.execute(sql, (current_user.id, *rango_dia(hoy)))
                 datos_para_plantilla['proximas_citas'] = cursor.fetchall()
 
         # --- LÓGICA DE CUMPLEAÑOS (General) ---
@@ -202,31 +195,26 @@ def index():
         fecha_proxima = hoy + timedelta(days=2)
         
         with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            # Cumpleaños de HOY (Postgres: EXTRACT)
-            sql_hoy = """
-                SELECT c.id, c.razon_social_nombres, c.apellidos, c.telefono 
+            # Una sola consulta por idx_clientes_cumple_mmdd (cumple_mmdd = mes*100 + día)
+            sql_cumpleanos = """
+                SELECT c.id, c.razon_social_nombres, c.apellidos, c.telefono, c.cumple_mmdd
                 FROM clientes c 
-                LEFT JOIN cliente_comunicaciones cc 
-                    ON c.id = cc.cliente_id AND cc.tipo_comunicacion = 'SALUDO_CUMPLEANOS' AND cc.año_aplicable = %s 
-                WHERE EXTRACT(MONTH FROM c.fecha_nacimiento) = %s 
-                  AND EXTRACT(DAY FROM c.fecha_nacimiento) = %s 
-                  AND cc.id IS NULL
+                WHERE c.cumple_mmdd IN (%s, %s)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM cliente_comunicaciones cc
+                      WHERE cc.cliente_id = c.id AND cc.año_aplicable = %s
+                        AND cc.tipo_comunicacion = CASE WHEN c.cumple_mmdd = %s
+                                                        THEN 'SALUDO_CUMPLEANOS' ELSE 'INVITACION_CUMPLEANOS' END
+                  )
             """
-            cursor.execute(sql_hoy, (anio_actual, hoy.month, hoy.day))
-            datos_para_plantilla['clientes_cumpleanos_hoy'] = cursor.fetchall()
-            
-            # Próximos cumpleaños
-            sql_proximos = """
-                SELECT c.id, c.razon_social_nombres, c.apellidos, c.telefono 
-                FROM clientes c 
-                LEFT JOIN cliente_comunicaciones cc 
-                    ON c.id = cc.cliente_id AND cc.tipo_comunicacion = 'INVITACION_CUMPLEANOS' AND cc.año_aplicable = %s 
-                WHERE EXTRACT(MONTH FROM c.fecha_nacimiento) = %s 
-                  AND EXTRACT(DAY FROM c.fecha_nacimiento) = %s 
-                  AND cc.id IS NULL
-            """
-            cursor.execute(sql_proximos, (anio_actual, fecha_proxima.month, fecha_proxima.day))
-            datos_para_plantilla['clientes_cumpleanos_proximos'] = cursor.fetchall()
+            mmdd_hoy = hoy.month * 100 + hoy.day
+            mmdd_proximo = fecha_proxima.month * 100 + fecha_proxima.day
+            cursor.execute(sql_cumpleanos, (mmdd_hoy, mmdd_proximo, anio_actual, mmdd_hoy))
+            for cliente in cursor.fetchall():
+                if cliente['cumple_mmdd'] == mmdd_hoy:
+                    datos_para_plantilla['clientes_cumpleanos_hoy'].append(cliente)
+                else:
+                    datos_para_plantilla['clientes_cumpleanos_proximos'].append(cliente)
 
     except Exception as e:
         print(f"Error en Dashboard: {e}")
@@ -415,6 +403,7 @@ def logout():
     Maneja el cierre de sesión del usuario.
     """
     logout_user()
+    session.pop(CLAVE_PRINCIPAL, None)
     flash('Has cerrado sesión exitosamente.', 'success')
     return redirect(url_for('main.login'))
 
@@ -505,6 +494,15 @@ def api_cliente_historial_servicios(cliente_id):
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+# Listado de clientes sin búsqueda: paginado por cursor (app/paginacion.py, índices en migración 0016)
+LISTADO_CLIENTES = paginacion.Listado({
+    'nombre': ("COALESCE(razon_social_nombres, '')", 'asc'),
+    'dni': ("COALESCE(numero_documento, '')", 'asc'),
+    'telefono': ("COALESCE(telefono, '')", 'asc'),
+    'puntos': ("COALESCE(puntos_fidelidad, 0)", 'asc'),
+}, defecto='nombre', clave='id')
+
+
 @main_bp.route('/clientes', methods=['GET'])
 @login_required
 def listar_clientes():
@@ -529,36 +527,27 @@ def listar_clientes():
         if order not in ['asc', 'desc']:
             order = 'asc'
 
-        # Consulta SQL optimizada para búsqueda general
-        sql_base = """
-            SELECT id, razon_social_nombres, apellidos, tipo_documento, 
-                   numero_documento, telefono, puntos_fidelidad 
-            FROM clientes 
-            WHERE 1=1
-        """
-        params = []
-
-        if q:
-            sql_base += " AND (razon_social_nombres ILIKE %s OR apellidos ILIKE %s OR numero_documento ILIKE %s OR telefono ILIKE %s)"
-            termino = f"%{q}%"
-            params.extend([termino, termino, termino, termino])
-
-        # Ordenar
-        sql_base += f" ORDER BY {db_sort_field} {order.upper()}"
-        
-        # Límite si no hay búsqueda
-        if not q:
-            sql_base += " LIMIT 100"
-
+        pagina = None
         with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            cursor.execute(sql_base, tuple(params))
-            clientes = cursor.fetchall()
+            if q:
+                # Búsqueda compartida (sin tildes, por trigramas): viene ordenada por relevancia
+                clientes = clientes_busqueda.buscar(cursor, q, limite=100, columnas=clientes_busqueda.COLUMNAS_LISTADO)
+                if sort_by != 'nombre':
+                    vacio = 0 if sort_by == 'puntos' else ''
+                    clientes.sort(key=lambda c: c[db_sort_field] or vacio, reverse=(order == 'desc'))
+            else:
+                pagina = LISTADO_CLIENTES.pagina(cursor, """
+                    id, razon_social_nombres, apellidos, tipo_documento, 
+                    numero_documento, telefono, puntos_fidelidad
+                """, "clientes", args=request.args, contar='aproximado')
+                clientes = pagina.filas
 
         if ajax:
             return render_template('clientes/_filas_clientes.html', clientes=clientes)
 
         return render_template('clientes/lista_clientes.html', 
                                clientes=clientes, 
+                               pagina=pagina,
                                termino_busqueda=q,
                                sort=sort_by,
                                order=order)
@@ -658,11 +647,16 @@ def nuevo_cliente():
                         (tipo_documento, numero_documento, razon_social_nombres, apellidos, 
                          apellido_paterno, apellido_materno,
                          direccion, email, telefono, fecha_nacimiento, puntos_fidelidad, apoderado_id, genero, preferencia_servicio) 
-                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 0, %s, %s, %s) RETURNING id"""
             
             cursor_insert.execute(sql, (tipo_documento, numero_documento, nombres, apellidos, 
                                         apellido_paterno, apellido_materno,
-                                        direccion, email, telefono, fecha_nacimiento, puntos, apoderado_id, genero, preferencia_servicio))
+                                        direccion, email, telefono, fecha_nacimiento, apoderado_id, genero, preferencia_servicio))
+            nuevo_cliente_id = cursor_insert.fetchone()[0]
+            if puntos:
+                # Puntos iniciales como primer movimiento del libro (ver services/saldos.py)
+                saldos.mover(cursor_insert, nuevo_cliente_id, saldos.PUNTOS, puntos, 'APERTURA',
+                             usuario_id=current_user.id, referencia='Puntos iniciales al registrar')
             db_conn.commit()
             
             # --- LÓGICA DE MARKETING POST-REGISTRO ---
@@ -997,15 +991,18 @@ def editar_cliente(cliente_id):
                                 tipo_documento=%s, numero_documento=%s, razon_social_nombres=%s, 
                                 apellidos=%s, apellido_paterno=%s, apellido_materno=%s,
                                 direccion=%s, email=%s, telefono=%s, 
-                                fecha_nacimiento=%s, puntos_fidelidad=%s, apoderado_id=%s,
+                                fecha_nacimiento=%s, apoderado_id=%s,
                                 genero=%s, preferencia_servicio=%s
                             WHERE id=%s"""
             val_update = (tipo_documento, numero_documento, razon_social_nombres, apellidos, 
                           apellido_paterno, apellido_materno,
-                          direccion, email, telefono, fecha_nacimiento, puntos_fidelidad, apoderado_id, 
+                          direccion, email, telefono, fecha_nacimiento, apoderado_id, 
                           genero, preferencia_servicio, cliente_id)
             
             cursor_update.execute(sql_update, val_update)
+            # Los puntos solo cambian si el formulario los trae (antes se ponían en 0 al editar)
+            if 'puntos_fidelidad' in request.form:
+                saldos.fijar(cursor_update, cliente_id, saldos.PUNTOS, puntos_fidelidad, usuario_id=current_user.id)
             db_conn.commit()
             flash('Cliente actualizado exitosamente.', 'success')
             return redirect(url_for('main.listar_clientes'))
@@ -1078,7 +1075,11 @@ def eliminar_cliente(cliente_id):
         db.rollback()
         # Detección de error de clave foránea en Postgres (IntegrityError código 23503)
         err_msg = str(err)
-        if '23503' in getattr(err, 'pgcode', '') or 'foreign key' in err_msg:
+        restriccion = getattr(getattr(err, 'diag', None), 'constraint_name', None) or ''
+        if restriccion.startswith(('saldo_movimientos_', 'saldo_cierres_')):
+             # El libro de saldos es de solo inserción: un cliente con movimientos no se borra
+             flash('No se puede eliminar: El cliente tiene movimientos de monedero o puntos en el libro de saldos.', 'warning')
+        elif '23503' in getattr(err, 'pgcode', '') or 'foreign key' in err_msg:
              flash('No se puede eliminar: El cliente tiene historial (ventas, citas, etc.).', 'warning')
         else:
              flash(f'Error al eliminar: {err}', 'danger')
@@ -2207,6 +2208,8 @@ def editar_empleado(empleado_id):
                         flash("Advertencia: La foto no se pudo subir. Verifique la configuración de Cloudinary.", "warning")
 
             db_conn.commit()
+            versiones.incrementar(db_conn, f'empleado:{empleado_id}')
+            cache_configuracion.invalidar(db_conn, f'sucursales:{empleado_id}')
             flash('Colaborador actualizado exitosamente!', 'success')
             return redirect(url_for('main.listar_empleados'))
 
@@ -2286,6 +2289,7 @@ def toggle_activo_empleado(empleado_id):
         sql_update = "UPDATE empleados SET activo = %s WHERE id = %s"
         cursor_update.execute(sql_update, (nuevo_estado_activo, empleado_id))
         db_conn.commit()
+        versiones.incrementar(db_conn, f'empleado:{empleado_id}')
         
         mensaje_estado = "activado" if nuevo_estado_activo else "desactivado"
         flash(f'El empleado {empleado_actual["nombres"]} {empleado_actual["apellidos"]} ha sido {mensaje_estado} exitosamente.', 'success')
@@ -2598,36 +2602,106 @@ def eliminar_ajuste(colaborador_id, ajuste_id):
 
 # --- RUTAS PARA LA GESTIÓN DE RESERVAS ---
 
+# Paginación por cursor (keyset) sobre (fecha_hora_inicio, id): ver migración 0008 y app/paginacion.py
+LISTADO_RESERVAS = paginacion.Listado({'inicio': ('r.fecha_hora_inicio', 'desc')}, defecto='inicio', clave='r.id')
+ESTADOS_RESERVA = ('Programada', 'Confirmada', 'Completada') + agenda_service.ESTADOS_OCULTOS
+
+
 @main_bp.route('/reservas')
 @login_required
 def listar_reservas():
     db = get_db()
-    lista_de_reservas = []
-    clientes_todos, empleados_para_selector, servicios_todos_activos = [], [], []
-    
+    pagina = paginacion.Pagina([], LISTADO_RESERVAS.defecto, 'desc')
+    empleados_para_selector, sucursales = [], []
+
+    filtros = {
+        'estado': request.args.get('estado', '').strip(),
+        'empleado_id': request.args.get('empleado_id', type=int),
+        'sucursal_id': request.args.get('sucursal_id', type=int),
+        'desde': request.args.get('desde', '').strip(),
+        'hasta': request.args.get('hasta', '').strip(),
+    }
+
     try:
+        where = []
+        params = []
+        if filtros['estado'] in ESTADOS_RESERVA:
+            where.append("r.estado = %s")
+            params.append(filtros['estado'])
+        if filtros['empleado_id']:
+            where.append("r.empleado_id = %s")
+            params.append(filtros['empleado_id'])
+        if filtros['sucursal_id']:
+            where.append("r.sucursal_id = %s")
+            params.append(filtros['sucursal_id'])
+        sql_fechas, params_fechas = filtro_rango('r.fecha_hora_inicio', filtros['desde'] or None, filtros['hasta'] or None)
+        if sql_fechas:
+            where.append(sql_fechas.removeprefix(' AND '))
+            params.extend(params_fechas)
+
         with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            # Obtener lista de reservas (sin cambios)
-            sql = "SELECT r.id, TO_CHAR(r.fecha_hora_inicio, 'DD/MM/YYYY') as fecha_hora, CONCAT(c.razon_social_nombres, ' ', COALESCE(c.apellidos, '')) AS cliente_nombre, e.nombre_display AS empleado_nombre, s.nombre AS servicio_nombre, r.precio_cobrado, r.estado, r.origen FROM reservas r LEFT JOIN clientes c ON r.cliente_id = c.id JOIN empleados e ON r.empleado_id = e.id JOIN servicios s ON r.servicio_id = s.id ORDER BY r.fecha_hora_inicio DESC"
-            cursor.execute(sql)
-            lista_de_reservas = cursor.fetchall()
+            pagina = LISTADO_RESERVAS.pagina(cursor, """
+                    r.id, r.fecha_hora_inicio,
+                    TO_CHAR(r.fecha_hora_inicio, 'DD/MM/YYYY HH24:MI') as fecha_hora,
+                    CONCAT(c.razon_social_nombres, ' ', COALESCE(c.apellidos, '')) AS cliente_nombre,
+                    e.nombre_display AS empleado_nombre, s.nombre AS servicio_nombre,
+                    r.precio_cobrado, r.estado, r.origen
+                """, """
+                    reservas r
+                    LEFT JOIN clientes c ON r.cliente_id = c.id
+                    JOIN empleados e ON r.empleado_id = e.id
+                    JOIN servicios s ON r.servicio_id = s.id
+                """, where, params, request.args)
 
-            # Obtener listas para los modales
-            cursor.execute("SELECT id, razon_social_nombres, apellidos FROM clientes ORDER BY razon_social_nombres, apellidos")
-            clientes_todos = cursor.fetchall()
+            # Colaboradores: lista corta (filtro y modal). Clientes y servicios se
+            # buscan por AJAX (/api/clientes/buscar, /api/servicios/buscar).
             cursor.execute("SELECT id, nombres, apellidos FROM empleados WHERE activo = TRUE ORDER BY apellidos, nombres")
             empleados_para_selector = cursor.fetchall()
-            cursor.execute("SELECT id, nombre, duracion_minutos FROM servicios WHERE activo = TRUE ORDER BY nombre")
-            servicios_todos_activos = cursor.fetchall()
+
+        es_admin = getattr(current_user, 'rol_nombre', '') == 'Administrador'
+        sucursales = cache_configuracion.sucursales_de_usuario(current_user.id, es_admin)
 
     except Exception as err:
         flash(f"Error al acceder a las reservas: {err}", "danger")
 
-    return render_template('reservas/lista_reservas.html', 
-                           reservas=lista_de_reservas,
-                           clientes_todos=clientes_todos,
+    return render_template('reservas/lista_reservas.html',
+                           reservas=pagina.filas,
+                           pagina=pagina,
                            empleados_para_selector=empleados_para_selector,
-                           servicios_todos_activos=servicios_todos_activos)
+                           sucursales=sucursales,
+                           estados_reserva=ESTADOS_RESERVA,
+                           filtros=filtros)
+
+
+@main_bp.route('/api/servicios/buscar', methods=['GET'])
+@login_required
+def api_buscar_servicios():
+    """
+    API para búsqueda de servicios activos via AJAX (Select2).
+    Sin término devuelve los primeros por nombre (el catálogo de servicios es corto).
+    """
+    search_term = request.args.get('q', '').strip()
+    try:
+        db = get_db()
+        with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT id, nombre, duracion_minutos, precio
+                FROM servicios
+                WHERE activo = TRUE AND nombre ILIKE %s
+                ORDER BY (nombre ILIKE %s) DESC, nombre
+                LIMIT 20
+            """, (f"%{search_term}%", f"{search_term}%"))
+            results = [{
+                "id": s['id'],
+                "text": f"{s['nombre']} ({s['duracion_minutos']} min)",
+                "duracion_minutos": s['duracion_minutos'],
+                "precio": float(s['precio']) if s['precio'] is not None else None
+            } for s in cursor.fetchall()]
+            return jsonify({"results": results})
+
+    except Exception as e:
+        current_app.logger.error(f"Error buscando servicios: {e}")
+        return jsonify({"results": []}), 500
 
 
 @main_bp.route('/reservas/agenda')
@@ -2698,21 +2772,8 @@ def api_buscar_clientes():
     try:
         db = get_db()
         with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            # Búsqueda por Nombre o Documento o Teléfono
-            query = """
-                SELECT id, razon_social_nombres, apellidos, numero_documento, telefono
-                FROM clientes
-                WHERE 
-                    razon_social_nombres ILIKE %s OR
-                    apellidos ILIKE %s OR
-                    numero_documento ILIKE %s OR
-                    telefono ILIKE %s
-                ORDER BY razon_social_nombres
-                LIMIT 20
-            """
-            term = f"%{search_term}%"
-            cursor.execute(query, (term, term, term, term))
-            clientes = cursor.fetchall()
+            # Búsqueda por Nombre, Documento o Teléfono (ver services/clientes_busqueda.py)
+            clientes = clientes_busqueda.buscar(cursor, search_term)
             
             results = []
             for c in clientes:
@@ -2729,6 +2790,69 @@ def api_buscar_clientes():
         current_app.logger.error(f"Error buscando clientes: {e}")
         return jsonify({"results": []})   
     
+@main_bp.route('/api/pos/clientes/buscar', methods=['GET'])
+@login_required
+def api_pos_buscar_clientes():
+    """
+    Typeahead del selector de clientes del POS (Select2): prefijo de nombre,
+    apellido, documento o teléfono, ordenado por relevancia. Incluye los datos
+    que la venta necesita (documento, saldo de monedero, cumpleaños).
+    """
+    termino = request.args.get('q', '').strip()
+    if not termino:
+        return jsonify({"results": []})
+    try:
+        db = get_db()
+        with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            clientes = clientes_busqueda.buscar(cursor, termino)
+        return jsonify({"results": [clientes_busqueda.a_resultado(c) for c in clientes]})
+    except Exception as e:
+        current_app.logger.error(f"Error en api_pos_buscar_clientes: {e}")
+        return jsonify({"results": []}), 500
+
+
+@main_bp.route('/api/pos/catalogo')
+@login_required
+def api_pos_catalogo():
+    """
+    Catálogo del POS (colaboradores, servicios, productos, campañas) con ETag por
+    versión. El navegador lo revalida en cada carga y casi siempre recibe 304
+    sin que se consulte la BD (ver services/catalogo_pos.py).
+    """
+    sucursal_id = session.get('sucursal_id')
+    if not sucursal_id:
+        return jsonify({"error": "Debes seleccionar una sucursal."}), 400
+
+    etag_vigente = catalogo_pos.etag(sucursal_id)
+    if etag_vigente and request.if_none_match.contains(etag_vigente):
+        response = Response(status=304)
+    else:
+        try:
+            db = get_db()
+            with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                etag_vigente, cuerpo = catalogo_pos.snapshot(cursor, sucursal_id)
+        except Exception as e:
+            current_app.logger.error(f"Error en api_pos_catalogo: {e}")
+            return jsonify({"error": "No se pudo cargar el catálogo."}), 500
+        response = Response(cuerpo, mimetype='application/json')
+    response.set_etag(etag_vigente)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@main_bp.route('/api/pos/stock')
+@login_required
+def api_pos_stock():
+    """Stock de los productos que cambiaron desde ?desde=<token> (todos si falta o venció)."""
+    try:
+        db = get_db()
+        with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            return jsonify(catalogo_pos.stock_delta(cursor, request.args.get('desde')))
+    except Exception as e:
+        current_app.logger.error(f"Error en api_pos_stock: {e}")
+        return jsonify({"error": "No se pudo consultar el stock."}), 500
+
+
 @main_bp.route('/api/reservas/<int:reserva_id>')
 @login_required
 def api_get_datos_reserva(reserva_id):
@@ -2772,10 +2896,18 @@ def api_get_datos_reserva(reserva_id):
 @login_required
 def api_agenda_dia_data():
     """
-    API Corregida: Carga agenda sin buscar la columna 'foto' para evitar errores.
+    Recursos y eventos del día para FullCalendar.
+    - Responde con ETag fuerte; si el navegador manda If-None-Match y nada cambió -> 304.
+    - El token de cambios viaja en la cabecera X-Agenda-Token (no en el cuerpo, para
+      que el ETag solo cambie cuando cambia la agenda).
+    - ?since=<token>: modo delta. Devuelve solo los colaboradores con reservas,
+      extras, ausencias u horarios modificados desde ese token ("recursos_actualizados");
+      el cliente reemplaza todos los eventos de esos colaboradores por los recibidos.
+      Si el token venció o es inválido responde la agenda completa ("completo": true).
     """
     fecha_str = request.args.get('fecha', date.today().isoformat())
     sucursal_id = request.args.get('sucursal_id', type=int)
+    since = request.args.get('since')
     
     if not sucursal_id:
         return jsonify({"recursos": [], "eventos": []})
@@ -2788,209 +2920,115 @@ def api_agenda_dia_data():
     try:
         db_conn = get_db()
         with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            
-            # --- 1. OBTENER RECURSOS (COLABORADORES) ---
-            # 🟢 CORRECCIÓN: Quitamos reference a 'e.foto' porque no existe en la BD
-            # 1.A. Pre-calcular quienes tienen turno este día (Optimización: 1 sola query en lugar de N)
-            # Buscamos IDs que tengan horarios_empleado (día semana) O horarios_extra (fecha exacta)
-            dia_semana_num = fecha_obj.isoweekday()
-            
-            cursor.execute("""
-                SELECT DISTINCT empleado_id 
-                FROM horarios_empleado 
-                WHERE dia_semana = %s
-                UNION
-                SELECT DISTINCT empleado_id 
-                FROM horarios_extra 
-                WHERE fecha = %s
-            """, (dia_semana_num, fecha_str))
-            
-            ids_con_turno = {row['empleado_id'] for row in cursor.fetchall()}
-
-            # --- 1.B. QUERY PRINCIPAL DE EMPLEADOS (OPTIMIZADA) ---
-            # Usamos LEFT JOIN con una subquery pre-agrupada en lugar de una subquery correlacionada por cada fila.
-            cursor.execute("""
-                SELECT e.id, e.nombre_display as title,
-                       COALESCE(citas.total, 0) as citas_hoy_count
-                FROM empleados e
-                LEFT JOIN (
-                    SELECT empleado_id, COUNT(*) as total
-                    FROM reservas 
-                    WHERE DATE(fecha_hora_inicio) = %s
-                      AND estado NOT IN ('Cancelada', 'Cancelada por Cliente', 'Cancelada por Staff', 'No Asistio')
-                    GROUP BY empleado_id
-                ) citas ON e.id = citas.empleado_id
-                WHERE e.activo = TRUE 
-                  AND e.realiza_servicios = TRUE  
-                  AND e.id IN (SELECT empleado_id FROM empleado_sucursales WHERE sucursal_id = %s)
-                ORDER BY e.nombres
-            """, (fecha_str, sucursal_id))
-            
-            recursos_db = cursor.fetchall()
-            
-            recursos = []
-            for r in recursos_db:
-                recursos.append({
-                    "id": r['id'],
-                    "title": r['title'],
-                    "imagen_url": None,
-                    "tiene_turno": (r['id'] in ids_con_turno),
-                    "citas_hoy": r['citas_hoy_count']
+            # El token se toma ANTES de leer para no perder cambios concurrentes
+            token = agenda_service.token_actual(cursor)
+
+            if since:
+                xmin = agenda_service.leer_token(since)
+                if xmin is None:
+                    recursos, eventos = agenda_service.agenda_dia(cursor, sucursal_id, fecha_obj)
+                    return jsonify({"token": token, "completo": True, "recursos": recursos, "eventos": eventos})
+
+                cambiados = agenda_service.empleados_con_cambios(cursor, xmin, fecha_obj)
+                recursos, eventos = [], []
+                if cambiados:
+                    recursos, eventos = agenda_service.agenda_dia(cursor, sucursal_id, fecha_obj, solo_empleados=cambiados)
+                return jsonify({
+                    "token": token,
+                    "completo": False,
+                    "recursos_actualizados": sorted(cambiados),
+                    "recursos": recursos,
+                    "eventos": eventos
                 })
-            
-            eventos = []
-            
-            if recursos:
-                recursos_ids = [r['id'] for r in recursos]
-                
-                placeholders = ','.join(['%s'] * len(recursos_ids))
-                params_base = list(recursos_ids)
-                
-                # --- 2. HORARIOS (FONDO BLANCO) ---
-                dia_semana_num = fecha_obj.isoweekday()
-                
-                # Estructura para validar horario de reservas: { emp_id: [ (start_time, end_time), ... ] }
-                turnos_validos = {} 
 
-                sql_turnos = f"""
-                    SELECT empleado_id, hora_inicio, hora_fin 
-                    FROM horarios_empleado 
-                    WHERE empleado_id IN ({placeholders}) AND dia_semana = %s
-                """
-                cursor.execute(sql_turnos, params_base + [dia_semana_num])
-                
-                rows_turnos = cursor.fetchall()
-                for turno in rows_turnos:
-                    # Guardar para validación
-                    if turno['empleado_id'] not in turnos_validos: turnos_validos[turno['empleado_id']] = []
-                    turnos_validos[turno['empleado_id']].append((turno['hora_inicio'], turno['hora_fin']))
-
-                    eventos.append({
-                        "resourceId": turno['empleado_id'],
-                        "start": f"{fecha_str}T{turno['hora_inicio']}", 
-                        "end": f"{fecha_str}T{turno['hora_fin']}",
-                        "display": "background", 
-                        "classNames": ["turno-disponible"]
-                    })
-                
-                # --- 2.1 HORARIOS EXTRA ---
-                sql_extras = f"""
-                    SELECT empleado_id, hora_inicio, hora_fin, motivo
-                    FROM horarios_extra
-                    WHERE empleado_id IN ({placeholders}) AND fecha = %s
-                """
-                cursor.execute(sql_extras, params_base + [fecha_str])
-                
-                rows_extras = cursor.fetchall()
-                for extra in rows_extras:
-                    # Guardar para validación
-                    if extra['empleado_id'] not in turnos_validos: turnos_validos[extra['empleado_id']] = []
-                    turnos_validos[extra['empleado_id']].append((extra['hora_inicio'], extra['hora_fin']))
-
-                    eventos.append({
-                        "resourceId": extra['empleado_id'],
-                        "start": f"{fecha_str}T{extra['hora_inicio']}", 
-                        "end": f"{fecha_str}T{extra['hora_fin']}",
-                        "display": "background", 
-                        "classNames": ["turno-disponible", "turno-extra"],
-                        "title": f"Extra: {extra.get('motivo','')}"
-                    })
-                
-                # --- 3. AUSENCIAS (FONDO ROJO) ---
-                sql_ausencias = f"""
-                    SELECT empleado_id, fecha_hora_inicio, fecha_hora_fin 
-                    FROM ausencias_empleado 
-                    WHERE empleado_id IN ({placeholders}) 
-                      AND aprobado = TRUE 
-                      AND DATE(fecha_hora_inicio) <= %s 
-                      AND DATE(fecha_hora_fin) >= %s
-                """
-                cursor.execute(sql_ausencias, params_base + [fecha_str, fecha_str])
-                
-                for ausencia in cursor.fetchall():
-                    eventos.append({
-                        "resourceId": ausencia['empleado_id'],
-                        "start": ausencia['fecha_hora_inicio'].isoformat(),
-                        "end": ausencia['fecha_hora_fin'].isoformat(),
-                        "display": "background", 
-                        "classNames": ["bg-danger-subtle"], 
-                        "title": "Ausente"
-                    })
-                
-                # --- 4. RESERVAS (TARJETAS) ---
-                sql_reservas = """
-                    SELECT 
-                        r.id, 
-                        r.fecha_hora_inicio as start, 
-                        r.fecha_hora_fin as end, 
-                        r.estado, 
-                        r.empleado_id as "resourceId", 
-                        r.origen,
-                        CONCAT(s.nombre, ' - ', c.razon_social_nombres) as title 
-                    FROM reservas r 
-                    JOIN servicios s ON r.servicio_id = s.id 
-                    LEFT JOIN clientes c ON r.cliente_id = c.id 
-                    WHERE r.sucursal_id = %s 
-                      AND DATE(r.fecha_hora_inicio) = %s 
-                      AND r.estado NOT IN ('Cancelada', 'Cancelada por Cliente', 'Cancelada por Staff', 'No Asistio')
-                """
-                cursor.execute(sql_reservas, (sucursal_id, fecha_str))
-                
-                for reserva in cursor.fetchall():
-                    # 🟢 LÓGICA DE FUERA DE HORARIO
-                    fuera_de_horario = True
-                    # Obtenemos los turnos del empleado
-                    mis_turnos = turnos_validos.get(reserva['resourceId'], [])
-                    
-                    # Convertir tiempos de la reserva para comparar
-                    r_start = reserva['start'].time()
-                    r_end = reserva['end'].time()
-                    
-                    # Si tiene turnos, verificamos si encaja en alguno
-                    if mis_turnos:
-                        for t_start, t_end in mis_turnos:
-                            # Asegurar tipos time (a veces vienen como datetime en extras?? NO, time en ambos casos normalmente)
-                            # Pero psycopg2 suele devolver time para TIME y datetime para TIMESTAMP.
-                            # Horarios es TIME.
-                            
-                            # Normalización defensiva (por si acaso)
-                            def to_time(val):
-                                if isinstance(val, datetime): return val.time()
-                                if isinstance(val, str): return datetime.strptime(val, "%H:%M:%S").time()
-                                return val
-
-                            ts = to_time(t_start)
-                            te = to_time(t_end)
-
-                            if r_start >= ts and r_end <= te:
-                                fuera_de_horario = False
-                                break
-                    
-                    titulo_final = reserva['title']
-                    clases = ["reserva-card"]
-                    
-                    if fuera_de_horario:
-                        clases.append("reserva-fuera-horario")
-                        titulo_final = "⚠️ " + titulo_final
-
-                    eventos.append({
-                        "id": reserva['id'],
-                        "resourceId": reserva['resourceId'],
-                        "title": titulo_final,
-                        "start": reserva['start'].isoformat(),
-                        "end": reserva['end'].isoformat(),
-                        "extendedProps": {
-                            "estado": reserva['estado'],
-                            "origen": reserva['origen']
-                        }, 
-                        "classNames": clases
-                    })
+            recursos, eventos = agenda_service.agenda_dia(cursor, sucursal_id, fecha_obj)
 
     except Exception as e:
         current_app.logger.error(f"Error fatal en api_agenda_dia_data: {e}", exc_info=True)
         return jsonify({"error": "Error interno del servidor."}), 500
 
-    return jsonify({"recursos": recursos, "eventos": eventos})
+    return _respuesta_agenda({"recursos": recursos, "eventos": eventos}, token)
+
+
+def _respuesta_agenda(datos, token):
+    """JSON con ETag fuerte (hash del cuerpo) + token de cambios; 304 si el cliente ya lo tiene."""
+    response = jsonify(datos)
+    response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['X-Agenda-Token'] = token
+    return response.make_conditional(request)
+
+
+@main_bp.route('/api/agenda/stream')
+@login_required
+def api_agenda_stream():
+    """
+    Server-Sent Events con los cambios de agenda de una sucursal (eventos 'cambio',
+    'resync' y 'listo'). Reemplaza el sondeo periódico: el cliente solo recarga
+    (o pide el delta con ?since=) cuando llega un aviso que toca la fecha visible.
+    """
+    sucursal_id = request.args.get('sucursal_id', type=int)
+    if not sucursal_id:
+        return jsonify({"error": "Falta la sucursal."}), 400
+
+    es_admin = getattr(current_user, 'rol_nombre', '') == 'Administrador'
+    permitidas = {s['id'] for s in cache_configuracion.sucursales_de_usuario(current_user.id, es_admin)}
+    if sucursal_id not in permitidas:
+        return jsonify({"error": "Sin acceso a esta sucursal."}), 403
+
+    # Cupo de flujos por worker (cada uno ocupa un hilo): sin cupo, 503 y el cliente sondea
+    cuerpo = agenda_stream.abrir_flujo(
+        sucursal_id, current_app.config.get('AGENDA_SSE_MAX_POR_WORKER', agenda_stream.MAX_FLUJOS_POR_WORKER)
+    )
+    if cuerpo is None:
+        response = jsonify({"error": "Agenda en vivo sin capacidad en este momento.", "modo": "sondeo"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '300'
+        return response
+
+    # Sin stream_with_context: la conexión a la BD vuelve al pool al salir de la vista
+    response = Response(cuerpo, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@main_bp.route('/api/agenda_rango_data')
+@login_required
+def api_agenda_rango_data():
+    """
+    Variante por rango de api_agenda_dia_data para vistas de semana / próximos días.
+    Parámetros: sucursal_id, start (inclusive) y end (exclusivo), como los envía
+    FullCalendar (YYYY-MM-DD o ISO con hora). Máximo 31 días.
+    Responde {"dias": {"YYYY-MM-DD": {"recursos": [...], "eventos": [...]}, ...}} con
+    el mismo formato por día que api_agenda_dia_data, armado con 6 consultas en total.
+    """
+    sucursal_id = request.args.get('sucursal_id', type=int)
+    if not sucursal_id:
+        return jsonify({"dias": {}})
+
+    try:
+        desde = a_fecha(request.args.get('start') or hoy_lima())
+        hasta = a_fecha(request.args.get('end')) or desde + timedelta(days=7)
+    except ValueError:
+        return jsonify({"error": "Formato de fecha inválido"}), 400
+
+    dias = (hasta - desde).days
+    if dias < 1 or dias > 31:
+        return jsonify({"error": "El rango debe tener entre 1 y 31 días (end es exclusivo)."}), 400
+
+    try:
+        db_conn = get_db()
+        with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            token = agenda_service.token_actual(cursor)
+            agenda = agenda_service.agenda_rango(cursor, sucursal_id, desde, dias)
+    except Exception as e:
+        current_app.logger.error(f"Error fatal en api_agenda_rango_data: {e}", exc_info=True)
+        return jsonify({"error": "Error interno del servidor."}), 500
+
+    return _respuesta_agenda({
+        "dias": {fecha: {"recursos": recursos, "eventos": eventos} for fecha, (recursos, eventos) in agenda.items()}
+    }, token)
 
 @main_bp.route('/api/agenda/bloquear', methods=['POST'])
 @login_required
@@ -3067,6 +3105,62 @@ def api_agenda_habilitar():
         if 'db' in locals(): db.rollback()
         current_app.logger.error(f"Error en api_agenda_habilitar: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
+
+
+@main_bp.route('/api/agenda/disponibilidad')
+@login_required
+def api_agenda_disponibilidad():
+    """
+    Primeros N huecos libres para un servicio (o duración) entre todos los
+    colaboradores de la sucursal, desde 'fecha' y por 'dias' días.
+    Parámetros: sucursal_id, servicio_id | duracion (min), fecha (YYYY-MM-DD, hoy por defecto),
+    dias (1-7), limite (1-50), resolucion (5 o 15), empleado_id (opcional).
+    """
+    sucursal_id = request.args.get('sucursal_id', type=int) or session.get('sucursal_id')
+    servicio_id = request.args.get('servicio_id', type=int)
+    duracion = request.args.get('duracion', type=int)
+    empleado_id = request.args.get('empleado_id', type=int)
+    dias = min(max(request.args.get('dias', 1, type=int), 1), 7)
+    limite = min(max(request.args.get('limite', 10, type=int), 1), 50)
+    resolucion = request.args.get('resolucion', 15, type=int)
+
+    if not sucursal_id:
+        return jsonify({"error": "Falta la sucursal."}), 400
+    if resolucion not in disponibilidad.RESOLUCIONES_API:
+        return jsonify({"error": "Resolución inválida (use 5 o 15)."}), 400
+    try:
+        fecha_obj = date.fromisoformat(request.args.get('fecha') or hoy_lima().isoformat())
+    except ValueError:
+        return jsonify({"error": "Formato de fecha inválido"}), 400
+
+    try:
+        db_conn = get_db()
+        with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            if servicio_id:
+                cursor.execute("SELECT duracion_minutos FROM servicios WHERE id = %s AND activo = TRUE", (servicio_id,))
+                servicio = cursor.fetchone()
+                if not servicio:
+                    return jsonify({"error": "Servicio no válido."}), 400
+                duracion = servicio['duracion_minutos']
+            if not duracion or duracion <= 0:
+                return jsonify({"error": "Indique servicio_id o duracion."}), 400
+
+            mapa = disponibilidad.mapa_sucursal(cursor, sucursal_id, fecha_obj, dias, resolucion, empleado_id)
+
+        # No ofrecer horas que ya pasaron (hora de Lima, naive como en la BD)
+        ahora = datetime.now(pytz.timezone('America/Lima')).replace(tzinfo=None)
+        huecos = mapa.huecos(duracion, limite=limite, desde=ahora)
+
+        return jsonify({
+            "duracion": duracion,
+            "resolucion": resolucion,
+            "desde": fecha_obj.isoformat(),
+            "dias": dias,
+            "huecos": huecos
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error en api_agenda_disponibilidad: {e}", exc_info=True)
+        return jsonify({"error": "Error interno del servidor."}), 500
    
     
     
@@ -3094,7 +3188,8 @@ def api_configuracion():
     try:
         cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         # Evitar bloqueos indefinidos (5 segundos timeout)
-        cursor.execute("SET statement_timeout = 5000") 
+        # SET LOCAL: la conexión vuelve al pool, el timeout no debe sobrevivir a esta transacción
+        cursor.execute("SET LOCAL statement_timeout = 5000") 
     except Exception as e:
         current_app.logger.error(f"Error creando cursor: {e}")
         return jsonify({"success": False, "message": "Error interno (Cursor)"}), 500
@@ -3180,6 +3275,7 @@ def api_configuracion():
 
             
             db.commit()
+            cache_configuracion.invalidar(db, f'sucursal:{sucursal_id}')
             current_app.logger.info("Configuración guardada exitosamente en DB.")
             return jsonify({"success": True, "message": "Configuración guardada correctamente."})
             
@@ -3219,6 +3315,22 @@ from app.services.whatsapp_service import enviar_alerta_reserva
 
 # ... (El resto de tus rutas) ...
 
+def _respuesta_choque_reserva(db_conn, empleado_id, inicio, fin, excluir_reserva_id=None):
+    """
+    409 con la reserva que ocupa el horario, tras violar la restricción
+    reservas_sin_solape (migración 0007). Hace rollback de la transacción abortada.
+    """
+    db_conn.rollback()
+    with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        conflicto = agenda_service.reserva_en_conflicto(cursor, empleado_id, inicio, fin, excluir_reserva_id)
+
+    mensaje = "El colaborador ya tiene una reserva en ese horario."
+    if conflicto:
+        mensaje = (f"El colaborador ya tiene una reserva de {conflicto['inicio'][11:16]} a {conflicto['fin'][11:16]}"
+                   f" ({conflicto['servicio']} - {conflicto['cliente']}).")
+    return jsonify({"success": False, "message": mensaje, "conflicto": conflicto}), 409
+
+
 @main_bp.route('/reservas/nueva', methods=['POST'])
 @login_required
 def nueva_reserva():
@@ -3285,58 +3397,22 @@ def nueva_reserva():
             precio_del_servicio = servicio_seleccionado['precio']
             nombre_servicio_str = servicio_seleccionado['nombre'] 
 
-            # Validar Horarios
-            dia_semana_reserva = fecha_hora_inicio.isoweekday()
-            
-            # 1. Turnos Recurrentes
-            cursor.execute("SELECT hora_inicio, hora_fin FROM horarios_empleado WHERE empleado_id = %s AND dia_semana = %s", (empleado_id, dia_semana_reserva))
-            turnos_recurrentes = cursor.fetchall()
-            
-            # 2. Turnos Extra (Específicos para la fecha)
-            fecha_solo_dia = fecha_hora_inicio.date()
-            cursor.execute("SELECT hora_inicio, hora_fin FROM horarios_extra WHERE empleado_id = %s AND fecha = %s", (empleado_id, fecha_solo_dia))
-            turnos_extra = cursor.fetchall()
-
-            # Combinar ambos
-            turnos_del_dia = turnos_recurrentes + turnos_extra
-            
-            if not turnos_del_dia:
-                 pass # return jsonify({"success": False, "message": f"El colaborador no trabaja el día seleccionado."}), 409
-            
-            esta_en_turno_valido = False
-            for turno in turnos_del_dia:
-                try:
-                    # Intento robusto de conversión de hora
-                    t_in = turno['hora_inicio'] if isinstance(turno['hora_inicio'], (datetime, type(datetime.now().time()))) else datetime.strptime(str(turno['hora_inicio']), "%H:%M:%S").time()
-                    t_out = turno['hora_fin'] if isinstance(turno['hora_fin'], (datetime, type(datetime.now().time()))) else datetime.strptime(str(turno['hora_fin']), "%H:%M:%S").time()
-                except:
-                    t_in = turno['hora_inicio']
-                    t_out = turno['hora_fin']
-
-                if fecha_hora_inicio.time() >= t_in and fecha_hora_fin.time() <= t_out:
-                    esta_en_turno_valido = True
-                    break
-            
-            if not esta_en_turno_valido:
+            # Validar horario, ausencias y choques (advertencias, la agenda es flexible)
+            # Los choques con otras reservas los rechaza la BD (reservas_sin_solape) al insertar
+            motivos = disponibilidad.conflictos_reserva(cursor, empleado_id, fecha_hora_inicio, fecha_hora_fin, incluir_reservas=False)
+            if 'sin_turno' in motivos or 'fuera_de_turno' in motivos:
                 current_app.logger.info("Advertencia: Reserva fuera de horario laboral.")
-                # return jsonify({"success": False, "message": "Fuera de horario laboral del colaborador."}), 409
-
-            # Validar Ausencias y Choques (Resumido)
-            cursor.execute("SELECT id FROM ausencias_empleado WHERE empleado_id=%s AND aprobado=TRUE AND fecha_hora_inicio<%s AND fecha_hora_fin>%s", (empleado_id, fecha_hora_fin, fecha_hora_inicio))
-            if cursor.fetchone(): 
+            if 'ausencia' in motivos:
                 current_app.logger.info("Advertencia: Reserva coincide con ausencia.")
-                # return jsonify({"success": False, "message": "Colaborador ausente."}), 409
-
-            cursor.execute("SELECT id FROM reservas WHERE empleado_id=%s AND sucursal_id=%s AND estado NOT IN ('Cancelada', 'Cancelada por Cliente', 'Cancelada por Staff', 'No Asistio', 'Completada') AND fecha_hora_inicio<%s AND fecha_hora_fin>%s", (empleado_id, sucursal_id, fecha_hora_fin, fecha_hora_inicio))
-            if cursor.fetchone(): 
-                current_app.logger.info("Advertencia: Choque de horarios permitido.")
-                # return jsonify({"success": False, "message": "Horario ocupado."}), 409
             
             # --- 3. Insertar Reserva ---
             sql = "INSERT INTO reservas (sucursal_id, cliente_id, empleado_id, servicio_id, fecha_hora_inicio, fecha_hora_fin, estado, notas_cliente, precio_cobrado, origen) VALUES (%s, %s, %s, %s, %s, %s, 'Programada', %s, %s, 'POS') RETURNING id"
             val = (sucursal_id, cliente_id, empleado_id, servicio_id, fecha_hora_inicio, fecha_hora_fin, notas_cliente, precio_del_servicio)
             
-            cursor.execute(sql, val)
+            try:
+                cursor.execute(sql, val)
+            except psycopg2.errors.ExclusionViolation:
+                return _respuesta_choque_reserva(db_conn, empleado_id, fecha_hora_inicio, fecha_hora_fin)
             
             # --- 4. 🟢 GENERAR LINK DE WHATSAPP ---
             whatsapp_url = None
@@ -3406,6 +3482,105 @@ def nueva_reserva():
         return jsonify({"success": False, "message": f"Error interno: {str(e)}"}), 500
        
             
+@main_bp.route('/api/reservas/lote', methods=['POST'])
+@login_required
+def api_reservas_lote():
+    """
+    Crea varias reservas de un servicio en una sola operación.
+    JSON: sucursal_id, servicio_id, cliente_id, empleado_id, notas_cliente y
+      - "recurrencia": {"inicio": "YYYY-MM-DDTHH:MM", "cada_dias": 14, "repeticiones": 6 | "hasta": "YYYY-MM-DD"}
+      - o "slots": [{"inicio": "...", "empleado_id": opcional, "cliente_id": opcional}, ...] (bloques de grupo)
+    Opcionales: "estricto" (rechaza fuera de turno o con ausencia; por defecto solo advierte,
+    igual que nueva_reserva) y "solo_validar" (no inserta).
+    Responde el resultado por horario: aceptada / rechazada con su motivo.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "message": "Error: Se esperaba contenido JSON."}), 400
+
+    try:
+        sucursal_id = int(data.get('sucursal_id') or 0)
+        servicio_id = int(data.get('servicio_id') or 0)
+        cliente_id = int(data.get('cliente_id') or 0) or None
+        empleado_id = int(data.get('empleado_id') or 0) or None
+        notas_cliente = (data.get('notas_cliente') or '').strip() or None
+        estricto = bool(data.get('estricto'))
+        solo_validar = bool(data.get('solo_validar'))
+
+        if data.get('recurrencia'):
+            inicios = [(inicio, empleado_id, cliente_id) for inicio in reservas_lote.expandir_recurrencia(data['recurrencia'])]
+        else:
+            inicios = [
+                (a_hora_local(datetime.fromisoformat(sl['inicio'])),
+                 int(sl.get('empleado_id') or 0) or empleado_id,
+                 int(sl.get('cliente_id') or 0) or cliente_id)
+                for sl in (data.get('slots') or [])
+            ]
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"success": False, "message": f"Datos inválidos: {e}"}), 400
+
+    if not sucursal_id or not servicio_id:
+        return jsonify({"success": False, "message": "Sucursal y servicio son obligatorios."}), 400
+    if not inicios or len(inicios) > reservas_lote.MAX_SLOTS:
+        return jsonify({"success": False, "message": f"Envíe entre 1 y {reservas_lote.MAX_SLOTS} horarios."}), 400
+    if any(not emp or not cli for _, emp, cli in inicios):
+        return jsonify({"success": False, "message": "Cada horario necesita colaborador y cliente."}), 400
+
+    db_conn = get_db()
+    try:
+        with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            cursor.execute("SELECT duracion_minutos, precio FROM servicios WHERE id = %s AND activo = TRUE", (servicio_id,))
+            servicio = cursor.fetchone()
+            if not servicio:
+                return jsonify({"success": False, "message": "Servicio no válido."}), 400
+            duracion = timedelta(minutes=servicio['duracion_minutos'])
+
+            slots = [
+                {'n': n, 'inicio': inicio, 'fin': inicio + duracion, 'empleado_id': emp, 'cliente_id': cli}
+                for n, (inicio, emp, cli) in enumerate(inicios)
+            ]
+            reservas_lote.validar_slots(cursor, slots, estricto)
+            aceptados = [sl for sl in slots if sl['motivo'] is None]
+
+            ids = {}
+            if aceptados and not solo_validar:
+                ids = reservas_lote.insertar_slots(
+                    cursor, aceptados, sucursal_id, servicio_id, servicio['precio'], notas_cliente
+                )
+                db_conn.commit()
+
+        resultados = []
+        for sl in slots:
+            reserva_id = ids.get((sl['empleado_id'], sl['inicio']))
+            if sl['motivo'] is None and not solo_validar and reserva_id is None:
+                # Otro usuario tomó el horario entre la validación y el INSERT
+                sl['motivo'] = 'choque'
+            resultados.append({
+                "inicio": sl['inicio'].isoformat(),
+                "fin": sl['fin'].isoformat(),
+                "empleado_id": sl['empleado_id'],
+                "cliente_id": sl['cliente_id'],
+                "estado": "rechazada" if sl['motivo'] else "aceptada",
+                "motivo": sl['motivo'],
+                "conflicto_id": sl['conflicto_id'],
+                "reserva_id": reserva_id,
+                "advertencias": sl['advertencias']
+            })
+
+        creadas = sum(1 for r in resultados if r['reserva_id'])
+        return jsonify({
+            "success": True,
+            "creadas": creadas,
+            "rechazadas": sum(1 for r in resultados if r['estado'] == 'rechazada'),
+            "resultados": resultados
+        }), 201 if creadas else 200
+
+    except Exception as e:
+        db_conn.rollback()
+        current_app.logger.error(f"Error en api_reservas_lote: {e}", exc_info=True)
+        return jsonify({"success": False, "message": f"Error interno: {str(e)}"}), 500
+
+
 @main_bp.route('/reservas/editar/<int:reserva_id>', methods=['POST'])
 @login_required
 def editar_reserva(reserva_id):
@@ -3467,15 +3642,7 @@ def editar_reserva(reserva_id):
             if not esta_en_turno:
                  pass # return jsonify({"success": False, "message": "El nuevo horario está fuera del turno laboral del colaborador."}), 409
 
-            # Validar que no choque con otra reserva (excluyendo la reserva actual)
-            cursor.execute("""
-                SELECT id FROM reservas 
-                WHERE empleado_id = %s AND id != %s AND estado NOT IN ('Cancelada', 'No Asistio', 'Cancelada por Staff') 
-                AND fecha_hora_inicio < %s AND fecha_hora_fin > %s
-            """, (empleado_id, reserva_id, nueva_fecha_fin, fecha_hora_inicio))
-            if cursor.fetchone():
-                current_app.logger.info("Advertencia: Choque horario en edición permitido.")
-                # return jsonify({"success": False, "message": "El nuevo horario entra en conflicto con otra reserva existente."}), 409
+            # Los choques con otras reservas los rechaza la BD (reservas_sin_solape) en el UPDATE
 
             # Validar que no choque con una ausencia
             cursor.execute("SELECT id FROM ausencias_empleado WHERE empleado_id = %s AND aprobado = TRUE AND fecha_hora_inicio < %s AND fecha_hora_fin > %s", (empleado_id, nueva_fecha_fin, fecha_hora_inicio))
@@ -3483,10 +3650,13 @@ def editar_reserva(reserva_id):
                  pass # return jsonify({"success": False, "message": "El nuevo horario coincide con una ausencia registrada."}), 409
 
             # 3. Si todas las validaciones pasan, actualizar la reserva
+            # solape_heredado (choques previos a la migración 0007) se conserva solo si no cambia el horario
             sql_update = """UPDATE reservas SET 
                                 cliente_id = %s, empleado_id = %s, servicio_id = %s, 
                                 fecha_hora_inicio = %s, fecha_hora_fin = %s, 
-                                precio_cobrado = %s, notas_cliente = %s, notas_internas = %s
+                                precio_cobrado = %s, notas_cliente = %s, notas_internas = %s,
+                                solape_heredado = solape_heredado AND empleado_id = %s
+                                                  AND fecha_hora_inicio = %s AND fecha_hora_fin = %s
                             WHERE id = %s"""
             
             precio_final = float(precio_cobrado_str) if precio_cobrado_str else servicio_info['precio']
@@ -3495,9 +3665,13 @@ def editar_reserva(reserva_id):
                 cliente_id, empleado_id, servicio_id,
                 fecha_hora_inicio, nueva_fecha_fin,
                 precio_final, notas_cliente, notas_internas,
+                empleado_id, fecha_hora_inicio, nueva_fecha_fin,
                 reserva_id
             )
-            cursor.execute(sql_update, val_update)
+            try:
+                cursor.execute(sql_update, val_update)
+            except psycopg2.errors.ExclusionViolation:
+                return _respuesta_choque_reserva(db, empleado_id, fecha_hora_inicio, nueva_fecha_fin, reserva_id)
             db.commit()
 
         return jsonify({"success": True, "message": "Reserva actualizada correctamente."})
@@ -3610,34 +3784,29 @@ def reagendar_reserva():
             if fecha_hora_inicio < datetime.now():
                 return jsonify({"success": False, "message": "No se puede mover una reserva a una fecha u hora pasada."}), 409
 
-            # 5. Realizar todas las validaciones comparando fechas "ingenuas"
-            dia_semana_reserva = fecha_hora_inicio.isoweekday()
-            cursor.execute("SELECT hora_inicio, hora_fin FROM horarios_empleado WHERE empleado_id = %s AND dia_semana = %s", (nuevo_colaborador_id, dia_semana_reserva))
-            turnos_del_dia = cursor.fetchall()
-            if not turnos_del_dia:
+            # 5. Validar turno, choques y ausencias con el motor de disponibilidad
+            #    (los choques con otras reservas los rechaza la BD al actualizar)
+            motivos = disponibilidad.conflictos_reserva(
+                cursor, int(nuevo_colaborador_id), fecha_hora_inicio, fecha_hora_fin,
+                excluir_reserva_id=int(reserva_id), incluir_reservas=False
+            )
+            if 'sin_turno' in motivos:
                 return jsonify({"success": False, "message": "El colaborador no trabaja en el día seleccionado."}), 409
-
-            esta_en_turno = False
-            for turno in turnos_del_dia:
-                inicio_turno = timedelta_to_time_obj(turno['hora_inicio'])
-                fin_turno = timedelta_to_time_obj(turno['hora_fin'])
-                if fecha_hora_inicio.time() >= inicio_turno and fecha_hora_fin.time() <= fin_turno:
-                    esta_en_turno = True
-                    break
-            if not esta_en_turno:
+            if 'fuera_de_turno' in motivos:
                  return jsonify({"success": False, "message": "El nuevo horario (inicio o fin) está fuera del turno laboral del colaborador."}), 409
-
-            cursor.execute("SELECT id FROM reservas WHERE empleado_id = %s AND id != %s AND estado NOT IN ('Cancelada', 'No Asistio', 'Cancelada por Staff') AND fecha_hora_inicio < %s AND fecha_hora_fin > %s", (nuevo_colaborador_id, reserva_id, fecha_hora_fin, fecha_hora_inicio))
-            if cursor.fetchone():
-                return jsonify({"success": False, "message": "El nuevo horario entra en conflicto con otra reserva existente."}), 409
-
-            cursor.execute("SELECT id FROM ausencias_empleado WHERE empleado_id = %s AND aprobado = TRUE AND fecha_hora_inicio < %s AND fecha_hora_fin > %s", (nuevo_colaborador_id, fecha_hora_fin, fecha_hora_inicio))
-            if cursor.fetchone():
+            if 'ausencia' in motivos:
                  return jsonify({"success": False, "message": "El nuevo horario coincide con un receso u otra ausencia registrada."}), 409
 
             # 6. Si todo es válido, actualizar la reserva
-            sql_update = "UPDATE reservas SET fecha_hora_inicio = %s, fecha_hora_fin = %s, empleado_id = %s WHERE id = %s"
-            cursor.execute(sql_update, (fecha_hora_inicio, fecha_hora_fin, nuevo_colaborador_id, reserva_id))
+            sql_update = """
+                UPDATE reservas SET fecha_hora_inicio = %s, fecha_hora_fin = %s, empleado_id = %s,
+                       solape_heredado = FALSE
+                WHERE id = %s
+            """
+            try:
+                cursor.execute(sql_update, (fecha_hora_inicio, fecha_hora_fin, nuevo_colaborador_id, reserva_id))
+            except psycopg2.errors.ExclusionViolation:
+                return _respuesta_choque_reserva(db, int(nuevo_colaborador_id), fecha_hora_inicio, fecha_hora_fin, int(reserva_id))
             db.commit()
 
         return jsonify({"success": True, "message": "Reserva reagendada exitosamente."})
@@ -5800,7 +5969,7 @@ def nueva_venta():
             # Esto previene que se registren ventas hoy si el "cierre" de ayer no se completó.
             cursor_val.execute("""
                 SELECT id FROM caja_sesiones 
-                WHERE sucursal_id = %s AND estado = 'Abierta' AND DATE(fecha_apertura) < CURRENT_DATE
+                WHERE sucursal_id = %s AND estado = 'Abierta' AND fecha_apertura < CURRENT_DATE
             """, (sucursal_id,))
             caja_olvidada = cursor_val.fetchone()
 
@@ -5813,6 +5982,7 @@ def nueva_venta():
     
     # --- LÓGICA POST (PROCESAR VENTA) ---
     if request.method == 'POST':
+        inicio_checkout = perf_counter()
         cursor = None
         try:
             # 1. Recoger Datos
@@ -5888,151 +6058,54 @@ def nueva_venta():
                 if not cliente_doc or len(cliente_doc['numero_documento']) != 11:
                     raise ValueError("El cliente debe tener un RUC de 11 dígitos para Factura Electrónica.")
 
-            # 3. Obtener Serie y Número
-            cursor.execute("""
-                SELECT serie, ultimo_numero 
-                FROM series_comprobantes 
-                WHERE sucursal_id = %s AND tipo_comprobante = %s AND activo = TRUE
-                ORDER BY serie DESC LIMIT 1
-            """, (sucursal_id, tipo_comprobante))
-            serie_row = cursor.fetchone()
-            
-            if not serie_row:
-                raise ValueError(f"No hay una serie activa configurada para '{tipo_comprobante}' en esta sucursal.")
-
-            serie_comprobante = serie_row['serie']
-            nuevo_numero = serie_row['ultimo_numero'] + 1
-            numero_comprobante_str = str(nuevo_numero).zfill(8)
-
-            cursor.execute("""
-                UPDATE series_comprobantes SET ultimo_numero = %s 
-                WHERE sucursal_id = %s AND serie = %s
-            """, (nuevo_numero, sucursal_id, serie_comprobante))
-
             # 4. Vincular con Caja Abierta
             cursor.execute("SELECT id FROM caja_sesiones WHERE usuario_id=%s AND estado='Abierta' AND sucursal_id=%s", (current_user.id, sucursal_id))
             row_caja = cursor.fetchone()
             caja_id = row_caja['id'] if row_caja else None
 
-            # 5. Insertar Venta
+            # 5. Insertar Venta (sin número: la serie se numera al final, paso 11)
             sql_venta = """
                 INSERT INTO ventas (
                     sucursal_id, cliente_receptor_id, empleado_id, fecha_venta, 
-                    tipo_comprobante, serie_comprobante, numero_comprobante,
+                    tipo_comprobante,
                     subtotal_servicios, subtotal_productos, descuento_monto, monto_final_venta,
                     estado_pago, campana_id, caja_sesion_id
-                ) VALUES (%s, %s, %s, CURRENT_TIMESTAMP, %s, %s, %s, %s, %s, %s, %s, 'Pagado', %s, %s) RETURNING id """
+                ) VALUES (%s, %s, %s, CURRENT_TIMESTAMP, %s, %s, %s, %s, %s, 'Pagado', %s, %s) RETURNING id """
             
             cursor.execute(sql_venta, (
                 sucursal_id, cliente_receptor_id, empleado_id, tipo_comprobante, 
-                serie_comprobante, numero_comprobante_str, subtotal_servicios, 
-                subtotal_productos, descuento_global, monto_final, campana_id, caja_id
+                subtotal_servicios, subtotal_productos, descuento_global, monto_final, campana_id, caja_id
             ))
             venta_id = cursor.fetchone()['id']
 
-            # 6. Insertar Ítems y Actualizar Stock
-            
+            # 6. Insertar Ítems, Comisiones, Stock y Kardex (en bloque, ver services/venta_detalle.py)
             # (Se eliminó la lógica de % Comisión de Empleado - Ahora es por Producto Fijo)
+            total_fidelidad = venta_detalle.registrar_items(cursor, venta_id, items)  # Acumulador para cubrir con Gasto
+            venta_detalle.descontar_stock(
+                cursor, venta_id, current_user.id, items,
+                f"Venta #{venta_id}"
+            )
+            # Devengo de producción/comisiones del colaborador (ver services/devengos.py)
+            devengos.sincronizar(cursor, [venta_id], 'VENTA')
 
-            sql_item = """
-                INSERT INTO venta_items (venta_id, servicio_id, producto_id, descripcion_item_venta, cantidad, precio_unitario_venta, subtotal_item_bruto, subtotal_item_neto, es_hora_extra, porcentaje_servicio_extra, comision_servicio_extra, entregado_al_colaborador) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, FALSE)
-                RETURNING id
-            """
-            
-            total_fidelidad = 0.0 # Acumulador para cubrir con Gasto
-            
-            for item in items:
-                total_item = float(item['precio']) * float(item['cantidad'])
-                
-                # Detectar Fidelidad
-                desc_fid = 0.0
-                if item.get('loyalty_applied') and item.get('loyalty_pct'):
-                    pct_fid = float(item['loyalty_pct'])
-                    desc_fid = total_item * (pct_fid / 100.0)
-                    total_fidelidad += desc_fid
-                
-                # Cálculo de Comisión Extra (Solo Servicios)
-                es_extra = item.get('es_hora_extra', False)
-                pct_extra = float(item.get('porcentaje_servicio_extra', 0)) if es_extra else 0.00
-                comision_extra = 0.00
-                
-                if es_extra and pct_extra > 0:
-                    comision_extra = total_item * (pct_extra / 100.0)
-
-                cursor.execute(sql_item, (
-                    venta_id, 
-                    item['id'] if item['tipo'] == 'servicio' else None,
-                    item['id'] if item['tipo'] == 'producto' else None,
-                    item['descripcion'], item['cantidad'], item['precio'], 
-                    total_item, total_item,
-                    es_extra,
-                    pct_extra,
-                    comision_extra
-                ))
-                venta_item_id = cursor.fetchone()['id']
-
-                if item['tipo'] == 'producto':
-                    # A. OBTENER DATOS DEL PRODUCTO (Stock y Comisión)
-                    cursor.execute("SELECT stock_actual, comision_vendedor_monto FROM productos WHERE id = %s", (item['id'],))
-                    res_prod = cursor.fetchone()
-                    
-                    if res_prod:
-                        stock_anterior = res_prod['stock_actual']
-                        comision_unitaria = float(res_prod.get('comision_vendedor_monto') or 0.00)
-                        
-                        # B. GENERAR COMISIÓN (Si existe monto)
-                        if comision_unitaria > 0:
-                            total_comision_prod = comision_unitaria * float(item['cantidad'])
-                            cursor.execute("""
-                                INSERT INTO comisiones (venta_item_id, empleado_id, monto_comision, porcentaje, fecha_generacion, estado)
-                                VALUES (%s, %s, %s, 0.00, CURRENT_TIMESTAMP, 'Pendiente')
-                            """, (venta_item_id, empleado_id, total_comision_prod))
-
-                        # C. ACTUALIZAR KARDEX (Stock)
-                        cantidad_salida = float(item['cantidad'])
-                        nuevo_stock = stock_anterior - cantidad_salida
-
-                    cursor.execute("UPDATE productos SET stock_actual = %s WHERE id = %s", (nuevo_stock, item['id']))
-
-                    cursor.execute("""
-                        INSERT INTO kardex (producto_id, tipo_movimiento, cantidad, stock_anterior, stock_actual, motivo, usuario_id, venta_id)
-                        VALUES (%s, 'VENTA', %s, %s, %s, %s, %s, %s)
-                    """, (item['id'], -cantidad_salida, stock_anterior, nuevo_stock, f"Venta {serie_comprobante}-{numero_comprobante_str}", current_user.id, venta_id))
-                    
             # 7. Insertar Pagos
             if not pagos:
                 pagos = [{'metodo': 'Efectivo', 'monto': monto_final, 'referencia': ''}]
             sql_pago = "INSERT INTO venta_pagos (venta_id, metodo_pago, monto, referencia_pago) VALUES (%s, %s, %s, %s)"
             for p in pagos:
-                # 🟢 NUEVO: Lógica de Pago con Monedero (Validation + Deduction)
-                if p['metodo'] == 'Monedero':
-                    monto_a_pagar = float(p['monto'])
-                    if not cliente_id:
-                        raise ValueError("Para pagar con Monedero debe seleccionar un cliente.")
-                    
-                    
-                    # Verificar Saldo Actual
-                    try:
-                        cursor.execute("SELECT saldo_monedero FROM clientes WHERE id = %s", (cliente_id,))
-                        res_saldo = cursor.fetchone()
-                        saldo_actual = float(res_saldo['saldo_monedero'] or 0.00)
-                    except psycopg2.errors.UndefinedColumn:
-                        db_conn.rollback()
-                        raise ValueError("Error de Sistema: La función de Monedero no está disponible (Falta columna en BD). Contacte soporte.")
-
-                    
-                    if saldo_actual < monto_a_pagar:
-                         raise ValueError(f"Saldo insuficiente en Monedero. (Disponible: S/ {saldo_actual:.2f}, Requerido: S/ {monto_a_pagar:.2f})")
-                    
-                    # Descontar saldo
-                    cursor.execute("UPDATE clientes SET saldo_monedero = saldo_monedero - %s WHERE id = %s", (monto_a_pagar, cliente_id))
-                    
-                    # Registrar Historial (Opcional pero recomendado para auditoría)
-                    # cursor.execute("INSERT INTO monedero_historial ...") # Si existiera la tabla
-
                 cursor.execute(sql_pago, (venta_id, p['metodo'], p['monto'], p.get('referencia')))
 
+            # 🟢 Pago con Monedero: un solo débito condicional + movimiento en el libro (ver services/saldos.py)
+            monto_monedero = sum(float(p['monto']) for p in pagos if p['metodo'] == 'Monedero')
+            if monto_monedero > 0:
+                if not cliente_id:
+                    raise ValueError("Para pagar con Monedero debe seleccionar un cliente.")
+                saldos.mover(
+                    cursor, cliente_id, saldos.MONEDERO, -monto_monedero, 'PAGO_VENTA',
+                    venta_id=venta_id, usuario_id=current_user.id,
+                    referencia=f"Venta #{venta_id}"
+                )
+
             # 8. PROPINA
             monto_propina = request.form.get('monto_propina')
             empleado_propina_id = request.form.get('empleado_propina_id')
@@ -6050,10 +6123,10 @@ def nueva_venta():
                         cursor.execute("""
                             INSERT INTO movimientos_caja (tipo, monto, concepto, metodo_pago, usuario_id)
                             VALUES ('INGRESO', %s, %s, %s, %s)
-                        """, (monto_p_float, f"Propina Venta #{serie_comprobante}-{numero_comprobante_str}", metodo_propina, current_user.id))
+                        """, (monto_p_float, f"Propina Venta #{venta_id}", metodo_propina, current_user.id))
                 except ValueError: pass
 
-            # 9. (NUEVO) REGISTRAR GASTO POR FIDELIDAD Y CONSUMIR ITEMS
+            # 9. (NUEVO) REGISTRAR GASTO POR FIDELIDAD (el consumo de ítems va por el outbox, paso 10)
             if total_fidelidad > 0:
                 # A. Registrar Gasto
                 cursor.execute("SELECT id FROM categorias_gastos WHERE nombre = 'Descuento Fidelidad'")
@@ -6068,107 +6141,105 @@ def nueva_venta():
                 cursor.execute("""
                     INSERT INTO gastos (sucursal_id, categoria_gasto_id, caja_sesion_id, fecha, descripcion, monto, metodo_pago, registrado_por_colaborador_id)
                     VALUES (%s, %s, %s, CURRENT_DATE, %s, %s, 'Interno', %s)
-                """, (sucursal_id, cat_id, caja_id, f"Cobertura Fidelidad Venta #{serie_comprobante}-{numero_comprobante_str}", total_fidelidad, current_user.id))
+                """, (sucursal_id, cat_id, caja_id, f"Cobertura Fidelidad Venta #{venta_id}", total_fidelidad, current_user.id))
 
                 # Movimiento de Caja (Reflejando la salida de dinero virtual para cuadrar)
                 cursor.execute("""
                     INSERT INTO movimientos_caja (tipo, monto, concepto, metodo_pago, usuario_id, caja_sesion_id)
                     VALUES ('EGRESO', %s, %s, 'SISTEMA', %s, %s)
-                """, (total_fidelidad, f"Cobertura Fidelidad #{serie_comprobante}-{numero_comprobante_str}", current_user.id, caja_id))
-
-                # B. Consumir Items (Anti-Double-Dip)
-                from .routes_marketing import consumir_items_fidelidad
-                
-                for idx, item in enumerate(items):
-                    if item.get('loyalty_applied') and item.get('loyalty_rule_id'):
-                        rule_id = item['loyalty_rule_id']
-                        group_id = f"SALE_{venta_id}_ITEM_{idx}"
-                        consumir_items_fidelidad(cliente_id, rule_id, group_id)
+                """, (total_fidelidad, f"Cobertura Fidelidad #{venta_id}", current_user.id, caja_id))
 
             # 9.5 (NUEVO) CANJE DE PUNTOS
             puntos_canjeados = int(request.form.get('puntos_canjeados') or 0)
             if puntos_canjeados > 0 and cliente_id:
-                # 1. Validar Saldo (Doble chequeo)
-                cursor.execute("SELECT puntos_fidelidad FROM clientes WHERE id = %s", (cliente_id,))
-                row_pts = cursor.fetchone()
-                saldo_actual = row_pts['puntos_fidelidad'] if row_pts else 0
-                
-                if saldo_actual >= puntos_canjeados:
-                    # 2. Calcular descuento (25 pts = 1 sol)
-                    monto_desc_puntos = puntos_canjeados / 25.0
-                    
-                    # 3. Determinar el Método de Gasto según el pago de la venta
-                    # Si al menos un pago es Efectivo, el canje se considera salida de Efectivo para cuadre
-                    # Si todo es digital, el canje es Interno.
-                    es_pago_efectivo = any(p.get('metodo') == 'Efectivo' for p in pagos)
-                    metodo_gasto = 'Efectivo' if es_pago_efectivo else 'Interno'
-                    metodo_movimiento = 'Efectivo' if es_pago_efectivo else 'SISTEMA'
-
-                    # 4. Registrar Gasto Interno (Para cuadrar caja)
-                    cursor.execute("SELECT id FROM categorias_gastos WHERE nombre = 'Canje Puntos'")
-                    cat_pts = cursor.fetchone()
-                    cat_pts_id = cat_pts['id'] if cat_pts else None
-                    if not cat_pts_id:
-                        cursor.execute("INSERT INTO categorias_gastos (nombre, descripcion) VALUES ('Canje Puntos', 'Redención de Puntos') RETURNING id")
-                        cat_pts_id = cursor.fetchone()['id']
-                    
-                    cursor.execute("""
-                        INSERT INTO gastos (sucursal_id, categoria_gasto_id, caja_sesion_id, fecha, descripcion, monto, metodo_pago, registrado_por_colaborador_id)
-                        VALUES (%s, %s, %s, CURRENT_DATE, %s, %s, %s, %s)
-                    """, (sucursal_id, cat_pts_id, caja_id, f"Canje Puntos Venta #{serie_comprobante}-{numero_comprobante_str}", monto_desc_puntos, metodo_gasto, current_user.id))
+                # 1. Descontar Puntos (débito condicional: si no alcanzan, se cancela la venta)
+                monto_desc_puntos = puntos_canjeados / 25.0  # 25 pts = 1 sol
+                saldos.mover(
+                    cursor, cliente_id, saldos.PUNTOS, -puntos_canjeados, 'CANJE',
+                    venta_id=venta_id, usuario_id=current_user.id,
+                    referencia=f"Canje por S/ {monto_desc_puntos:.2f} en Venta #{venta_id}"
+                )
 
-                    # 5. Registrar Movimiento Egreso
-                    cursor.execute("""
-                        INSERT INTO movimientos_caja (tipo, monto, concepto, metodo_pago, usuario_id, caja_sesion_id)
-                        VALUES ('EGRESO', %s, %s, %s, %s, %s)
-                    """, (monto_desc_puntos, f"Canje Puntos #{serie_comprobante}-{numero_comprobante_str}", metodo_movimiento, current_user.id, caja_id))
-                    
-                    # 5. Descontar Puntos del Cliente
-                    cursor.execute("UPDATE clientes SET puntos_fidelidad = puntos_fidelidad - %s WHERE id = %s", (puntos_canjeados, cliente_id))
-                    
-                    # 6. Historial
-                    cursor.execute("""
-                        INSERT INTO puntos_historial (cliente_id, venta_id, monto_puntos, tipo_transaccion, descripcion)
-                        VALUES (%s, %s, %s, 'CANJE', %s)
-                    """, (cliente_id, venta_id, puntos_canjeados, f"Canje por S/ {monto_desc_puntos:.2f} en Venta #{serie_comprobante}-{numero_comprobante_str}"))
+                # 2. Determinar el Método de Gasto según el pago de la venta
+                # Si al menos un pago es Efectivo, el canje se considera salida de Efectivo para cuadre
+                # Si todo es digital, el canje es Interno.
+                es_pago_efectivo = any(p.get('metodo') == 'Efectivo' for p in pagos)
+                metodo_gasto = 'Efectivo' if es_pago_efectivo else 'Interno'
+                metodo_movimiento = 'Efectivo' if es_pago_efectivo else 'SISTEMA'
+
+                # 3. Registrar Gasto Interno (Para cuadrar caja)
+                cursor.execute("SELECT id FROM categorias_gastos WHERE nombre = 'Canje Puntos'")
+                cat_pts = cursor.fetchone()
+                cat_pts_id = cat_pts['id'] if cat_pts else None
+                if not cat_pts_id:
+                    cursor.execute("INSERT INTO categorias_gastos (nombre, descripcion) VALUES ('Canje Puntos', 'Redención de Puntos') RETURNING id")
+                    cat_pts_id = cursor.fetchone()['id']
 
-            # 10. (NUEVO) ACUMULAR PUNTOS (Solo Servicios - 1 Sol = 1 Punto)
-            if cliente_id:
-                try:
-                    # Calcular Puntos solo sobre SERVICIOS (aplicando descuento proporcional)
-                    monto_servicios_neto = 0
-                    if monto_total_bruto > 0:
-                        factor_neto = monto_final / monto_total_bruto
-                        monto_servicios_neto = subtotal_servicios * factor_neto
-                    
-                    puntos_ganados = int(monto_servicios_neto) 
+                cursor.execute("""
+                    INSERT INTO gastos (sucursal_id, categoria_gasto_id, caja_sesion_id, fecha, descripcion, monto, metodo_pago, registrado_por_colaborador_id)
+                    VALUES (%s, %s, %s, CURRENT_DATE, %s, %s, %s, %s)
+                """, (sucursal_id, cat_pts_id, caja_id, f"Canje Puntos Venta #{venta_id}", monto_desc_puntos, metodo_gasto, current_user.id))
 
-                    if puntos_ganados > 0:
-                        # Actualizar saldo cliente
-                        cursor.execute("UPDATE clientes SET puntos_fidelidad = COALESCE(puntos_fidelidad, 0) + %s WHERE id = %s", (puntos_ganados, cliente_id))
-                        # Registrar historial
-                        cursor.execute("""
-                            INSERT INTO puntos_historial (cliente_id, venta_id, monto_puntos, tipo_transaccion, descripcion)
-                            VALUES (%s, %s, %s, 'ACUMULA', %s)
-                        """, (cliente_id, venta_id, puntos_ganados, f"Puntos por Venta #{serie_comprobante}-{numero_comprobante_str}"))
-                except Exception as e:
-                    db_conn.rollback() # Limpiar estado
-                    print(f"Error acumulando puntos: {e}") 
+                # 4. Registrar Movimiento Egreso
+                cursor.execute("""
+                    INSERT INTO movimientos_caja (tipo, monto, concepto, metodo_pago, usuario_id, caja_sesion_id)
+                    VALUES ('EGRESO', %s, %s, %s, %s, %s)
+                """, (monto_desc_puntos, f"Canje Puntos #{venta_id}", metodo_movimiento, current_user.id, caja_id))
+
+            # 9.6 CONSUMO DE VISITAS DE FIDELIDAD (en la venta, como el canje de puntos:
+            # diferirlo dejaría las mismas visitas disponibles para otra venta)
+            reglas_fidelidad = [
+                (item['loyalty_rule_id'], f"SALE_{venta_id}_ITEM_{idx}")
+                for idx, item in enumerate(items)
+                if item.get('loyalty_applied') and item.get('loyalty_rule_id')
+            ]
+            if cliente_id and reglas_fidelidad:
+                post_venta.consumir_fidelidad(cursor, cliente_id, reglas_fidelidad)
+
+            # 10. EFECTOS POSTERIORES (puntos ganados, reserva)
+            # Se encolan en el outbox dentro de esta transacción y los aplica el
+            # worker (ver services/post_venta.py): la venta no espera por ellos.
+            puntos_ganados = 0
+            if cliente_id and monto_total_bruto > 0:
+                # Puntos solo sobre SERVICIOS (1 Sol = 1 Punto, aplicando descuento proporcional)
+                puntos_ganados = int(subtotal_servicios * (monto_final / monto_total_bruto))
 
-            # 11. (NUEVO) VINCULACIÓN AUTOMÁTICA CON RESERVAS (AGENDA)
             reserva_id_form = request.form.get('reserva_id')
-            if reserva_id_form and reserva_id_form.strip():
-                try:
-                    res_id_int = int(reserva_id_form)
-                    # Cambiar estado a Completada (y opcionalmente vincular el ID de la venta si existiera la columna)
-                    cursor.execute("UPDATE reservas SET estado = 'Completada' WHERE id = %s", (res_id_int,))
-                except Exception as e:
-                    print(f"Error actualizando estado de reserva {reserva_id_form}: {e}")
+            reserva_id_venta = int(reserva_id_form) if reserva_id_form and reserva_id_form.strip().isdigit() else None
+
+            post_venta.encolar_efectos(
+                cursor, venta_id, cliente_id=cliente_id, puntos=puntos_ganados,
+                descripcion=f"Puntos por Venta #{venta_id}",
+                reserva_id=reserva_id_venta,
+                en_linea=current_app.config.get('OUTBOX_EN_LINEA', False)
+            )
+
+            # 11. NÚMERO DEL COMPROBANTE, como última sentencia: la fila de la serie queda
+            # bloqueada solo desde aquí hasta el COMMIT (ver services/correlativos.py)
+            serie_comprobante, nuevo_numero, numero_comprobante_str = correlativos.numerar_venta(
+                cursor, venta_id, sucursal_id, tipo_comprobante
+            )
 
             db_conn.commit()
+            latencias.registrar(
+                'checkout_en_linea' if current_app.config.get('OUTBOX_EN_LINEA') else 'checkout',
+                (perf_counter() - inicio_checkout) * 1000
+            )
             flash(f'Venta registrada: {serie_comprobante}-{numero_comprobante_str}', 'success')
             return redirect(url_for('main.ver_detalle_venta', venta_id=venta_id))
 
+        except psycopg2.errors.UniqueViolation as e:
+            db_conn.rollback()
+            restriccion = e.diag.constraint_name
+            if restriccion == correlativos.INDICE_UNICO:
+                # El último número de la serie quedó por debajo de uno ya emitido
+                current_app.logger.error(f"Correlativo duplicado en nueva_venta: {e}")
+                flash("El correlativo asignado ya fue emitido. Revise el último número de la serie en Configuración > Series.", "danger")
+            else:
+                # p.ej. uq_saldo_mov_venta o la clave del outbox: no es un problema de la serie
+                current_app.logger.error(f"Registro duplicado en nueva_venta ({restriccion}): {e}")
+                flash(f"Error al procesar la venta: registro duplicado ({restriccion}). {e.diag.message_detail or ''}", "danger")
+            return redirect(url_for('main.nueva_venta'))
         except Exception as e:
             if db_conn: db_conn.rollback()
             flash(f"Error al procesar la venta: {e}", "danger")
@@ -6216,84 +6287,22 @@ def nueva_venta():
                     }
                     flash(f"Datos cargados desde la Reserva #{reserva_id}", "info")
 
-            # 1. Clientes
-            try:
-                cursor.execute("""
-                    SELECT id, razon_social_nombres, apellidos, telefono, numero_documento,
-                           TO_CHAR(fecha_nacimiento, 'YYYY-MM-DD') as fecha_nac_str,
-                           cumpleanos_validado, rechazo_dato_cumpleanos,
-                           saldo_monedero
-                    FROM clientes ORDER BY razon_social_nombres
-                """)
-            except psycopg2.errors.UndefinedColumn:
-                # Fallback por si la migración de columna falló
-                db_conn.rollback() # Necesario tras error
-                cursor.execute("""
-                    SELECT id, razon_social_nombres, apellidos, telefono, numero_documento,
-                           TO_CHAR(fecha_nacimiento, 'YYYY-MM-DD') as fecha_nac_str,
-                           cumpleanos_validado, rechazo_dato_cumpleanos,
-                           0.00 as saldo_monedero
-                    FROM clientes ORDER BY razon_social_nombres
-                """)
+            # 1. Clientes: ya no se carga la tabla completa. El selector busca por
+            # prefijo en /api/pos/clientes/buscar y al abrirse muestra estos frecuentes.
+            clientes_frecuentes = [
+                clientes_busqueda.a_resultado(c)
+                for c in clientes_busqueda.frecuentes(cursor, session.get('sucursal_id'))
+            ]
+            if prefill_data and prefill_data.get('cliente_id'):
+                cliente_reserva = clientes_busqueda.por_id(cursor, prefill_data['cliente_id'])
+                if cliente_reserva:
+                    prefill_data['cliente'] = clientes_busqueda.a_resultado(cliente_reserva)
 
-            clientes = cursor.fetchall()
-            
-            # DEBUG: Inspect wallet balance
-            for c in clientes:
-                if c['telefono'] == '983000102':
-                     print(f"DEBUG TARGET CLIENT: {c['razon_social_nombres']} | SALDO DB: {c.get('saldo_monedero')} | Type: {type(c.get('saldo_monedero'))}")
+            # 2-5. Colaboradores, servicios, productos y campañas: ya no se consultan
+            # aquí. La página los pide a /api/pos/catalogo (ETag, casi siempre 304).
 
-            for c in clientes:
-                nombre_full = f"{c['razon_social_nombres']} {c['apellidos'] or ''}".strip()
-                doc = c['numero_documento'] or 'S/D'
-                tel = c['telefono'] or ''
-                c['texto_busqueda'] = f"{nombre_full} | Doc: {doc} | Tel: {tel}"
-
-            # 2. Empleados Activos
-            # 2. Empleados Activos (Filtrados por permiso de Ventas)
-            cursor.execute("SELECT id, nombre_display FROM empleados WHERE activo = TRUE AND realiza_ventas = TRUE ORDER BY nombres")
-            empleados = cursor.fetchall()
-            
-            # 3. Servicios Activos
-            try:
-                cursor.execute("SELECT id, nombre, precio FROM servicios WHERE activo = TRUE ORDER BY orden ASC, nombre ASC")
-                servicios = cursor.fetchall()
-            except Exception:
-                db_conn.rollback()
-                cursor.execute("SELECT id, nombre, precio FROM servicios WHERE activo = TRUE ORDER BY nombre ASC")
-                servicios = cursor.fetchall()
-            
-            # 4. Productos Activos (con Marca)
-            try:
-                cursor.execute("""
-                    SELECT p.id, p.nombre, p.precio_venta, p.stock_actual, m.nombre as marca_nombre
-                    FROM productos p
-                    LEFT JOIN marcas m ON p.marca_id = m.id
-                    WHERE p.activo = TRUE 
-                    ORDER BY p.orden ASC, p.nombre ASC
-                """)
-                productos = cursor.fetchall()
-            except Exception:
-                db_conn.rollback()
-                cursor.execute("""
-                    SELECT p.id, p.nombre, p.precio_venta, p.stock_actual, m.nombre as marca_nombre
-                    FROM productos p
-                    LEFT JOIN marcas m ON p.marca_id = m.id
-                    WHERE p.activo = TRUE 
-                    ORDER BY p.nombre ASC
-                """)
-                productos = cursor.fetchall()
-            
-            # 5. Campañas Vigentes
-            cursor.execute("SELECT id, nombre FROM campanas WHERE activo = TRUE AND CURRENT_DATE BETWEEN fecha_inicio AND fecha_fin")
-            campanas = cursor.fetchall()
-            
             return render_template('ventas/form_venta.html', # Asegúrate que tu archivo se llama así, o 'nueva_venta.html'
-                                   clientes=clientes, 
-                                   empleados=empleados,
-                                   servicios=servicios, 
-                                   productos=productos,
-                                   campanas=campanas, 
+                                   clientes_frecuentes=clientes_frecuentes, 
                                    prefill_data=prefill_data, # <--- IMPORTANTE: Enviamos los datos
                                    hoy=date.today().strftime('%d/%m/%Y'))
                                    
@@ -6446,6 +6455,9 @@ def editar_venta(venta_id):
                     metodo = pago.get('metodo_pago') or 'Efectivo'
                     cursor_update.execute(sql_insert_pago, (venta_id, metodo, float(pago.get('monto', 0)), pago.get('referencia_pago')))
 
+                # 7. Ajustar el devengo de comisiones a los ítems/colaborador/fecha nuevos
+                devengos.sincronizar(cursor_update, [venta_id], 'EDICION')
+
             db_conn.commit()
             flash('Datos de la venta actualizados correctamente.', 'success')
             return redirect(url_for('main.ver_detalle_venta', venta_id=venta_id))
@@ -6585,21 +6597,16 @@ def anular_venta(venta_id):
                     cursor.execute("UPDATE productos SET stock_actual = stock_actual + %s WHERE id = %s", 
                                    (item['cantidad'], item['producto_id']))
 
-            # 3. Revertir puntos de fidelidad si se otorgaron
-            cliente_id_para_puntos = venta.get('cliente_receptor_id')
-            if venta['estado_pago'] == 'Pagado' and cliente_id_para_puntos:
-                monto_base_puntos = float(venta.get('subtotal_servicios', 0.0))
-                puntos_otorgados = math.floor(monto_base_puntos / 10)
-                
-                if puntos_otorgados > 0:
-                    cursor.execute("UPDATE clientes SET puntos_fidelidad = GREATEST(0, puntos_fidelidad - %s) WHERE id = %s",
-                                   (puntos_otorgados, cliente_id_para_puntos))
-                    cursor.execute("INSERT INTO puntos_log (cliente_id, venta_id, puntos_cambio, tipo_transaccion, descripcion) VALUES (%s, %s, %s, 'Reversión por Anulación', %s)",
-                                   (cliente_id_para_puntos, venta_id, -puntos_otorgados, f"Anulación de Venta #{venta_id}"))
+            # 3. Revertir monedero usado, puntos canjeados y puntos ganados (libro de saldos)
+            saldos.revertir_venta(cursor, venta_id, current_user.id)
 
             # 4. Actualizar el estado de la venta a 'Anulado'
             cursor.execute("UPDATE ventas SET estado_proceso = 'Anulada', estado_pago = 'Anulado' WHERE id = %s", (venta_id,))
 
+            # 5. Reversar su devengo de comisiones (lo ya pagado por caja queda como pagado de ventas anuladas)
+            devengos.sincronizar(cursor, [venta_id], 'ANULACION')
+            devengos.anular_pagos(cursor, [venta_id])
+
         # Si el bloque 'with' termina sin errores, se guardan todos los cambios
         db_conn.commit()
         flash(f"Venta #{venta_id} anulada exitosamente. El stock y los puntos han sido revertidos.", "success")
@@ -6817,6 +6824,35 @@ def imprimir_ticket_venta(venta_id):
                            pagos=pagos_actuales)
 
     
+# Listado de ventas paginado por cursor (app/paginacion.py, índices en migración 0016)
+def _where_ventas(filtros):
+    """
+    Condiciones (alias v) y parámetros de los filtros del historial de ventas.
+    Compartido por listar_ventas y sus exportaciones para que bajen exactamente
+    lo mismo que se ve en pantalla. 'Todos' o vacío = sin filtro.
+    """
+    where, params = [], []
+
+    # Rango semiabierto para poder usar el índice de fecha_venta
+    sql_fechas, params_fechas = filtro_rango('v.fecha_venta', filtros.get('fecha_inicio'), filtros.get('fecha_fin'))
+    if sql_fechas:
+        where.append(sql_fechas.removeprefix(' AND '))
+        params.extend(params_fechas)
+
+    for campo in ('estado_pago', 'tipo_comprobante', 'empleado_id'):
+        valor = filtros.get(campo)
+        if valor and valor != 'Todos':
+            where.append(f"v.{campo} = %s")
+            params.append(valor)
+    return where, params
+
+
+LISTADO_VENTAS = paginacion.Listado({
+    'fecha': ('v.fecha_venta', 'desc'),
+    'monto': ('COALESCE(v.monto_final_venta, 0)', 'desc'),
+}, defecto='fecha', clave='v.id')
+
+
 @main_bp.route('/ventas')
 @login_required
 def listar_ventas():
@@ -6827,7 +6863,7 @@ def listar_ventas():
     Muestra una lista de todas las ventas registradas con filtros.
     """
     db_conn = get_db()
-    lista_de_ventas = []
+    pagina = paginacion.Pagina([], LISTADO_VENTAS.defecto, 'desc')
     
     # Obtener filtros de la URL
     fecha_inicio_str = request.args.get('fecha_inicio')
@@ -6863,8 +6899,10 @@ def listar_ventas():
             cursor.execute("SELECT id, nombre_display FROM empleados WHERE activo=TRUE ORDER BY nombre_display")
             lista_de_empleados = cursor.fetchall()
             
-            base_sql = """
-                SELECT 
+            where, params = _where_ventas(filtros)
+            
+            # Una página por cursor; el total es la estimación del planificador (no recorre el rango)
+            pagina = LISTADO_VENTAS.pagina(cursor, """
                     v.id AS venta_id, 
                     v.fecha_venta, 
                     v.monto_final_venta, 
@@ -6875,161 +6913,166 @@ def listar_ventas():
                     v.numero_comprobante,
                     e.nombre_display AS empleado_nombre,
                     COALESCE(CONCAT(c.razon_social_nombres, ' ', c.apellidos), 'Cliente Varios') AS cliente_nombre
-                FROM ventas v
-                JOIN empleados e ON v.empleado_id = e.id
-                LEFT JOIN clientes c ON v.cliente_receptor_id = c.id
-                WHERE 1=1
-            """
-            params = []
-
-            # Filtros Dinámicos
-            if fecha_inicio_str:
-                base_sql += " AND DATE(v.fecha_venta) >= %s"
-                params.append(fecha_inicio_str)
-            
-            if fecha_fin_str:
-                base_sql += " AND DATE(v.fecha_venta) <= %s"
-                params.append(fecha_fin_str)
-
-            if estado_pago and estado_pago != 'Todos':
-                base_sql += " AND v.estado_pago = %s"
-                params.append(estado_pago)
-            
-            if tipo_comprobante and tipo_comprobante != 'Todos':
-                base_sql += " AND v.tipo_comprobante = %s"
-                params.append(tipo_comprobante)
-
-            if empleado_id and empleado_id != 'Todos':
-                base_sql += " AND v.empleado_id = %s"
-                params.append(empleado_id)
-            
-            # Ordenamiento
-            base_sql += " ORDER BY v.fecha_venta DESC"
-
-            # Límite por defecto si no hay filtro de fechas para evitar carga masiva experimental
-            cursor.execute(base_sql, tuple(params))
-            lista_de_ventas = cursor.fetchall()
+                """, """
+                    ventas v
+                    JOIN empleados e ON v.empleado_id = e.id
+                    LEFT JOIN clientes c ON v.cliente_receptor_id = c.id
+                """, where, params, request.args, contar='aproximado')
             
     except Exception as err:
         flash(f"Error al acceder al historial de ventas: {err}", "danger")
         current_app.logger.error(f"Error en listar_ventas: {err}")
         
     return render_template('ventas/lista_ventas.html', 
-                            ventas=lista_de_ventas,
-                            total_ventas=len(lista_de_ventas),
+                            ventas=pagina.filas,
+                            pagina=pagina,
                             empleados=lista_de_empleados,
                             titulo_pagina="Historial de Ventas",
-                            filtros=filtros)
+                            filtros=filtros,
+                            conjuntos_exportacion=EXPORTACION_MASIVA,
+                            parquet_disponible=exportacion.PARQUET_DISPONIBLE)
 
 
 @main_bp.route('/ventas/exportar/excel')
 @login_required
 def exportar_ventas_excel():
     """
-    Exporta el listado de ventas filtrado a Excel.
+    Exporta el listado de ventas filtrado a Excel (en streaming, ver app/exportacion.py).
     """
     if not current_user.can('ver_ventas'):
         return "Acceso Denegado", 403
 
     db_conn = get_db()
     
-    # Obtener filtros (Misma lógica que listar_ventas - Ideal refactorizar a función común)
-    fecha_inicio_str = request.args.get('fecha_inicio')
-    fecha_fin_str = request.args.get('fecha_fin')
-    estado_pago = request.args.get('estado_pago')
-    tipo_comprobante = request.args.get('tipo_comprobante')
-    empleado_id = request.args.get('empleado_id')
-
     try:
-        with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            sql = """
-                SELECT 
-                    v.fecha_venta, 
-                    COALESCE(CONCAT(c.razon_social_nombres, ' ', c.apellidos), 'Cliente Varios') AS cliente,
-                    e.nombre_display AS colaborador,
-                    v.tipo_comprobante,
-                    CONCAT(v.serie_comprobante, '-', v.numero_comprobante) AS numero,
-                    v.monto_final_venta AS monto,
-                    v.estado_pago,
-                    COALESCE(v.estado_sunat, 'Pendiente') as sunat
-                FROM ventas v
-                JOIN empleados e ON v.empleado_id = e.id
-                LEFT JOIN clientes c ON v.cliente_receptor_id = c.id
-                WHERE 1=1
-            """
-            params = []
+        sql = """
+            SELECT 
+                v.fecha_venta, 
+                COALESCE(CONCAT(c.razon_social_nombres, ' ', c.apellidos), 'Cliente Varios') AS cliente,
+                e.nombre_display AS colaborador,
+                v.tipo_comprobante,
+                CONCAT(v.serie_comprobante, '-', v.numero_comprobante) AS numero,
+                v.monto_final_venta AS monto,
+                v.estado_pago,
+                COALESCE(v.estado_sunat, 'Pendiente') as sunat
+            FROM ventas v
+            JOIN empleados e ON v.empleado_id = e.id
+            LEFT JOIN clientes c ON v.cliente_receptor_id = c.id
+            WHERE TRUE
+        """
+        where, params = _where_ventas(request.args)
+        for condicion in where:
+            sql += f" AND {condicion}"
+        sql += " ORDER BY v.fecha_venta DESC, v.id DESC"
+
+        hoja = exportacion.Hoja('Ventas', sql, params, [
+            ('Fecha', 18), ('Cliente', 35), ('Colaborador', 22), ('Tipo', 16),
+            ('Comprobante', 16), ('Total', 12), ('Estado Pago', 14), ('Estado SUNAT', 14)
+        ])
+        ruta, (filas,) = exportacion.escribir_xlsx(db_conn, [hoja])
+
+        if not filas:
+            os.remove(ruta)
+            flash("No hay datos para exportar con los filtros actuales.", "warning")
+            return redirect(url_for('main.listar_ventas'))
 
-            if fecha_inicio_str:
-                sql += " AND DATE(v.fecha_venta) >= %s"
-                params.append(fecha_inicio_str)
-            if fecha_fin_str:
-                sql += " AND DATE(v.fecha_venta) <= %s"
-                params.append(fecha_fin_str)
-            if estado_pago and estado_pago != 'Todos':
-                sql += " AND v.estado_pago = %s"
-                params.append(estado_pago)
-            if tipo_comprobante and tipo_comprobante != 'Todos':
-                sql += " AND v.tipo_comprobante = %s"
-                params.append(tipo_comprobante)
-            if empleado_id and empleado_id != 'Todos':
-                sql += " AND v.empleado_id = %s"
-                params.append(empleado_id)
-            
-            sql += " ORDER BY v.fecha_venta DESC"
-
-            cursor.execute(sql, tuple(params))
-            datos = cursor.fetchall()
-            
-            if not datos:
-                 flash("No hay datos para exportar con los filtros actuales.", "warning")
-                 return redirect(url_for('main.listar_ventas'))
-
-            # Generar DataFrame
-            df = pd.DataFrame(datos)
-            
-            # Renombrar columnas para el Excel
-            df.rename(columns={
-                'fecha_venta': 'Fecha',
-                'cliente': 'Cliente',
-                'colaborador': 'Colaborador',
-                'tipo_comprobante': 'Tipo',
-                'numero': 'Comprobante',
-                'monto': 'Total',
-                'estado_pago': 'Estado Pago',
-                'sunat': 'Estado SUNAT'
-            }, inplace=True)
-
-            # Formatear Fecha
-            # Convertir a datetime si no lo es (psycopg2 suele devolver datetime)
-            # Y luego a string sin zona horaria para Excel
-            if 'Fecha' in df.columns:
-                 df['Fecha'] = df['Fecha'].apply(lambda x: x.strftime('%Y-%m-%d %H:%M') if x else '')
-
-            # Buffer en memoria
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Ventas')
-                
-                # Ajuste de ancho de columnas (Opcional, básico)
-                worksheet = writer.sheets['Ventas']
-                for idx, col in enumerate(df.columns):
-                    max_len = max((df[col].astype(str).map(len).max(), len(str(col)))) + 2
-                    worksheet.column_dimensions[chr(65 + idx)].width = min(max_len, 50) 
-
-            output.seek(0)
-            
-            return send_file(
-                output,
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                as_attachment=True,
-                download_name=f'ventas_export_{date.today()}.xlsx'
-            )
+        return exportacion.respuesta_archivo(ruta, f'ventas_export_{date.today()}.xlsx', exportacion.MIME_XLSX)
 
     except Exception as e:
         flash(f"Error generando Excel: {e}", "danger")
         current_app.logger.error(f"Error exportar Excel: {e}")
         return redirect(url_for('main.listar_ventas'))
 
+# Exportación masiva (contabilidad): CSV por COPY o Parquet, un conjunto por descarga.
+# Ventas, ítems y pagos llevan los filtros del historial (_where_ventas, alias v);
+# gastos y movimientos de caja solo el rango de fechas (no tienen comprobante ni
+# estado de pago). {where} se arma con condiciones fijas y parámetros %s.
+_VENTAS_FILTRADAS = "ventas v JOIN empleados e ON v.empleado_id = e.id"
+EXPORTACION_MASIVA = {
+    'ventas': (f"""
+        SELECT v.id, v.fecha_venta, v.sucursal_id, v.caja_sesion_id, v.empleado_id, e.nombre_display AS colaborador,
+               v.cliente_receptor_id, v.tipo_comprobante, v.serie_comprobante, v.numero_comprobante,
+               v.subtotal_servicios, v.subtotal_productos, v.descuento_monto, v.monto_impuestos,
+               v.monto_final_venta, v.estado_pago, v.estado_sunat
+        FROM {_VENTAS_FILTRADAS}
+        WHERE {{where}}
+        ORDER BY v.fecha_venta, v.id
+    """, None),
+    'venta_items': (f"""
+        SELECT vi.id, vi.venta_id, v.fecha_venta, vi.servicio_id, vi.producto_id, vi.descripcion_item_venta,
+               vi.cantidad, vi.precio_unitario_venta, vi.subtotal_item_bruto, vi.subtotal_item_neto,
+               vi.es_hora_extra, vi.porcentaje_servicio_extra, vi.comision_servicio_extra, vi.usado_como_beneficio
+        FROM venta_items vi JOIN {_VENTAS_FILTRADAS} ON vi.venta_id = v.id
+        WHERE {{where}}
+        ORDER BY v.fecha_venta, vi.venta_id, vi.id
+    """, None),
+    'venta_pagos': (f"""
+        SELECT vp.id, vp.venta_id, v.fecha_venta, vp.fecha_pago, vp.metodo_pago, vp.monto, vp.referencia_pago
+        FROM venta_pagos vp JOIN {_VENTAS_FILTRADAS} ON vp.venta_id = v.id
+        WHERE {{where}}
+        ORDER BY v.fecha_venta, vp.venta_id, vp.id
+    """, None),
+    'gastos': ("""
+        SELECT g.id, g.fecha, g.fecha_registro, g.sucursal_id, g.caja_sesion_id, cg.nombre AS categoria,
+               g.descripcion, g.monto, g.metodo_pago, g.estado_confirmacion,
+               g.empleado_beneficiario_id, g.registrado_por_colaborador_id
+        FROM gastos g
+        LEFT JOIN categorias_gastos cg ON g.categoria_gasto_id = cg.id
+        WHERE {where}
+        ORDER BY g.fecha, g.id
+    """, 'g.fecha'),
+    'movimientos_caja': ("""
+        SELECT mc.id, mc.fecha, mc.caja_sesion_id, mc.tipo, mc.monto, mc.concepto, mc.metodo_pago, mc.usuario_id
+        FROM movimientos_caja mc
+        WHERE {where}
+        ORDER BY mc.fecha, mc.id
+    """, 'mc.fecha'),
+}
+
+
+@main_bp.route('/ventas/exportar/masivo/<conjunto>')
+@login_required
+def exportar_ventas_masivo(conjunto):
+    """
+    Descarga completa de un conjunto con los filtros del historial de ventas.
+    ?formato=csv (COPY en streaming, por defecto) o parquet (si hay pyarrow).
+    """
+    if conjunto not in EXPORTACION_MASIVA:
+        return "Conjunto no válido", 404
+    if not current_user.can('ver_ventas'):
+        return "Acceso Denegado", 403
+    if conjunto in ('gastos', 'movimientos_caja') and not current_user.can('ver_finanzas'):
+        return "Acceso Denegado", 403
+
+    formato = request.args.get('formato', 'csv')
+    if formato == 'parquet' and not exportacion.PARQUET_DISPONIBLE:
+        flash("La exportación a Parquet no está disponible en este servidor (falta pyarrow).", "warning")
+        return redirect(url_for('main.listar_ventas', **request.args))
+    if formato not in ('csv', 'parquet'):
+        return "Formato no válido", 400
+
+    plantilla, columna_fecha = EXPORTACION_MASIVA[conjunto]
+    if columna_fecha:
+        sql_fechas, params = filtro_rango(columna_fecha, request.args.get('fecha_inicio'), request.args.get('fecha_fin'))
+        where = [sql_fechas.removeprefix(' AND ')] if sql_fechas else []
+    else:
+        where, params = _where_ventas(request.args)
+    sql = plantilla.format(where=' AND '.join(where) or 'TRUE')
+
+    rango = '_'.join(filter(None, (request.args.get('fecha_inicio'), request.args.get('fecha_fin')))) or date.today().isoformat()
+    nombre = f"{conjunto}_{rango}.{formato}"
+    db_conn = get_db()
+    try:
+        if formato == 'parquet':
+            ruta, _ = exportacion.escribir_parquet(db_conn, sql, params)
+            return exportacion.respuesta_archivo(ruta, nombre, exportacion.MIME_PARQUET)
+        return exportacion.respuesta_csv(db_conn, sql, params, nombre)
+    except Exception as e:
+        db_conn.rollback()
+        flash(f"Error en la exportación: {e}", "danger")
+        current_app.logger.error(f"Error exportar_ventas_masivo ({conjunto}, {formato}): {e}")
+        return redirect(url_for('main.listar_ventas', **request.args))
+
 @main_bp.route('/ventas/eliminar/<int:venta_id>', methods=['POST'])
 @login_required
 @admin_required
@@ -7041,8 +7084,8 @@ def eliminar_venta_nota_venta(venta_id):
     db_conn = get_db()
     try:
         with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            # 1. Verificar que sea Nota de Venta
-            cursor.execute("SELECT tipo_comprobante FROM ventas WHERE id = %s", (venta_id,))
+            # 1. Verificar que sea Nota de Venta (FOR UPDATE: el outbox espera antes de acumular puntos)
+            cursor.execute("SELECT tipo_comprobante FROM ventas WHERE id = %s FOR UPDATE", (venta_id,))
             venta = cursor.fetchone()
             
             if not venta:
@@ -7053,6 +7096,11 @@ def eliminar_venta_nota_venta(venta_id):
                 flash("Solo se pueden eliminar Notas de Venta.", "danger")
                 return redirect(url_for('main.listar_ventas'))
 
+            # Con comisiones ya pagadas por caja se anula (queda el registro de lo pagado), no se elimina
+            if devengos.ventas_con_pagos(cursor, [venta_id]):
+                flash("Esta venta tiene comisiones ya pagadas desde caja: anúlela en lugar de eliminarla.", "warning")
+                return redirect(url_for('main.ver_detalle_venta', venta_id=venta_id))
+
             # 2. Revertir Stock de Productos 
             # Primero obtenemos los items para saber qué devolver
             cursor.execute("SELECT producto_id, cantidad FROM venta_items WHERE venta_id = %s", (venta_id,))
@@ -7071,6 +7119,13 @@ def eliminar_venta_nota_venta(venta_id):
             # 4. Eliminar items y pagos
             cursor.execute("DELETE FROM venta_items WHERE venta_id = %s", (venta_id,))
             cursor.execute("DELETE FROM venta_pagos WHERE venta_id = %s", (venta_id,))
+
+            # Reversar su devengo de comisiones (ya sin ítems, el objetivo es 0)
+            devengos.sincronizar(cursor, [venta_id], 'ELIMINACION')
+
+            # Devolver monedero y puntos canjeados y retirar los ganados (libro de saldos;
+            # los movimientos quedan con el venta_id de la venta eliminada, migración 0020)
+            saldos.revertir_venta(cursor, venta_id, current_user.id)
             
             # 5. Finalmente eliminar la venta
             cursor.execute("DELETE FROM ventas WHERE id = %s", (venta_id,))
@@ -7163,6 +7218,7 @@ def nueva_sucursal():
             
             cursor_insert.execute(sql, val)
             db.commit()
+            cache_configuracion.invalidar(db, 'sucursales')
             flash(f'Sucursal "{nombre}" registrada exitosamente!', 'success')
             return redirect(url_for('main.listar_sucursales'))
         except Exception as err:
@@ -7289,6 +7345,7 @@ def editar_sucursal(sucursal_id):
                               sucursal_id)
                 cursor.execute(sql_update, val_update)
                 db_conn.commit()
+                cache_configuracion.invalidar(db_conn, 'sucursales', f'sucursal:{sucursal_id}')
                 flash(f'Sucursal "{nombre_nuevo}" actualizada exitosamente!', 'success')
                 return redirect(url_for('main.listar_sucursales'))
             except Exception as err_upd:
@@ -7342,6 +7399,7 @@ def toggle_activo_sucursal(sucursal_id):
         # Actualizar el estado en la base de datos
         cursor.execute("UPDATE sucursales SET activo = %s WHERE id = %s", (nuevo_estado_activo, sucursal_id))
         db_conn.commit()
+        cache_configuracion.invalidar(db_conn, 'sucursales', f'sucursal:{sucursal_id}')
         
         mensaje_estado = "activada" if nuevo_estado_activo else "desactivada"
         flash(f'La sucursal "{sucursal_actual["nombre"]}" ha sido {mensaje_estado} exitosamente.', 'success')
@@ -7390,6 +7448,32 @@ def listar_series():
                            series=lista_de_series,
                            titulo_pagina="Series y Correlativos")
 
+
+@main_bp.route('/api/series/<int:serie_id>/huecos')
+@login_required
+@admin_required
+def api_huecos_serie(serie_id):
+    """
+    Números de la serie (1..ultimo_numero) sin venta asociada, agrupados en rangos.
+    Sirve para auditar ajustes manuales del correlativo antes de reportar a SUNAT.
+    """
+    try:
+        db = get_db()
+        with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            cursor.execute("SELECT id, tipo_comprobante, serie, ultimo_numero FROM series_comprobantes WHERE id = %s", (serie_id,))
+            serie = cursor.fetchone()
+            if not serie:
+                return jsonify({"error": "Serie no encontrada."}), 404
+            huecos = correlativos.huecos_serie(cursor, serie_id)
+        return jsonify({
+            "serie": serie,
+            "total_faltantes": sum(h['cantidad'] for h in huecos),
+            "huecos": huecos
+        })
+    except Exception as err:
+        current_app.logger.error(f"Error en api_huecos_serie ({serie_id}): {err}")
+        return jsonify({"error": "Error interno al calcular los huecos de la serie."}), 500
+
 @main_bp.route('/configuracion/series/nueva', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -7562,6 +7646,18 @@ def editar_serie(serie_id):
         except (ValueError, TypeError):
             errores.append("El último número debe ser un número entero.")
         
+        # El correlativo no puede bajar de un número ya emitido (uq_ventas_correlativo_sucursal)
+        if not errores:
+            try:
+                with db_conn.cursor() as cursor_max:
+                    maximo = correlativos.numero_maximo_emitido(cursor_max, sucursal_id, tipo_comprobante, serie_nueva)
+                if ultimo_numero < maximo:
+                    errores.append(f"El último número no puede ser menor que {maximo}, que ya fue emitido en esta serie.")
+            except Exception as err_max:
+                db_conn.rollback()
+                current_app.logger.error(f"Error DB verificando correlativo de serie: {err_max}")
+                errores.append("Error al verificar el último número emitido.")
+
         # Validar unicidad de la combinación (sucursal, tipo, serie) si ha cambiado
         if (sucursal_id != serie_actual.get('sucursal_id') or 
             tipo_comprobante != serie_actual.get('tipo_comprobante') or 
@@ -7897,6 +7993,13 @@ def eliminar_categoria_gasto(categoria_id):
 
     return redirect(url_for('main.listar_categorias_gastos'))
 
+# Historial de gastos por cursor (app/paginacion.py, índices en migración 0016)
+LISTADO_GASTOS = paginacion.Listado({
+    'fecha': ('g.fecha', 'desc'),
+    'monto': ('COALESCE(g.monto, 0)', 'desc'),
+}, defecto='fecha', clave='g.id')
+
+
 @main_bp.route('/finanzas/gastos')
 @login_required
 def listar_gastos():
@@ -7915,7 +8018,7 @@ def listar_gastos():
         db = get_db()
         cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
-        where_clauses = ["TRUE"]
+        where_clauses = []
         params = []
         
         if fecha_inicio:
@@ -7931,29 +8034,28 @@ def listar_gastos():
             where_clauses.append("g.categoria_gasto_id = %s")
             params.append(categoria_id)
             
-        where_sql = " AND ".join(where_clauses)
-        
-        # Unimos con otras tablas para obtener nombres en lugar de solo IDs
-        sql = f"""
-            SELECT 
+        # Unimos con otras tablas para obtener nombres en lugar de solo IDs (una página por cursor)
+        pagina = LISTADO_GASTOS.pagina(cursor, """
                 g.id, g.fecha, g.descripcion, g.monto, g.metodo_pago,
                 s.nombre AS sucursal_nombre,
                 cg.nombre AS categoria_nombre,
                 CONCAT(e.nombres, ' ', e.apellidos) AS colaborador_nombre,
                 CONCAT(eb.nombres, ' ', eb.apellidos) AS beneficiario_nombre
-            FROM gastos g
-            JOIN sucursales s ON g.sucursal_id = s.id
-            JOIN categorias_gastos cg ON g.categoria_gasto_id = cg.id
-            JOIN empleados e ON g.registrado_por_colaborador_id = e.id
-            LEFT JOIN empleados eb ON g.empleado_beneficiario_id = eb.id
-            WHERE {where_sql}
-            ORDER BY g.fecha DESC, g.id DESC
-        """
-        cursor.execute(sql, params)
-        lista_de_gastos = cursor.fetchall()
-        
-        # Calcular el total para la vista
-        total_gastos = sum(float(g['monto']) for g in lista_de_gastos) if lista_de_gastos else 0.0
+            """, """
+                gastos g
+                JOIN sucursales s ON g.sucursal_id = s.id
+                JOIN categorias_gastos cg ON g.categoria_gasto_id = cg.id
+                JOIN empleados e ON g.registrado_por_colaborador_id = e.id
+                LEFT JOIN empleados eb ON g.empleado_beneficiario_id = eb.id
+            """, where_clauses, params, request.args, contar='exacto')
+        lista_de_gastos = pagina.filas
+        
+        # Total de todos los gastos del filtro (no solo de la página)
+        cursor.execute(f"""
+            SELECT COALESCE(SUM(g.monto), 0) AS total FROM gastos g
+            WHERE {' AND '.join(where_clauses) or 'TRUE'}
+        """, params)
+        total_gastos = float(cursor.fetchone()['total'])
 
         # Maestros para los filtros
         cursor.execute("SELECT id, nombre FROM categorias_gastos ORDER BY nombre")
@@ -7966,16 +8068,18 @@ def listar_gastos():
         flash(f"Error al acceder a los gastos: {err}", "danger")
         current_app.logger.error(f"Error en listar_gastos: {err}")
         lista_de_gastos = []
+        pagina = paginacion.Pagina([], LISTADO_GASTOS.defecto, 'desc')
         total_gastos = 0.0
         categorias = []
         colaboradores = []
         
     return render_template('finanzas/lista_gastos.html', 
                            gastos=lista_de_gastos,
+                           pagina=pagina,
                            total_gastos=total_gastos,
                            categorias_matriz=categorias,
                            colaboradores_matriz=colaboradores,
-                           filtros=request.args,
+                           filtros={k: v for k, v in request.args.items() if k not in ('sort', 'order', 'cursor')},
                            titulo_pagina="Historial de Gastos")
 
 @main_bp.route('/finanzas/gastos/exportar')
@@ -7990,9 +8094,6 @@ def exportar_gastos_excel():
     categoria_id = request.args.get('categoria_id')
 
     try:
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
         where_clauses = ["TRUE"]
         params = []
         
@@ -8029,31 +8130,19 @@ def exportar_gastos_excel():
             WHERE {where_sql}
             ORDER BY g.fecha DESC, g.id DESC
         """
-        cursor.execute(sql, params)
-        data = cursor.fetchall()
-        cursor.close()
-        
-        if not data:
+        hoja = exportacion.Hoja('Gastos', sql, params, [
+            ('Fecha', 12), ('Categoría', 22), ('Descripción', 40), ('Monto', 12),
+            ('Método Pago', 14), ('Sucursal', 18), ('Beneficiario', 28), ('Registrado por', 28)
+        ])
+        ruta, (filas,) = exportacion.escribir_xlsx(get_db(), [hoja])
+
+        if not filas:
+            os.remove(ruta)
             flash("No hay datos para exportar con los filtros seleccionados.", "warning")
             return redirect(url_for('main.listar_gastos', **request.args))
 
-        import pandas as pd
-        import io
-        from flask import send_file
-        
-        df = pd.DataFrame(data)
-            
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Gastos')
-            
-        output.seek(0)
-        
-        return send_file(
-            output,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            as_attachment=True,
-            download_name=f"reporte_gastos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        return exportacion.respuesta_archivo(
+            ruta, f"reporte_gastos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx", exportacion.MIME_XLSX
         )
         
     except Exception as e:
@@ -8099,7 +8188,7 @@ def nuevo_gasto():
             # 2. Verificar si hay cajas de días anteriores sin cerrar (de cualquier usuario en esta sucursal)
             cursor_val.execute("""
                 SELECT id FROM caja_sesiones 
-                WHERE sucursal_id = %s AND estado = 'Abierta' AND DATE(fecha_apertura) < CURRENT_DATE
+                WHERE sucursal_id = %s AND estado = 'Abierta' AND fecha_apertura < CURRENT_DATE
             """, (sucursal_id,))
             caja_olvidada = cursor_val.fetchone()
 
@@ -8606,6 +8695,10 @@ def nueva_compra():
                            marcas_todas=marcas_todas)
 
 
+# Historial de compras por cursor (app/paginacion.py, índices en migración 0016)
+LISTADO_COMPRAS = paginacion.Listado({'fecha': ('c.fecha_compra', 'desc')}, defecto='fecha', clave='c.id')
+
+
 @main_bp.route('/compras')
 @login_required
 @admin_required
@@ -8615,13 +8708,12 @@ def listar_compras():
     """
     db_conn = get_db()
     cursor = None
-    lista_de_compras = []
+    pagina = paginacion.Pagina([], LISTADO_COMPRAS.defecto, 'desc')
 
     try:
         cursor = db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        # Unimos con proveedores y sucursales para obtener sus nombres
-        sql = """
-            SELECT 
+        # Unimos con proveedores y sucursales para obtener sus nombres (una página por cursor)
+        pagina = LISTADO_COMPRAS.pagina(cursor, """
                 c.id AS compra_id,
                 c.fecha_compra,
                 c.monto_total,
@@ -8630,14 +8722,11 @@ def listar_compras():
                 c.serie_numero_comprobante,
                 p.nombre_empresa AS proveedor_nombre,
                 s.nombre AS sucursal_nombre
-            FROM compras c
-            JOIN proveedores p ON c.proveedor_id = p.id
-            JOIN sucursales s ON c.sucursal_id = s.id
-            ORDER BY c.fecha_compra DESC, c.id DESC
-        """
-        
-        cursor.execute(sql)
-        lista_de_compras = cursor.fetchall()
+            """, """
+                compras c
+                JOIN proveedores p ON c.proveedor_id = p.id
+                JOIN sucursales s ON c.sucursal_id = s.id
+            """, args=request.args, contar='aproximado')
     except Exception as err:
         flash(f"Error al acceder al historial de compras: {err}", "danger")
         current_app.logger.error(f"Error en listar_compras: {err}")
@@ -8646,7 +8735,8 @@ def listar_compras():
             cursor.close()
             
     return render_template('compras/lista_compras.html', 
-                           compras=lista_de_compras,
+                           compras=pagina.filas,
+                           pagina=pagina,
                            titulo_pagina="Historial de Compras")
 
 @main_bp.route('/compras/detalle/<int:compra_id>')
@@ -8751,7 +8841,7 @@ def gestionar_caja():
                     # 2. Validar si hay cajas de días anteriores abiertas en esta sucursal
                     cursor.execute("""
                         SELECT id FROM caja_sesiones 
-                        WHERE sucursal_id = %s AND estado = 'Abierta' AND DATE(fecha_apertura) < CURRENT_DATE
+                        WHERE sucursal_id = %s AND estado = 'Abierta' AND fecha_apertura < CURRENT_DATE
                     """, (sucursal_id,))
                     
                     if cursor.fetchone():
@@ -8791,7 +8881,7 @@ def gestionar_caja():
                     JOIN empleados e ON cs.usuario_id = e.id
                     WHERE cs.sucursal_id = %s 
                       AND cs.estado = 'Abierta' 
-                      AND DATE(cs.fecha_apertura) < CURRENT_DATE
+                      AND cs.fecha_apertura < CURRENT_DATE
                     ORDER BY cs.fecha_apertura ASC
                 """, (sucursal_id,))
                 cajas_olvidadas = cursor.fetchall()
@@ -8946,11 +9036,14 @@ def gestionar_caja():
                 JOIN empleados e ON v.empleado_id = e.id
                 WHERE vi.es_hora_extra = TRUE 
                   AND vi.entregado_al_colaborador = FALSE 
-                  AND v.estado != 'Anulada'
+                  AND COALESCE(v.estado_pago, '') <> 'Anulado'
                 ORDER BY v.fecha_venta DESC
             """)
             extras_pendientes = cursor.fetchall()
 
+            # --- RESUMEN POR COLABORADOR (del resumen diario de devengos) ---
+            resumen_comisiones = devengos.pendientes_por_colaborador(cursor, sucursal_id)
+
             # --- 🟢 TAMBIÉN FALTABA ESTO: EMPLEADOS (Para el modal) ---
             cursor.execute("SELECT id, nombre_display FROM empleados WHERE activo = TRUE")
             empleados = cursor.fetchall()
@@ -8965,6 +9058,7 @@ def gestionar_caja():
                                    comisiones_pendientes=comisiones,
                                    propinas_pendientes=propinas_pendientes, # <--- Enviamos la lista
                                    extras_pendientes=extras_pendientes, # <--- NEW
+                                   resumen_comisiones=resumen_comisiones,
                                    empleados=empleados) # <--- Enviamos empleados
 
     except Exception as e:
@@ -9097,7 +9191,7 @@ def abrir_caja():
             # --- NUEVA VALIDACIÓN: REVISAR CAJAS ANTERIORES ABIERTAS ---
             cursor.execute("""
                 SELECT id FROM caja_sesiones 
-                WHERE sucursal_id = %s AND estado = 'Abierta' AND DATE(fecha_apertura) < CURRENT_DATE
+                WHERE sucursal_id = %s AND estado = 'Abierta' AND fecha_apertura < CURRENT_DATE
             """, (sucursal_id,))
             if cursor.fetchone():
                 flash("No se puede abrir una nueva caja: Existen sesiones de días anteriores pendientes de cierre.", "danger")
@@ -9124,10 +9218,14 @@ def abrir_caja():
 # -------------------------------------------------------------------------
 # HISTORIAL DE CAJA Y CONFIRMACIÓN
 # -------------------------------------------------------------------------
+# Historial de sesiones de caja por cursor (app/paginacion.py, índices en migración 0016)
+LISTADO_CAJAS = paginacion.Listado({'apertura': ('cs.fecha_apertura', 'desc')}, defecto='apertura', clave='cs.id')
+
+
 @main_bp.route('/finanzas/caja/historial')
 @login_required
 def listar_historial_caja():
-    """Muestra la lista de todas las sesiones de caja pasadas."""
+    """Muestra la lista de todas las sesiones de caja pasadas (paginada por cursor)."""
     db_conn = get_db()
     sucursal_id = session.get('sucursal_id')
     
@@ -9143,44 +9241,28 @@ def listar_historial_caja():
             
             if es_admin_global:
                 # Consulta GLOBAL (sin filtro de sucursal)
-                sql = """
-                    SELECT cs.*, 
-                           e.nombre_display as cajero_nombre,
-                           s.nombre as sucursal_nombre, -- Agregamos el nombre de la sede
-                           TO_CHAR(cs.fecha_apertura, 'DD/MM/YYYY HH24:MI') as inicio_fmt,
-                           TO_CHAR(cs.fecha_cierre, 'DD/MM/YYYY HH24:MI') as fin_fmt
-                    FROM caja_sesiones cs
-                    JOIN empleados e ON cs.usuario_id = e.id
-                    LEFT JOIN sucursales s ON cs.sucursal_id = s.id
-                    ORDER BY cs.fecha_apertura DESC
-                    LIMIT 100
-                """
-                cursor.execute(sql)
-            
+                where, params = [], []
             elif sucursal_id:
                 # Consulta FILTRADA por sucursal
-                sql = """
-                    SELECT cs.*, 
-                           e.nombre_display as cajero_nombre,
-                           s.nombre as sucursal_nombre,
-                           TO_CHAR(cs.fecha_apertura, 'DD/MM/YYYY HH24:MI') as inicio_fmt,
-                           TO_CHAR(cs.fecha_cierre, 'DD/MM/YYYY HH24:MI') as fin_fmt
-                    FROM caja_sesiones cs
-                    JOIN empleados e ON cs.usuario_id = e.id
-                    LEFT JOIN sucursales s ON cs.sucursal_id = s.id
-                    WHERE cs.sucursal_id = %s
-                    ORDER BY cs.fecha_apertura DESC
-                    LIMIT 50
-                """
-                cursor.execute(sql, (sucursal_id,))
+                where, params = ["cs.sucursal_id = %s"], [sucursal_id]
             else:
                 # Si no es admin y no tiene sucursal, no ve nada
                 flash("Selecciona una sucursal para ver el historial.", "warning")
                 return redirect(url_for('main.index'))
 
-            sesiones = cursor.fetchall()
+            pagina = LISTADO_CAJAS.pagina(cursor, """
+                    cs.*, 
+                    e.nombre_display as cajero_nombre,
+                    s.nombre as sucursal_nombre,
+                    TO_CHAR(cs.fecha_apertura, 'DD/MM/YYYY HH24:MI') as inicio_fmt,
+                    TO_CHAR(cs.fecha_cierre, 'DD/MM/YYYY HH24:MI') as fin_fmt
+                """, """
+                    caja_sesiones cs
+                    JOIN empleados e ON cs.usuario_id = e.id
+                    LEFT JOIN sucursales s ON cs.sucursal_id = s.id
+                """, where, params, request.args)
             
-        return render_template('caja/historial.html', sesiones=sesiones)
+        return render_template('caja/historial.html', sesiones=pagina.filas, pagina=pagina)
         
     except Exception as e:
         flash(f"Error al cargar historial: {e}", "danger")
@@ -9212,7 +9294,7 @@ def pagar_comision_caja(comision_id):
                 return redirect(url_for('main.gestionar_caja', sucursal_id=sucursal_id))
 
             # 2. Obtener datos de la comisión
-            cursor.execute("SELECT monto_comision, empleado_id FROM comisiones WHERE id = %s", (comision_id,))
+            cursor.execute("SELECT monto_comision, empleado_id, venta_item_id FROM comisiones WHERE id = %s", (comision_id,))
             comision = cursor.fetchone()
 
             # 3. Registrar el GASTO en la caja (Salida de dinero)
@@ -9234,8 +9316,11 @@ def pagar_comision_caja(comision_id):
             cursor.execute("""
                 UPDATE comisiones 
                 SET estado = 'Pagada', fecha_pago = CURRENT_TIMESTAMP, pago_caja_sesion_id = %s 
-                WHERE id = %s
+                WHERE id = %s AND estado <> 'Pagada'
             """, (caja['id'], comision_id))
+            # Resumen de devengos: solo si este request fue el que la pagó
+            if cursor.rowcount:
+                devengos.registrar_pago(cursor, comision['venta_item_id'], comision['monto_comision'])
 
             db_conn.commit()
             flash(f"Comisión de S/ {comision['monto_comision']} pagada correctamente.", "success")
@@ -9286,7 +9371,9 @@ def pagar_extra_caja(item_id):
             """, (sucursal_id, cat_id, caja['id'], f"Pago Extra: {item['descripcion_item_venta']}", monto, current_user.id))
 
             # 4. Actualizar estado
-            cursor.execute("UPDATE venta_items SET entregado_al_colaborador = TRUE WHERE id = %s", (item_id,))
+            cursor.execute("UPDATE venta_items SET entregado_al_colaborador = TRUE WHERE id = %s AND entregado_al_colaborador = FALSE", (item_id,))
+            if cursor.rowcount:
+                devengos.registrar_pago(cursor, item_id, monto)
             
             db_conn.commit()
             flash(f"Pago de extra (S/ {monto:.2f}) registrado.", "success")
@@ -9374,9 +9461,9 @@ def reporte_estado_resultados():
                         SUM(subtotal_servicios) as total_servicios, 
                         SUM(subtotal_productos) as total_productos
                     FROM ventas 
-                    WHERE sucursal_id = %s AND DATE(fecha_venta) BETWEEN %s AND %s AND estado_pago != 'Anulado'
+                    WHERE sucursal_id = %s AND fecha_venta >= %s AND fecha_venta < %s AND estado_pago != 'Anulado'
                 """
-                cursor.execute(sql_ingresos, (sucursal_id, fecha_inicio, fecha_fin))
+                cursor.execute(sql_ingresos, (sucursal_id, *rango_fechas(fecha_inicio, fecha_fin)))
                 ingresos = cursor.fetchone()
                 
                 # 2. Calcular Gastos por categoría
@@ -9576,6 +9663,7 @@ def reporte_produccion():
     resultados = None
     if colaborador_id and sucursal_id and fecha_inicio and fecha_fin:
         try:
+            desde_ts, hasta_ts = rango_fechas(fecha_inicio, fecha_fin)
             with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
                 # Consulta para el detalle de SERVICIOS
                 sql_servicios = """
@@ -9593,12 +9681,12 @@ def reporte_produccion():
                     JOIN servicios s ON vi.servicio_id = s.id
                     LEFT JOIN clientes cl ON v.cliente_receptor_id = cl.id
                     LEFT JOIN campanas ca ON v.campana_id = ca.id
-                    WHERE v.empleado_id = %s AND v.sucursal_id = %s AND DATE(v.fecha_venta) BETWEEN %s AND %s
+                    WHERE v.empleado_id = %s AND v.sucursal_id = %s AND v.fecha_venta >= %s AND v.fecha_venta < %s
                       AND v.estado_pago != 'Anulado'
                       AND vi.servicio_id IS NOT NULL
                     ORDER BY v.fecha_venta DESC
                 """
-                cursor.execute(sql_servicios, (colaborador_id, sucursal_id, fecha_inicio, fecha_fin))
+                cursor.execute(sql_servicios, (colaborador_id, sucursal_id, desde_ts, hasta_ts))
                 servicios_vendidos = cursor.fetchall()
 
                 # Consulta para el detalle de PRODUCTOS
@@ -9619,12 +9707,12 @@ def reporte_produccion():
                     LEFT JOIN clientes cl ON v.cliente_receptor_id = cl.id
                     LEFT JOIN marcas m ON p.marca_id = m.id
                     LEFT JOIN comisiones com ON com.venta_item_id = vi.id
-                    WHERE v.empleado_id = %s AND v.sucursal_id = %s AND DATE(v.fecha_venta) BETWEEN %s AND %s
+                    WHERE v.empleado_id = %s AND v.sucursal_id = %s AND v.fecha_venta >= %s AND v.fecha_venta < %s
                       AND v.estado_pago != 'Anulado'
                       AND vi.producto_id IS NOT NULL
                     ORDER BY v.fecha_venta DESC
                 """
-                cursor.execute(sql_productos, (colaborador_id, sucursal_id, fecha_inicio, fecha_fin))
+                cursor.execute(sql_productos, (colaborador_id, sucursal_id, desde_ts, hasta_ts))
                 productos_vendidos = cursor.fetchall()
                 
                 # Cálculos para el resumen usando 'valor_produccion' (que ahora es el subtotal neto correjido)
@@ -9637,17 +9725,17 @@ def reporte_produccion():
                 
                 # Las comisiones se calculan aparte, no cambian
                 total_comisiones_productos = sum(float(p['monto_comision']) for p in productos_vendidos if p.get('monto_comision'))
-                cursor.execute("""SELECT SUM(c.monto_comision) as total FROM comisiones c JOIN venta_items vi ON c.venta_item_id = vi.id JOIN ventas v ON vi.venta_id = v.id WHERE c.empleado_id = %s AND vi.servicio_id IS NOT NULL AND DATE(c.fecha_generacion) BETWEEN %s AND %s""", (colaborador_id, fecha_inicio, fecha_fin))
+                cursor.execute("""SELECT SUM(c.monto_comision) as total FROM comisiones c JOIN venta_items vi ON c.venta_item_id = vi.id JOIN ventas v ON vi.venta_id = v.id WHERE c.empleado_id = %s AND vi.servicio_id IS NOT NULL AND c.fecha_generacion >= %s AND c.fecha_generacion < %s""", (colaborador_id, desde_ts, hasta_ts))
                 comisiones_servicios = cursor.fetchone()
                 total_comisiones_servicios = float(comisiones_servicios['total']) if comisiones_servicios and comisiones_servicios['total'] else 0.0
                 total_comisiones_generadas = total_comisiones_productos + total_comisiones_servicios
 
                 # --- NUEVO: Propinas y Fidelidad ---
-                cursor.execute("SELECT * FROM propinas WHERE empleado_id = %s AND DATE(fecha_registro) BETWEEN %s AND %s ORDER BY fecha_registro DESC", (colaborador_id, fecha_inicio, fecha_fin))
+                cursor.execute("SELECT * FROM propinas WHERE empleado_id = %s AND fecha_registro >= %s AND fecha_registro < %s ORDER BY fecha_registro DESC", (colaborador_id, desde_ts, hasta_ts))
                 propinas = cursor.fetchall()
                 total_propinas = sum(float(p['monto']) for p in propinas)
 
-                cursor.execute("SELECT * FROM ajustes_pago WHERE empleado_id = %s AND tipo ILIKE '%%Fidelidad%%' AND DATE(fecha) BETWEEN %s AND %s ORDER BY fecha DESC", (colaborador_id, fecha_inicio, fecha_fin))
+                cursor.execute("SELECT * FROM ajustes_pago WHERE empleado_id = %s AND tipo ILIKE '%%Fidelidad%%' AND fecha >= %s AND fecha < %s ORDER BY fecha DESC", (colaborador_id, desde_ts, hasta_ts))
                 ajustes_fidelidad = cursor.fetchall()
                 total_fidelidad = sum(abs(float(a['monto'])) for a in ajustes_fidelidad)
 
@@ -9698,50 +9786,59 @@ def exportar_reporte_produccion():
         return redirect(url_for('main.reporte_produccion'))
 
     try:
+        desde_ts, hasta_ts = rango_fechas(fecha_inicio, fecha_fin)
         with db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
             # Obtener nombre del colaborador para el nombre del archivo
             cursor.execute("SELECT nombres, apellidos FROM empleados WHERE id = %s", (colaborador_id,))
             colaborador = cursor.fetchone()
-            nombre_colaborador = f"{colaborador['nombres']} {colaborador['apellidos']}"
-
-            # Ejecutar las mismas consultas que en el reporte en pantalla
-            # Consulta para SERVICIOS
-            sql_servicios = """SELECT v.fecha_venta, cl.nombres as cliente_nombres, cl.apellidos as cliente_apellidos, s.nombre as servicio_nombre, vi.precio_unitario_venta, ca.nombre as campana_nombre, vi.es_hora_extra FROM venta_items vi JOIN ventas v ON vi.venta_id = v.id JOIN servicios s ON vi.servicio_id = s.id LEFT JOIN clientes cl ON v.cliente_id = cl.id LEFT JOIN campanas ca ON v.campana_id = ca.id WHERE v.empleado_id = %s AND v.sucursal_id = %s AND DATE(v.fecha_venta) BETWEEN %s AND %s AND v.estado_pago != 'Anulado' ORDER BY v.fecha_venta DESC"""
-            cursor.execute(sql_servicios, (colaborador_id, sucursal_id, fecha_inicio, fecha_fin))
-            servicios_vendidos = cursor.fetchall()
-
-            # Consulta para PRODUCTOS
-            sql_productos = """SELECT v.fecha_venta, cl.nombres as cliente_nombres, cl.apellidos as cliente_apellidos, p.nombre as producto_nombre, m.nombre as marca_nombre, vi.cantidad, vi.precio_unitario_venta, vi.subtotal_item_neto, com.monto_comision FROM venta_items vi JOIN ventas v ON vi.venta_id = v.id JOIN productos p ON vi.producto_id = p.id LEFT JOIN clientes cl ON v.cliente_id = cl.id LEFT JOIN marcas m ON p.marca_id = m.id LEFT JOIN comisiones com ON com.venta_item_id = vi.id WHERE v.empleado_id = %s AND v.sucursal_id = %s AND DATE(v.fecha_venta) BETWEEN %s AND %s AND v.estado_pago != 'Anulado' ORDER BY v.fecha_venta DESC"""
-            cursor.execute(sql_productos, (colaborador_id, sucursal_id, fecha_inicio, fecha_fin))
-            productos_vendidos = cursor.fetchall()
-            
-        # Crear DataFrames de pandas con los resultados
-        df_servicios = pd.DataFrame(servicios_vendidos)
-        df_productos = pd.DataFrame(productos_vendidos)
-
-        # Renombrar columnas para que se vean bien en Excel
-        if not df_servicios.empty:
-            df_servicios.rename(columns={'fecha_venta': 'Fecha', 'cliente_nombres': 'Nombres Cliente', 'cliente_apellidos': 'Apellidos Cliente', 'servicio_nombre': 'Servicio', 'precio_unitario_venta': 'Precio', 'campana_nombre': 'Campaña', 'es_hora_extra': 'Es Extra'}, inplace=True)
-        if not df_productos.empty:
-            df_productos.rename(columns={'fecha_venta': 'Fecha', 'cliente_nombres': 'Nombres Cliente', 'cliente_apellidos': 'Apellidos Cliente', 'producto_nombre': 'Producto', 'marca_nombre': 'Marca', 'cantidad': 'Cantidad', 'precio_unitario_venta': 'P. Venta Unit.', 'subtotal_item_neto': 'Subtotal', 'monto_comision': 'Comisión'}, inplace=True)
-
-        # Crear un archivo Excel en memoria
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_servicios.to_excel(writer, sheet_name='Servicios Realizados', index=False)
-            df_productos.to_excel(writer, sheet_name='Productos Vendidos', index=False)
-        output.seek(0)
-        
-        # Preparar la respuesta para 
-        # el archivo
+        if not colaborador:
+            flash("Colaborador no encontrado.", "warning")
+            return redirect(url_for('main.reporte_produccion'))
+        nombre_colaborador = f"{colaborador['nombres']} {colaborador['apellidos']}"
+
+        # Las mismas consultas que el reporte en pantalla, leídas en streaming
+        filtro = (colaborador_id, sucursal_id, desde_ts, hasta_ts)
+        sql_servicios = """
+            SELECT v.fecha_venta,
+                   COALESCE(CONCAT(cl.razon_social_nombres, ' ', cl.apellidos), 'Cliente Varios'),
+                   s.nombre, vi.precio_unitario_venta, vi.subtotal_item_neto, ca.nombre, vi.es_hora_extra
+            FROM venta_items vi
+            JOIN ventas v ON vi.venta_id = v.id
+            JOIN servicios s ON vi.servicio_id = s.id
+            LEFT JOIN clientes cl ON v.cliente_receptor_id = cl.id
+            LEFT JOIN campanas ca ON v.campana_id = ca.id
+            WHERE v.empleado_id = %s AND v.sucursal_id = %s AND v.fecha_venta >= %s AND v.fecha_venta < %s
+              AND v.estado_pago != 'Anulado'
+            ORDER BY v.fecha_venta DESC, vi.id
+        """
+        sql_productos = """
+            SELECT v.fecha_venta,
+                   COALESCE(CONCAT(cl.razon_social_nombres, ' ', cl.apellidos), 'Cliente Varios'),
+                   p.nombre, m.nombre, vi.cantidad, vi.precio_unitario_venta, vi.subtotal_item_neto, com.monto_comision
+            FROM venta_items vi
+            JOIN ventas v ON vi.venta_id = v.id
+            JOIN productos p ON vi.producto_id = p.id
+            LEFT JOIN clientes cl ON v.cliente_receptor_id = cl.id
+            LEFT JOIN marcas m ON p.marca_id = m.id
+            LEFT JOIN comisiones com ON com.venta_item_id = vi.id
+            WHERE v.empleado_id = %s AND v.sucursal_id = %s AND v.fecha_venta >= %s AND v.fecha_venta < %s
+              AND v.estado_pago != 'Anulado'
+            ORDER BY v.fecha_venta DESC, vi.id
+        """
+        ruta, _ = exportacion.escribir_xlsx(db_conn, [
+            exportacion.Hoja('Servicios Realizados', sql_servicios, filtro, [
+                ('Fecha', 18), ('Cliente', 35), ('Servicio', 30), ('Precio', 12),
+                ('Producción', 12), ('Campaña', 20), ('Es Extra', 10)
+            ]),
+            exportacion.Hoja('Productos Vendidos', sql_productos, filtro, [
+                ('Fecha', 18), ('Cliente', 35), ('Producto', 30), ('Marca', 18), ('Cantidad', 10),
+                ('P. Venta Unit.', 14), ('Subtotal', 12), ('Comisión', 12)
+            ]),
+        ])
+
         sanitized_name = "".join([c for c in nombre_colaborador if c.isalpha() or c.isdigit() or c==' ']).rstrip()
         nombre_archivo = f"Reporte_Produccion_{sanitized_name}_{fecha_inicio}_a_{fecha_fin}.xlsx"
-        
-        return Response(
-            output,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment;filename={nombre_archivo}"}
-        )
+        return exportacion.respuesta_archivo(ruta, nombre_archivo, exportacion.MIME_XLSX)
 
     except Exception as e:
         flash(f"Error al generar el archivo Excel: {e}", "danger")
@@ -9822,18 +9919,19 @@ def reporte_produccion_general():
                         SUM(CASE WHEN vi.servicio_id IS NOT NULL AND vi.es_hora_extra = FALSE THEN vi.subtotal_item_neto ELSE 0 END) as produccion_servicios_regular,
                         SUM(CASE WHEN vi.servicio_id IS NOT NULL AND vi.es_hora_extra = TRUE THEN vi.subtotal_item_neto ELSE 0 END) as produccion_servicios_extra,
                         SUM(CASE WHEN vi.producto_id IS NOT NULL THEN vi.subtotal_item_neto ELSE 0 END) as produccion_productos,
-                        (SELECT COALESCE(SUM(c.monto_comision), 0) FROM comisiones c JOIN venta_items vi_c ON c.venta_item_id = vi_c.id JOIN ventas v_c ON vi_c.venta_id = v_c.id WHERE v_c.empleado_id = e.id AND DATE(v_c.fecha_venta) BETWEEN %s AND %s) as total_comisiones,
-                        (SELECT COALESCE(SUM(p.monto), 0) FROM propinas p WHERE p.empleado_id = e.id AND DATE(p.fecha_registro) BETWEEN %s AND %s) as total_propinas,
-                        (SELECT COALESCE(ABS(SUM(a.monto)), 0) FROM ajustes_pago a WHERE a.empleado_id = e.id AND a.tipo ILIKE '%%Fidelidad%%' AND DATE(a.fecha) BETWEEN %s AND %s) as total_fidelidad
+                        (SELECT COALESCE(SUM(c.monto_comision), 0) FROM comisiones c JOIN venta_items vi_c ON c.venta_item_id = vi_c.id JOIN ventas v_c ON vi_c.venta_id = v_c.id WHERE v_c.empleado_id = e.id AND v_c.fecha_venta >= %s AND v_c.fecha_venta < %s) as total_comisiones,
+                        (SELECT COALESCE(SUM(p.monto), 0) FROM propinas p WHERE p.empleado_id = e.id AND p.fecha_registro >= %s AND p.fecha_registro < %s) as total_propinas,
+                        (SELECT COALESCE(ABS(SUM(a.monto)), 0) FROM ajustes_pago a WHERE a.empleado_id = e.id AND a.tipo ILIKE '%%Fidelidad%%' AND a.fecha >= %s AND a.fecha < %s) as total_fidelidad
                     FROM ventas v
                     JOIN empleados e ON v.empleado_id = e.id
                     JOIN venta_items vi ON v.id = vi.venta_id
-                    WHERE v.sucursal_id = %s AND DATE(v.fecha_venta) BETWEEN %s AND %s
+                    WHERE v.sucursal_id = %s AND v.fecha_venta >= %s AND v.fecha_venta < %s
                       AND v.estado_pago != 'Anulado'
                     GROUP BY e.id, e.nombre_display
                     ORDER BY {db_sort} {order.upper()};
                 """
-                cursor.execute(sql, (fecha_inicio, fecha_fin, fecha_inicio, fecha_fin, fecha_inicio, fecha_fin, sucursal_id, fecha_inicio, fecha_fin))
+                desde_ts, hasta_ts = rango_fechas(fecha_inicio, fecha_fin)
+                cursor.execute(sql, (desde_ts, hasta_ts, desde_ts, hasta_ts, desde_ts, hasta_ts, sucursal_id, desde_ts, hasta_ts))
                 resultados = cursor.fetchall()
                 
                 # Calcular los totales generales para el resumen
@@ -9983,6 +10081,8 @@ def guardar_permisos_rol(rol_id):
                 cursor.executemany(sql_insert, valores_a_insertar)
             
             db_conn.commit()
+            versiones.incrementar(db_conn, f'rol:{rol_id}')
+            cache_configuracion.invalidar(db_conn, 'sucursales')
             flash("Permisos actualizados exitosamente.", "success")
 
     except Exception as err:
@@ -10046,13 +10146,14 @@ def nueva_comanda():
                                         estado_proceso, estado_pago, monto_final_venta, 
                                         subtotal_servicios, subtotal_productos, monto_impuestos)
                     VALUES (%s, %s, %s, %s, %s, 'En Comanda', 'Pendiente de Pago', %s, %s, %s, %s)
+                    RETURNING id
                 """
                 val_venta = (
                     sucursal_id, cliente_receptor_id, cliente_receptor_id, colaborador_id, datetime.now(), 
                     monto_final, subtotal_servicios, subtotal_productos, monto_impuestos
                 )
                 cursor.execute(sql_venta, val_venta)
-                venta_id = cursor.lastrowid
+                venta_id = cursor.fetchone()[0]
 
                 # Insertar los ítems en 'venta_items'
                 for item in lista_items:
@@ -10076,6 +10177,9 @@ def nueva_comanda():
                         item.get('notas_item') # Guardar la nota del estilo
                     )
                     cursor.execute(sql_item, val_item)
+
+                # La comanda ya es una venta: publica su devengo como cualquier otra
+                devengos.sincronizar(cursor, [venta_id], 'VENTA')
             
             db_conn.commit()
             flash(f"Comanda #{venta_id} enviada a caja exitosamente.", "success")
@@ -11562,19 +11666,8 @@ def procesar_conversion_venta(venta_id):
                 """, (tipo_doc, num_doc, nombre_cliente, direccion_cliente))
                 cliente_id = cursor.fetchone()[0]
 
-            # 2. Obtener Nueva Serie y Correlativo
-            cursor.execute("""
-                SELECT serie, ultimo_numero FROM series_comprobantes 
-                WHERE sucursal_id = %s AND tipo_comprobante = %s FOR UPDATE
-            """, (sucursal_id, nuevo_tipo))
-            serie_config = cursor.fetchone()
-            
-            if not serie_config:
-                raise Exception(f"No hay serie configurada para {nuevo_tipo} en esta sucursal.")
-                
-            serie = serie_config[0]
-            nuevo_numero = serie_config[1] + 1
-            numero_str = str(nuevo_numero).zfill(8)
+            # 2. Obtener Nueva Serie y Correlativo (atómico, ver services/correlativos.py)
+            serie, nuevo_numero, numero_str = correlativos.asignar_numero(cursor, sucursal_id, nuevo_tipo)
 
             # 3. Actualizar Venta (El Canje Real)
             # PROTECCIÓN DE PUNTOS: Si es 'Sin Documento' (Clientes Varios), no sobreescribimos el cliente_receptor_id
@@ -11590,12 +11683,6 @@ def procesar_conversion_venta(venta_id):
                 WHERE id = %s
             """, (nuevo_tipo, serie, numero_str, es_clientes_varios, cliente_id, cliente_id, venta_id))
 
-            # 4. Actualizar Correlativo
-            cursor.execute("""
-                UPDATE series_comprobantes SET ultimo_numero = %s 
-                WHERE sucursal_id = %s AND tipo_comprobante = %s
-            """, (nuevo_numero, sucursal_id, nuevo_tipo))
-            
             db_conn.commit()
             
             flash(f"¡Canje Exitoso! Se generó la {nuevo_tipo} {serie}-{numero_str}", "success")
@@ -11797,6 +11884,28 @@ def detalle_cliente(cliente_id):
                            titulo_pagina=f"Detalle de Cliente")
 
 
+@main_bp.route('/api/sistema/db-pool')
+@login_required
+@admin_required
+def api_db_pool_stats():
+    """
+    Estado del pool de conexiones del worker que atiende la petición
+    (cada worker de gunicorn tiene su propio pool).
+    """
+    return jsonify(pool_stats())
+
+
+@main_bp.route('/api/sistema/latencias')
+@login_required
+@admin_required
+def api_latencias():
+    """
+    p50/p99 de las operaciones medidas (p.ej. 'checkout') en el worker que
+    atiende la petición. 'checkout_en_linea' corresponde a OUTBOX_EN_LINEA=1.
+    """
+    return jsonify(latencias.resumen())
+
+
 @main_bp.route('/configuracion/sistema', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -11835,6 +11944,7 @@ def configurar_sistema():
             """
             cursor.execute(sql_update, (nombre_empresa, color_primario, color_secundario, color_fondo, color_texto, color_sidebar_fondo, color_sidebar_texto, color_navbar_fondo))
             db_conn.commit()
+            cache_configuracion.invalidar(db_conn, 'sistema')
             flash('Configuración del sistema actualizada exitosamente.', 'success')
             return redirect(url_for('main.configurar_sistema'))
 
@@ -11902,17 +12012,9 @@ def emitir_comprobante(venta_id):
             tipo_map = {'Boleta': 'Boleta Electrónica', 'Factura': 'Factura Electrónica'}
             tipo_comprobante_db = tipo_map.get(tipo_comprobante_form)
 
-            cursor.execute(
-                "SELECT id, serie, ultimo_numero FROM series_comprobantes WHERE sucursal_id = %s AND tipo_comprobante = %s FOR UPDATE",
-                (venta['sucursal_id'], tipo_comprobante_db)
+            serie_comprobante, nuevo_numero, numero_formateado = correlativos.asignar_numero(
+                cursor, venta['sucursal_id'], tipo_comprobante_db
             )
-            serie_info = cursor.fetchone()
-            if not serie_info:
-                raise ValueError(f"No hay una serie configurada para '{tipo_comprobante_db}' en esta sucursal.")
-
-            nuevo_numero = serie_info['ultimo_numero'] + 1
-            numero_formateado = f"{nuevo_numero:08d}"
-            serie_comprobante = serie_info['serie']
 
             cursor.execute("""
                 UPDATE ventas 
@@ -11920,11 +12022,6 @@ def emitir_comprobante(venta_id):
                 WHERE id = %s
             """, (tipo_comprobante_db, serie_comprobante, numero_formateado, cliente_facturacion_id, venta_id))
 
-            cursor.execute(
-                "UPDATE series_comprobantes SET ultimo_numero = %s WHERE id = %s",
-                (nuevo_numero, serie_info['id'])
-            )
-
             db_conn.commit()
 
             # Intento de envío inmediato a SUNAT
@@ -5,6 +5,8 @@ import psycopg2.extras
 from datetime import date, datetime, timedelta
 from calendar import monthrange
 from .db import get_db
+from .utils.fechas import rango_fechas
+from .services import saldos, devengos
 
 
 # ... el resto del código sigue igual ...
@@ -66,24 +68,14 @@ def _calcular_metricas_fondo(cursor, empleado_id, tipo_salario, sueldo_basico=0,
     base_calculo = 0.00
 
     # --- 1. DATOS COMUNES: VENTA DE PRODUCTOS ---
-    # Necesario para Cajeros y Barberos
-    cursor.execute("""
-        SELECT COALESCE(SUM(vi.subtotal_item_neto), 0) as total
-        FROM venta_items vi JOIN ventas v ON vi.venta_id = v.id
-        JOIN productos p ON vi.producto_id = p.id
-        WHERE v.empleado_id = %s AND v.fecha_venta >= %s AND v.estado != 'Anulada'
-    """, (empleado_id, inicio_mes))
-    venta_productos = float(cursor.fetchone()['total'])
+    # Necesario para Cajeros y Barberos (del resumen diario de devengos)
+    venta_productos = devengos.totales(cursor, empleado_id, inicio_mes, hoy, [devengos.PRODUCTO])['produccion']
     comision_productos = venta_productos * (float(porcentaje_prod_empleado) / 100)
 
     # --- 2. DATOS COMUNES: VENTA DE SERVICIOS (BARBERÍA) ---
-    cursor.execute("""
-        SELECT COALESCE(SUM(vi.subtotal_item_neto), 0) as total
-        FROM venta_items vi JOIN ventas v ON vi.venta_id = v.id
-        JOIN servicios s ON vi.servicio_id = s.id
-        WHERE v.empleado_id = %s AND v.fecha_venta >= %s AND v.estado != 'Anulada'
-    """, (empleado_id, inicio_mes))
-    produccion_servicios = float(cursor.fetchone()['total'])
+    produccion_servicios = devengos.totales(
+        cursor, empleado_id, inicio_mes, hoy, [devengos.SERVICIO, devengos.HORA_EXTRA]
+    )['produccion']
 
 
     # === CASO A: CAJERO (Meta = Comisiones Productos | Fondo = Sueldo + Comisiones) ===
@@ -295,20 +287,10 @@ def _calcular_produccion_rango(cursor, empleado_id, tipo_salario, f_inicio, f_fi
         produccion = float(sueldo_basico or 0)
 
     elif tipo_salario in ['Comisionista', 'Mixto_Instructor']:
-        cursor.execute("""
-            SELECT COALESCE(SUM(vi.subtotal_item_neto), 0) as total
-            FROM venta_items vi
-            JOIN ventas v ON vi.venta_id = v.id
-            WHERE v.empleado_id = %s 
-              AND v.fecha_venta BETWEEN %s AND %s
-              AND v.estado != 'Anulada'
-        """, (empleado_id, f_inicio, f_fin))
-        
-        result = cursor.fetchone()
-        if result:
-            # Safe access
-            val = result['total'] if isinstance(result, dict) else result[0]
-            produccion = float(val)
+        # Producción total del rango (inclusive) desde el resumen diario de devengos
+        produccion = devengos.totales(
+            cursor, empleado_id, f_inicio, f_fin, [devengos.SERVICIO, devengos.HORA_EXTRA, devengos.PRODUCTO]
+        )['produccion']
     
     return produccion
 
@@ -586,31 +568,16 @@ def calcular_planilla_preliminar():
                 p_ini = periodo['inicio']
                 p_fin = periodo['fin']
                 
-                # 1. VENTA PAGABLE (Solo lo que NO tiene 'pago_nomina_id')
-                cursor.execute("""
-                    SELECT COALESCE(SUM(vi.subtotal_item_neto), 0) as total
-                    FROM venta_items vi JOIN ventas v ON vi.venta_id = v.id
-                    WHERE v.empleado_id = %s 
-                      AND DATE(v.fecha_venta) BETWEEN %s AND %s 
-                      AND v.estado_pago != 'Anulado'
-                      AND vi.servicio_id IS NOT NULL 
-                      AND vi.es_hora_extra = FALSE
-                      AND v.pago_nomina_id IS NULL 
-                """, (empleado_id, p_ini, p_fin))
-                venta_pagable = float(cursor.fetchone()['total'])
+                # 1. VENTA PAGABLE (servicios normales aún no liquidados en planilla)
+                # Sale del resumen diario de devengos (services/devengos.py): ~31 filas por mes
+                venta_pagable = devengos.totales(cursor, empleado_id, p_ini, p_fin, [devengos.SERVICIO])['pagable']
                 
                 # 2. ACUMULADO HISTÓRICO DEL MES (Para nivel de escala o meta)
+                # Días del mes anteriores a p_ini (si p_ini es día 1 el rango queda vacío)
                 inicio_de_ese_mes = p_ini.replace(day=1)
-                cursor.execute("""
-                    SELECT COALESCE(SUM(vi.subtotal_item_neto), 0) as total
-                    FROM venta_items vi JOIN ventas v ON vi.venta_id = v.id
-                    WHERE v.empleado_id = %s 
-                      AND DATE(v.fecha_venta) >= %s AND DATE(v.fecha_venta) < %s 
-                      AND v.estado_pago != 'Anulado'
-                      AND vi.servicio_id IS NOT NULL 
-                      AND vi.es_hora_extra = FALSE
-                """, (empleado_id, inicio_de_ese_mes, p_ini))
-                acumulado_histórico = float(cursor.fetchone()['total'])
+                acumulado_histórico = devengos.totales(
+                    cursor, empleado_id, inicio_de_ese_mes, p_ini - timedelta(days=1), [devengos.SERVICIO]
+                )['produccion']
                 
                 comision_sub = 0.00
                 desglose_tramos = []
@@ -700,9 +667,9 @@ def calcular_planilla_preliminar():
                 SELECT id, motivo, monto, fecha_registro as fecha
                 FROM empleado_penalidades
                 WHERE empleado_id = %s
-                  AND fecha_registro::date BETWEEN %s AND %s
+                  AND fecha_registro >= %s AND fecha_registro < %s
                   AND deducido_en_planilla_id IS NULL
-            """, (empleado_id, f_inicio, f_fin))
+            """, (empleado_id, *rango_fechas(f_inicio, f_fin)))
             penalidades = cursor.fetchall()
             total_penalidades = sum(float(p['monto']) for p in penalidades) if penalidades else 0.0
 
@@ -735,9 +702,9 @@ def calcular_planilla_preliminar():
                 SELECT id, motivo, monto, fecha_registro as fecha
                 FROM empleado_bonos
                 WHERE empleado_id = %s
-                  AND fecha_registro::date BETWEEN %s AND %s
+                  AND fecha_registro >= %s AND fecha_registro < %s
                   AND deducido_en_planilla_id IS NULL
-            """, (empleado_id, f_inicio, f_fin))
+            """, (empleado_id, *rango_fechas(f_inicio, f_fin)))
             bonos = cursor.fetchall()
             total_bonos = sum(float(b['monto']) for b in bonos) if bonos else 0.0
 
@@ -913,7 +880,7 @@ def confirmar_adelanto(gasto_id):
             # 2.2 Bloqueo si hay cajas de días anteriores sin cerrar
             cursor.execute("""
                 SELECT id FROM caja_sesiones 
-                WHERE sucursal_id = %s AND estado = 'Abierta' AND DATE(fecha_apertura) < CURRENT_DATE
+                WHERE sucursal_id = %s AND estado = 'Abierta' AND fecha_apertura < CURRENT_DATE
             """, (sucursal_id,))
             if cursor.fetchone():
                 return jsonify({'error': '⚠️ BLOQUEO OPERATIVO: Existen cajas de días anteriores que siguen abiertas. Por favor, ciérrelas antes de procesar movimientos hoy.'}), 400
@@ -1097,7 +1064,7 @@ def registrar_ingreso():
                 # 2. Verificar cajas de días anteriores pendientes de cierre (Cualquier usuario)
                 cursor.execute("""
                     SELECT id FROM caja_sesiones 
-                    WHERE sucursal_id = %s AND estado = 'Abierta' AND DATE(fecha_apertura) < CURRENT_DATE
+                    WHERE sucursal_id = %s AND estado = 'Abierta' AND fecha_apertura < CURRENT_DATE
                 """, (sucursal_id,))
                 if cursor.fetchone():
                     flash("⚠️ BLOQUEO OPERATIVO: Existen cajas de días anteriores sin cerrar. Por favor, ciérrelas antes de registrar ingresos hoy.", "danger")
@@ -1122,22 +1089,10 @@ def registrar_ingreso():
                     if not cliente_id:
                         raise ValueError("Debe seleccionar un cliente para abonar al monedero.")
                     
-                    try:
-                        # Actualizar Saldo Cliente
-                        cursor.execute("""
-                            UPDATE clientes 
-                            SET saldo_monedero = COALESCE(saldo_monedero, 0) + %s 
-                            WHERE id = %s
-                        """, (monto, cliente_id))
-                        flash(f"Ingreso registrado y abonado S/ {monto:.2f} al monedero del cliente.", "success")
-                    except Exception as e:
-                        # Si falla (ej. no existe columna saldo_monedero por permisos), no crashear todo el ingreso
-                        current_app.logger.error(f"No se pudo actualizar monedero: {e}")
-                        flash(f"Ingreso registrado en CAJA, pero no se pudo actualizar el Monedero Virtual (Verifique permisos DB).", "warning")
-                    
-                    # Registrar Historial Puntos / Monedero (Opcional, si queremos trazarlo)
-                    # Podemos usar la tabla 'puntos_historial' adaptada o crear 'monedero_historial'
-                    # Por ahora, agregamos al concepto de caja que fue a monedero.
+                    # Abono al monedero + movimiento en el libro de saldos (ver services/saldos.py)
+                    saldos.mover(cursor, cliente_id, saldos.MONEDERO, monto, 'ABONO',
+                                 usuario_id=current_user.id, referencia=f"Movimiento de caja #{mov_id}")
+                    flash(f"Ingreso registrado y abonado S/ {monto:.2f} al monedero del cliente.", "success")
                     
                 else:
                     flash(f"Ingreso de S/ {monto:.2f} registrado correctamente.", "success")
@@ -1294,10 +1249,13 @@ def confirmar_pago_planilla():
                 UPDATE ventas 
                 SET pago_nomina_id = %s 
                 WHERE empleado_id = %s 
-                  AND fecha_venta BETWEEN %s AND %s
-                  AND estado != 'Anulada'
+                  AND fecha_venta >= %s AND fecha_venta < %s
+                  AND COALESCE(estado_pago, '') <> 'Anulado'
                   AND pago_nomina_id IS NULL
-            """, (planilla_id, empleado_id, f_inicio, f_fin))
+                RETURNING id
+            """, (planilla_id, empleado_id, *rango_fechas(f_inicio, f_fin)))
+            # ...y su producción como liquidada en el resumen de devengos
+            devengos.liquidar_ventas(cursor, [fila['id'] for fila in cursor.fetchall()])
 
             # 3. MARCAR ADELANTOS COMO DEDUCIDOS (Bloquearlos)
             cursor.execute("""
@@ -1313,9 +1271,9 @@ def confirmar_pago_planilla():
                 UPDATE empleado_penalidades
                 SET deducido_en_planilla_id = %s
                 WHERE empleado_id = %s
-                  AND fecha_registro::date BETWEEN %s AND %s
+                  AND fecha_registro >= %s AND fecha_registro < %s
                   AND deducido_en_planilla_id IS NULL
-            """, (planilla_id, empleado_id, f_inicio, f_fin))
+            """, (planilla_id, empleado_id, *rango_fechas(f_inicio, f_fin)))
 
             # 5. APLICAR AMORTIZACIÓN A DEUDAS
             # Recibiremos la lista de amortizaciones desde el Frontend
@@ -1339,9 +1297,9 @@ def confirmar_pago_planilla():
                 UPDATE empleado_bonos
                 SET deducido_en_planilla_id = %s
                 WHERE empleado_id = %s
-                  AND fecha_registro::date BETWEEN %s AND %s
+                  AND fecha_registro >= %s AND fecha_registro < %s
                   AND deducido_en_planilla_id IS NULL
-            """, (planilla_id, empleado_id, f_inicio, f_fin))
+            """, (planilla_id, empleado_id, *rango_fechas(f_inicio, f_fin)))
 
             db.commit()
             return jsonify({'mensaje': 'Pago registrado correctamente. Ventas, Bonos y deducciones cerradas.', 'planilla_id': planilla_id})
@@ -1380,7 +1338,7 @@ def registrar_propina():
                     return redirect(request.referrer)
             
             # 2. Bloqueo por cajas anteriores
-            cursor_val.execute("SELECT id FROM caja_sesiones WHERE sucursal_id = %s AND estado = 'Abierta' AND DATE(fecha_apertura) < CURRENT_DATE", (sucursal_id,))
+            cursor_val.execute("SELECT id FROM caja_sesiones WHERE sucursal_id = %s AND estado = 'Abierta' AND fecha_apertura < CURRENT_DATE", (sucursal_id,))
             if cursor_val.fetchone():
                 flash("⚠️ Bloqueo: Existen cajas de días anteriores abiertas. Ciérrelas antes de registrar propinas hoy.", "danger")
                 return redirect(request.referrer)
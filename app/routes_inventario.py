@@ -3,6 +3,7 @@ from flask_login import login_required, current_user
 import psycopg2
 import psycopg2.extras
 from .db import get_db
+from . import paginacion
 
 inventario_bp = Blueprint('inventario', __name__, url_prefix='/inventario')
 
@@ -27,25 +28,34 @@ def registrar_movimiento_kardex(cursor, producto_id, tipo, cantidad, motivo, usu
     """, (producto_id, tipo, cantidad, stock_ant, stock_nuevo, motivo, usuario_id, venta_id))
 
 
+# Listados paginados por cursor (app/paginacion.py, índices en migración 0016)
+LISTADO_INVENTARIO = paginacion.Listado({
+    'stock': ('COALESCE(stock_actual, 0)', 'asc'),
+    'nombre': ("COALESCE(nombre, '')", 'asc'),
+}, defecto='stock', clave='id')
+LISTADO_KARDEX = paginacion.Listado({'fecha': ('k.fecha', 'desc')}, defecto='fecha', clave='k.id')
+
+
 @inventario_bp.route('/lista')
 @login_required
 def lista_inventario():
     db = get_db()
     with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-        # Traemos productos con cálculo de estado
-        cursor.execute("""
-            SELECT id, nombre, precio_venta, stock_actual, stock_minimo,
-                   CASE 
-                       WHEN stock_actual <= 0 THEN 'Agotado'
-                       WHEN stock_actual <= stock_minimo THEN 'Bajo'
-                       ELSE 'Optimo'
-                   END as estado_stock
-            FROM productos 
-            WHERE activo = TRUE 
-            ORDER BY stock_actual ASC
-        """)
-        productos = cursor.fetchall()
-    return render_template('inventario/lista.html', productos=productos)
+        # Traemos productos con cálculo de estado (una página, los de menos stock primero)
+        pagina = LISTADO_INVENTARIO.pagina(cursor, """
+                id, nombre, precio_venta, stock_actual, stock_minimo,
+                CASE 
+                    WHEN stock_actual <= 0 THEN 'Agotado'
+                    WHEN stock_actual <= stock_minimo THEN 'Bajo'
+                    ELSE 'Optimo'
+                END as estado_stock
+            """, "productos", ["activo = TRUE"], args=request.args, contar='aproximado')
+
+        # El modal de movimientos necesita todos los productos activos (solo id/nombre/stock)
+        cursor.execute("SELECT id, nombre, stock_actual FROM productos WHERE activo = TRUE ORDER BY nombre")
+        productos_selector = cursor.fetchall()
+    return render_template('inventario/lista.html', productos=pagina.filas, pagina=pagina,
+                           productos_selector=productos_selector)
 
 
 @inventario_bp.route('/movimiento', methods=['POST'])
@@ -100,14 +110,12 @@ def ver_kardex_producto(producto_id):
         cursor.execute("SELECT nombre, stock_actual FROM productos WHERE id = %s", (producto_id,))
         prod = cursor.fetchone()
         
-        # Historial
-        cursor.execute("""
-            SELECT k.*, u.nombres as usuario
-            FROM kardex k
-            LEFT JOIN empleados u ON k.usuario_id = u.id
-            WHERE k.producto_id = %s
-            ORDER BY k.fecha DESC
-        """, (producto_id,))
-        movimientos = cursor.fetchall()
+        # Historial (una página por cursor, lo más reciente primero)
+        pagina = LISTADO_KARDEX.pagina(
+            cursor, "k.*, u.nombres as usuario",
+            "kardex k LEFT JOIN empleados u ON k.usuario_id = u.id",
+            ["k.producto_id = %s"], [producto_id], request.args
+        )
         
-    return render_template('inventario/kardex_detalle.html', prod=prod, movimientos=movimientos)
\ No newline at end of file
+    return render_template('inventario/kardex_detalle.html', prod=prod, movimientos=pagina.filas, pagina=pagina,
+                           producto_id=producto_id)
\ No newline at end of file
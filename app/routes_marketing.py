@@ -6,6 +6,7 @@ import random
 import string
 import os
 from .db import get_db
+from .services import clientes_busqueda
 from .utils.gift_card_generator import generate_gift_card_image
 from .utils.gift_card_pdf_generator import generate_gift_card_pdf
 from flask import send_file
@@ -251,19 +252,8 @@ def api_buscar_clientes_marketing():
     db = get_db()
     try:
         with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            # Búsqueda insensible a mayúsculas
-            search_pattern = f"%{q}%"
-            cursor.execute("""
-                SELECT id, razon_social_nombres, apellidos, numero_documento, telefono 
-                FROM clientes 
-                WHERE 
-                    razon_social_nombres ILIKE %s OR 
-                    apellidos ILIKE %s OR 
-                    numero_documento ILIKE %s
-                ORDER BY razon_social_nombres LIMIT 10
-            """, (search_pattern, search_pattern, search_pattern))
-            
-            resultados = cursor.fetchall()
+            # Búsqueda insensible a mayúsculas y tildes (ver services/clientes_busqueda.py)
+            resultados = clientes_busqueda.buscar(cursor, q, limite=10)
             
             # Formatear respuesta
             data = []
@@ -358,12 +348,20 @@ def get_client_status(cliente_id):
                     'vence': fecha_vencimiento if count > 0 else '-'
                 })
 
-            # 3. Historial (Ultimos 5)
+            # 3. Historial (Ultimos 5): libro de saldos + historial anterior al libro
             cursor.execute("""
-                SELECT * FROM puntos_historial 
-                WHERE cliente_id = %s 
+                (SELECT creado_en AS fecha_registro, tipo AS tipo_transaccion,
+                        ABS(monto)::int AS monto_puntos, referencia AS descripcion
+                 FROM saldo_movimientos
+                 WHERE cliente_id = %s AND cuenta = 'PUNTOS' AND tipo <> 'APERTURA'
+                 ORDER BY creado_en DESC LIMIT 5)
+                UNION ALL
+                (SELECT fecha_registro, tipo_transaccion, monto_puntos, descripcion
+                 FROM puntos_historial
+                 WHERE cliente_id = %s
+                 ORDER BY fecha_registro DESC LIMIT 5)
                 ORDER BY fecha_registro DESC LIMIT 5
-            """, (cliente_id,))
+            """, (cliente_id, cliente_id))
             hist = cursor.fetchall()
             for h in hist:
                 data['historial_puntos'].append({
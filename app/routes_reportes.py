@@ -5,6 +5,7 @@ from flask import Blueprint, render_template, request, flash, current_app, jsoni
 from flask_login import login_required, current_user
 from .db import get_db
 from .decorators import admin_required
+from .utils.fechas import rango_fechas, rango_mes
 
 reportes_bp = Blueprint('reportes', __name__)
 
@@ -40,13 +41,14 @@ def ingresos_egresos():
                 sucursal_id = int(sucursal_id_str)
                 f_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
                 f_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
+                desde_ts, hasta_ts = rango_fechas(f_inicio, f_fin)
                 
                 # 1. Ingresos (Ventas)
                 cursor.execute("""
                     SELECT 'Ventas Generales' as concepto, SUM(monto_final_venta) as total, 'Ingreso' as tipo
                     FROM ventas
-                    WHERE sucursal_id = %s AND DATE(fecha_venta) BETWEEN %s AND %s AND estado_pago != 'Anulado'
-                """, (sucursal_id, f_inicio, f_fin))
+                    WHERE sucursal_id = %s AND fecha_venta >= %s AND fecha_venta < %s AND estado_pago != 'Anulado'
+                """, (sucursal_id, desde_ts, hasta_ts))
                 ventas_total = cursor.fetchone()
                 
                 # Movimientos manuales de ingreso
@@ -54,9 +56,9 @@ def ingresos_egresos():
                     SELECT concepto, SUM(monto) as total, 'Ingreso' as tipo 
                     FROM movimientos_caja mc 
                     JOIN caja_sesiones cs ON mc.caja_sesion_id = cs.id
-                    WHERE cs.sucursal_id = %s AND mc.tipo = 'Ingreso' AND DATE(mc.fecha) BETWEEN %s AND %s 
+                    WHERE cs.sucursal_id = %s AND mc.tipo = 'Ingreso' AND mc.fecha >= %s AND mc.fecha < %s 
                     GROUP BY concepto
-                """, (sucursal_id, f_inicio, f_fin))
+                """, (sucursal_id, desde_ts, hasta_ts))
                 mov_ingresos = cursor.fetchall()
 
                 # 2. Egresos (Gastos Operativos, Planillas, Movimientos extra)
@@ -64,17 +66,17 @@ def ingresos_egresos():
                     SELECT cg.nombre as concepto, SUM(g.monto) as total, 'Egreso' as tipo
                     FROM gastos g
                     JOIN categorias_gastos cg ON g.categoria_gasto_id = cg.id
-                    WHERE g.sucursal_id = %s AND DATE(g.fecha) BETWEEN %s AND %s
+                    WHERE g.sucursal_id = %s AND g.fecha >= %s AND g.fecha < %s
                     GROUP BY cg.nombre
-                """, (sucursal_id, f_inicio, f_fin))
+                """, (sucursal_id, desde_ts, hasta_ts))
                 gastos = cursor.fetchall()
                 
                 # Compras
                 cursor.execute("""
                     SELECT 'Compras a Proveedores' as concepto, SUM(monto_total) as total, 'Egreso' as tipo
                     FROM compras
-                    WHERE sucursal_id = %s AND DATE(fecha_compra) BETWEEN %s AND %s
-                """, (sucursal_id, f_inicio, f_fin))
+                    WHERE sucursal_id = %s AND fecha_compra >= %s AND fecha_compra < %s
+                """, (sucursal_id, desde_ts, hasta_ts))
                 compras = cursor.fetchone()
                 
                 mov_egresos = [] # Simplificado para arrancar
@@ -267,9 +269,9 @@ def registro_contable_mensual():
                      ON c.tipo_documento = tc.tipo
                 WHERE v.estado_pago != 'Anulado' 
                 AND v.tipo_comprobante IN ('Factura Electrónica', 'Boleta Electrónica')
-                AND TO_CHAR(v.fecha_venta, 'YYYY-MM') = %s
+                AND v.fecha_venta >= %s AND v.fecha_venta < %s
                 ORDER BY v.fecha_venta ASC
-            """, (periodo_str,))
+            """, rango_mes(periodo_str))
             ventas_db = cursor.fetchall()
             
             for v in ventas_db:
@@ -298,9 +300,9 @@ def registro_contable_mensual():
                     p.ruc as proveedor_ruc
                 FROM compras c
                 LEFT JOIN proveedores p ON c.proveedor_id = p.id
-                WHERE TO_CHAR(c.fecha_compra, 'YYYY-MM') = %s
+                WHERE c.fecha_compra >= %s AND c.fecha_compra < %s
                 ORDER BY c.fecha_compra ASC
-            """, (periodo_str,))
+            """, rango_mes(periodo_str))
             compras_db = cursor.fetchall()
             
             for comp in compras_db:
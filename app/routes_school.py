@@ -5,6 +5,8 @@ import psycopg2
 import psycopg2.extras
 from datetime import date, datetime, timedelta
 from .db import get_db
+from .services import clientes_busqueda
+from . import paginacion
 
 # Definimos el Blueprint para la Escuela
 school_bp = Blueprint('school', __name__, url_prefix='/school')
@@ -256,23 +258,57 @@ def register_student():
         print(f"Error registrando alumno: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Alumnos por cursor, los últimos inscritos primero (app/paginacion.py, índice en migración 0016)
+LISTADO_ALUMNOS = paginacion.Listado({
+    'inscripcion': ("COALESCE(a.fecha_inscripcion, TIMESTAMP '1900-01-01')", 'desc'),
+}, defecto='inscripcion', clave='a.id')
+
+# Join with courses and groups to get names/codes instead of just IDs
+_COLUMNAS_ALUMNO = """
+    a.id, a.codigo_alumno, a.nombres, a.apellidos, a.dni, a.estado,
+    c.nombre as curso_nombre, g.codigo_grupo
+"""
+_ORIGEN_ALUMNO = """
+    escuela_alumnos a
+    LEFT JOIN escuela_cursos c ON a.curso_id = c.id
+    LEFT JOIN escuela_grupos g ON a.grupo_id = g.id
+"""
+
+
 @school_bp.route('/api/students', methods=['GET'])
 @login_required
 def list_students():
+    """
+    Lista completa de alumnos (formato original: un arreglo JSON). Se mantiene para
+    integraciones existentes; el panel usa /api/v2/students, paginado.
+    """
     db = get_db()
     try:
         with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            # Join with courses and groups to get names/codes instead of just IDs
-            cursor.execute("""
-                SELECT a.id, a.codigo_alumno, a.nombres, a.apellidos, a.dni, a.estado,
-                       c.nombre as curso_nombre, g.codigo_grupo
-                FROM escuela_alumnos a
-                LEFT JOIN escuela_cursos c ON a.curso_id = c.id
-                LEFT JOIN escuela_grupos g ON a.grupo_id = g.id
+            cursor.execute(f"""
+                SELECT {_COLUMNAS_ALUMNO}
+                FROM {_ORIGEN_ALUMNO}
                 ORDER BY a.fecha_inscripcion DESC
             """)
-            alumnos = cursor.fetchall()
-            return jsonify([dict(a) for a in alumnos])
+            response = jsonify([dict(a) for a in cursor.fetchall()])
+            response.headers['Deprecation'] = 'true'
+            response.headers['Link'] = '</school/api/v2/students>; rel="successor-version"'
+            return response
+    except Exception as e:
+        print(f"Error listing students: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@school_bp.route('/api/v2/students', methods=['GET'])
+@login_required
+def list_students_v2():
+    """Una página de alumnos: {'alumnos': [...], 'siguiente': token o null, ...}. Pasar ?cursor=<siguiente>."""
+    db = get_db()
+    try:
+        with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            pagina = LISTADO_ALUMNOS.pagina(cursor, _COLUMNAS_ALUMNO, _ORIGEN_ALUMNO, args=request.args)
+            alumnos = [{k: v for k, v in a.items() if not k.startswith('_pag_')} for a in pagina.filas]
+            return jsonify(dict(pagina.a_dict(), alumnos=alumnos))
     except Exception as e:
         print(f"Error listing students: {e}")
         return jsonify({'error': str(e)}), 500
@@ -288,17 +324,9 @@ def search_student():
     db = get_db()
     try:
         with db.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            # Buscar coincidencia exacta por DNI o Código, o LIKE por nombres/apellidos/teléfono
-            cursor.execute("""
-                SELECT id 
-                FROM escuela_alumnos 
-                WHERE codigo_alumno ILIKE %s 
-                   OR dni = %s 
-                   OR telefono = %s
-                   OR (nombres || ' ' || apellidos) ILIKE %s
-                ORDER BY id DESC LIMIT 1
-            """, (f"%{query}%", query, query, f"%{query}%"))
-            result = cursor.fetchone()
+            # Mejor coincidencia por código, DNI, teléfono o nombres (sin tildes; DNI/teléfono exacto primero)
+            encontrados = clientes_busqueda.buscar(cursor, query, limite=1, columnas="c.id", fuente='alumnos')
+            result = encontrados[0] if encontrados else None
             
             if result:
                 return jsonify({'id': result['id']})
@@ -409,7 +437,7 @@ def register_payment():
             # 2. Verificar cajas de días anteriores (CUALQUIER MÉTODO DE PAGO)
             cursor_val.execute("""
                 SELECT id FROM caja_sesiones 
-                WHERE sucursal_id = %s AND estado = 'Abierta' AND DATE(fecha_apertura) < CURRENT_DATE
+                WHERE sucursal_id = %s AND estado = 'Abierta' AND fecha_apertura < CURRENT_DATE
             """, (sucursal_id,))
             if cursor_val.fetchone():
                 return jsonify({'error': '⚠️ BLOQUEO OPERATIVO: Existen cajas de días anteriores abiertas en esta sucursal. Ciérrelas para iniciar hoy.'}), 403
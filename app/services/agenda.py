@@ -0,0 +1,294 @@
+import time
+from datetime import datetime, timedelta
+from ..utils.fechas import rango_dia
+
+# ---------------------------------------------------------
+# AGENDA (recursos + eventos para FullCalendar)
+# ---------------------------------------------------------
+# Armado de /api/agenda_dia_data (y su modo delta) y de /api/agenda_rango_data.
+# Los cambios se registran por trigger en agenda_cambios (migración 0005).
+
+ESTADOS_OCULTOS = ('Cancelada', 'Cancelada por Cliente', 'Cancelada por Staff', 'No Asistio')
+
+# Un token más viejo que esto obliga al cliente a recargar la agenda completa
+# (agenda_cambios se purga a los 3 días).
+TOKEN_VIGENCIA_SEGUNDOS = 24 * 3600
+
+
+def token_actual(cursor):
+    """
+    Token de cambios: xmin del snapshot actual + hora de emisión.
+    Debe pedirse ANTES de leer la agenda para no perder cambios concurrentes.
+    """
+    cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin")
+    fila = cursor.fetchone()
+    xmin = fila['xmin'] if isinstance(fila, dict) else fila[0]
+    return f"{xmin}.{int(time.time())}"
+
+
+def leer_token(token):
+    """Devuelve el xmin del token, o None si es inválido o ya venció."""
+    try:
+        xmin, emitido = (int(p) for p in str(token).split('.'))
+    except (TypeError, ValueError):
+        return None
+    if time.time() - emitido > TOKEN_VIGENCIA_SEGUNDOS:
+        return None
+    return xmin
+
+
+def empleados_con_cambios(cursor, xmin, fecha_obj):
+    """
+    Empleados con reservas, extras, ausencias u horarios modificados en
+    transacciones que el token no alcanzó a ver y que afectan al día.
+    Puede repetir cambios ya entregados (mismo txid), nunca omitirlos.
+    """
+    cursor.execute("""
+        SELECT DISTINCT empleado_id
+        FROM agenda_cambios
+        WHERE txid >= %s
+          AND empleado_id IS NOT NULL
+          AND (fecha_desde IS NULL OR (fecha_desde <= %s AND fecha_hasta >= %s))
+    """, (xmin, fecha_obj, fecha_obj))
+    return {row['empleado_id'] for row in cursor.fetchall()}
+
+
+def _to_time(val):
+    # Normalización defensiva (horarios es TIME, pero por si llega datetime o texto)
+    if isinstance(val, datetime): return val.time()
+    if isinstance(val, str): return datetime.strptime(val, "%H:%M:%S").time()
+    return val
+
+
+def agenda_dia(cursor, sucursal_id, fecha_obj, solo_empleados=None):
+    """
+    Devuelve (recursos, eventos) del día para la sucursal.
+    solo_empleados: restringe a esos colaboradores (modo delta).
+    El cursor debe ser RealDictCursor.
+    """
+    return agenda_rango(cursor, sucursal_id, fecha_obj, 1, solo_empleados)[fecha_obj.isoformat()]
+
+
+def agenda_rango(cursor, sucursal_id, desde, dias, solo_empleados=None):
+    """
+    Agenda de 'dias' días a partir de 'desde' con un solo juego de consultas
+    (6, sin importar la cantidad de días). Los horarios semanales se expanden
+    por día en Python. Devuelve {'YYYY-MM-DD': (recursos, eventos)} en orden.
+    """
+    fechas = [desde + timedelta(days=d) for d in range(dias)]
+    inicio_rango, _ = rango_dia(fechas[0])
+    _, fin_rango = rango_dia(fechas[-1])
+
+    filtro_empleados = ""
+    params_filtro = []
+    if solo_empleados is not None:
+        filtro_empleados = " AND e.id = ANY(%s)"
+        params_filtro = [list(solo_empleados)]
+
+    # --- 1. RECURSOS (COLABORADORES) ---
+    cursor.execute(f"""
+        SELECT e.id, e.nombre_display as title
+        FROM empleados e
+        WHERE e.activo = TRUE
+          AND e.realiza_servicios = TRUE
+          AND e.id IN (SELECT empleado_id FROM empleado_sucursales WHERE sucursal_id = %s)
+          {filtro_empleados}
+        ORDER BY e.nombres
+    """, [sucursal_id] + params_filtro)
+    empleados = cursor.fetchall()
+
+    resultado = {f.isoformat(): ([], []) for f in fechas}
+    if not empleados:
+        return resultado
+    recursos_ids = [e['id'] for e in empleados]
+
+    # 1.A. Citas por colaborador y día (subquery agrupada, no correlacionada)
+    cursor.execute("""
+        SELECT empleado_id, fecha_hora_inicio::date as dia, COUNT(*) as total
+        FROM reservas
+        WHERE empleado_id = ANY(%s)
+          AND fecha_hora_inicio >= %s AND fecha_hora_inicio < %s
+          AND estado NOT IN %s
+        GROUP BY empleado_id, fecha_hora_inicio::date
+    """, (recursos_ids, inicio_rango, fin_rango, ESTADOS_OCULTOS))
+    citas = {(row['empleado_id'], row['dia']): row['total'] for row in cursor.fetchall()}
+
+    # --- 2. HORARIOS SEMANALES (todos los días de la semana de una vez) ---
+    cursor.execute("""
+        SELECT empleado_id, dia_semana, hora_inicio, hora_fin
+        FROM horarios_empleado
+        WHERE empleado_id = ANY(%s)
+    """, (recursos_ids,))
+    turnos_semana = {}
+    for turno in cursor.fetchall():
+        turnos_semana.setdefault(turno['dia_semana'], []).append(turno)
+
+    # --- 2.1 HORARIOS EXTRA DEL RANGO ---
+    cursor.execute("""
+        SELECT empleado_id, fecha, hora_inicio, hora_fin, motivo
+        FROM horarios_extra
+        WHERE empleado_id = ANY(%s) AND fecha >= %s AND fecha <= %s
+    """, (recursos_ids, fechas[0], fechas[-1]))
+    extras_por_fecha = {}
+    for extra in cursor.fetchall():
+        extras_por_fecha.setdefault(extra['fecha'], []).append(extra)
+
+    # --- 3. AUSENCIAS QUE TOCAN EL RANGO ---
+    cursor.execute("""
+        SELECT empleado_id, fecha_hora_inicio, fecha_hora_fin
+        FROM ausencias_empleado
+        WHERE empleado_id = ANY(%s)
+          AND aprobado = TRUE
+          AND fecha_hora_inicio < %s
+          AND fecha_hora_fin >= %s
+    """, (recursos_ids, fin_rango, inicio_rango))
+    ausencias = cursor.fetchall()
+
+    # --- 4. RESERVAS DEL RANGO ---
+    filtro_reservas = ""
+    params_reservas = [sucursal_id, inicio_rango, fin_rango, ESTADOS_OCULTOS]
+    if solo_empleados is not None:
+        filtro_reservas = " AND r.empleado_id = ANY(%s)"
+        params_reservas.append(recursos_ids)
+
+    cursor.execute(f"""
+        SELECT
+            r.id,
+            r.fecha_hora_inicio as start,
+            r.fecha_hora_fin as end,
+            r.estado,
+            r.empleado_id as "resourceId",
+            r.origen,
+            CONCAT(s.nombre, ' - ', c.razon_social_nombres) as title
+        FROM reservas r
+        JOIN servicios s ON r.servicio_id = s.id
+        LEFT JOIN clientes c ON r.cliente_id = c.id
+        WHERE r.sucursal_id = %s
+          AND r.fecha_hora_inicio >= %s AND r.fecha_hora_inicio < %s
+          AND r.estado NOT IN %s
+          {filtro_reservas}
+    """, params_reservas)
+    reservas_por_fecha = {}
+    for reserva in cursor.fetchall():
+        reservas_por_fecha.setdefault(reserva['start'].date(), []).append(reserva)
+
+    # --- ARMADO POR DÍA (sin consultas) ---
+    for fecha_obj in fechas:
+        fecha_str = fecha_obj.isoformat()
+        inicio_dia, fin_dia = rango_dia(fecha_obj)
+        turnos_dia = turnos_semana.get(fecha_obj.isoweekday(), [])
+        extras_dia = extras_por_fecha.get(fecha_obj, [])
+        recursos, eventos = resultado[fecha_str]
+
+        ids_con_turno = {t['empleado_id'] for t in turnos_dia} | {x['empleado_id'] for x in extras_dia}
+        for e in empleados:
+            recursos.append({
+                "id": e['id'],
+                "title": e['title'],
+                "imagen_url": None,
+                "tiene_turno": (e['id'] in ids_con_turno),
+                "citas_hoy": citas.get((e['id'], fecha_obj), 0)
+            })
+
+        # Para validar horario de reservas: { emp_id: [ (start_time, end_time), ... ] }
+        turnos_validos = {}
+
+        # Horarios (fondo blanco)
+        for turno in turnos_dia:
+            turnos_validos.setdefault(turno['empleado_id'], []).append((turno['hora_inicio'], turno['hora_fin']))
+            eventos.append({
+                "resourceId": turno['empleado_id'],
+                "start": f"{fecha_str}T{turno['hora_inicio']}",
+                "end": f"{fecha_str}T{turno['hora_fin']}",
+                "display": "background",
+                "classNames": ["turno-disponible"]
+            })
+
+        # Horarios extra
+        for extra in extras_dia:
+            turnos_validos.setdefault(extra['empleado_id'], []).append((extra['hora_inicio'], extra['hora_fin']))
+            eventos.append({
+                "resourceId": extra['empleado_id'],
+                "start": f"{fecha_str}T{extra['hora_inicio']}",
+                "end": f"{fecha_str}T{extra['hora_fin']}",
+                "display": "background",
+                "classNames": ["turno-disponible", "turno-extra"],
+                "title": f"Extra: {extra.get('motivo','')}"
+            })
+
+        # Ausencias (fondo rojo): mismo criterio de solape que la vista de un día
+        for ausencia in ausencias:
+            if ausencia['fecha_hora_inicio'] < fin_dia and ausencia['fecha_hora_fin'] >= inicio_dia:
+                eventos.append({
+                    "resourceId": ausencia['empleado_id'],
+                    "start": ausencia['fecha_hora_inicio'].isoformat(),
+                    "end": ausencia['fecha_hora_fin'].isoformat(),
+                    "display": "background",
+                    "classNames": ["bg-danger-subtle"],
+                    "title": "Ausente"
+                })
+
+        # Reservas (tarjetas)
+        for reserva in reservas_por_fecha.get(fecha_obj, []):
+            # 🟢 LÓGICA DE FUERA DE HORARIO: la reserva debe encajar en algún turno del empleado
+            r_start = reserva['start'].time()
+            r_end = reserva['end'].time()
+            fuera_de_horario = not any(
+                r_start >= _to_time(t_start) and r_end <= _to_time(t_end)
+                for t_start, t_end in turnos_validos.get(reserva['resourceId'], [])
+            )
+
+            titulo_final = reserva['title']
+            clases = ["reserva-card"]
+            if fuera_de_horario:
+                clases.append("reserva-fuera-horario")
+                titulo_final = "⚠️ " + titulo_final
+
+            eventos.append({
+                "id": reserva['id'],
+                "resourceId": reserva['resourceId'],
+                "title": titulo_final,
+                "start": reserva['start'].isoformat(),
+                "end": reserva['end'].isoformat(),
+                "extendedProps": {
+                    "estado": reserva['estado'],
+                    "origen": reserva['origen']
+                },
+                "classNames": clases
+            })
+
+    return resultado
+
+
+def reserva_en_conflicto(cursor, empleado_id, inicio, fin, excluir_reserva_id=None):
+    """
+    Reserva activa del colaborador que se solapa con [inicio, fin). Se usa para
+    explicar un rechazo de la restricción reservas_sin_solape (migración 0007),
+    después del rollback. Devuelve un dict listo para JSON o None.
+    """
+    cursor.execute("""
+        SELECT r.id, r.fecha_hora_inicio, r.fecha_hora_fin, r.estado,
+               s.nombre as servicio,
+               CONCAT(c.razon_social_nombres, ' ', COALESCE(c.apellidos, '')) as cliente
+        FROM reservas r
+        JOIN servicios s ON r.servicio_id = s.id
+        LEFT JOIN clientes c ON r.cliente_id = c.id
+        WHERE r.empleado_id = %s
+          AND r.estado NOT IN %s
+          AND NOT r.solape_heredado
+          AND r.fecha_hora_inicio < %s AND r.fecha_hora_fin > %s
+          AND r.id IS DISTINCT FROM %s
+        ORDER BY r.fecha_hora_inicio
+        LIMIT 1
+    """, (empleado_id, ESTADOS_OCULTOS, fin, inicio, excluir_reserva_id))
+    fila = cursor.fetchone()
+    if not fila:
+        return None
+    return {
+        "id": fila['id'],
+        "inicio": fila['fecha_hora_inicio'].isoformat(),
+        "fin": fila['fecha_hora_fin'].isoformat(),
+        "estado": fila['estado'],
+        "servicio": fila['servicio'],
+        "cliente": fila['cliente'].strip()
+    }
@@ -0,0 +1,120 @@
+import json
+import hashlib
+import threading
+from .. import versiones
+from ..utils.fechas import hoy_lima
+from . import agenda
+
+# ---------------------------------------------------------
+# CATÁLOGO DEL POS (colaboradores, servicios, productos, campañas)
+# ---------------------------------------------------------
+# La pantalla de venta consultaba las 4 tablas en cada carga. Ahora el navegador
+# pide /api/pos/catalogo y lo guarda en su caché HTTP: mientras la versión no
+# cambie la respuesta es un 304 sin tocar la BD (la versión se lee de memoria,
+# ver versiones.py).
+#
+# La versión 'catalogo' la incrementan triggers (migración 0011) en servicios,
+# productos (salvo cambios solo de stock), campañas y empleados, así que vale para
+# cualquier pantalla que los edite. El stock cambia en cada venta: no invalida el
+# catálogo, se refresca con /api/pos/stock?desde=<token> (solo productos cuyo
+# stock cambió desde el token, vía productos.stock_txid).
+
+CLAVE_VERSION = 'catalogo'
+
+_cache = {}  # sucursal_id -> (etag, cuerpo_json)
+_lock = threading.Lock()
+
+
+def etag(sucursal_id):
+    """
+    ETag sin consultar la BD: versión del catálogo + día (las campañas vigentes
+    dependen de la fecha). None si la versión no se pudo leer.
+    """
+    version = versiones.version(CLAVE_VERSION)
+    if version is None:
+        return None
+    return f"cat-{sucursal_id}-{version}-{hoy_lima().isoformat()}"
+
+
+def _leer(cursor, sucursal_id):
+    token = agenda.token_actual(cursor)  # antes de leer el stock, para el delta
+
+    cursor.execute("""
+        SELECT id, nombre_display FROM empleados
+        WHERE activo = TRUE AND realiza_ventas = TRUE ORDER BY nombres
+    """)
+    empleados = cursor.fetchall()
+
+    cursor.execute("SELECT id, nombre, precio FROM servicios WHERE activo = TRUE ORDER BY orden ASC, nombre ASC")
+    servicios = [{'id': s['id'], 'nombre': s['nombre'], 'precio': float(s['precio'] or 0)} for s in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT p.id, p.nombre, p.precio_venta, p.stock_actual, m.nombre AS marca_nombre
+        FROM productos p
+        LEFT JOIN marcas m ON p.marca_id = m.id
+        WHERE p.activo = TRUE
+        ORDER BY p.orden ASC, p.nombre ASC
+    """)
+    productos = [{
+        'id': p['id'],
+        'nombre': f"{p['nombre']} ({p['marca_nombre']})" if p['marca_nombre'] else p['nombre'],
+        'precio': float(p['precio_venta'] or 0),
+        'stock': p['stock_actual'] or 0
+    } for p in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT id, nombre FROM campanas
+        WHERE activo = TRUE AND CURRENT_DATE BETWEEN fecha_inicio AND fecha_fin
+        ORDER BY nombre
+    """)
+    campanas = cursor.fetchall()
+
+    return {
+        'sucursal_id': sucursal_id,
+        'stock_token': token,
+        'empleados': empleados,
+        'servicios': servicios,
+        'productos': productos,
+        'campanas': campanas
+    }
+
+
+def snapshot(cursor, sucursal_id):
+    """
+    Devuelve (etag, cuerpo_json) del catálogo. Reusa el armado en memoria del
+    worker mientras el ETag no cambie. El cursor debe ser RealDictCursor.
+    """
+    actual = etag(sucursal_id)
+    if actual:
+        with _lock:
+            guardado = _cache.get(sucursal_id)
+        if guardado and guardado[0] == actual:
+            return guardado
+
+    cuerpo = json.dumps(_leer(cursor, sucursal_id), default=str)
+    if not actual:
+        # Sin versión fiable: ETag por contenido y sin guardar en memoria
+        return f"cat-{hashlib.sha256(cuerpo.encode()).hexdigest()[:32]}", cuerpo
+
+    with _lock:
+        _cache[sucursal_id] = (actual, cuerpo)
+    return actual, cuerpo
+
+
+def stock_delta(cursor, token):
+    """
+    Stock de los productos modificados desde el token (o de todos si el token no
+    sirve). Devuelve {'token', 'completo', 'productos': [{'id', 'stock'}]}.
+    """
+    xmin = agenda.leer_token(token) if token else None
+    nuevo_token = agenda.token_actual(cursor)
+    if xmin is None:
+        cursor.execute("SELECT id, stock_actual FROM productos WHERE activo = TRUE")
+    else:
+        # Puede repetir productos ya entregados (mismo txid), nunca omitirlos
+        cursor.execute("SELECT id, stock_actual FROM productos WHERE stock_txid >= %s", (xmin,))
+    return {
+        'token': nuevo_token,
+        'completo': xmin is None,
+        'productos': [{'id': f['id'], 'stock': f['stock_actual'] or 0} for f in cursor.fetchall()]
+    }
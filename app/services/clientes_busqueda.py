@@ -0,0 +1,226 @@
+import re
+
+# ---------------------------------------------------------
+# BÚSQUEDA DE CLIENTES (y alumnos de la escuela)
+# ---------------------------------------------------------
+# Una sola búsqueda para todas las pantallas: POS, listado de clientes, API de
+# Select2, marketing y la escuela. buscar() encuentra el término en cualquier
+# parte del nombre, apellidos, documento o teléfono, sin importar tildes ni
+# mayúsculas ("munoz" encuentra a "Muñoz"), con índices de trigramas sobre las
+# expresiones de nombre y dígitos de cada fuente (migración 0015; las de _FUENTES
+# deben coincidir textualmente con las del índice para que Postgres lo use).
+#
+# Cada palabra del término debe aparecer (las de solo dígitos se buscan en
+# documento/teléfono). Si ninguna palabra coincide tal cual, se aceptan nombres
+# parecidos (similitud de palabra de pg_trgm) para tolerar errores de tipeo.
+# Orden: documento/teléfono exacto, luego similitud (en escalones de 0.1) y,
+# dentro del mismo escalón, el cliente con la visita más reciente.
+#
+# Con términos de menos de 3 letras los trigramas no sirven: se usa la búsqueda
+# por prefijo con índices text_pattern_ops (migración 0010), como antes en el POS:
+#   0 documento o teléfono exacto, 1 prefijo de documento/teléfono,
+#   2 prefijo del nombre, 3 prefijo del apellido.
+# Al abrirse el selector del POS se muestran los clientes recientes/frecuentes
+# de la sucursal (precargados en la página, sin esperar al servidor).
+
+LIMITE_RESULTADOS = 20
+MIN_TRIGRAMA = 3
+CANDIDATOS_POR_RESULTADO = 5
+LIMITE_FRECUENTES = 15
+DIAS_FRECUENTES = 60
+
+_COLUMNAS = """
+    c.id, c.razon_social_nombres, c.apellidos, c.numero_documento, c.telefono,
+    TO_CHAR(c.fecha_nacimiento, 'YYYY-MM-DD') AS fecha_nac_str,
+    c.cumpleanos_validado, c.rechazo_dato_cumpleanos, c.saldo_monedero
+"""
+
+# Columnas del listado de clientes (/clientes)
+COLUMNAS_LISTADO = """
+    c.id, c.razon_social_nombres, c.apellidos, c.tipo_documento,
+    c.numero_documento, c.telefono, c.puntos_fidelidad
+"""
+
+# Tablas donde se puede buscar: expresiones indexadas (migración 0015) y cómo
+# obtener la fecha que desempata por recencia
+_FUENTES = {
+    'clientes': {
+        'tabla': 'clientes',
+        'nombre': "normalizar_busqueda(COALESCE(c.razon_social_nombres, '') || ' ' || COALESCE(c.apellidos, ''))",
+        'digitos': "(solo_digitos(c.numero_documento) || ' ' || solo_digitos(c.telefono))",
+        'recencia': "SELECT MAX(v.fecha_venta) AS ultima FROM ventas v WHERE v.cliente_receptor_id = c.id",
+    },
+    'alumnos': {
+        'tabla': 'escuela_alumnos',
+        'nombre': ("normalizar_busqueda(COALESCE(c.nombres, '') || ' ' || COALESCE(c.apellidos, '')"
+                   " || ' ' || COALESCE(c.codigo_alumno, ''))"),
+        'digitos': ("(solo_digitos(c.dni) || ' ' || solo_digitos(c.telefono)"
+                    " || ' ' || solo_digitos(c.codigo_alumno))"),
+        'recencia': "SELECT c.fecha_inscripcion AS ultima",
+    },
+}
+
+
+def _escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def a_resultado(c):
+    """Fila de clientes -> opción Select2 con los datos que usa el POS."""
+    nombre_full = f"{c['razon_social_nombres']} {c['apellidos'] or ''}".strip()
+    doc = c['numero_documento'] or 'S/D'
+    tel = c['telefono'] or ''
+    return {
+        "id": c['id'],
+        "text": f"{nombre_full} | Doc: {doc} | Tel: {tel}",
+        "documento": c['numero_documento'] or '',
+        "fecha": c['fecha_nac_str'] or '',
+        "validado": bool(c['cumpleanos_validado']),
+        "rechazo": bool(c['rechazo_dato_cumpleanos']),
+        "saldo": float(c['saldo_monedero'] or 0)
+    }
+
+
+def _palabras(termino):
+    """Separa el término en palabras; en las numéricas quita '+' y el 51 de un celular pegado."""
+    palabras = []
+    for palabra in termino.split():
+        digitos = palabra.replace('+', '')
+        if digitos.isdigit():
+            if digitos.startswith('51') and len(digitos) == 11:
+                digitos = digitos[2:]
+            palabras.append((True, digitos))
+        else:
+            palabras.append((False, palabra))
+    return palabras
+
+
+def buscar(cursor, termino, limite=LIMITE_RESULTADOS, columnas=_COLUMNAS, fuente='clientes'):
+    """
+    Búsqueda compartida: filas de `fuente` ('clientes' o 'alumnos') que contienen
+    cada palabra del término, ordenadas por relevancia y recencia.
+    `columnas` usa el alias c (por defecto, las que necesita el POS).
+    """
+    termino = (termino or '').strip()
+    if not termino:
+        return []
+    palabras = _palabras(termino)
+    if fuente == 'clientes' and all(len(p) < MIN_TRIGRAMA for _, p in palabras):
+        return _buscar_prefijo(cursor, termino, limite, columnas)
+
+    tabla = _FUENTES[fuente]['tabla']
+    nombre, digitos = _FUENTES[fuente]['nombre'], _FUENTES[fuente]['digitos']
+    en_nombre, en_digitos, params = [], [], {}
+    for i, (es_numero, palabra) in enumerate(palabras):
+        params[f"p{i}"] = _escapar_like(palabra)
+        if es_numero:
+            en_digitos.append(f"{digitos} LIKE '%%' || %(p{i})s || '%%'")
+        else:
+            en_nombre.append(f"{nombre} LIKE '%%' || normalizar_busqueda(%(p{i})s) || '%%'")
+
+    texto = ' '.join(p for es_numero, p in palabras if not es_numero)
+    numeros = [p for es_numero, p in palabras if es_numero]
+    filtro = ' AND '.join(en_nombre + en_digitos)
+    if texto:
+        # Tolerancia a errores de tipeo en el texto (usa el mismo índice de trigramas)
+        parecido = ' AND '.join([f"normalizar_busqueda(%(texto)s) <%% {nombre}"] + en_digitos)
+        filtro = f"(({filtro}) OR ({parecido}))"
+    exacto = f"(' ' || {digitos} || ' ') LIKE %(exacto)s" if numeros else 'FALSE'
+
+    params.update({
+        'texto': texto,
+        'exacto': f"% {max(numeros, key=len)} %" if numeros else None,
+        'candidatos': limite * CANDIDATOS_POR_RESULTADO,
+        'limite': limite,
+    })
+    cursor.execute(f"""
+        WITH candidatos AS (
+            SELECT c.id, {exacto} AS exacto,
+                   word_similarity(normalizar_busqueda(%(texto)s), {nombre}) AS similitud
+            FROM {tabla} c
+            WHERE {filtro}
+            ORDER BY 2 DESC, 3 DESC
+            LIMIT %(candidatos)s
+        )
+        SELECT {columnas}
+        FROM candidatos k
+        JOIN {tabla} c ON c.id = k.id
+        LEFT JOIN LATERAL ({_FUENTES[fuente]['recencia']}) r ON TRUE
+        ORDER BY k.exacto DESC, round(k.similitud::numeric, 1) DESC, r.ultima DESC NULLS LAST, c.id DESC
+        LIMIT %(limite)s
+    """, params)
+    return cursor.fetchall()
+
+
+def _buscar_prefijo(cursor, termino, limite, columnas):
+    """Clientes cuyo nombre, apellido, documento o teléfono empiezan con el término."""
+    solo_digitos = re.sub(r'[\s+]', '', termino)
+    if solo_digitos.startswith('51') and len(solo_digitos) == 11:
+        solo_digitos = solo_digitos[2:]  # teléfono pegado con +51
+
+    if solo_digitos.isdigit():
+        prefijo = _escapar_like(solo_digitos) + '%'
+        sql_ramas = """
+            (SELECT id, CASE WHEN numero_documento = %(exacto)s THEN 0 ELSE 1 END AS rango
+             FROM clientes WHERE numero_documento LIKE %(prefijo)s
+             ORDER BY numero_documento LIMIT %(limite)s)
+            UNION ALL
+            (SELECT id, CASE WHEN telefono = %(exacto)s THEN 0 ELSE 1 END AS rango
+             FROM clientes WHERE telefono LIKE %(prefijo)s
+             ORDER BY telefono LIMIT %(limite)s)
+        """
+        params = {'exacto': solo_digitos, 'prefijo': prefijo, 'limite': limite}
+    else:
+        prefijo = _escapar_like(termino.lower()) + '%'
+        sql_ramas = """
+            (SELECT id, 2 AS rango
+             FROM clientes WHERE lower(razon_social_nombres) LIKE %(prefijo)s
+             ORDER BY lower(razon_social_nombres) LIMIT %(limite)s)
+            UNION ALL
+            (SELECT id, 3 AS rango
+             FROM clientes WHERE lower(apellidos) LIKE %(prefijo)s
+             ORDER BY lower(apellidos) LIMIT %(limite)s)
+        """
+        params = {'prefijo': prefijo, 'limite': limite}
+
+    cursor.execute(f"""
+        WITH candidatos AS ({sql_ramas}),
+        mejores AS (SELECT id, MIN(rango) AS rango FROM candidatos GROUP BY id)
+        SELECT {columnas}
+        FROM mejores m
+        JOIN clientes c ON c.id = m.id
+        ORDER BY m.rango, c.razon_social_nombres, c.apellidos
+        LIMIT %(limite)s
+    """, params)
+    return cursor.fetchall()
+
+
+def frecuentes(cursor, sucursal_id, limite=LIMITE_FRECUENTES):
+    """
+    Clientes con compras recientes en la sucursal: primero los de más visitas en
+    los últimos DIAS_FRECUENTES días, desempatando por la última visita.
+    """
+    if not sucursal_id:
+        return []
+    cursor.execute(f"""
+        WITH visitas AS (
+            SELECT v.cliente_receptor_id AS id, COUNT(*) AS n, MAX(v.fecha_venta) AS ultima
+            FROM ventas v
+            WHERE v.sucursal_id = %s
+              AND v.fecha_venta >= CURRENT_DATE - %s
+              AND v.cliente_receptor_id IS NOT NULL
+            GROUP BY v.cliente_receptor_id
+            ORDER BY n DESC, ultima DESC
+            LIMIT %s
+        )
+        SELECT {_COLUMNAS}
+        FROM visitas vi
+        JOIN clientes c ON c.id = vi.id
+        ORDER BY vi.n DESC, vi.ultima DESC
+    """, (sucursal_id, DIAS_FRECUENTES, limite))
+    return cursor.fetchall()
+
+
+def por_id(cursor, cliente_id):
+    cursor.execute(f"SELECT {_COLUMNAS} FROM clientes c WHERE c.id = %s", (cliente_id,))
+    return cursor.fetchone()
@@ -0,0 +1,106 @@
+# ---------------------------------------------------------
+# CORRELATIVOS DE COMPROBANTES (series_comprobantes)
+# ---------------------------------------------------------
+# El número se asigna con un solo UPDATE ... RETURNING sobre la fila de la serie:
+# el incremento es atómico y la fila queda bloqueada hasta el COMMIT de la venta,
+# así que dos cajas nunca obtienen el mismo número. Solo esperan entre sí las
+# ventas de la MISMA serie, y únicamente por el resto de su transacción: por eso
+# nueva_venta inserta la venta sin número y la numera con numerar_venta() como
+# última sentencia antes del COMMIT (la espera es de un UPDATE, no de la venta).
+# Si la venta aborta, el ROLLBACK deshace también el incremento: los únicos huecos
+# posibles son ajustes manuales del correlativo o ventas eliminadas (huecos_serie).
+#
+# Además ventas tiene un índice único sobre
+# (sucursal_id, tipo_comprobante, serie_comprobante, numero_comprobante)
+# (migraciones 0009 y 0019): las series son por sucursal y dos sucursales pueden
+# usar el mismo código de serie.
+
+
+INDICE_UNICO = 'uq_ventas_correlativo_sucursal'
+
+
+class SinSerieActiva(ValueError):
+    pass
+
+
+def asignar_numero(cursor, sucursal_id, tipo_comprobante):
+    """
+    Reserva el siguiente número de la serie activa de la sucursal para el tipo.
+    Devuelve (serie, numero_int, numero_str con 8 dígitos).
+    Debe llamarse dentro de la transacción que inserta/actualiza la venta.
+    """
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            UPDATE series_comprobantes
+            SET ultimo_numero = ultimo_numero + 1
+            WHERE id = (
+                SELECT id FROM series_comprobantes
+                WHERE sucursal_id = %s AND tipo_comprobante = %s AND activo = TRUE
+                ORDER BY serie DESC LIMIT 1
+            )
+            RETURNING serie, ultimo_numero
+        """, (sucursal_id, tipo_comprobante))
+        fila = cur.fetchone()
+    if not fila:
+        raise SinSerieActiva(f"No hay una serie activa configurada para '{tipo_comprobante}' en esta sucursal.")
+    serie, numero = fila
+    return serie, numero, str(numero).zfill(8)
+
+
+def numerar_venta(cursor, venta_id, sucursal_id, tipo_comprobante):
+    """
+    Asigna serie y número a una venta ya insertada. Llamar justo antes del COMMIT:
+    la fila de la serie queda bloqueada desde aquí. Devuelve lo mismo que asignar_numero.
+    """
+    serie, numero, numero_str = asignar_numero(cursor, sucursal_id, tipo_comprobante)
+    with cursor.connection.cursor() as cur:
+        cur.execute(
+            "UPDATE ventas SET serie_comprobante = %s, numero_comprobante = %s WHERE id = %s",
+            (serie, numero_str, venta_id)
+        )
+    return serie, numero, numero_str
+
+
+def numero_maximo_emitido(cursor, sucursal_id, tipo_comprobante, serie):
+    """Mayor número ya usado en ventas de la sucursal para la serie (0 si no hay)."""
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            SELECT COALESCE(MAX(numero_comprobante::bigint), 0)
+            FROM ventas
+            WHERE sucursal_id = %s AND tipo_comprobante = %s AND serie_comprobante = %s
+              AND numero_comprobante ~ '^[0-9]+$'
+        """, (sucursal_id, tipo_comprobante, serie))
+        return cur.fetchone()[0]
+
+
+def huecos_serie(cursor, serie_id):
+    """
+    Números de 1..ultimo_numero de la serie que no tienen venta en su sucursal (p.ej. por ajustes
+    manuales del correlativo o ventas eliminadas). Se devuelven agrupados en
+    rangos: [{'desde', 'hasta', 'cantidad'}].
+    """
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            WITH cfg AS (
+                SELECT sucursal_id, tipo_comprobante, serie, ultimo_numero
+                FROM series_comprobantes WHERE id = %s
+            ),
+            usados AS (
+                SELECT DISTINCT v.numero_comprobante::bigint AS n
+                FROM ventas v, cfg
+                WHERE v.sucursal_id = cfg.sucursal_id
+                  AND v.tipo_comprobante = cfg.tipo_comprobante
+                  AND v.serie_comprobante = cfg.serie
+                  AND v.numero_comprobante ~ '^[0-9]+$'
+            ),
+            faltantes AS (
+                SELECT g.n
+                FROM cfg, generate_series(1::bigint, cfg.ultimo_numero::bigint) AS g(n)
+                WHERE NOT EXISTS (SELECT 1 FROM usados u WHERE u.n = g.n)
+            )
+            SELECT MIN(n) AS desde, MAX(n) AS hasta, COUNT(*) AS cantidad
+            FROM (SELECT n, n - ROW_NUMBER() OVER (ORDER BY n) AS grupo FROM faltantes) t
+            GROUP BY grupo
+            ORDER BY desde
+        """, (serie_id,))
+        return [{'desde': d, 'hasta': h, 'cantidad': c} for d, h, c in cur.fetchall()]
@@ -0,0 +1,353 @@
+# ---------------------------------------------------------
+# DEVENGO DE COMISIONES (libro + resumen diario)
+# ---------------------------------------------------------
+# Planilla, métricas del fondo y caja recalculaban la producción y comisiones
+# del periodo recorriendo ventas / venta_items / comisiones en cada apertura.
+# Ahora cada venta publica su devengo en comision_devengos (solo inserción),
+# agrupado por colaborador, sucursal, día y fuente:
+#   SERVICIO    servicios normales (base de la comisión escalonada de planilla)
+#   HORA_EXTRA  servicios en hora extra (comisión = comision_servicio_extra)
+#   PRODUCTO    productos (comisión fija de la tabla comisiones)
+# y en la misma sentencia actualiza comision_resumen_diario, que es lo que leen
+# las pantallas (a lo más ~31 filas por colaborador y mes).
+#
+# sincronizar() publica la DIFERENCIA entre lo que la venta debería devengar hoy
+# y lo ya registrado: sirve igual para venta nueva, edición, anulación (objetivo
+# 0) o eliminación, y repetirla no cambia nada. Los pagos (planilla y caja) solo
+# tocan las columnas *_liquidada / *_pagada del resumen. Lo pagado por caja de una
+# venta que luego se anula pasa de comision_pagada a comision_pagada_anulada
+# (anular_pagos): así comision - comision_pagada no queda negativo y lo entregado
+# de más sigue visible.
+# `flask comisiones-verificar` compara todo contra el origen y
+# `flask comisiones-rebuild` lo recalcula.
+
+SERVICIO = 'SERVICIO'
+HORA_EXTRA = 'HORA_EXTRA'
+PRODUCTO = 'PRODUCTO'
+
+# Devengo que corresponde a las ventas del filtro según los datos de origen.
+# Las anuladas (y las eliminadas, que ya no aparecen) devengan 0.
+_SQL_OBJETIVO = """
+    SELECT v.empleado_id, COALESCE(v.sucursal_id, 0) AS sucursal_id, v.fecha_venta::date AS dia,
+           CASE WHEN vi.producto_id IS NOT NULL THEN 'PRODUCTO'
+                WHEN vi.es_hora_extra THEN 'HORA_EXTRA'
+                ELSE 'SERVICIO' END AS fuente,
+           v.id AS venta_id,
+           SUM(COALESCE(vi.subtotal_item_neto, 0)) AS produccion,
+           SUM(CASE WHEN vi.producto_id IS NOT NULL
+                    THEN COALESCE((SELECT SUM(c.monto_comision) FROM comisiones c WHERE c.venta_item_id = vi.id), 0)
+                    WHEN vi.es_hora_extra THEN COALESCE(vi.comision_servicio_extra, 0)
+                    ELSE 0 END) AS comision
+    FROM ventas v
+    JOIN venta_items vi ON vi.venta_id = v.id
+    WHERE ({filtro_ventas})
+      AND v.empleado_id IS NOT NULL
+      AND COALESCE(v.estado_pago, '') <> 'Anulado'
+      AND (vi.producto_id IS NOT NULL OR vi.servicio_id IS NOT NULL)
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+# Diferencia objetivo - registrado por venta y clave
+_SQL_DIFERENCIAS = """
+    WITH objetivo AS ({objetivo}),
+    registrado AS (
+        SELECT empleado_id, sucursal_id, dia, fuente, venta_id,
+               SUM(produccion) AS produccion, SUM(comision) AS comision
+        FROM comision_devengos d
+        WHERE ({filtro_devengos})
+        GROUP BY 1, 2, 3, 4, 5
+    )
+    SELECT COALESCE(o.empleado_id, r.empleado_id) AS empleado_id,
+           COALESCE(o.sucursal_id, r.sucursal_id) AS sucursal_id,
+           COALESCE(o.dia, r.dia) AS dia,
+           COALESCE(o.fuente, r.fuente) AS fuente,
+           COALESCE(o.venta_id, r.venta_id) AS venta_id,
+           COALESCE(o.produccion, 0) - COALESCE(r.produccion, 0) AS produccion,
+           COALESCE(o.comision, 0) - COALESCE(r.comision, 0) AS comision
+    FROM objetivo o
+    FULL JOIN registrado r
+      ON r.venta_id = o.venta_id AND r.empleado_id = o.empleado_id AND r.sucursal_id = o.sucursal_id
+     AND r.dia = o.dia AND r.fuente = o.fuente
+    WHERE COALESCE(o.produccion, 0) <> COALESCE(r.produccion, 0)
+       OR COALESCE(o.comision, 0) <> COALESCE(r.comision, 0)
+"""
+
+# Comisiones ya pagadas desde caja, por clave del resumen y según la venta esté anulada
+_SQL_PAGOS = """
+    SELECT v.empleado_id, COALESCE(v.sucursal_id, 0) AS sucursal_id, v.fecha_venta::date AS dia,
+           'PRODUCTO' AS fuente, COALESCE(v.estado_pago, '') = 'Anulado' AS anulada,
+           SUM(c.monto_comision) AS pagado
+    FROM comisiones c
+    JOIN venta_items vi ON vi.id = c.venta_item_id
+    JOIN ventas v ON v.id = vi.venta_id
+    WHERE ({filtro_ventas}) AND c.estado = 'Pagada' AND v.empleado_id IS NOT NULL AND vi.producto_id IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+    UNION ALL
+    SELECT v.empleado_id, COALESCE(v.sucursal_id, 0), v.fecha_venta::date,
+           'HORA_EXTRA', COALESCE(v.estado_pago, '') = 'Anulado',
+           SUM(COALESCE(vi.comision_servicio_extra, 0))
+    FROM venta_items vi
+    JOIN ventas v ON v.id = vi.venta_id
+    WHERE ({filtro_ventas}) AND vi.es_hora_extra AND vi.entregado_al_colaborador AND vi.producto_id IS NULL
+      AND v.empleado_id IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+# Resumen calculado desde cero: libro + estado de pago en las tablas de origen
+_SQL_RESUMEN_ORIGEN = """
+    WITH libro AS (
+        SELECT d.empleado_id, d.sucursal_id, d.dia, d.fuente,
+               SUM(d.produccion) AS produccion, SUM(d.comision) AS comision,
+               SUM(CASE WHEN v.pago_nomina_id IS NOT NULL THEN d.produccion ELSE 0 END) AS produccion_liquidada
+        FROM comision_devengos d
+        LEFT JOIN ventas v ON v.id = d.venta_id
+        GROUP BY 1, 2, 3, 4
+    ),
+    pagos AS (
+        SELECT empleado_id, sucursal_id, dia, fuente,
+               SUM(pagado) FILTER (WHERE NOT anulada) AS comision_pagada,
+               SUM(pagado) FILTER (WHERE anulada) AS comision_pagada_anulada
+        FROM ({pagos}) t
+        GROUP BY 1, 2, 3, 4
+    )
+    -- Pagos solo donde hay devengo (igual que registrar_pago, que no crea filas)
+    SELECT l.empleado_id, l.sucursal_id, l.dia, l.fuente, l.produccion, l.comision, l.produccion_liquidada,
+           COALESCE(p.comision_pagada, 0) AS comision_pagada,
+           COALESCE(p.comision_pagada_anulada, 0) AS comision_pagada_anulada
+    FROM libro l
+    LEFT JOIN pagos p
+      ON p.empleado_id = l.empleado_id AND p.sucursal_id = l.sucursal_id
+     AND p.dia = l.dia AND p.fuente = l.fuente
+""".format(pagos=_SQL_PAGOS.format(filtro_ventas='TRUE'))
+
+
+def _filtros(venta_ids):
+    if venta_ids is None:
+        return 'TRUE', 'TRUE', {}
+    return 'v.id = ANY(%(ventas)s)', 'd.venta_id = ANY(%(ventas)s)', {'ventas': list(venta_ids)}
+
+
+def sincronizar(cursor, venta_ids, motivo):
+    """
+    Publica en el libro la diferencia entre el devengo actual de las ventas y lo
+    ya registrado, y la suma al resumen diario. venta_ids=None = todas las ventas.
+    Devuelve cuántos movimientos se registraron.
+    """
+    filtro_ventas, filtro_devengos, params = _filtros(venta_ids)
+    if venta_ids is not None and not params['ventas']:
+        return 0
+    diferencias = _SQL_DIFERENCIAS.format(
+        objetivo=_SQL_OBJETIVO.format(filtro_ventas=filtro_ventas),
+        filtro_devengos=filtro_devengos
+    )
+    with cursor.connection.cursor() as cur:
+        cur.execute(f"""
+            WITH dif AS ({diferencias}),
+            nuevos AS (
+                INSERT INTO comision_devengos (empleado_id, sucursal_id, dia, fuente, venta_id, motivo, produccion, comision)
+                SELECT empleado_id, sucursal_id, dia, fuente, venta_id, %(motivo)s, produccion, comision
+                FROM dif
+                RETURNING empleado_id, sucursal_id, dia, fuente, venta_id, produccion, comision
+            ),
+            agregado AS (
+                SELECT n.empleado_id, n.sucursal_id, n.dia, n.fuente,
+                       SUM(n.produccion) AS produccion, SUM(n.comision) AS comision,
+                       SUM(CASE WHEN v.pago_nomina_id IS NOT NULL THEN n.produccion ELSE 0 END) AS liquidada
+                FROM nuevos n
+                LEFT JOIN ventas v ON v.id = n.venta_id
+                GROUP BY 1, 2, 3, 4
+            ),
+            resumen AS (
+                INSERT INTO comision_resumen_diario AS r
+                       (empleado_id, sucursal_id, dia, fuente, produccion, comision, produccion_liquidada)
+                SELECT empleado_id, sucursal_id, dia, fuente, produccion, comision, liquidada
+                FROM agregado
+                ORDER BY empleado_id, sucursal_id, dia, fuente
+                ON CONFLICT (empleado_id, sucursal_id, dia, fuente) DO UPDATE
+                SET produccion = r.produccion + EXCLUDED.produccion,
+                    comision = r.comision + EXCLUDED.comision,
+                    produccion_liquidada = r.produccion_liquidada + EXCLUDED.produccion_liquidada
+            )
+            SELECT COUNT(*) FROM nuevos
+        """, dict(params, motivo=motivo))
+        return cur.fetchone()[0]
+
+
+def liquidar_ventas(cursor, venta_ids):
+    """Suma a produccion_liquidada el devengo de las ventas incluidas en una planilla."""
+    if not venta_ids:
+        return
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            WITH d AS (
+                SELECT empleado_id, sucursal_id, dia, fuente, SUM(produccion) AS produccion
+                FROM comision_devengos
+                WHERE venta_id = ANY(%s)
+                GROUP BY 1, 2, 3, 4
+            )
+            UPDATE comision_resumen_diario r
+            SET produccion_liquidada = r.produccion_liquidada + d.produccion
+            FROM d
+            WHERE r.empleado_id = d.empleado_id AND r.sucursal_id = d.sucursal_id
+              AND r.dia = d.dia AND r.fuente = d.fuente
+        """, (list(venta_ids),))
+
+
+def registrar_pago(cursor, venta_item_id, monto):
+    """
+    Suma a comision_pagada del día/fuente de la venta del ítem (pago desde caja);
+    si la venta ya está anulada, a comision_pagada_anulada.
+    """
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            UPDATE comision_resumen_diario r
+            SET comision_pagada = r.comision_pagada
+                    + CASE WHEN COALESCE(v.estado_pago, '') = 'Anulado' THEN 0 ELSE %(monto)s END,
+                comision_pagada_anulada = r.comision_pagada_anulada
+                    + CASE WHEN COALESCE(v.estado_pago, '') = 'Anulado' THEN %(monto)s ELSE 0 END
+            FROM venta_items vi
+            JOIN ventas v ON v.id = vi.venta_id
+            WHERE vi.id = %(item)s
+              AND r.empleado_id = v.empleado_id AND r.sucursal_id = COALESCE(v.sucursal_id, 0)
+              AND r.dia = v.fecha_venta::date
+              AND r.fuente = CASE WHEN vi.producto_id IS NOT NULL THEN 'PRODUCTO'
+                                  WHEN vi.es_hora_extra THEN 'HORA_EXTRA' ELSE 'SERVICIO' END
+        """, {'monto': monto, 'item': venta_item_id})
+
+
+def anular_pagos(cursor, venta_ids):
+    """
+    Al anular ventas: lo que ya se pagó por caja de sus comisiones deja de contar
+    como pagado del devengo (que pasó a 0) y queda en comision_pagada_anulada.
+    Llamar una sola vez por venta, en la misma transacción que la anulación.
+    """
+    if not venta_ids:
+        return
+    with cursor.connection.cursor() as cur:
+        cur.execute(f"""
+            WITH p AS ({_SQL_PAGOS.format(filtro_ventas='v.id = ANY(%(ventas)s)')})
+            UPDATE comision_resumen_diario r
+            SET comision_pagada = r.comision_pagada - p.pagado,
+                comision_pagada_anulada = r.comision_pagada_anulada + p.pagado
+            FROM p
+            WHERE r.empleado_id = p.empleado_id AND r.sucursal_id = p.sucursal_id
+              AND r.dia = p.dia AND r.fuente = p.fuente
+        """, {'ventas': list(venta_ids)})
+
+
+def ventas_con_pagos(cursor, venta_ids):
+    """Ids de las ventas que ya tienen alguna comisión pagada desde caja."""
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT v.id
+            FROM ventas v
+            JOIN venta_items vi ON vi.venta_id = v.id
+            LEFT JOIN comisiones c ON c.venta_item_id = vi.id AND c.estado = 'Pagada'
+            WHERE v.id = ANY(%s) AND (c.id IS NOT NULL OR (vi.es_hora_extra AND vi.entregado_al_colaborador))
+        """, (list(venta_ids),))
+        return [fila[0] for fila in cur.fetchall()]
+
+
+def totales(cursor, empleado_id, desde, hasta, fuentes):
+    """
+    Suma del resumen diario para un colaborador entre dos fechas (inclusive).
+    Devuelve {'produccion', 'comision', 'pagable'} (pagable = aún no liquidada en planilla).
+    """
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            SELECT COALESCE(SUM(produccion), 0), COALESCE(SUM(comision), 0),
+                   COALESCE(SUM(produccion - produccion_liquidada), 0)
+            FROM comision_resumen_diario
+            WHERE empleado_id = %s AND dia BETWEEN %s AND %s AND fuente = ANY(%s)
+        """, (empleado_id, desde, hasta, list(fuentes)))
+        produccion, comision, pagable = cur.fetchone()
+    return {'produccion': float(produccion), 'comision': float(comision), 'pagable': float(pagable)}
+
+
+def pendientes_por_colaborador(cursor, sucursal_id):
+    """Comisiones devengadas aún no pagadas por caja, por colaborador de la sucursal."""
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            SELECT r.empleado_id, e.nombre_display,
+                   SUM(r.comision - r.comision_pagada) FILTER (WHERE r.fuente = 'PRODUCTO') AS productos,
+                   SUM(r.comision - r.comision_pagada) FILTER (WHERE r.fuente = 'HORA_EXTRA') AS extras
+            FROM comision_resumen_diario r
+            JOIN empleados e ON e.id = r.empleado_id
+            WHERE r.sucursal_id = %s AND r.comision <> r.comision_pagada
+            GROUP BY r.empleado_id, e.nombre_display
+            ORDER BY e.nombre_display
+        """, (sucursal_id,))
+        return [{
+            'empleado_id': empleado_id, 'colaborador': nombre,
+            'productos': float(productos or 0), 'extras': float(extras or 0)
+        } for empleado_id, nombre, productos, extras in cur.fetchall()]
+
+
+def reconstruir(cursor):
+    """
+    Registra en el libro las diferencias de TODAS las ventas contra el origen y
+    vuelve a calcular el resumen diario completo. Bloquea el resumen mientras
+    tanto (las ventas que se registren en paralelo esperan).
+    Devuelve (movimientos_nuevos, filas_resumen).
+    """
+    with cursor.connection.cursor() as cur:
+        cur.execute("LOCK TABLE comision_resumen_diario IN EXCLUSIVE MODE")
+    movimientos = sincronizar(cursor, None, 'REBUILD')
+    with cursor.connection.cursor() as cur:
+        cur.execute("DELETE FROM comision_resumen_diario")
+        cur.execute(f"""
+            INSERT INTO comision_resumen_diario
+                   (empleado_id, sucursal_id, dia, fuente, produccion, comision, produccion_liquidada,
+                    comision_pagada, comision_pagada_anulada)
+            SELECT empleado_id, sucursal_id, dia, fuente, produccion, comision, produccion_liquidada,
+                   comision_pagada, comision_pagada_anulada
+            FROM ({_SQL_RESUMEN_ORIGEN}) t
+        """)
+        return movimientos, cur.rowcount
+
+
+def verificar(cursor, limite=50):
+    """
+    Sin escribir nada: (ventas cuyo libro difiere del origen, filas del resumen
+    que difieren del cálculo desde cero, filas del resumen con más pagado por caja
+    que devengado). Cada lista trae como máximo `limite`.
+    """
+    diferencias = _SQL_DIFERENCIAS.format(
+        objetivo=_SQL_OBJETIVO.format(filtro_ventas='TRUE'), filtro_devengos='TRUE'
+    )
+    with cursor.connection.cursor() as cur:
+        cur.execute(f"""
+            SELECT venta_id, empleado_id, dia, fuente, produccion, comision
+            FROM ({diferencias}) t
+            ORDER BY venta_id
+            LIMIT %s
+        """, (limite,))
+        ventas = cur.fetchall()
+
+        cur.execute(f"""
+            SELECT COALESCE(o.empleado_id, r.empleado_id), COALESCE(o.sucursal_id, r.sucursal_id),
+                   COALESCE(o.dia, r.dia), COALESCE(o.fuente, r.fuente)
+            FROM ({_SQL_RESUMEN_ORIGEN}) o
+            FULL JOIN comision_resumen_diario r
+              ON r.empleado_id = o.empleado_id AND r.sucursal_id = o.sucursal_id
+             AND r.dia = o.dia AND r.fuente = o.fuente
+            WHERE (o.produccion, o.comision, o.produccion_liquidada, o.comision_pagada, o.comision_pagada_anulada)
+                  IS DISTINCT FROM (r.produccion, r.comision, r.produccion_liquidada, r.comision_pagada,
+                                    r.comision_pagada_anulada)
+              AND NOT (o.empleado_id IS NULL AND r.produccion = 0 AND r.comision = 0
+                       AND r.produccion_liquidada = 0 AND r.comision_pagada = 0
+                       AND r.comision_pagada_anulada = 0)
+            LIMIT %s
+        """, (limite,))
+        resumen = cur.fetchall()
+
+        # Pendiente de caja negativo (p.ej. una edición bajó la comisión después de pagarla)
+        cur.execute("""
+            SELECT empleado_id, sucursal_id, dia, fuente, comision - comision_pagada
+            FROM comision_resumen_diario
+            WHERE comision_pagada > comision AND fuente <> 'SERVICIO'
+            ORDER BY dia DESC
+            LIMIT %s
+        """, (limite,))
+        negativos = cur.fetchall()
+    return ventas, resumen, negativos
@@ -0,0 +1,235 @@
+import math
+from datetime import datetime, time, timedelta
+import numpy as np
+from .agenda import ESTADOS_OCULTOS
+from ..utils.fechas import a_fecha
+
+# ---------------------------------------------------------
+# MOTOR DE DISPONIBILIDAD (bitmaps por colaborador con NumPy)
+# ---------------------------------------------------------
+# Cada colaborador es una fila y cada columna un bloque de 'resolucion' minutos
+# del rango pedido (1 día = 96 bloques a 15 min). Con 5 consultas (empleados,
+# turnos, extras, ausencias y reservas del rango completo) se pintan tres máscaras:
+#   turno    -> horarios_empleado (semanal) + horarios_extra (por fecha)
+#   ausencia -> ausencias_empleado aprobadas
+#   ocupado  -> reservas activas
+# libre = turno & ~ausencia & ~ocupado. Los intervalos se pintan sin bucles por
+# bloque: +1/-1 en un arreglo de diferencias y suma acumulada.
+
+RESOLUCIONES_API = (5, 15)
+
+
+def _minutos(valor):
+    """TIME, timedelta (psycopg2 a veces devuelve intervalos) o 'HH:MM[:SS]' -> minutos del día."""
+    if isinstance(valor, timedelta):
+        return int(valor.total_seconds() // 60)
+    if isinstance(valor, str):
+        partes = [int(p) for p in valor.split(':')[:2]]
+        return partes[0] * 60 + partes[1]
+    return valor.hour * 60 + valor.minute
+
+
+class MapaDisponibilidad:
+    """Máscaras de disponibilidad de varios colaboradores sobre [desde, desde + dias)."""
+
+    def __init__(self, empleados, desde, dias=1, resolucion=15):
+        if 1440 % resolucion:
+            raise ValueError("La resolución debe dividir el día en bloques enteros.")
+        self.empleados = list(empleados)          # [{'id':..., 'nombre':...}]
+        self.fila = {e['id']: i for i, e in enumerate(self.empleados)}
+        self.desde = datetime.combine(a_fecha(desde), time.min)
+        self.dias = dias
+        self.resolucion = resolucion
+        self.bloques_dia = 1440 // resolucion
+        self.total_bloques = self.bloques_dia * dias
+
+        forma = (len(self.empleados), self.total_bloques)
+        self.turno = np.zeros(forma, dtype=bool)
+        self.ausencia = np.zeros(forma, dtype=bool)
+        self.ocupado = np.zeros(forma, dtype=bool)
+
+    # --- Conversión de tiempos a bloques ---
+    def bloque(self, momento, redondeo=math.floor):
+        minutos = (momento - self.desde).total_seconds() / 60
+        return int(np.clip(redondeo(minutos / self.resolucion), 0, self.total_bloques))
+
+    def momento(self, bloque):
+        return self.desde + timedelta(minutes=int(bloque) * self.resolucion)
+
+    # --- Pintado vectorizado ---
+    def _pintar(self, mascara, intervalos):
+        """intervalos: [(empleado_id, bloque_inicio, bloque_fin)] (fin exclusivo)."""
+        intervalos = [(self.fila[e], a, b) for e, a, b in intervalos if e in self.fila and b > a]
+        if not intervalos:
+            return
+        filas, inicios, fines = (np.array(c) for c in zip(*intervalos))
+        diferencias = np.zeros((mascara.shape[0], mascara.shape[1] + 1), dtype=np.int32)
+        np.add.at(diferencias, (filas, inicios), 1)
+        np.add.at(diferencias, (filas, fines), -1)
+        mascara |= np.cumsum(diferencias[:, :-1], axis=1) > 0
+
+    def _intervalo(self, empleado_id, inicio, fin):
+        # Los bloques parcialmente ocupados cuentan como ocupados (floor/ceil)
+        return (empleado_id, self.bloque(inicio), self.bloque(fin, math.ceil))
+
+    def cargar(self, cursor, excluir_reserva_id=None, incluir_reservas=True):
+        """
+        Carga turnos, extras, ausencias y reservas del rango completo (4 consultas).
+        incluir_reservas=False omite las reservas (el choque lo valida la restricción
+        reservas_sin_solape al guardar).
+        """
+        if not self.empleados:
+            return self
+        ids = list(self.fila)
+        hasta = self.desde + timedelta(days=self.dias)
+
+        # 1. Turnos semanales: se expanden sobre cada día del rango en Python
+        cursor.execute("""
+            SELECT empleado_id, dia_semana, hora_inicio, hora_fin
+            FROM horarios_empleado WHERE empleado_id = ANY(%s)
+        """, (ids,))
+        turnos_por_dia = {}
+        for t in cursor.fetchall():
+            turnos_por_dia.setdefault(t['dia_semana'], []).append(t)
+
+        intervalos = []
+        for d in range(self.dias):
+            base = d * self.bloques_dia
+            for t in turnos_por_dia.get((self.desde + timedelta(days=d)).isoweekday(), []):
+                intervalos.append((
+                    t['empleado_id'],
+                    base + _minutos(t['hora_inicio']) // self.resolucion,
+                    base + math.ceil(_minutos(t['hora_fin']) / self.resolucion)
+                ))
+
+        # 2. Turnos extra por fecha
+        cursor.execute("""
+            SELECT empleado_id, fecha, hora_inicio, hora_fin
+            FROM horarios_extra
+            WHERE empleado_id = ANY(%s) AND fecha >= %s AND fecha < %s
+        """, (ids, self.desde.date(), hasta.date()))
+        for x in cursor.fetchall():
+            base = (x['fecha'] - self.desde.date()).days * self.bloques_dia
+            intervalos.append((
+                x['empleado_id'],
+                base + _minutos(x['hora_inicio']) // self.resolucion,
+                base + math.ceil(_minutos(x['hora_fin']) / self.resolucion)
+            ))
+        self._pintar(self.turno, intervalos)
+
+        # 3. Ausencias aprobadas que tocan el rango
+        cursor.execute("""
+            SELECT empleado_id, fecha_hora_inicio, fecha_hora_fin
+            FROM ausencias_empleado
+            WHERE empleado_id = ANY(%s) AND aprobado = TRUE
+              AND fecha_hora_inicio < %s AND fecha_hora_fin > %s
+        """, (ids, hasta, self.desde))
+        self._pintar(self.ausencia, [
+            self._intervalo(a['empleado_id'], a['fecha_hora_inicio'], a['fecha_hora_fin'])
+            for a in cursor.fetchall()
+        ])
+
+        if not incluir_reservas:
+            return self
+
+        # 4. Reservas activas (de cualquier sucursal: el colaborador no puede estar en dos)
+        cursor.execute("""
+            SELECT empleado_id, fecha_hora_inicio, fecha_hora_fin
+            FROM reservas
+            WHERE empleado_id = ANY(%s) AND estado NOT IN %s
+              AND fecha_hora_inicio < %s AND fecha_hora_fin > %s
+              AND id IS DISTINCT FROM %s
+        """, (ids, ESTADOS_OCULTOS, hasta, self.desde, excluir_reserva_id))
+        self._pintar(self.ocupado, [
+            self._intervalo(r['empleado_id'], r['fecha_hora_inicio'], r['fecha_hora_fin'])
+            for r in cursor.fetchall()
+        ])
+        return self
+
+    @property
+    def libre(self):
+        return self.turno & ~self.ausencia & ~self.ocupado
+
+    def huecos(self, duracion_minutos, limite=10, desde=None, empleado_id=None):
+        """
+        Primeros 'limite' inicios (ordenados por hora y luego por colaborador) con
+        'duracion_minutos' libres seguidos. desde: no ofrecer horas anteriores (ej. ahora).
+        """
+        libre = self.libre
+        if empleado_id is not None:
+            if empleado_id not in self.fila:
+                return []
+            libre = libre[[self.fila[empleado_id]]]
+            empleados = [self.empleados[self.fila[empleado_id]]]
+        else:
+            empleados = self.empleados
+
+        k = max(1, math.ceil(duracion_minutos / self.resolucion))
+        if libre.shape[0] == 0 or k > libre.shape[1]:
+            return []
+
+        # Ventanas de k bloques completamente libres: suma acumulada por fila
+        acumulado = np.zeros((libre.shape[0], libre.shape[1] + 1), dtype=np.int32)
+        np.cumsum(libre, axis=1, dtype=np.int32, out=acumulado[:, 1:])
+        ventanas = (acumulado[:, k:] - acumulado[:, :-k]) == k
+
+        if desde is not None:
+            ventanas[:, :self.bloque(desde, math.ceil)] = False
+
+        # argwhere sobre la transpuesta -> ordenado por bloque y luego por colaborador
+        resultado = []
+        for bloque, fila in np.argwhere(ventanas.T)[:limite]:
+            inicio = self.momento(bloque)
+            resultado.append({
+                "empleado_id": empleados[fila]['id'],
+                "empleado": empleados[fila]['nombre'],
+                "inicio": inicio.isoformat(),
+                "fin": (inicio + timedelta(minutes=duracion_minutos)).isoformat()
+            })
+        return resultado
+
+    def conflictos(self, empleado_id, inicio, fin):
+        """
+        Motivos por los que [inicio, fin) no está disponible para el colaborador:
+        'sin_turno' (no trabaja ese día), 'fuera_de_turno', 'ausencia', 'choque'.
+        """
+        i = self.fila[empleado_id]
+        a, b = self.bloque(inicio), self.bloque(fin, math.ceil)
+        dia = (a // self.bloques_dia) * self.bloques_dia
+        motivos = []
+        if not self.turno[i, dia:dia + self.bloques_dia].any():
+            motivos.append('sin_turno')
+        elif not self.turno[i, a:b].all():
+            motivos.append('fuera_de_turno')
+        if self.ausencia[i, a:b].any():
+            motivos.append('ausencia')
+        if self.ocupado[i, a:b].any():
+            motivos.append('choque')
+        return motivos
+
+
+def empleados_de_sucursal(cursor, sucursal_id, empleado_id=None):
+    sql = """
+        SELECT e.id, e.nombre_display as nombre
+        FROM empleados e
+        WHERE e.activo = TRUE AND e.realiza_servicios = TRUE
+          AND e.id IN (SELECT empleado_id FROM empleado_sucursales WHERE sucursal_id = %s)
+    """
+    params = [sucursal_id]
+    if empleado_id:
+        sql += " AND e.id = %s"
+        params.append(empleado_id)
+    cursor.execute(sql + " ORDER BY e.nombres", params)
+    return cursor.fetchall()
+
+
+def mapa_sucursal(cursor, sucursal_id, desde, dias=1, resolucion=15, empleado_id=None):
+    empleados = empleados_de_sucursal(cursor, sucursal_id, empleado_id)
+    return MapaDisponibilidad(empleados, desde, dias, resolucion).cargar(cursor)
+
+
+def conflictos_reserva(cursor, empleado_id, inicio, fin, excluir_reserva_id=None, incluir_reservas=True):
+    """Validación de una reserva puntual a resolución de 1 minuto (sin falsos choques)."""
+    mapa = MapaDisponibilidad([{'id': empleado_id, 'nombre': ''}], inicio.date(), 1, resolucion=1)
+    mapa.cargar(cursor, excluir_reserva_id=excluir_reserva_id, incluir_reservas=incluir_reservas)
+    return mapa.conflictos(empleado_id, inicio, fin)
@@ -0,0 +1,33 @@
+from .. import outbox
+
+# ---------------------------------------------------------
+# KPIs DIARIOS DEL DASHBOARD (migraciones 0004 y 0017)
+# ---------------------------------------------------------
+# Los triggers de ventas y reservas agregan filas de diferencia en
+# kpi_diarios_deltas (sin bloquear nada compartido) y el worker del outbox las
+# consolida en kpi_diarios una vez por minuto. Las lecturas van contra la vista
+# kpi_diarios_vigentes (consolidado + deltas pendientes): siempre exactas.
+
+CONSOLIDAR_CADA_SEGUNDOS = 60
+
+
+def totales_dia(cursor, fecha):
+    """Ventas, totales y citas del día sumando todas las sucursales (cursor RealDictCursor)."""
+    cursor.execute("""
+        SELECT
+            COALESCE(SUM(numero_ventas), 0) as numero_ventas,
+            COALESCE(SUM(total_servicios), 0) as total_servicios,
+            COALESCE(SUM(total_productos), 0) as total_productos,
+            COALESCE(SUM(numero_citas), 0) as numero_citas
+        FROM kpi_diarios_vigentes
+        WHERE fecha = %s
+    """, (fecha,))
+    return cursor.fetchone()
+
+
+@outbox.tarea_periodica('kpi_diarios.consolidar', CONSOLIDAR_CADA_SEGUNDOS)
+def consolidar(cursor):
+    """Pasa las diferencias confirmadas a kpi_diarios. Devuelve las filas tocadas (-1 si ya corría otra)."""
+    cursor.execute("SELECT kpi_diarios_consolidar() AS filas")
+    fila = cursor.fetchone()
+    return fila['filas'] if isinstance(fila, dict) else fila[0]
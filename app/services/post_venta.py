@@ -0,0 +1,130 @@
+from .. import outbox
+from . import saldos
+
+# ---------------------------------------------------------
+# EFECTOS POSTERIORES A UNA VENTA (vía outbox)
+# ---------------------------------------------------------
+# nueva_venta confirma en su transacción todo lo que mueve dinero o da un
+# beneficio: venta, ítems, stock, pagos (incluido el monedero), propina,
+# gastos/caja, el canje de puntos y el consumo de visitas de fidelidad
+# (consumir_fidelidad). Aplicarlos después permitiría usarlos dos veces: hasta
+# que corriera el worker, otra venta vería los mismos puntos o visitas como
+# disponibles. Lo que no es un beneficio se encola aquí y lo aplica
+# `flask outbox-worker`:
+#   venta.puntos     acumula los puntos ganados (movimiento ACUMULA del libro de saldos)
+#   venta.reserva    pasa la reserva de la agenda a 'Completada'
+# (venta.fidelidad queda registrado solo para vaciar eventos encolados antes.)
+#
+# Cada manejador es idempotente por sí mismo (además del control del outbox):
+# reprocesar un evento a mano no duplica puntos ni consumos.
+
+
+class VisitasInsuficientes(ValueError):
+    pass
+
+
+def encolar_efectos(cursor, venta_id, cliente_id=None, puntos=0, descripcion='',
+                    reserva_id=None, en_linea=False):
+    """
+    Encola los efectos de la venta en la transacción del cursor.
+    en_linea=True los aplica en la misma transacción (comportamiento anterior,
+    útil para comparar tiempos o si no hay worker corriendo).
+    """
+    eventos = []
+    if cliente_id and puntos > 0:
+        eventos.append(('venta.puntos', f"venta:{venta_id}:puntos", {
+            'venta_id': venta_id, 'cliente_id': cliente_id, 'puntos': puntos, 'descripcion': descripcion
+        }))
+    if reserva_id:
+        eventos.append(('venta.reserva', f"venta:{venta_id}:reserva", {
+            'venta_id': venta_id, 'reserva_id': reserva_id
+        }))
+
+    for tipo, clave, payload in eventos:
+        if en_linea:
+            outbox.ejecutar(cursor, tipo, payload)
+        else:
+            outbox.encolar(cursor, tipo, clave, payload)
+    return len(eventos)
+
+
+@outbox.manejador('venta.puntos')
+def acumular_puntos(cursor, payload):
+    # FOR SHARE: espera a una anulación en curso; si la venta ya se anuló no se acumula
+    cursor.execute("SELECT estado_pago FROM ventas WHERE id = %s FOR SHARE", (payload['venta_id'],))
+    venta = cursor.fetchone()
+    if not venta or venta['estado_pago'] == 'Anulado':
+        return
+    if saldos.movimiento_de_venta(cursor, payload['venta_id'], saldos.PUNTOS, 'ACUMULA'):
+        return
+    saldos.mover(
+        cursor, payload['cliente_id'], saldos.PUNTOS, payload['puntos'], 'ACUMULA',
+        venta_id=payload['venta_id'], referencia=payload.get('descripcion')
+    )
+
+
+def consumir_fidelidad(cursor, cliente_id, reglas, estricto=True):
+    """
+    Por cada regla aplicada marca las visitas elegibles más antiguas (FIFO) con
+    el group_id del canje, para que no vuelvan a contar (anti doble uso).
+    reglas: [(rule_id, group_id)] de los ítems con descuento aplicado.
+    Se llama dentro de la transacción de la venta. Las visitas se toman con
+    FOR UPDATE: si otra venta concurrente ya las consumió, quedan menos de las
+    requeridas y (estricto) se lanza VisitasInsuficientes para cancelar la venta.
+    """
+    for rule_id, group_id in reglas:
+        if estricto:
+            cursor.execute("SELECT cantidad_requerida FROM loyalty_rules WHERE id = %s", (rule_id,))
+            regla = cursor.fetchone()
+            requeridas = (regla['cantidad_requerida'] if isinstance(regla, dict) else regla[0]) if regla else 0
+        cursor.execute("""
+            WITH regla AS (
+                SELECT id, cantidad_requerida, periodo_meses, servicio_id
+                FROM loyalty_rules WHERE id = %(rule_id)s
+            ),
+            servicios_regla AS (
+                SELECT rs.servicio_id FROM loyalty_rule_services rs WHERE rs.loyalty_rule_id = %(rule_id)s
+                UNION
+                SELECT r.servicio_id FROM regla r
+                WHERE r.servicio_id IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM loyalty_rule_services rs WHERE rs.loyalty_rule_id = %(rule_id)s)
+            ),
+            elegibles AS (
+                SELECT vi.id
+                FROM venta_items vi
+                JOIN ventas v ON v.id = vi.venta_id
+                CROSS JOIN regla r
+                WHERE v.cliente_receptor_id = %(cliente_id)s
+                  AND vi.servicio_id IN (SELECT servicio_id FROM servicios_regla)
+                  AND v.fecha_venta >= CURRENT_DATE - make_interval(months => r.periodo_meses)
+                  AND COALESCE(v.estado_pago, '') <> 'Anulado'
+                  AND COALESCE(vi.loyalty_consumption_group_id, '') = ''
+                  AND NOT EXISTS (
+                      SELECT 1 FROM venta_items ya WHERE ya.loyalty_consumption_group_id = %(group_id)s
+                  )
+                ORDER BY v.fecha_venta ASC, vi.id ASC
+                LIMIT (SELECT cantidad_requerida FROM regla)
+                FOR UPDATE OF vi
+            )
+            UPDATE venta_items SET loyalty_consumption_group_id = %(group_id)s
+            WHERE id IN (SELECT id FROM elegibles)
+        """, {'rule_id': rule_id, 'group_id': str(group_id), 'cliente_id': cliente_id})
+        if estricto and cursor.rowcount < requeridas:
+            raise VisitasInsuficientes(
+                "Las visitas de fidelidad de este cliente ya no alcanzan para el descuento "
+                "(posiblemente se usaron en otra venta). Quite el beneficio e intente de nuevo."
+            )
+
+
+@outbox.manejador('venta.fidelidad')
+def consumir_fidelidad_pendiente(cursor, payload):
+    """Eventos encolados antes de que el consumo pasara a la venta (idempotente por group_id)."""
+    consumir_fidelidad(cursor, payload['cliente_id'], payload['reglas'], estricto=False)
+
+
+@outbox.manejador('venta.reserva')
+def completar_reserva(cursor, payload):
+    cursor.execute("""
+        UPDATE reservas SET estado = 'Completada'
+        WHERE id = %s AND estado IS DISTINCT FROM 'Completada'
+    """, (payload['reserva_id'],))
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
+from .agenda import ESTADOS_OCULTOS
+from ..utils.fechas import a_hora_local
+
+# ---------------------------------------------------------
+# RESERVAS EN LOTE (citas recurrentes y bloques de grupo)
+# ---------------------------------------------------------
+# Todos los horarios pedidos se validan con UNA consulta (VALUES + EXISTS contra
+# reservas, ausencias, horarios y extras, usando los índices de la migración 0002)
+# y los aceptados se insertan con UN INSERT multi-fila. Si otra recepción reserva
+# el mismo hueco entre la validación y el INSERT, ON CONFLICT DO NOTHING (que
+# respeta la restricción de exclusión reservas_sin_solape) lo descarta sin abortar
+# el resto del lote.
+#
+# Los inicios se normalizan a hora local de Lima sin zona (a_hora_local): así se
+# guardan y así vuelven en el RETURNING con el que se emparejan los resultados.
+
+MAX_SLOTS = 100
+
+# execute_values solo interpola el VALUES %s: los estados van como literal (constantes)
+_ESTADOS_OCULTOS_SQL = "(" + ", ".join(f"'{e}'" for e in ESTADOS_OCULTOS) + ")"
+
+
+def expandir_recurrencia(regla):
+    """
+    regla: {"inicio": "YYYY-MM-DDTHH:MM", "cada_dias": 14, "repeticiones": 6}
+           o con "hasta": "YYYY-MM-DD" en lugar de repeticiones.
+    Devuelve la lista de datetimes de inicio, en hora local sin zona (máximo MAX_SLOTS).
+    """
+    inicio = a_hora_local(datetime.fromisoformat(regla['inicio']))
+    cada_dias = int(regla.get('cada_dias') or 7)
+    if cada_dias < 1:
+        raise ValueError("cada_dias debe ser al menos 1.")
+
+    if regla.get('hasta'):
+        hasta = datetime.fromisoformat(str(regla['hasta'])[:10]).date()
+        repeticiones = (hasta - inicio.date()).days // cada_dias + 1
+    else:
+        repeticiones = int(regla.get('repeticiones') or 1)
+    if repeticiones < 1 or repeticiones > MAX_SLOTS:
+        raise ValueError(f"La recurrencia debe generar entre 1 y {MAX_SLOTS} citas.")
+
+    return [inicio + timedelta(days=cada_dias * i) for i in range(repeticiones)]
+
+
+def validar_slots(cursor, slots, estricto=False):
+    """
+    slots: [{'n', 'empleado_id', 'inicio', 'fin', ...}]. Agrega a cada slot:
+    'conflicto_id' (reserva que lo ocupa), 'ausencia', 'en_turno', 'advertencias'
+    y 'motivo' (None = se acepta; 'choque', 'choque_en_lote' o, con estricto,
+    la primera advertencia). Una sola consulta.
+    """
+    if not slots:
+        return slots
+    filas = execute_values(cursor, """
+        SELECT c.n,
+               (SELECT r.id FROM reservas r
+                 WHERE r.empleado_id = c.empleado_id
+                   AND r.estado NOT IN {estados}
+                   AND r.fecha_hora_inicio < c.fin AND r.fecha_hora_fin > c.inicio
+                 ORDER BY r.fecha_hora_inicio LIMIT 1) AS conflicto_id,
+               EXISTS (SELECT 1 FROM ausencias_empleado a
+                 WHERE a.empleado_id = c.empleado_id AND a.aprobado = TRUE
+                   AND a.fecha_hora_inicio < c.fin AND a.fecha_hora_fin > c.inicio) AS ausencia,
+               (EXISTS (SELECT 1 FROM horarios_empleado h
+                 WHERE h.empleado_id = c.empleado_id
+                   AND h.dia_semana = EXTRACT(ISODOW FROM c.inicio)
+                   AND h.hora_inicio <= c.inicio::time AND h.hora_fin >= c.fin::time)
+                OR EXISTS (SELECT 1 FROM horarios_extra x
+                 WHERE x.empleado_id = c.empleado_id AND x.fecha = c.inicio::date
+                   AND x.hora_inicio <= c.inicio::time AND x.hora_fin >= c.fin::time)) AS en_turno
+        FROM (VALUES %s) AS c(n, empleado_id, inicio, fin)
+    """.format(estados=_ESTADOS_OCULTOS_SQL),
+        [(s['n'], s['empleado_id'], s['inicio'], s['fin']) for s in slots],
+        template="(%s::int, %s::int, %s::timestamp, %s::timestamp)",
+        page_size=len(slots),
+        fetch=True
+    )
+    por_n = {f['n']: f for f in filas}
+    for s in slots:
+        f = por_n[s['n']]
+        s['conflicto_id'] = f['conflicto_id']
+        s['ausencia'] = f['ausencia']
+        s['en_turno'] = f['en_turno']
+
+    # Choques dentro del mismo lote (mismo colaborador, horarios solapados). Solo
+    # los slots que se aceptan ocupan el horario: uno rechazado no tapa al siguiente.
+    ultimo_fin = {}
+    for s in sorted(slots, key=lambda x: (x['empleado_id'], x['inicio'])):
+        s['advertencias'] = []
+        if not s['en_turno']:
+            s['advertencias'].append('fuera_de_turno')
+        if s['ausencia']:
+            s['advertencias'].append('ausencia')
+
+        if s['conflicto_id']:
+            s['motivo'] = 'choque'
+        elif s['inicio'] < ultimo_fin.get(s['empleado_id'], s['inicio']):
+            s['motivo'] = 'choque_en_lote'
+        elif estricto and s['advertencias']:
+            s['motivo'] = s['advertencias'][0]
+        else:
+            s['motivo'] = None
+            ultimo_fin[s['empleado_id']] = s['fin']
+    return slots
+
+
+def insertar_slots(cursor, slots, sucursal_id, servicio_id, precio, notas_cliente):
+    """INSERT multi-fila de los slots aceptados. Devuelve {(empleado_id, inicio): reserva_id}."""
+    if not slots:
+        return {}
+    filas = execute_values(cursor, """
+        INSERT INTO reservas (sucursal_id, cliente_id, empleado_id, servicio_id,
+                              fecha_hora_inicio, fecha_hora_fin, estado, notas_cliente, precio_cobrado, origen)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING id, empleado_id, fecha_hora_inicio
+    """, [
+        (sucursal_id, s['cliente_id'], s['empleado_id'], servicio_id,
+         s['inicio'], s['fin'], 'Programada', notas_cliente, precio, 'POS')
+        for s in slots
+    ], page_size=len(slots), fetch=True)
+    return {(f['empleado_id'], f['fecha_hora_inicio']): f['id'] for f in filas}
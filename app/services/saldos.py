@@ -0,0 +1,268 @@
+from datetime import date
+
+# ---------------------------------------------------------
+# MONEDERO Y PUNTOS: LIBRO DE MOVIMIENTOS (saldo_movimientos)
+# ---------------------------------------------------------
+# Antes cada ruta leía el saldo, comparaba en Python y luego hacía el UPDATE:
+# dos cajas podían gastar el mismo saldo. Ahora todo cambio pasa por aquí:
+#   - El UPDATE de clientes lleva la condición (WHERE saldo >= débito) y, en la
+#     misma sentencia (CTE), inserta el movimiento con el saldo resultante. Si no
+#     alcanza, no se modifica nada y se levanta SaldoInsuficiente.
+#   - saldo_movimientos es de solo inserción (trigger en la migración 0013); las
+#     correcciones se registran como AJUSTE. Solo se registran movimientos con
+#     monto distinto de 0 (la apertura omite saldos en cero), pero un cliente que
+#     tuvo alguno ya no puede eliminarse (FK cliente_id). venta_id no tiene FK
+#     (migración 0020): una Nota de Venta eliminada deja su reverso en el libro.
+#   - saldo_cierres guarda el saldo al final de cada mes (`flask saldos-cierre`):
+#     saldo_al() lee el cierre anterior + el último movimiento del mes en curso.
+
+MONEDERO = 'MONEDERO'
+PUNTOS = 'PUNTOS'
+
+_COLUMNAS = {MONEDERO: 'saldo_monedero', PUNTOS: 'puntos_fidelidad'}
+
+
+class SaldoInsuficiente(ValueError):
+    pass
+
+
+def _columna(cuenta):
+    try:
+        return _COLUMNAS[cuenta]
+    except KeyError:
+        raise ValueError(f"Cuenta de saldo desconocida: {cuenta}")
+
+
+def _error_saldo(cur, cliente_id, cuenta, monto):
+    columna = _columna(cuenta)
+    cur.execute(f"SELECT COALESCE({columna}, 0) FROM clientes WHERE id = %s", (cliente_id,))
+    fila = cur.fetchone()
+    if not fila:
+        return SaldoInsuficiente("Cliente no encontrado.")
+    if cuenta == MONEDERO:
+        return SaldoInsuficiente(
+            f"Saldo insuficiente en Monedero. (Disponible: S/ {float(fila[0]):.2f}, Requerido: S/ {-monto:.2f})"
+        )
+    return SaldoInsuficiente(f"Puntos insuficientes. (Disponibles: {int(fila[0])}, Requeridos: {int(-monto)})")
+
+
+def mover(cursor, cliente_id, cuenta, monto, tipo, venta_id=None, referencia=None, usuario_id=None):
+    """
+    Aplica un movimiento con signo (+ abona, - descuenta) y lo registra.
+    Un débito solo procede si el saldo alcanza. Devuelve el saldo resultante.
+    """
+    columna = _columna(cuenta)
+    params = {
+        'cliente_id': cliente_id, 'cuenta': cuenta, 'monto': monto, 'tipo': tipo,
+        'venta_id': venta_id, 'referencia': referencia, 'usuario_id': usuario_id
+    }
+    with cursor.connection.cursor() as cur:
+        cur.execute(f"""
+            WITH upd AS (
+                UPDATE clientes
+                SET {columna} = COALESCE({columna}, 0) + %(monto)s
+                WHERE id = %(cliente_id)s
+                  AND (%(monto)s >= 0 OR COALESCE({columna}, 0) >= -%(monto)s)
+                RETURNING id, {columna} AS saldo
+            )
+            INSERT INTO saldo_movimientos (cliente_id, cuenta, tipo, monto, saldo_resultante,
+                                           venta_id, referencia, usuario_id)
+            SELECT id, %(cuenta)s, %(tipo)s, %(monto)s, saldo, %(venta_id)s, %(referencia)s, %(usuario_id)s
+            FROM upd
+            RETURNING saldo_resultante
+        """, params)
+        fila = cur.fetchone()
+        if not fila:
+            raise _error_saldo(cur, cliente_id, cuenta, monto)
+    return fila[0]
+
+
+def _mover_calculado(cursor, cliente_id, cuenta, expresion, params, tipo, venta_id, referencia, usuario_id):
+    """
+    Variante para montos que dependen del saldo actual (ajuste a un valor fijo,
+    reversiones recortadas a lo disponible): bloquea la fila, calcula el monto
+    con `expresion` (en función de a.saldo) y lo aplica. None si el monto es 0.
+    """
+    columna = _columna(cuenta)
+    params = dict(params, cliente_id=cliente_id, cuenta=cuenta, tipo=tipo, venta_id=venta_id,
+                  referencia=referencia, usuario_id=usuario_id)
+    with cursor.connection.cursor() as cur:
+        cur.execute(f"""
+            WITH a AS (
+                SELECT id, COALESCE({columna}, 0) AS saldo FROM clientes WHERE id = %(cliente_id)s FOR UPDATE
+            ), d AS (
+                SELECT id, saldo, ({expresion}) AS monto FROM a
+            ), upd AS (
+                UPDATE clientes c
+                SET {columna} = d.saldo + d.monto
+                FROM d
+                WHERE c.id = d.id AND d.monto <> 0
+                RETURNING c.id, d.monto, c.{columna} AS saldo
+            )
+            INSERT INTO saldo_movimientos (cliente_id, cuenta, tipo, monto, saldo_resultante,
+                                           venta_id, referencia, usuario_id)
+            SELECT id, %(cuenta)s, %(tipo)s, monto, saldo, %(venta_id)s, %(referencia)s, %(usuario_id)s
+            FROM upd
+            RETURNING monto, saldo_resultante
+        """, params)
+        return cur.fetchone()
+
+
+def fijar(cursor, cliente_id, cuenta, saldo_nuevo, usuario_id=None, referencia='Ajuste manual'):
+    """Lleva el saldo a un valor dado registrando la diferencia como AJUSTE."""
+    return _mover_calculado(cursor, cliente_id, cuenta, "%(objetivo)s - a.saldo", {'objetivo': saldo_nuevo},
+                            'AJUSTE', None, referencia, usuario_id)
+
+
+def revertir_venta(cursor, venta_id, usuario_id=None):
+    """
+    Revierte los movimientos de saldo de una venta anulada o eliminada: devuelve el monedero
+    usado y los puntos canjeados, y retira los puntos ganados (como máximo lo
+    que el cliente aún tenga, igual que antes). Idempotente por uq_saldo_mov_venta.
+    """
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            SELECT cliente_id, cuenta, SUM(monto)
+            FROM saldo_movimientos
+            WHERE venta_id = %s AND tipo <> 'ANULACION'
+            GROUP BY cliente_id, cuenta
+            HAVING SUM(monto) <> 0
+        """, (venta_id,))
+        netos = cur.fetchall()
+
+        if not any(cuenta == PUNTOS for _, cuenta, _ in netos):
+            # Ventas anteriores al libro: los puntos ganados solo están en puntos_historial
+            cur.execute("""
+                SELECT cliente_id, 'PUNTOS', SUM(monto_puntos)
+                FROM puntos_historial
+                WHERE venta_id = %s AND tipo_transaccion = 'ACUMULA'
+                GROUP BY cliente_id
+            """, (venta_id,))
+            netos += [f for f in cur.fetchall() if f[2]]
+
+    referencia = f"Anulación de Venta #{venta_id}"
+    aplicados = []
+    for cliente_id, cuenta, neto in netos:
+        resultado = _mover_calculado(
+            cursor, cliente_id, cuenta, "GREATEST(-(%(neto)s), -a.saldo)", {'neto': neto},
+            'ANULACION', venta_id, referencia, usuario_id
+        )
+        if resultado:
+            aplicados.append((cliente_id, cuenta, resultado[0]))
+    return aplicados
+
+
+def movimiento_de_venta(cursor, venta_id, cuenta, tipo):
+    """True si la venta ya tiene un movimiento de ese tipo en la cuenta."""
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            SELECT 1 FROM saldo_movimientos WHERE venta_id = %s AND cuenta = %s AND tipo = %s
+        """, (venta_id, cuenta, tipo))
+        return cur.fetchone() is not None
+
+
+def saldo_al(cursor, cliente_id, cuenta, instante):
+    """
+    Saldo de la cuenta en un instante dado: último movimiento del mes del
+    instante o, si no hubo, el cierre del mes anterior. Si ese mes aún no se
+    cerró, cae al último movimiento anterior (índice idx_saldo_mov_cliente).
+    """
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            SELECT saldo FROM (
+                (SELECT saldo_resultante AS saldo, 1 AS prioridad
+                 FROM saldo_movimientos
+                 WHERE cliente_id = %(cliente_id)s AND cuenta = %(cuenta)s
+                   AND creado_en >= date_trunc('month', %(instante)s::timestamp)
+                   AND creado_en <= %(instante)s
+                 ORDER BY creado_en DESC, id DESC LIMIT 1)
+                UNION ALL
+                (SELECT saldo, 2 FROM saldo_cierres
+                 WHERE cliente_id = %(cliente_id)s AND cuenta = %(cuenta)s
+                   AND mes = (date_trunc('month', %(instante)s::timestamp) - INTERVAL '1 month')::date)
+            ) s
+            ORDER BY prioridad
+            LIMIT 1
+        """, {'cliente_id': cliente_id, 'cuenta': cuenta, 'instante': instante})
+        fila = cur.fetchone()
+        if fila:
+            return fila[0]
+        cur.execute("""
+            SELECT saldo_resultante FROM saldo_movimientos
+            WHERE cliente_id = %s AND cuenta = %s AND creado_en <= %s
+            ORDER BY creado_en DESC, id DESC LIMIT 1
+        """, (cliente_id, cuenta, instante))
+        fila = cur.fetchone()
+        return fila[0] if fila else 0
+
+
+def _primer_dia(valor):
+    return date(valor.year, valor.month, 1)
+
+
+def cerrar_mes(cursor, mes):
+    """
+    Calcula saldo_cierres para el mes (cualquier fecha del mes) a partir del
+    cierre del mes anterior y los movimientos del mes. Requiere el mes anterior
+    cerrado; cerrar_pendientes() los recorre en orden. Devuelve las filas escritas.
+    """
+    mes = _primer_dia(mes)
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            INSERT INTO saldo_cierres (cliente_id, cuenta, mes, saldo, ultimo_movimiento_id)
+            SELECT DISTINCT ON (cliente_id, cuenta) cliente_id, cuenta, %(mes)s, saldo, ultimo_id
+            FROM (
+                SELECT cliente_id, cuenta, saldo_resultante AS saldo, id AS ultimo_id, creado_en, 1 AS prioridad
+                FROM saldo_movimientos
+                WHERE creado_en >= %(mes)s AND creado_en < %(mes)s::date + INTERVAL '1 month'
+                UNION ALL
+                SELECT cliente_id, cuenta, saldo, ultimo_movimiento_id, NULL, 2
+                FROM saldo_cierres
+                WHERE mes = %(mes)s::date - INTERVAL '1 month'
+            ) t
+            ORDER BY cliente_id, cuenta, prioridad, creado_en DESC NULLS LAST, ultimo_id DESC
+            ON CONFLICT (cliente_id, cuenta, mes) DO UPDATE
+            SET saldo = EXCLUDED.saldo, ultimo_movimiento_id = EXCLUDED.ultimo_movimiento_id
+        """, {'mes': mes})
+        return cur.rowcount
+
+
+def cerrar_pendientes(cursor, hasta, eco=print):
+    """Cierra en orden todos los meses sin cierre anteriores al mes de `hasta`."""
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            SELECT COALESCE(
+                (SELECT MAX(mes) + INTERVAL '1 month' FROM saldo_cierres),
+                (SELECT date_trunc('month', MIN(creado_en)) FROM saldo_movimientos)
+            )::date
+        """)
+        desde = cur.fetchone()[0]
+    limite = _primer_dia(hasta)
+    cerrados = []
+    while desde and desde < limite:
+        filas = cerrar_mes(cursor, desde)
+        eco(f"  {desde:%Y-%m}: {filas} saldo(s)")
+        cerrados.append(desde)
+        desde = date(desde.year + desde.month // 12, desde.month % 12 + 1, 1)
+    return cerrados
+
+
+def diferencias(cursor, limite=50):
+    """Clientes cuyo saldo en caché no coincide con su último movimiento."""
+    with cursor.connection.cursor() as cur:
+        cur.execute("""
+            WITH ultimo AS (
+                SELECT DISTINCT ON (cliente_id, cuenta) cliente_id, cuenta, saldo_resultante
+                FROM saldo_movimientos
+                ORDER BY cliente_id, cuenta, creado_en DESC, id DESC
+            )
+            SELECT c.id, x.cuenta, x.en_cache, COALESCE(u.saldo_resultante, 0) AS en_libro
+            FROM clientes c
+            CROSS JOIN LATERAL (VALUES ('MONEDERO', COALESCE(c.saldo_monedero, 0)::numeric),
+                                       ('PUNTOS', COALESCE(c.puntos_fidelidad, 0)::numeric)) AS x(cuenta, en_cache)
+            LEFT JOIN ultimo u ON u.cliente_id = c.id AND u.cuenta = x.cuenta
+            WHERE x.en_cache <> COALESCE(u.saldo_resultante, 0)
+            ORDER BY c.id
+            LIMIT %s
+        """, (limite,))
+        return cur.fetchall()
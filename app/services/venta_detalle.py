@@ -0,0 +1,133 @@
+from psycopg2.extras import execute_values
+
+# ---------------------------------------------------------
+# DETALLE DE VENTA EN BLOQUE (ítems, comisiones, stock y kardex)
+# ---------------------------------------------------------
+# nueva_venta hacía hasta 5 sentencias por línea del carrito (INSERT ítem, SELECT
+# producto, INSERT comisión, UPDATE stock, INSERT kardex) dentro de la misma
+# transacción que tiene bloqueada la serie del comprobante. Ahora el carrito
+# completo se escribe con dos sentencias, sin importar su tamaño:
+#   1. INSERT multi-fila de venta_items + comisiones de productos (CTE).
+#   2. UPDATE productos ... FROM (VALUES ...) que solo descuenta si alcanza el
+#      stock, + kardex (CTE). Si falta stock de algún producto se levanta
+#      StockInsuficiente y la ruta hace ROLLBACK de toda la venta.
+#
+# execute_values solo interpola el VALUES %s: los datos comunes (venta, usuario,
+# motivo) viajan repetidos en cada fila. Se usa un cursor simple (tuplas) sobre la
+# misma conexión, así que vale cualquier cursor_factory de la ruta.
+
+
+class StockInsuficiente(ValueError):
+    pass
+
+
+def total_item(item):
+    return float(item['precio']) * float(item['cantidad'])
+
+
+def registrar_items(cursor, venta_id, items):
+    """
+    Inserta todas las líneas del carrito y las comisiones fijas de los productos
+    (productos.comision_vendedor_monto x cantidad) para el empleado de la venta.
+    Devuelve el total de descuento por fidelidad de las líneas.
+    """
+    if not items:
+        return 0.0
+
+    filas = []
+    total_fidelidad = 0.0
+    for n, item in enumerate(items):
+        total = total_item(item)
+
+        # Detectar Fidelidad
+        if item.get('loyalty_applied') and item.get('loyalty_pct'):
+            total_fidelidad += total * (float(item['loyalty_pct']) / 100.0)
+
+        # Cálculo de Comisión Extra (Solo Servicios)
+        es_extra = bool(item.get('es_hora_extra', False))
+        pct_extra = float(item.get('porcentaje_servicio_extra', 0)) if es_extra else 0.00
+        comision_extra = total * (pct_extra / 100.0) if es_extra and pct_extra > 0 else 0.00
+
+        filas.append((
+            n, venta_id,
+            item['id'] if item['tipo'] == 'servicio' else None,
+            item['id'] if item['tipo'] == 'producto' else None,
+            item['descripcion'], item['cantidad'], item['precio'],
+            total, total, es_extra, pct_extra, comision_extra
+        ))
+
+    with cursor.connection.cursor() as cur:
+        execute_values(cur, """
+            WITH nuevos AS (
+                INSERT INTO venta_items (venta_id, servicio_id, producto_id, descripcion_item_venta, cantidad,
+                                         precio_unitario_venta, subtotal_item_bruto, subtotal_item_neto,
+                                         es_hora_extra, porcentaje_servicio_extra, comision_servicio_extra,
+                                         entregado_al_colaborador)
+                SELECT v.venta_id, v.servicio_id, v.producto_id, v.descripcion, v.cantidad,
+                       v.precio, v.bruto, v.neto, v.es_extra, v.pct_extra, v.comision_extra, FALSE
+                FROM (VALUES %s) AS v(n, venta_id, servicio_id, producto_id, descripcion, cantidad,
+                                      precio, bruto, neto, es_extra, pct_extra, comision_extra)
+                ORDER BY v.n
+                RETURNING id, venta_id, producto_id, cantidad
+            )
+            INSERT INTO comisiones (venta_item_id, empleado_id, monto_comision, porcentaje, fecha_generacion, estado)
+            SELECT nv.id, ve.empleado_id, p.comision_vendedor_monto * nv.cantidad, 0.00, CURRENT_TIMESTAMP, 'Pendiente'
+            FROM nuevos nv
+            JOIN ventas ve ON ve.id = nv.venta_id
+            JOIN productos p ON p.id = nv.producto_id
+            WHERE COALESCE(p.comision_vendedor_monto, 0) > 0
+        """, filas,
+            template="(%s::int, %s::int, %s::int, %s::int, %s, %s::numeric, %s::numeric,"
+                     " %s::numeric, %s::numeric, %s::boolean, %s::numeric, %s::numeric)",
+            page_size=len(filas))
+    return total_fidelidad
+
+
+def descontar_stock(cursor, venta_id, usuario_id, items, motivo):
+    """
+    Descuenta el stock de los productos del carrito (agrupado por producto) y
+    registra el kardex en una sola sentencia. Ningún producto queda con stock
+    negativo: si alguno no alcanza, levanta StockInsuficiente.
+    Devuelve [(producto_id, stock_anterior, stock_actual)].
+    """
+    cantidades = {}
+    for item in items:
+        if item['tipo'] == 'producto':
+            producto_id = int(item['id'])
+            cantidades[producto_id] = cantidades.get(producto_id, 0.0) + float(item['cantidad'])
+    if not cantidades:
+        return []
+
+    filas = [(pid, cantidades[pid], venta_id, usuario_id, motivo) for pid in sorted(cantidades)]
+
+    with cursor.connection.cursor() as cur:
+        # El UPDATE ... FROM (VALUES) no bloquea en el orden de la lista: se toman
+        # antes los bloqueos por id, así dos ventas con los mismos productos no se cruzan
+        cur.execute("SELECT id FROM productos WHERE id = ANY(%s) ORDER BY id FOR UPDATE", (sorted(cantidades),))
+        movimientos = execute_values(cur, """
+            WITH mov AS (
+                UPDATE productos p
+                SET stock_actual = p.stock_actual - v.cantidad
+                FROM (VALUES %s) AS v(producto_id, cantidad, venta_id, usuario_id, motivo)
+                WHERE p.id = v.producto_id
+                  AND p.stock_actual >= v.cantidad
+                RETURNING p.id AS producto_id, v.cantidad, p.stock_actual + v.cantidad AS stock_anterior,
+                          p.stock_actual, v.venta_id, v.usuario_id, v.motivo
+            ), k AS (
+                INSERT INTO kardex (producto_id, tipo_movimiento, cantidad, stock_anterior, stock_actual,
+                                    motivo, usuario_id, venta_id)
+                SELECT producto_id, 'VENTA', -cantidad, stock_anterior, stock_actual, motivo, usuario_id, venta_id
+                FROM mov
+            )
+            SELECT producto_id, stock_anterior, stock_actual FROM mov
+        """, filas, template="(%s::int, %s::numeric, %s::int, %s::int, %s::text)",
+            page_size=len(filas), fetch=True)
+
+        if len(movimientos) < len(cantidades):
+            # Camino de error: una consulta más solo para armar el mensaje
+            descontados = {m[0] for m in movimientos}
+            faltantes = [pid for pid in cantidades if pid not in descontados]
+            cur.execute("SELECT nombre, stock_actual FROM productos WHERE id = ANY(%s)", (faltantes,))
+            detalle = ", ".join(f"{nombre} (stock: {stock or 0})" for nombre, stock in cur.fetchall())
+            raise StockInsuficiente(f"Stock insuficiente para: {detalle or 'producto no encontrado'}.")
+    return movimientos
@@ -0,0 +1,137 @@
+import re
+import json
+import time
+from collections import Counter
+import psycopg2
+import psycopg2.extensions
+from flask import g, request, has_app_context
+
+# ---------------------------------------------------------
+# INSTRUMENTACIÓN SQL POR PETICIÓN
+# ---------------------------------------------------------
+# Todas las conexiones del pool se crean con ConexionInstrumentada. Sus cursores
+# (cualquiera sea el cursor_factory: RealDictCursor, DictCursor, el por defecto...)
+# registran texto, duración y filas de cada sentencia en g.sql_consultas.
+# - Modo debug: el resumen viaja en cabeceras X-SQL-* de la respuesta.
+# - Producción: las consultas lentas y los patrones N+1 se escriben como JSON en el log.
+
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_ESPACIOS = re.compile(r'\s+')
+_cursores_medidos = {}
+
+
+def normalizar_sql(sql):
+    """Colapsa espacios y reemplaza literales para agrupar sentencias que solo difieren en parámetros."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _ESPACIOS.sub(' ', str(sql)).strip()
+    return _LITERALES.sub('?', sql)
+
+
+def _registrar(sql, inicio, cursor):
+    if not has_app_context():
+        return
+    consultas = g.get('sql_consultas')
+    if consultas is None:
+        return
+    consultas.append({
+        'sql': sql,
+        'ms': (time.perf_counter() - inicio) * 1000,
+        'filas': cursor.rowcount
+    })
+
+
+class _CursorMedido:
+    """Mixin que mide execute/executemany del cursor base."""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _registrar(query, inicio, self)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _registrar(query, inicio, self)
+
+
+def _cursor_medido(factory):
+    clase = _cursores_medidos.get(factory)
+    if clase is None:
+        clase = type(f"{factory.__name__}Medido", (_CursorMedido, factory), {})
+        _cursores_medidos[factory] = clase
+    return clase
+
+
+class ConexionInstrumentada(psycopg2.extensions.connection):
+    """Conexión cuyos cursores quedan instrumentados sin cambiar el código de las rutas."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        if not issubclass(factory, _CursorMedido):
+            factory = _cursor_medido(factory)
+        return super().cursor(*args, cursor_factory=factory, **kwargs)
+
+
+def resumen_consultas(consultas, umbral_repeticiones):
+    """Totales de la petición y sentencias repetidas (posibles N+1)."""
+    repetidas = Counter(normalizar_sql(c['sql']) for c in consultas)
+    n_mas_1 = [
+        {'sql': sql[:300], 'veces': veces}
+        for sql, veces in repetidas.most_common()
+        if veces >= umbral_repeticiones
+    ]
+    return {
+        'total': len(consultas),
+        'ms': round(sum(c['ms'] for c in consultas), 2),
+        'n_mas_1': n_mas_1
+    }
+
+
+def init_app(app):
+    @app.before_request
+    def _iniciar_registro_sql():
+        g.sql_consultas = []
+
+    @app.after_request
+    def _reportar_sql(response):
+        consultas = g.pop('sql_consultas', None)
+        if not consultas:
+            return response
+
+        umbral_ms = float(app.config.get('SQL_SLOW_QUERY_MS', 200))
+        resumen = resumen_consultas(consultas, int(app.config.get('SQL_NPLUS1_UMBRAL', 5)))
+
+        if app.debug:
+            response.headers['X-SQL-Count'] = str(resumen['total'])
+            response.headers['X-SQL-Time-Ms'] = str(resumen['ms'])
+            if resumen['n_mas_1']:
+                response.headers['X-SQL-N-Plus-1'] = json.dumps(
+                    [{'veces': n['veces'], 'sql': n['sql'][:120]} for n in resumen['n_mas_1']]
+                )
+            return response
+
+        ruta = request.endpoint or request.path
+        for consulta in consultas:
+            if consulta['ms'] >= umbral_ms:
+                app.logger.warning(json.dumps({
+                    'evento': 'sql_lento',
+                    'ruta': ruta,
+                    'ms': round(consulta['ms'], 2),
+                    'filas': consulta['filas'],
+                    'sql': normalizar_sql(consulta['sql'])[:1000]
+                }, ensure_ascii=False))
+
+        if resumen['n_mas_1']:
+            app.logger.warning(json.dumps({
+                'evento': 'sql_n_mas_1',
+                'ruta': ruta,
+                'total_consultas': resumen['total'],
+                'ms_total': resumen['ms'],
+                'repetidas': resumen['n_mas_1']
+            }, ensure_ascii=False))
+        return response
@@ -0,0 +1,88 @@
+from datetime import date, datetime, time, timedelta
+import pytz
+
+# ---------------------------------------------------------
+# RANGOS DE FECHA "SARGABLES"
+# ---------------------------------------------------------
+# Las columnas fecha_venta, fecha_hora_inicio, fecha, etc. son TIMESTAMP sin zona
+# y guardan la hora local de Lima (la sesión corre con TIME ZONE 'America/Lima').
+# Filtrar con DATE(col) = %s o TO_CHAR(col, 'YYYY-MM') = %s obliga a Postgres a
+# evaluar la función fila por fila y no puede usar los índices sobre la columna.
+# Estas funciones convierten los filtros de la UI en rangos semiabiertos
+# [inicio, fin) para escribir:  col >= %s AND col < %s
+
+ZONA_LIMA = pytz.timezone('America/Lima')
+
+
+def hoy_lima():
+    """Fecha actual en Lima (independiente de la zona horaria del servidor)."""
+    return datetime.now(ZONA_LIMA).date()
+
+
+def a_hora_local(valor):
+    """datetime con zona -> hora de Lima sin zona (como se guarda en la BD). Uno sin zona queda igual."""
+    if valor.tzinfo is None:
+        return valor
+    return valor.astimezone(ZONA_LIMA).replace(tzinfo=None)
+
+
+def a_fecha(valor):
+    """Acepta date, datetime o 'YYYY-MM-DD' (lo que llega de los formularios)."""
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor).strip()[:10])
+
+
+def rango_dia(dia):
+    """[00:00 del día, 00:00 del día siguiente)"""
+    dia = a_fecha(dia)
+    inicio = datetime.combine(dia, time.min)
+    return inicio, inicio + timedelta(days=1)
+
+
+def rango_fechas(desde=None, hasta=None):
+    """
+    Convierte un filtro inclusivo de la UI (desde/hasta, ambos opcionales) en
+    límites semiabiertos. Devuelve (inicio o None, fin_exclusivo o None).
+    """
+    desde = a_fecha(desde)
+    hasta = a_fecha(hasta)
+    inicio = datetime.combine(desde, time.min) if desde else None
+    fin = datetime.combine(hasta + timedelta(days=1), time.min) if hasta else None
+    return inicio, fin
+
+
+def rango_mes(anio_mes, mes=None):
+    """Acepta 'YYYY-MM' o (anio, mes). Devuelve [día 1 00:00, día 1 del mes siguiente)."""
+    if mes is None:
+        anio, mes = (int(p) for p in str(anio_mes).split('-')[:2])
+    else:
+        anio = int(anio_mes)
+    inicio = datetime(anio, int(mes), 1)
+    if inicio.month == 12:
+        fin = datetime(anio + 1, 1, 1)
+    else:
+        fin = datetime(anio, inicio.month + 1, 1)
+    return inicio, fin
+
+
+def filtro_rango(columna, desde=None, hasta=None):
+    """
+    Arma el fragmento SQL y los parámetros para un filtro de fechas opcional.
+    Ej: sql, params = filtro_rango('v.fecha_venta', '2025-01-01', '2025-01-31')
+        -> " AND v.fecha_venta >= %s AND v.fecha_venta < %s", [inicio, fin]
+    """
+    inicio, fin = rango_fechas(desde, hasta)
+    sql = ""
+    params = []
+    if inicio:
+        sql += f" AND {columna} >= %s"
+        params.append(inicio)
+    if fin:
+        sql += f" AND {columna} < %s"
+        params.append(fin)
+    return sql, params
@@ -0,0 +1,84 @@
+import threading
+from flask import current_app
+from . import pg_listener
+from .db import get_db
+
+# ---------------------------------------------------------
+# SELLOS DE VERSIÓN PARA CACHÉS
+# ---------------------------------------------------------
+# Cada worker guarda en memoria la última versión conocida de cada clave
+# ('empleado:<id>', 'rol:<id>'...). La primera lectura de una clave consulta
+# versiones_cache; después se mantiene al día con los NOTIFY del canal
+# 'versiones_cache', así que comparar versiones no cuesta consultas.
+
+CANAL = 'versiones_cache'
+
+_versiones = {}
+_lock = threading.Lock()
+
+
+def version(clave):
+    """Versión vigente de la clave (0 si nunca se incrementó, None si no se pudo leer)."""
+    with _lock:
+        if clave in _versiones:
+            return _versiones[clave]
+
+    conn = get_db()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT version FROM versiones_cache WHERE clave = %s", (clave,))
+            fila = cursor.fetchone()
+    except Exception as e:
+        # Ej: migración 0003 aún no aplicada. None = "desconocida", no cachear.
+        conn.rollback()
+        current_app.logger.warning(f"No se pudo leer la versión de '{clave}': {e}")
+        return None
+    valor = fila[0] if fila else 0
+    with _lock:
+        _versiones.setdefault(clave, valor)
+        return _versiones[clave]
+
+
+def incrementar(conn, clave):
+    """
+    Sube la versión de la clave y avisa a todos los workers.
+    Llamar después del commit de los datos modificados (hace su propio commit).
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO versiones_cache (clave, version) VALUES (%s, 1)
+                ON CONFLICT (clave) DO UPDATE
+                SET version = versiones_cache.version + 1, actualizado_en = CURRENT_TIMESTAMP
+                RETURNING version
+            """, (clave,))
+            nueva = cursor.fetchone()[0]
+            pg_listener.notificar(cursor, CANAL, f"{clave}={nueva}")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.error(f"No se pudo incrementar la versión de '{clave}': {e}")
+        # Sin versión fiable: que este worker vuelva a leerla de la BD
+        with _lock:
+            _versiones.pop(clave, None)
+        return None
+
+    with _lock:
+        _versiones[clave] = max(nueva, _versiones.get(clave, 0))
+    return nueva
+
+
+def _al_recibir_aviso(payload):
+    with _lock:
+        if payload is None:
+            # Reconexión del listener: pudimos perder avisos, se releen bajo demanda
+            _versiones.clear()
+            return
+        clave, _, valor = payload.rpartition('=')
+        try:
+            _versiones[clave] = max(int(valor), _versiones.get(clave, 0))
+        except ValueError:
+            _versiones.pop(clave, None)
+
+
+pg_listener.suscribir(CANAL, _al_recibir_aviso)
@@ -0,0 +1,97 @@
+"""
+Compara la búsqueda de clientes anterior (ILIKE '%term%' sobre cuatro columnas,
+recorrido secuencial) contra la búsqueda compartida de
+app/services/clientes_busqueda.py (columnas normalizadas + índices de trigramas,
+migración 0015) con un millón de clientes sintéticos, incluidos nombres con tildes.
+
+Uso:  python bench_clientes_busqueda.py [cantidad]
+Inserta los clientes en una transacción que termina en ROLLBACK: no deja datos
+(la carga tarda unos minutos porque también se llenan los índices GIN).
+"""
+import sys
+import time
+import statistics
+import psycopg2.extras
+from app import create_app
+from app.db import get_db
+from app.services import clientes_busqueda
+
+CANTIDAD = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPETICIONES = 20
+# (término, qué prueba)
+TERMINOS = (
+    ('munoz', 'sin tilde contra "Muñoz"'),
+    ('Núñez Rosa', 'dos palabras, con tilde'),
+    ('gutierres', 'error de tipeo'),
+    ('987654', 'parte del teléfono'),
+    ('10500000', 'documento exacto'),
+    ('zzqx', 'sin resultados'),
+)
+
+SQL_ANTERIOR = """
+    SELECT id, razon_social_nombres, apellidos, numero_documento, telefono
+    FROM clientes
+    WHERE razon_social_nombres ILIKE %s OR apellidos ILIKE %s OR numero_documento ILIKE %s OR telefono ILIKE %s
+    ORDER BY razon_social_nombres
+    LIMIT 20
+"""
+
+app = create_app()
+
+
+def cargar(cursor, cantidad):
+    """Clientes sintéticos: combinaciones de nombres/apellidos comunes, documento y celular únicos."""
+    cursor.execute("""
+        WITH nombres AS (
+            SELECT ARRAY['José', 'María', 'Ángel', 'Rosa', 'Raúl', 'Inés', 'Julián', 'Lucía', 'Martín', 'Sofía',
+                         'Carlos', 'Ana', 'Luis', 'Elena', 'Jesús', 'Verónica', 'Óscar', 'Andrés', 'Nicolás', 'Mónica'] AS n,
+                   ARRAY['Muñoz', 'Núñez', 'Pérez', 'Gutiérrez', 'Ramírez', 'Chávez', 'Quispe', 'Huamán', 'Flores',
+                         'Rodríguez', 'Sánchez', 'Díaz', 'Vásquez', 'Gómez', 'Ibáñez', 'Castañeda', 'Mamani',
+                         'López', 'Ordóñez', 'Cárdenas'] AS a
+        )
+        INSERT INTO clientes (razon_social_nombres, apellidos, tipo_documento, numero_documento, telefono)
+        SELECT n[1 + (g %% 20)] || CASE WHEN g %% 7 = 0 THEN ' ' || n[1 + (g / 20) %% 20] ELSE '' END,
+               a[1 + (g / 3) %% 20] || ' ' || a[1 + (g / 61) %% 20],
+               'DNI',
+               (10000000 + g)::text,
+               '9' || lpad(((g * 7919) %% 100000000)::text, 8, '0')
+        FROM generate_series(1, %s) g, nombres
+        ON CONFLICT DO NOTHING
+    """, (cantidad,))
+    insertados = cursor.rowcount
+    cursor.execute("ANALYZE clientes")
+    return insertados
+
+
+def medir(funcion):
+    tiempos, filas = [], 0
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        filas = len(funcion())
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return statistics.median(tiempos), tiempos[int(len(tiempos) * 0.95) - 1], filas
+
+
+with app.app_context():
+    conn = get_db()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            inicio = time.perf_counter()
+            insertados = cargar(cursor, CANTIDAD)
+            print(f"Cargados {insertados} clientes sintéticos en {time.perf_counter() - inicio:.1f} s\n")
+
+            print(f"{'término':>12} | {'ILIKE p50/p95 (ms)':>22} | {'filas':>5} | {'trigramas p50/p95 (ms)':>24} | {'filas':>5} | caso")
+            for termino, caso in TERMINOS:
+                patron = f"%{termino}%"
+
+                def anterior():
+                    cursor.execute(SQL_ANTERIOR, (patron, patron, patron, patron))
+                    return cursor.fetchall()
+
+                p50_a, p95_a, filas_a = medir(anterior)
+                p50_b, p95_b, filas_b = medir(lambda: clientes_busqueda.buscar(cursor, termino))
+                print(f"{termino:>12} | {p50_a:>9.1f} / {p95_a:<10.1f} | {filas_a:>5} | "
+                      f"{p50_b:>11.1f} / {p95_b:<10.1f} | {filas_b:>5} | {caso}")
+    finally:
+        conn.rollback()
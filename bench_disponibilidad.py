@@ -0,0 +1,51 @@
+"""
+Mide el motor de disponibilidad (app/services/disponibilidad.py) con datos sintéticos,
+sin BD: 40 colaboradores, 7 días a 5 minutos, ~12 reservas por colaborador y día.
+
+Uso:  python bench_disponibilidad.py
+"""
+import random
+import time
+from datetime import date, datetime, timedelta
+from app.services.disponibilidad import MapaDisponibilidad
+
+EMPLEADOS = 40
+DIAS = 7
+RESOLUCION = 5
+REPETICIONES = 50
+
+random.seed(7)
+empleados = [{'id': i, 'nombre': f'Colaborador {i}'} for i in range(1, EMPLEADOS + 1)]
+desde = date.today()
+
+
+def construir():
+    mapa = MapaDisponibilidad(empleados, desde, DIAS, RESOLUCION)
+    turnos, reservas = [], []
+    for e in empleados:
+        for d in range(DIAS):
+            base = datetime.combine(desde + timedelta(days=d), datetime.min.time())
+            turnos.append(mapa._intervalo(e['id'], base + timedelta(hours=9), base + timedelta(hours=20)))
+            for _ in range(12):
+                inicio = base + timedelta(hours=9, minutes=random.randrange(0, 600, 5))
+                reservas.append(mapa._intervalo(e['id'], inicio, inicio + timedelta(minutes=random.choice((30, 45, 60)))))
+    mapa._pintar(mapa.turno, turnos)
+    mapa._pintar(mapa.ocupado, reservas)
+    return mapa
+
+
+inicio = time.perf_counter()
+for _ in range(REPETICIONES):
+    mapa = construir()
+ms_construir = (time.perf_counter() - inicio) * 1000 / REPETICIONES
+
+inicio = time.perf_counter()
+for _ in range(REPETICIONES):
+    huecos = mapa.huecos(60, limite=10)
+ms_buscar = (time.perf_counter() - inicio) * 1000 / REPETICIONES
+
+print(f"Bitmap {EMPLEADOS}x{mapa.total_bloques} bloques")
+print(f"  Pintar turnos + reservas: {ms_construir:.2f} ms")
+print(f"  Primeros 10 huecos de 60 min: {ms_buscar:.2f} ms")
+for h in huecos[:3]:
+    print(f"    {h['inicio']}  {h['empleado']}")
@@ -0,0 +1,126 @@
+"""
+Compara la exportación de ventas a Excel anterior (fetchall -> DataFrame de
+pandas -> libro completo en un BytesIO) contra la de app/exportacion.py
+(cursor de servidor -> libro write-only en un archivo temporal), midiendo
+filas/segundo y el pico de memoria (RSS) del proceso sobre la base.
+
+Uso:  python bench_exportacion.py [cantidad]
+Inserta las ventas sintéticas en una transacción que termina en ROLLBACK: no
+deja datos. La memoria se muestrea desde /proc (Linux, como en producción).
+La versión en streaming corre primero: así el heap que deja pandas no le
+infla la medición.
+"""
+import io
+import os
+import sys
+import time
+import threading
+import pandas as pd
+import psycopg2.extras
+from app import create_app
+from app.db import get_db
+from app import exportacion
+
+CANTIDAD = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+
+SQL = """
+    SELECT
+        v.fecha_venta,
+        COALESCE(CONCAT(c.razon_social_nombres, ' ', c.apellidos), 'Cliente Varios') AS cliente,
+        e.nombre_display AS colaborador,
+        v.tipo_comprobante,
+        CONCAT(v.serie_comprobante, '-', v.numero_comprobante) AS numero,
+        v.monto_final_venta AS monto,
+        v.estado_pago,
+        COALESCE(v.estado_sunat, 'Pendiente') as sunat
+    FROM ventas v
+    JOIN empleados e ON v.empleado_id = e.id
+    LEFT JOIN clientes c ON v.cliente_receptor_id = c.id
+    ORDER BY v.fecha_venta DESC, v.id DESC
+"""
+COLUMNAS = [('Fecha', 18), ('Cliente', 35), ('Colaborador', 22), ('Tipo', 16),
+            ('Comprobante', 16), ('Total', 12), ('Estado Pago', 14), ('Estado SUNAT', 14)]
+
+app = create_app()
+
+
+def rss_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+class PicoMemoria:
+    """Muestrea el RSS cada 10 ms mientras dura el bloque."""
+
+    def __enter__(self):
+        self.base = self.pico = rss_mb()
+        self._seguir = True
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self._hilo.start()
+        return self
+
+    def _muestrear(self):
+        while self._seguir:
+            self.pico = max(self.pico, rss_mb())
+            time.sleep(0.01)
+
+    def __exit__(self, *exc):
+        self._seguir = False
+        self._hilo.join()
+        self.pico = max(self.pico, rss_mb())
+
+
+def cargar(cursor, cantidad):
+    """Ventas sintéticas repartidas en el último año, con cliente y colaborador existentes."""
+    cursor.execute("""
+        INSERT INTO ventas (sucursal_id, empleado_id, cliente_receptor_id, fecha_venta, tipo_comprobante,
+                            serie_comprobante, numero_comprobante, subtotal_servicios, subtotal_productos,
+                            descuento_monto, monto_final_venta, estado_pago)
+        SELECT (SELECT MIN(id) FROM sucursales), (SELECT MIN(id) FROM empleados), (SELECT MIN(id) FROM clientes),
+               CURRENT_TIMESTAMP - (g %% 365) * INTERVAL '1 day' - (g %% 600) * INTERVAL '1 minute',
+               'Nota de Venta', 'BENCH', g::text, 50 + g %% 200, 0, 0, 50 + g %% 200, 'Pagado'
+        FROM generate_series(1, %s) g
+    """, (cantidad,))
+    return cursor.rowcount
+
+
+def anterior(conn):
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute(SQL)
+        datos = cursor.fetchall()
+    df = pd.DataFrame(datos)
+    df['fecha_venta'] = df['fecha_venta'].apply(lambda x: x.strftime('%Y-%m-%d %H:%M') if x else '')
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Ventas')
+    return len(datos), output.getbuffer().nbytes
+
+
+def streaming(conn):
+    ruta, (filas,) = exportacion.escribir_xlsx(conn, [exportacion.Hoja('Ventas', SQL, (), COLUMNAS)])
+    tamano = os.path.getsize(ruta)
+    # Consumir la respuesta como lo haría el servidor (y borrar el temporal)
+    with app.test_request_context():
+        for _ in exportacion.respuesta_archivo(ruta, 'bench.xlsx', exportacion.MIME_XLSX).response:
+            pass
+    return filas, tamano
+
+
+with app.app_context():
+    conn = get_db()
+    try:
+        with conn.cursor() as cursor:
+            inicio = time.perf_counter()
+            insertados = cargar(cursor, CANTIDAD)
+            print(f"Cargadas {insertados} ventas sintéticas en {time.perf_counter() - inicio:.1f} s\n")
+
+        print(f"{'versión':>10} | {'filas':>8} | {'segundos':>8} | {'filas/s':>9} | {'RSS pico +MB':>12} | {'archivo MB':>10}")
+        for nombre, funcion in (('streaming', streaming), ('anterior', anterior)):
+            with PicoMemoria() as memoria:
+                inicio = time.perf_counter()
+                filas, tamano = funcion(conn)
+                segundos = time.perf_counter() - inicio
+            print(f"{nombre:>10} | {filas:>8} | {segundos:>8.1f} | {filas / segundos:>9.0f} | "
+                  f"{memoria.pico - memoria.base:>12.1f} | {tamano / 1024 / 1024:>10.1f}")
+    finally:
+        conn.rollback()
@@ -0,0 +1,96 @@
+"""
+Compara la escritura del detalle de una venta (ítems, comisiones, stock y kardex)
+línea por línea (como hacía nueva_venta) contra la versión en bloque de
+app/services/venta_detalle.py, para varios tamaños de carrito.
+
+Uso:  python bench_venta_detalle.py
+Todo corre dentro de transacciones que terminan en ROLLBACK: no deja datos.
+Necesita al menos un producto activo y una sucursal en la BD.
+"""
+import time
+import statistics
+import psycopg2.extras
+from app import create_app
+from app.db import get_db
+from app.services import venta_detalle
+
+TAMANOS = (1, 5, 10, 20, 50)
+REPETICIONES = 30
+
+app = create_app()
+
+
+def preparar(cursor, productos, n):
+    """Venta de prueba + carrito de n líneas (productos repetidos si hacen falta)."""
+    cursor.execute("""
+        INSERT INTO ventas (sucursal_id, empleado_id, fecha_venta, tipo_comprobante,
+                            subtotal_servicios, subtotal_productos, descuento_monto, monto_final_venta, estado_pago)
+        VALUES ((SELECT MIN(id) FROM sucursales), NULL, CURRENT_TIMESTAMP, 'Nota de Venta', 0, 0, 0, 0, 'Pagado')
+        RETURNING id
+    """)
+    venta_id = cursor.fetchone()['id']
+    cursor.execute("UPDATE productos SET stock_actual = 100000 WHERE id = ANY(%s)", ([p['id'] for p in productos],))
+    items = [{
+        'tipo': 'producto', 'id': productos[i % len(productos)]['id'], 'descripcion': 'bench',
+        'cantidad': 1, 'precio': 10.0
+    } for i in range(n)]
+    return venta_id, items
+
+
+def por_linea(cursor, venta_id, items):
+    for item in items:
+        total = venta_detalle.total_item(item)
+        cursor.execute("""
+            INSERT INTO venta_items (venta_id, servicio_id, producto_id, descripcion_item_venta, cantidad, precio_unitario_venta,
+                                     subtotal_item_bruto, subtotal_item_neto, es_hora_extra, porcentaje_servicio_extra,
+                                     comision_servicio_extra, entregado_al_colaborador)
+            VALUES (%s, NULL, %s, %s, %s, %s, %s, %s, FALSE, 0, 0, FALSE) RETURNING id
+        """, (venta_id, item['id'], item['descripcion'], item['cantidad'], item['precio'], total, total))
+        venta_item_id = cursor.fetchone()['id']
+        cursor.execute("SELECT stock_actual, comision_vendedor_monto FROM productos WHERE id = %s", (item['id'],))
+        prod = cursor.fetchone()
+        if float(prod['comision_vendedor_monto'] or 0) > 0:
+            cursor.execute("""
+                INSERT INTO comisiones (venta_item_id, empleado_id, monto_comision, porcentaje, fecha_generacion, estado)
+                VALUES (%s, NULL, %s, 0.00, CURRENT_TIMESTAMP, 'Pendiente')
+            """, (venta_item_id, float(prod['comision_vendedor_monto']) * item['cantidad']))
+        nuevo_stock = prod['stock_actual'] - item['cantidad']
+        cursor.execute("UPDATE productos SET stock_actual = %s WHERE id = %s", (nuevo_stock, item['id']))
+        cursor.execute("""
+            INSERT INTO kardex (producto_id, tipo_movimiento, cantidad, stock_anterior, stock_actual, motivo, usuario_id, venta_id)
+            VALUES (%s, 'VENTA', %s, %s, %s, 'bench', NULL, %s)
+        """, (item['id'], -item['cantidad'], prod['stock_actual'], nuevo_stock, venta_id))
+
+
+def en_bloque(cursor, venta_id, items):
+    venta_detalle.registrar_items(cursor, venta_id, items)
+    venta_detalle.descontar_stock(cursor, venta_id, None, items, 'bench')
+
+
+def medir(conn, productos, n, escritor):
+    tiempos = []
+    for _ in range(REPETICIONES):
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            venta_id, items = preparar(cursor, productos, n)
+            inicio = time.perf_counter()
+            escritor(cursor, venta_id, items)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        conn.rollback()
+    tiempos.sort()
+    return statistics.median(tiempos), tiempos[int(len(tiempos) * 0.95) - 1]
+
+
+with app.app_context():
+    conn = get_db()
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute("SELECT id FROM productos WHERE activo = TRUE ORDER BY id LIMIT 50")
+        productos = cursor.fetchall()
+    conn.rollback()
+    if not productos:
+        raise SystemExit("No hay productos activos para la prueba.")
+
+    print(f"{'líneas':>7} | {'por línea p50/p95 (ms)':>24} | {'en bloque p50/p95 (ms)':>24}")
+    for n in TAMANOS:
+        p50_a, p95_a = medir(conn, productos, n, por_linea)
+        p50_b, p95_b = medir(conn, productos, n, en_bloque)
+        print(f"{n:>7} | {p50_a:>11.2f} / {p95_a:<10.2f} | {p50_b:>11.2f} / {p95_b:<10.2f}")
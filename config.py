@@ -6,6 +6,31 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'miclave_super_secreta_jvstudio_2025'
     TIMEZONE = 'America/Lima'
+
+    # --- POOL DE CONEXIONES (por worker de gunicorn) ---
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+    DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # Segundos esperando una conexión libre
+    DB_POOL_PING_SEGUNDOS = float(os.environ.get('DB_POOL_PING_SEGUNDOS', 30))  # Ping si estuvo ociosa más que esto
+
+    # --- INSTRUMENTACIÓN SQL ---
+    SQL_SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', 200))  # Umbral del log de consultas lentas
+    SQL_NPLUS1_UMBRAL = int(os.environ.get('SQL_NPLUS1_UMBRAL', 5))  # Repeticiones de una misma sentencia para marcar N+1
+
+    # --- CACHÉ DE CONFIGURACIÓN (tema, sucursales) ---
+    CONFIG_CACHE_TTL = float(os.environ.get('CONFIG_CACHE_TTL', 300))  # Segundos; respaldo si se pierde un NOTIFY
+
+    # --- AGENDA EN VIVO (SSE) ---
+    # Flujos abiertos a la vez por worker; cada uno ocupa un hilo de gthread (16 por worker)
+    AGENDA_SSE_MAX_POR_WORKER = int(os.environ.get('AGENDA_SSE_MAX_POR_WORKER', 4))
+
+    # --- OUTBOX (efectos posteriores a la venta) ---
+    # 1 = aplicar puntos/fidelidad/reserva dentro de la transacción de la venta (sin worker)
+    OUTBOX_EN_LINEA = os.environ.get('OUTBOX_EN_LINEA', '0') == '1'
+
+    # --- MIGRACIONES ---
+    # En producción se usa `flask db-upgrade`; AUTO_MIGRAR=1 aplica pendientes al arrancar (uso local)
+    AUTO_MIGRAR = os.environ.get('AUTO_MIGRAR', '0') == '1'
     
     # --- CLOUDINARY ---
     CLOUDINARY_URL = os.environ.get('CLOUDINARY_URL')
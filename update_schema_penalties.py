@@ -1,8 +1,9 @@
 from app import create_app
-from app.db import check_schema_updates
+from app.db import get_db
+from app.migrador import aplicar_migraciones
 
 app = create_app()
 with app.app_context():
     print("Aplicando actualizaciones de esquema...")
-    check_schema_updates(app)
+    aplicar_migraciones(get_db())
     print("¡Tablas creadas exitosamente!")
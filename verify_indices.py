@@ -0,0 +1,111 @@
+"""
+Verifica con EXPLAIN que los filtros por rango de fecha usan los índices de la
+migración 0002_indices_rangos_fecha.sql (y los del dashboard, 0004, del listado de reservas, 0008, y del POS, 0010).
+
+Uso:  python verify_indices.py
+Con enable_seqscan = off el planificador solo elige Seq Scan si el índice NO es
+utilizable para el predicado (p.ej. DATE(col) = %s), así que la prueba no depende
+del volumen de datos de la BD local.
+"""
+import sys
+from datetime import date
+from app import create_app
+from app.db import get_db
+from app.utils.fechas import rango_dia, rango_fechas, rango_mes
+
+app = create_app()
+
+hoy = date.today()
+inicio_mes, fin_mes = rango_fechas(hoy.replace(day=1), hoy)
+
+CASOS = [
+    (
+        "listar_ventas (sucursal + rango)",
+        "SELECT id FROM ventas WHERE sucursal_id = %s AND fecha_venta >= %s AND fecha_venta < %s",
+        (1, inicio_mes, fin_mes),
+        "idx_ventas_sucursal_fecha",
+    ),
+    (
+        "reporte_produccion (empleado + rango)",
+        "SELECT id FROM ventas WHERE empleado_id = %s AND fecha_venta >= %s AND fecha_venta < %s",
+        (1, inicio_mes, fin_mes),
+        "idx_ventas_empleado_fecha",
+    ),
+    (
+        "registro_contable_mensual (mes)",
+        "SELECT id FROM ventas WHERE fecha_venta >= %s AND fecha_venta < %s",
+        rango_mes(hoy.year, hoy.month),
+        "idx_ventas_fecha",
+    ),
+    (
+        "api_agenda_dia_data (reservas del día)",
+        "SELECT id FROM reservas WHERE sucursal_id = %s AND fecha_hora_inicio >= %s AND fecha_hora_inicio < %s",
+        (1, *rango_dia(hoy)),
+        "idx_reservas_sucursal_inicio",
+    ),
+    (
+        "detalle de venta (items)",
+        "SELECT id FROM venta_items WHERE venta_id = %s",
+        (1,),
+        "idx_venta_items_venta",
+    ),
+    (
+        "comisiones por item",
+        "SELECT id FROM comisiones WHERE venta_item_id = %s",
+        (1,),
+        "idx_comisiones_venta_item",
+    ),
+    (
+        "ingresos_egresos (gastos)",
+        "SELECT id FROM gastos WHERE sucursal_id = %s AND fecha >= %s AND fecha < %s",
+        (1, inicio_mes, fin_mes),
+        "idx_gastos_sucursal_fecha",
+    ),
+    (
+        "index (cumpleaños por clave mes-día, migración 0004)",
+        "SELECT id FROM clientes WHERE cumple_mmdd IN (%s, %s)",
+        (hoy.month * 100 + hoy.day, 101),
+        "idx_clientes_cumple_mmdd",
+    ),
+    (
+        "index (KPIs del día, migración 0004)",
+        "SELECT numero_ventas FROM kpi_diarios WHERE sucursal_id = %s AND fecha = %s",
+        (1, hoy),
+        "kpi_diarios_pkey",
+    ),
+    (
+        "listar_reservas (página siguiente por cursor, migración 0008)",
+        "SELECT id FROM reservas WHERE (fecha_hora_inicio, id) < (%s, %s) ORDER BY fecha_hora_inicio DESC, id DESC LIMIT 51",
+        (fin_mes, 1),
+        "idx_reservas_inicio_id",
+    ),
+    (
+        "POS: búsqueda de clientes por prefijo de nombre (migración 0010)",
+        "SELECT id FROM clientes WHERE lower(razon_social_nombres) LIKE %s",
+        ("jua%",),
+        "idx_clientes_nombre_prefijo",
+    ),
+    (
+        "POS: búsqueda de clientes por prefijo de teléfono (migración 0010)",
+        "SELECT id FROM clientes WHERE telefono LIKE %s",
+        ("98300%",),
+        "idx_clientes_telefono_prefijo",
+    ),
+]
+
+fallos = 0
+with app.app_context():
+    conn = get_db()
+    with conn.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        for nombre, sql, params, indice in CASOS:
+            cursor.execute("EXPLAIN " + sql, params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            if indice in plan:
+                print(f"✅ {nombre}: usa {indice}")
+            else:
+                fallos += 1
+                print(f"❌ {nombre}: NO usa {indice}\n{plan}\n")
+    conn.rollback()
+
+sys.exit(1 if fallos else 0)